@@ -0,0 +1,66 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Requests per second through RedisProtocol, with and without I/O threads
+# (see karton.iothreads): many connections, each sending a few pipelined
+# SETs and GETs per turn of the (simulated) reactor.
+#
+# One thread is the reactor's alone, writing replies a batch at a time.
+# Under the GIL, more threads can only be slower than that: this shows by
+# how much. On an interpreter without one, they parse and encode side by
+# side.
+#
+# Usage: python benchmarks/io_threads.py [connections] [turns]
+
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from twisted.internet.testing import StringTransport
+
+from karton.server import Server
+from karton.iothreads import IOThreads
+from karton.protocol import python_to_redis
+from twisted_karton import RedisProtocol
+
+PIPELINE = 8
+
+
+def run(threads, count, turns):
+    server = Server()
+    calls = []
+    io = IOThreads(threads, calls.append) if threads else None
+    connections = []
+    for index in xrange(count):
+        connection = RedisProtocol(server, ('127.0.0.1', index), io)
+        connection.makeConnection(StringTransport())
+        connections.append(connection)
+    data = [''.join(python_to_redis(['SET', 'key:%d:%d' % (index, i), 'x' * 100]) +
+                    python_to_redis(['GET', 'key:%d:%d' % (index, i)]) for i in xrange(PIPELINE // 2))
+            for index in xrange(count)]
+    started = time.time()
+    for turn in xrange(turns):
+        for connection, request in zip(connections, data):
+            connection.dataReceived(request)
+        while calls:
+            calls.pop()()
+        for connection in connections:
+            connection.transport.clear()
+    elapsed = time.time() - started
+    if io is not None:
+        io.close()
+    return count * turns * PIPELINE / elapsed
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    turns = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+    print '%-12s %14s' % ('io-threads', 'requests/s')
+    for threads in (0, 1, 2, 4):
+        print '%-12d %14.0f' % (threads, run(threads, count, turns))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,52 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Memory per list element: blist vs quicklist.
+#
+# Every measurement runs in a fresh interpreter and looks at the resident
+# set size growth (Linux only), so allocator overhead is accounted for.
+#
+# Usage: python benchmarks/list_memory.py [count]
+
+import os
+import sys
+import subprocess
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+
+def rss():
+    with open('/proc/self/statm') as statm:
+        return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+
+
+def measure(kind, count, size):
+    from blist import blist
+    from karton.quicklist import quicklist
+    cls = {'blist': blist, 'quicklist': quicklist}[kind]
+    # distinct values, so nothing gets shared between elements
+    values = ('%0*d' % (size, i) for i in xrange(count))
+    before = rss()
+    items = cls()
+    for value in values:
+        items.append(value)
+    return float(rss() - before) / count
+
+
+def main():
+    if len(sys.argv) == 4:
+        kind, count, size = sys.argv[1], int(sys.argv[2]), int(sys.argv[3])
+        print measure(kind, count, size)
+        return
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    print '%-8s %12s %12s' % ('value', 'blist', 'quicklist')
+    for size in (8, 32, 512):
+        results = []
+        for kind in ('blist', 'quicklist'):
+            output = subprocess.check_output([sys.executable, __file__, kind, str(count), str(size)])
+            results.append(float(output))
+        print '%-8s %10.1f B %10.1f B' % ('%d B' % size, results[0], results[1])
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,69 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Startup time and memory with a mapped snapshot (karton.mapped), against
+# loading the same data from an RDB file.
+#
+# Generates a dataset (1M keys by default) with the same mix of values as
+# benchmarks/rdb_load.py, writes it both ways, then loads each in a fresh
+# process and reports the time to the first reply and the memory used.
+#
+# Usage: python benchmarks/mapped_start.py [count]
+
+import os
+import sys
+import time
+import tempfile
+import subprocess
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from karton.server import Server
+from karton import rdb, mapped, memory
+
+from rdb_load import value
+
+
+def generate(directory, count):
+    db = dict(('key:%010d' % index, value(index)) for index in xrange(count))
+    with open(os.path.join(directory, 'dump.rdb'), 'wb') as output:
+        rdb.save([db], output)
+    mapped.save_path([db], os.path.join(directory, 'dump.kmap'))
+
+
+def start(kind, path):
+    """Load path into a fresh server, and answer one command."""
+    before = memory.rss()
+    started = time.time()
+    server = Server()
+    if kind == 'rdb':
+        with open(path, 'rb') as input:
+            rdb.load(server, input)
+    else:
+        mapped.Mapped(path).load(server)
+    client = server.new_client(('127.0.0.1', 0))
+    client.do(['HGETALL', 'key:0000000020'])
+    elapsed = time.time() - started
+    print '%-5s %6.2f s to the first reply, %7.1f MB' % (kind, elapsed, (memory.rss() - before) / 1024.0**2)
+    if kind == 'kmap':
+        started = time.time()
+        while not server.mapped.warm(server.dbs, 1.0):
+            pass
+        print '      %6.2f s more to warm everything up, %7.1f MB' % (
+            time.time() - started, (memory.rss() - before) / 1024.0**2)
+
+
+def main():
+    if len(sys.argv) > 2:
+        return start(sys.argv[1], sys.argv[2])
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    directory = tempfile.mkdtemp(prefix='karton-mapped-')
+    generate(directory, count)
+    for kind, name in (('rdb', 'dump.rdb'), ('kmap', 'dump.kmap')):
+        path = os.path.join(directory, name)
+        print '%s: %.1f MB' % (path, os.path.getsize(path) / 1024.0**2)
+        subprocess.check_call([sys.executable, __file__, kind, path])
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,61 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Mass insertion and export throughput (karton.bulk).
+#
+# Writes a synthetic RESP file of SET commands (10M keys by default, about
+# 450 MB), loads it into a fresh server, then exports the data as RESP and
+# as JSON lines, discarding the output. Every tenth key is a small hash
+# instead of a string, so that export goes through more than one type.
+#
+# Usage: python benchmarks/mass_insert.py [count] [file]
+
+import os
+import sys
+import time
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from karton.server import Server
+from karton import bulk
+
+
+def generate(path, count):
+    with open(path, 'wb') as output:
+        batch = []
+        for index in xrange(count):
+            key = 'key:%010d' % index
+            if index % 10:
+                batch.append(bulk.encode(['SET', key, 'value:%d' % index]))
+            else:
+                batch.append(bulk.encode(['HMSET', key, 'name', key, 'index', str(index)]))
+            if len(batch) == 10000:
+                output.write(''.join(batch))
+                batch = []
+        output.write(''.join(batch))
+
+
+def timed(label, count, function):
+    started = time.time()
+    result = function()
+    elapsed = time.time() - started
+    print '%-12s %8.1f s %12.0f keys/s' % (label, elapsed, count / elapsed)
+    return result
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 10000000
+    path = sys.argv[2] if len(sys.argv) > 2 else os.path.join(tempfile.gettempdir(), 'karton-mass-insert.resp')
+    if not os.path.exists(path):
+        timed('generate', count, lambda: generate(path, count))
+    server = Server()
+    with open(path, 'rb') as input:
+        result = timed('load', count, lambda: bulk.load(server, input))
+    assert not result.errors, result.first_errors
+    for format in ('resp', 'json'):
+        timed('export ' + format, count, lambda: sum(len(chunk) for chunk in bulk.export(server, format)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,60 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# RDB loading throughput (karton.rdb).
+#
+# Generates a test RDB (1M keys by default) of mostly short strings, with
+# some small hashes, intsets, lists and sorted sets mixed in, the way Redis
+# itself would encode them, and times loading it into a fresh server.
+#
+# Usage: python benchmarks/rdb_load.py [count] [file]
+
+import os
+import sys
+import time
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from karton.server import Server
+from karton.intset import intset
+from karton.quicklist import quicklist
+from karton.sorteddict import sorteddict
+from karton import rdb
+
+
+def value(index):
+    kind = index % 20
+    if kind == 0:
+        return dict(('field%d' % field, str(index + field)) for field in xrange(10))
+    if kind == 1:
+        return intset(str(index + member) for member in xrange(0, 100, 7))
+    if kind == 2:
+        return quicklist('item%d' % item for item in xrange(20))
+    if kind == 3:
+        return sorteddict.fromitems(('member%d' % member, float(member)) for member in xrange(10))
+    return 'value:%d' % index
+
+
+def generate(path, count):
+    db = dict(('key:%010d' % index, value(index)) for index in xrange(count))
+    with open(path, 'wb') as output:
+        rdb.save([db], output)
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    path = sys.argv[2] if len(sys.argv) > 2 else os.path.join(tempfile.gettempdir(), 'karton-load.rdb')
+    if not os.path.exists(path):
+        generate(path, count)
+    print '%s: %.1f MB' % (path, os.path.getsize(path) / 1024.0**2)
+    server = Server()
+    started = time.time()
+    with open(path, 'rb') as input:
+        loaded, expired = rdb.load(server, input)
+    elapsed = time.time() - started
+    print 'loaded %d keys in %.1f s: %.0f keys/s' % (loaded, elapsed, loaded / elapsed)
+
+
+if __name__ == '__main__':
+    main()
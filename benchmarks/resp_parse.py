@@ -0,0 +1,59 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Request parsing throughput: karton.protocol.Reader against hiredis.Reader.
+#
+# Parses a pipeline of SET commands (200k by default) with short keys and
+# values, fed 64 KB at a time the way the server receives it, plus a run of
+# inline PINGs (hiredis doesn't parse those). Runs on PyPy as well, where
+# hiredis usually isn't installed and only the built-in parser is timed.
+#
+# Usage: python benchmarks/resp_parse.py [count]
+
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from karton.protocol import Reader, python_to_redis
+
+try:
+    import hiredis
+except ImportError:
+    hiredis = None
+
+CHUNK = 64 * 1024
+
+
+def parse(reader, data):
+    count = 0
+    for start in xrange(0, len(data), CHUNK):
+        reader.feed(data[start:start+CHUNK])
+        request = reader.gets()
+        while request is not False:
+            count += 1
+            request = reader.gets()
+    return count
+
+
+def run(name, make_reader, data, count):
+    started = time.time()
+    assert parse(make_reader(), data) == count
+    elapsed = time.time() - started
+    print '%-22s %8.0f requests/s  %6.1f MB/s' % (name, count / elapsed, len(data) / elapsed / 1024**2)
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    sets = ''.join(python_to_redis(['SET', 'key:%010d' % index, 'value:%d' % index]) for index in xrange(count))
+    pings = 'PING\r\n' * count
+    print '%s %s' % (sys.subversion[0], sys.version.split()[0])
+    if hiredis is not None:
+        run('hiredis, SET', hiredis.Reader, sets, count)
+    run('Reader, SET', Reader, sets, count)
+    run('Reader, inline PING', Reader, pings, count)
+
+
+if __name__ == '__main__':
+    main()
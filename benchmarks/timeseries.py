@@ -0,0 +1,51 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Time series: bytes per sample, against a sorted set of "timestamp:value"
+# members, and the speed of range scans and aggregations.
+#
+# Usage: python benchmarks/timeseries.py [samples]
+
+import os
+import sys
+import time
+import random
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from karton.server import Server
+from karton import memory
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    server = Server()
+    client = server.new_client(('127.0.0.1', 0))
+    start = 1600000000000
+    kinds = [
+        ('constant', lambda index: '1'),
+        ('counter', lambda index: str(index * 7)),
+        ('integer', lambda index: str(random.randint(0, 100))),
+        ('gauge', lambda index: '%.1f' % random.uniform(0, 100)),
+    ]
+    print '%-10s %10s %10s %12s %12s' % ('values', 'TS', 'ZSET', 'TS.RANGE', 'avg 1m')
+    for name, value in kinds:
+        samples = [(str(start + index * 1000 + random.randint(0, 2)), value(index)) for index in xrange(count)]
+        for timestamp, sample in samples:
+            client.do(['TS.ADD', 'ts', timestamp, sample])
+            client.do(['ZADD', 'zset', timestamp, timestamp + ':' + sample])
+        ts = memory.value_size(server.dbs[0]['ts'])
+        zset = memory.value_size(server.dbs[0]['zset'])
+        began = time.time()
+        client.do(['TS.RANGE', 'ts', '-', '+'])
+        scan = time.time() - began
+        began = time.time()
+        client.do(['TS.RANGE', 'ts', '-', '+', 'AGGREGATION', 'avg', '60000'])
+        aggregate = time.time() - began
+        print '%-10s %8.2f B %8.1f B %9.2f µs %9.2f µs' % (
+            name, float(ts) / count, float(zset) / count, scan * 1e6 / count, aggregate * 1e6 / count)
+        client.do(['DEL', 'ts', 'zset'])
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+
+"""
+Big key sampler, in the spirit of redis-cli --bigkeys and --memkeys.
+
+Walks the keyspace with SCAN, a batch of keys at a time, and asks for the
+TYPE and MEMORY USAGE of every key in the batch in one pipelined round
+trip. The server only ever does a little work per command, so sampling
+a large database doesn't stall other clients; a pause between batches
+can make it gentler still.
+
+Sizes are also kept in a log2 histogram, which is enough to tell what
+share of the memory the biggest keys take without remembering every key.
+
+Run it against a server with python -m karton.bigkeys [--port 6379].
+"""
+
+import time
+import heapq
+import socket
+import optparse
+
+from .protocol import reader
+
+
+class Connection(object):
+    """Minimal pipelining client."""
+
+    def __init__(self, host='127.0.0.1', port=6379):
+        self.socket = socket.create_connection((host, port))
+        self.reader = reader(replies=True)
+
+    def pipeline(self, commands):
+        from .bulk import encode
+        self.socket.sendall(''.join(map(encode, commands)))
+        replies = []
+        while len(replies) < len(commands):
+            reply = self.reader.gets()
+            if reply is False:
+                data = self.socket.recv(65536)
+                if not data:
+                    raise IOError('connection closed')
+                self.reader.feed(data)
+            else:
+                replies.append(reply)
+        return replies
+
+
+class Report(object):
+
+    def __init__(self, top=10):
+        self.top = top
+        # type -> [keys, bytes, heap of the (bytes, key) biggest]
+        self.types = {}
+        # bit length of the size -> [keys, bytes]
+        self.histogram = {}
+        self.keys = 0
+        self.bytes = 0
+
+    def add(self, key, type, size):
+        self.keys += 1
+        self.bytes += size
+        stats = self.types.setdefault(type, [0, 0, []])
+        stats[0] += 1
+        stats[1] += size
+        if len(stats[2]) < self.top:
+            heapq.heappush(stats[2], (size, key))
+        elif size > stats[2][0][0]:
+            heapq.heapreplace(stats[2], (size, key))
+        bucket = self.histogram.setdefault(size.bit_length(), [0, 0])
+        bucket[0] += 1
+        bucket[1] += size
+
+    def biggest(self, type):
+        return sorted(self.types[type][2], reverse=True)
+
+    def share(self, fraction):
+        """Approximate share of the bytes taken by the biggest fraction of
+        the keys (to the precision of the histogram buckets)."""
+        wanted = self.keys * fraction
+        keys = size = 0
+        for bits in sorted(self.histogram, reverse=True):
+            count, total = self.histogram[bits]
+            if keys + count >= wanted:
+                size += total * (wanted - keys) / count
+                break
+            keys += count
+            size += total
+        return float(size) / self.bytes if self.bytes else 0.0
+
+    def format(self):
+        lines = ['Sampled %d keys, %d bytes in total.' % (self.keys, self.bytes)]
+        for type in sorted(self.types):
+            keys, size, biggest = self.types[type]
+            lines.append('')
+            lines.append('%d %ss with %d bytes (%.2f%% of keys, avg size %.2f)' % (
+                keys, type, size, 100.0 * keys / self.keys, float(size) / keys))
+            for key_size, key in self.biggest(type):
+                lines.append('  %12d  %r' % (key_size, key))
+        lines.append('')
+        for fraction in (0.01, 0.1):
+            lines.append('The biggest %g%% of keys take about %.1f%% of the memory.' % (
+                fraction * 100, self.share(fraction) * 100))
+        return '\n'.join(lines)
+
+
+def sample(pipeline, top=10, count=100, samples=5, pause=0.0):
+    """Walk the keyspace; pipeline(commands) runs a list of commands and
+    returns their replies. Return a Report."""
+    report = Report(top)
+    cursor = '0'
+    while True:
+        cursor, keys = pipeline([['SCAN', cursor, 'COUNT', str(count)]])[0]
+        commands = []
+        for key in keys:
+            commands.append(['TYPE', key])
+            commands.append(['MEMORY', 'USAGE', key, 'SAMPLES', str(samples)])
+        replies = pipeline(commands) if commands else []
+        for key, type, size in zip(keys, replies[0::2], replies[1::2]):
+            # gone in the meantime
+            if size is None or isinstance(size, Exception):
+                continue
+            report.add(key, str(type), size)
+        if cursor == '0':
+            return report
+        if pause:
+            time.sleep(pause)
+
+
+def main():
+    parser = optparse.OptionParser(usage='%prog [options]')
+    parser.add_option('--host', default='127.0.0.1')
+    parser.add_option('-p', '--port', type='int', default=6379)
+    parser.add_option('-n', '--db', type='int', default=0)
+    parser.add_option('--top', type='int', default=10, help='biggest keys listed per type')
+    parser.add_option('--count', type='int', default=100, help='SCAN COUNT')
+    parser.add_option('--samples', type='int', default=5, help='MEMORY USAGE SAMPLES')
+    parser.add_option('-i', '--pause', type='float', default=0.0, help='seconds to sleep between batches')
+    options, args = parser.parse_args()
+    connection = Connection(options.host, options.port)
+    connection.pipeline([['SELECT', str(options.db)]])
+    report = sample(connection.pipeline, options.top, options.count, options.samples, options.pause)
+    print report.format()
+
+
+if __name__ == '__main__':
+    main()
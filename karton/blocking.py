@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+
+"""
+Clients blocked until a key receives new data (XREAD BLOCK and friends).
+
+A blocking command that can't be served right away registers a Waiter on
+the keys it's interested in and replies with the waiter's Deferred. Write
+commands signal the keys they touch, and only the waiters registered on
+those keys retry, so nothing is ever polled. Timeouts are enforced from
+Server.cron(), which gives them the same 1/hz resolution as in Redis.
+"""
+
+import heapq
+import itertools
+
+from twisted.internet import defer
+
+
+class Waiter(object):
+
+    def __init__(self, client, keys, deadline, retry):
+        self.client = client
+        # (db, key) pairs
+        self.keys = keys
+        # absolute time.time(), or None to wait forever
+        self.deadline = deadline
+        # returns the reply, or None to keep waiting
+        self.retry = retry
+        self.deferred = defer.Deferred()
+        self.active = True
+
+
+class Blocking(object):
+
+    def __init__(self):
+        # (db, key) -> [Waiter]
+        self.waiters = {}
+        # heap of (deadline, counter, Waiter)
+        self.deadlines = []
+        self._counter = itertools.count()
+        self.count = 0
+
+    def block(self, client, keys, deadline, retry):
+        """Block client on keys; return a Deferred firing with the reply."""
+        waiter = Waiter(client, keys, deadline, retry)
+        for key in keys:
+            self.waiters.setdefault(key, []).append(waiter)
+        if deadline is not None:
+            heapq.heappush(self.deadlines, (deadline, next(self._counter), waiter))
+        client.blocked = waiter
+        self.count += 1
+        return waiter.deferred
+
+    def _remove(self, waiter):
+        if not waiter.active:
+            return
+        waiter.active = False
+        for key in waiter.keys:
+            waiters = self.waiters.get(key)
+            if waiters and waiter in waiters:
+                waiters.remove(waiter)
+                if not waiters:
+                    del self.waiters[key]
+        waiter.client.blocked = None
+        self.count -= 1
+        # the deadline heap entry is dropped lazily by expire()
+
+    def cancel(self, waiter):
+        """Forget about a waiter whose client went away."""
+        self._remove(waiter)
+
+    def signal(self, db, key):
+        """Key got new data: let its waiters retry, oldest first."""
+        waiters = self.waiters.get((db, key))
+        if not waiters:
+            return
+        for waiter in list(waiters):
+            reply = waiter.retry()
+            if reply is not None:
+                self._remove(waiter)
+                waiter.deferred.callback(reply)
+
+    def expire(self, now, reply=None):
+        """Time out waiters whose deadline has passed."""
+        deadlines = self.deadlines
+        while deadlines and deadlines[0][0] <= now:
+            deadline, counter, waiter = heapq.heappop(deadlines)
+            if waiter.active:
+                self._remove(waiter)
+                waiter.deferred.callback(reply)
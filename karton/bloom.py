@@ -0,0 +1,317 @@
+# -*- coding: utf-8 -*-
+
+"""
+Bloom and cuckoo filters (BF.* and CF.*), as in RedisBloom.
+
+Both answer "have I seen this before?" in a few bits per member, at the
+price of some false positives (and no false negatives). A Bloom filter
+sets a few bits per member in a bytearray; a cuckoo filter keeps a one
+byte fingerprint per member in buckets of a few slots, which it can also
+remove again.
+
+Both scale: once the newest sub-filter is full, another one, expansion
+times bigger, is added, and members are looked up in all of them. New
+Bloom sub-filters get a tighter error rate, so that the overall one stays
+about the one asked for.
+
+Members are hashed once (MD5: stable across processes, and done in C),
+into two 32-bit numbers that every sub-filter derives its bit positions or
+bucket and fingerprint from; they're small enough for the arithmetic to
+stay in machine integers. Commands taking several members hash them
+all up front, with hash_all().
+
+Filters are saved in RDB files and DUMP payloads as module values (see
+karton.rdb), under names of their own: the layout isn't RedisBloom's.
+"""
+
+import math
+import random
+import struct
+import hashlib
+
+
+# BF.ADD and CF.ADD on a missing key create filters with these.
+BLOOM_ERROR = 0.01
+BLOOM_CAPACITY = 100
+BLOOM_EXPANSION = 2
+CUCKOO_CAPACITY = 1080
+CUCKOO_BUCKET_SIZE = 2
+CUCKOO_MAX_ITERATIONS = 20
+CUCKOO_EXPANSION = 1
+
+# Error rate of each new Bloom sub-filter, relative to the previous one.
+TIGHTENING = 0.5
+
+_LN2_SQUARED = math.log(2) ** 2
+_halves = struct.Struct('<II8x')
+
+
+def hash_one(member):
+    """The two 32-bit hashes of a member."""
+    return _halves.unpack(hashlib.md5(member).digest())
+
+
+def hash_all(members):
+    md5 = hashlib.md5
+    unpack = _halves.unpack
+    return [unpack(md5(member).digest()) for member in members]
+
+
+class bloomlayer(object):
+    """One fixed-size Bloom filter."""
+
+    __slots__ = ('capacity', 'error', 'hashes', 'size', 'data', 'count')
+
+    def __init__(self, capacity, error, data=None, count=0):
+        self.capacity = capacity
+        self.error = error
+        self.hashes = max(1, int(math.ceil(-math.log(error, 2))))
+        size = int(math.ceil(-capacity * math.log(error) / _LN2_SQUARED))
+        # in bits: a whole number of bytes
+        self.size = max(64, (size + 7) & ~7)
+        self.data = bytearray(self.size >> 3) if data is None else data
+        self.count = count
+
+    def contains(self, h1, h2):
+        data = self.data
+        size = self.size
+        # most members that aren't there are out after a probe or two
+        for index in xrange(self.hashes):
+            position = (h1 + index * h2) % size
+            if not data[position >> 3] & (1 << (position & 7)):
+                return False
+        return True
+
+    def add(self, h1, h2):
+        data = self.data
+        size = self.size
+        for index in xrange(self.hashes):
+            position = (h1 + index * h2) % size
+            data[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+
+class bloomfilter(object):
+    """Scalable Bloom filter; expansion 0 means it doesn't scale."""
+
+    # RDB module type name and encoding version
+    MODULE = ('KRbloom--', 1)
+
+    def __init__(self, error=BLOOM_ERROR, capacity=BLOOM_CAPACITY, expansion=BLOOM_EXPANSION):
+        self.expansion = expansion
+        self.layers = [bloomlayer(capacity, error)]
+        self.count = 0
+
+    def __nonzero__(self):
+        # an empty filter still has its settings to keep
+        return True
+
+    @property
+    def capacity(self):
+        return sum(layer.capacity for layer in self.layers)
+
+    @property
+    def size(self):
+        """Bytes of bits."""
+        return sum(len(layer.data) for layer in self.layers)
+
+    def contains(self, hashed):
+        h1, h2 = hashed
+        for layer in reversed(self.layers):
+            if layer.contains(h1, h2):
+                return True
+        return False
+
+    def add(self, hashed):
+        """Add a hashed member; return False if it may have been there
+        already. Raise ValueError if the filter is full and can't scale."""
+        if self.contains(hashed):
+            return False
+        layer = self.layers[-1]
+        if layer.count >= layer.capacity:
+            if not self.expansion:
+                raise ValueError('non scaling filter is full')
+            layer = bloomlayer(layer.capacity * self.expansion, layer.error * TIGHTENING)
+            self.layers.append(layer)
+        layer.add(*hashed)
+        self.count += 1
+        return True
+
+    def fields(self):
+        """Values saved in RDB files, as karton.rdb wants them."""
+        fields = [self.expansion, self.count, len(self.layers)]
+        for layer in self.layers:
+            fields.extend([layer.capacity, layer.error, layer.count, str(layer.data)])
+        return fields
+
+    @classmethod
+    def fromfields(cls, fields):
+        self = cls.__new__(cls)
+        self.expansion, self.count, layers = fields[:3]
+        self.layers = []
+        for index in xrange(3, 3 + 4 * layers, 4):
+            capacity, error, count, data = fields[index:index+4]
+            layer = bloomlayer(capacity, error, bytearray(data), count)
+            if len(layer.data) != layer.size >> 3:
+                raise ValueError('invalid Bloom filter')
+            self.layers.append(layer)
+        if not self.layers:
+            raise ValueError('invalid Bloom filter')
+        return self
+
+
+class cuckoolayer(object):
+    """One fixed-size cuckoo filter: buckets (a power of two) of
+    bucket_size one-byte slots, zero for an empty one."""
+
+    __slots__ = ('buckets', 'bucket_size', 'mask', 'data')
+
+    def __init__(self, buckets, bucket_size, data=None):
+        self.buckets = buckets
+        self.bucket_size = bucket_size
+        self.mask = buckets - 1
+        self.data = bytearray(buckets * bucket_size) if data is None else data
+
+    def alternate(self, index, fingerprint):
+        """The other bucket of a fingerprint: either one leads to the other."""
+        return (index ^ (fingerprint * 0x5bd1e995)) & self.mask
+
+    def place(self, h1, fingerprint):
+        """Put a fingerprint in a free slot of one of its buckets; return
+        False if they're both full."""
+        data = self.data
+        size = self.bucket_size
+        first = h1 & self.mask
+        for index in (first, self.alternate(first, fingerprint)):
+            slot = data.find('\0', index * size, index * size + size)
+            if slot >= 0:
+                data[slot] = fingerprint
+                return True
+        return False
+
+    def kick(self, h1, fingerprint, max_iterations):
+        """Make room for a fingerprint whose buckets are full, by moving
+        others over to their other bucket. Return False if there's still no
+        room after max_iterations moves; the filter is left as it was, then."""
+        data = self.data
+        size = self.bucket_size
+        first = h1 & self.mask
+        second = self.alternate(first, fingerprint)
+        index = random.choice((first, second))
+        path = []
+        for iteration in xrange(max_iterations):
+            slot = index * size + random.randrange(size)
+            path.append((slot, data[slot]))
+            fingerprint, data[slot] = data[slot], fingerprint
+            index = self.alternate(index, fingerprint)
+            free = data.find('\0', index * size, index * size + size)
+            if free >= 0:
+                data[free] = fingerprint
+                return True
+        for slot, old in reversed(path):
+            data[slot] = old
+        return False
+
+
+def _power_of_two(number):
+    return 1 << max(0, int(math.ceil(math.log(max(number, 1), 2))))
+
+
+class cuckoofilter(object):
+    """Scalable cuckoo filter; expansion 0 means it doesn't scale."""
+
+    MODULE = ('KRbloomCF', 1)
+
+    def __init__(self, capacity=CUCKOO_CAPACITY, bucket_size=CUCKOO_BUCKET_SIZE,
+                 max_iterations=CUCKOO_MAX_ITERATIONS, expansion=CUCKOO_EXPANSION):
+        self.bucket_size = bucket_size
+        self.max_iterations = max_iterations
+        self.expansion = expansion
+        buckets = _power_of_two(int(math.ceil(float(capacity) / bucket_size)))
+        self.layers = [cuckoolayer(buckets, bucket_size)]
+        self.count = 0
+        self.deleted = 0
+
+    def __nonzero__(self):
+        return True
+
+    @property
+    def buckets(self):
+        return sum(layer.buckets for layer in self.layers)
+
+    @property
+    def size(self):
+        return sum(len(layer.data) for layer in self.layers)
+
+    @staticmethod
+    def _fingerprint(h2):
+        return h2 % 255 + 1
+
+    def _slots(self, hashed):
+        """(layer, slot) of every copy of a hashed member, newest first."""
+        h1, h2 = hashed
+        fingerprint = self._fingerprint(h2)
+        for layer in reversed(self.layers):
+            first = h1 & layer.mask
+            second = layer.alternate(first, fingerprint)
+            for index in ((first,) if first == second else (first, second)):
+                start = index * layer.bucket_size
+                slot = layer.data.find(chr(fingerprint), start, start + layer.bucket_size)
+                while slot >= 0:
+                    yield layer, slot
+                    slot = layer.data.find(chr(fingerprint), slot + 1, start + layer.bucket_size)
+
+    def contains(self, hashed):
+        return next(self._slots(hashed), None) is not None
+
+    def occurrences(self, hashed):
+        return sum(1 for slot in self._slots(hashed))
+
+    def add(self, hashed):
+        """Add a hashed member, even if it's there already. Raise ValueError
+        if the filter is full and can't scale."""
+        h1, h2 = hashed
+        fingerprint = self._fingerprint(h2)
+        # evictions are only worth it in the newest sub-filter: the others
+        # have been full, and only have room where members were deleted
+        layers = self.layers
+        if not any(layer.place(h1, fingerprint) for layer in reversed(layers)) and \
+                not layers[-1].kick(h1, fingerprint, self.max_iterations):
+            if not self.expansion:
+                raise ValueError('Filter is full')
+            layer = cuckoolayer(_power_of_two(layers[-1].buckets * self.expansion), self.bucket_size)
+            layers.append(layer)
+            layer.place(h1, fingerprint)
+        self.count += 1
+        return True
+
+    def delete(self, hashed):
+        """Remove one copy of a hashed member; return whether there was one.
+        Deleting a member that was never added may remove another one."""
+        for layer, slot in self._slots(hashed):
+            layer.data[slot] = 0
+            self.count -= 1
+            self.deleted += 1
+            return True
+        return False
+
+    def fields(self):
+        fields = [self.bucket_size, self.max_iterations, self.expansion, self.count, self.deleted,
+                  len(self.layers)]
+        for layer in self.layers:
+            fields.extend([layer.buckets, str(layer.data)])
+        return fields
+
+    @classmethod
+    def fromfields(cls, fields):
+        self = cls.__new__(cls)
+        self.bucket_size, self.max_iterations, self.expansion, self.count, self.deleted, layers = fields[:6]
+        self.layers = []
+        for index in xrange(6, 6 + 2 * layers, 2):
+            buckets, data = fields[index:index+2]
+            if buckets & (buckets - 1) or len(data) != buckets * self.bucket_size:
+                raise ValueError('invalid cuckoo filter')
+            self.layers.append(cuckoolayer(buckets, self.bucket_size, bytearray(data)))
+        if not self.layers:
+            raise ValueError('invalid cuckoo filter')
+        return self
@@ -0,0 +1,230 @@
+# -*- coding: utf-8 -*-
+
+"""
+Command table: which arguments of a command are keys, and whether the
+command writes to them.
+
+Key positions follow the Redis convention: (first, last, step), counting
+the command name as argument zero, with a negative last counting from the
+end. Commands whose keys can't be described that way have a function
+instead, taking the full argument list and returning the keys; the same
+goes for whether it writes, for SORT, which only does with STORE.
+
+Used by features that need to know what a command touches without running
+it, such as client-side caching invalidation.
+"""
+
+
+def _numkeys(position, extra=0):
+    """Keys counted by a numkeys argument at position, plus the extra
+    keys right before it."""
+    def keys(args):
+        try:
+            numkeys = int(args[position])
+        except (IndexError, ValueError):
+            return []
+        return list(args[position-extra:position]) + list(args[position+1:position+1+numkeys])
+    return keys
+
+
+def _streams(args):
+    """Keys of XREAD and XREADGROUP: the first half after STREAMS."""
+    for index, arg in enumerate(args):
+        if arg.upper() == 'STREAMS':
+            rest = args[index+1:]
+            return list(rest[:len(rest) // 2])
+    return []
+
+
+def _sort(args):
+    keys = list(args[1:2])
+    for index, arg in enumerate(args[2:-1], 2):
+        if arg.upper() == 'STORE':
+            keys.append(args[index+1])
+    return keys
+
+
+def _sort_writes(args):
+    return any(arg.upper() == 'STORE' for arg in args[2:-1])
+
+
+READ = False
+WRITE = True
+
+# name: (writes, keys), keys being (first, last, step) or a function, and
+# writes a boolean or a function.
+COMMANDS = {
+    # Keys
+    'DEL': (WRITE, (1, -1, 1)),
+    'UNLINK': (WRITE, (1, -1, 1)),
+    'DUMP': (READ, (1, 1, 1)),
+    'EXISTS': (READ, (1, -1, 1)),
+    'EXPIRE': (WRITE, (1, 1, 1)),
+    'EXPIREAT': (WRITE, (1, 1, 1)),
+    'MOVE': (WRITE, (1, 1, 1)),
+    'PERSIST': (WRITE, (1, 1, 1)),
+    'RENAME': (WRITE, (1, 2, 1)),
+    'RENAMENX': (WRITE, (1, 2, 1)),
+    'RESTORE': (WRITE, (1, 1, 1)),
+    'SORT': (_sort_writes, _sort),
+    'TTL': (READ, (1, 1, 1)),
+    'TYPE': (READ, (1, 1, 1)),
+    'OBJECT': (READ, (2, 2, 1)),
+    # Strings
+    'APPEND': (WRITE, (1, 1, 1)),
+    'BITCOUNT': (READ, (1, 1, 1)),
+    'BITOP': (WRITE, (2, -1, 1)),
+    'DECR': (WRITE, (1, 1, 1)),
+    'DECRBY': (WRITE, (1, 1, 1)),
+    'GET': (READ, (1, 1, 1)),
+    'GETBIT': (READ, (1, 1, 1)),
+    'GETRANGE': (READ, (1, 1, 1)),
+    'GETSET': (WRITE, (1, 1, 1)),
+    'INCR': (WRITE, (1, 1, 1)),
+    'INCRBY': (WRITE, (1, 1, 1)),
+    'INCRBYFLOAT': (WRITE, (1, 1, 1)),
+    'MGET': (READ, (1, -1, 1)),
+    'MSET': (WRITE, (1, -1, 2)),
+    'MSETNX': (WRITE, (1, -1, 2)),
+    'PSETEX': (WRITE, (1, 1, 1)),
+    'SET': (WRITE, (1, 1, 1)),
+    'SETBIT': (WRITE, (1, 1, 1)),
+    'SETEX': (WRITE, (1, 1, 1)),
+    'SETNX': (WRITE, (1, 1, 1)),
+    'SETRANGE': (WRITE, (1, 1, 1)),
+    'STRLEN': (READ, (1, 1, 1)),
+    # Hashes
+    'HDEL': (WRITE, (1, 1, 1)),
+    'HEXISTS': (READ, (1, 1, 1)),
+    'HGET': (READ, (1, 1, 1)),
+    'HGETALL': (READ, (1, 1, 1)),
+    'HINCRBY': (WRITE, (1, 1, 1)),
+    'HINCRBYFLOAT': (WRITE, (1, 1, 1)),
+    'HKEYS': (READ, (1, 1, 1)),
+    'HLEN': (READ, (1, 1, 1)),
+    'HMGET': (READ, (1, 1, 1)),
+    'HMSET': (WRITE, (1, 1, 1)),
+    'HSET': (WRITE, (1, 1, 1)),
+    'HSETNX': (WRITE, (1, 1, 1)),
+    'HVALS': (READ, (1, 1, 1)),
+    # Lists
+    'LINDEX': (READ, (1, 1, 1)),
+    'LINSERT': (WRITE, (1, 1, 1)),
+    'LLEN': (READ, (1, 1, 1)),
+    'LMOVE': (WRITE, (1, 2, 1)),
+    'LPOP': (WRITE, (1, 1, 1)),
+    'LPOS': (READ, (1, 1, 1)),
+    'LPUSH': (WRITE, (1, 1, 1)),
+    'LPUSHX': (WRITE, (1, 1, 1)),
+    'LRANGE': (READ, (1, 1, 1)),
+    'LREM': (WRITE, (1, 1, 1)),
+    'LSET': (WRITE, (1, 1, 1)),
+    'LTRIM': (WRITE, (1, 1, 1)),
+    'RPOP': (WRITE, (1, 1, 1)),
+    'RPOPLPUSH': (WRITE, (1, 2, 1)),
+    'RPUSH': (WRITE, (1, 1, 1)),
+    'RPUSHX': (WRITE, (1, 1, 1)),
+    # Sets
+    'SADD': (WRITE, (1, 1, 1)),
+    'SCARD': (READ, (1, 1, 1)),
+    'SDIFF': (READ, (1, -1, 1)),
+    'SDIFFSTORE': (WRITE, (1, -1, 1)),
+    'SINTER': (READ, (1, -1, 1)),
+    'SINTERCARD': (READ, _numkeys(1)),
+    'SINTERSTORE': (WRITE, (1, -1, 1)),
+    'SISMEMBER': (READ, (1, 1, 1)),
+    'SMEMBERS': (READ, (1, 1, 1)),
+    'SMOVE': (WRITE, (1, 2, 1)),
+    'SPOP': (WRITE, (1, 1, 1)),
+    'SRANDMEMBER': (READ, (1, 1, 1)),
+    'SREM': (WRITE, (1, 1, 1)),
+    'SUNION': (READ, (1, -1, 1)),
+    'SUNIONSTORE': (WRITE, (1, -1, 1)),
+    # Sorted Sets
+    'ZADD': (WRITE, (1, 1, 1)),
+    'ZCARD': (READ, (1, 1, 1)),
+    'ZCOUNT': (READ, (1, 1, 1)),
+    'ZINCRBY': (WRITE, (1, 1, 1)),
+    'ZINTERSTORE': (WRITE, _numkeys(2, extra=1)),
+    'ZRANGE': (READ, (1, 1, 1)),
+    'ZRANGEBYSCORE': (READ, (1, 1, 1)),
+    'ZRANK': (READ, (1, 1, 1)),
+    'ZREM': (WRITE, (1, 1, 1)),
+    'ZREMRANGEBYRANK': (WRITE, (1, 1, 1)),
+    'ZREMRANGEBYSCORE': (WRITE, (1, 1, 1)),
+    'ZREVRANGE': (READ, (1, 1, 1)),
+    'ZREVRANGEBYSCORE': (READ, (1, 1, 1)),
+    'ZREVRANK': (READ, (1, 1, 1)),
+    'ZSCORE': (READ, (1, 1, 1)),
+    'ZUNIONSTORE': (WRITE, _numkeys(2, extra=1)),
+    # Geo
+    'GEOADD': (WRITE, (1, 1, 1)),
+    'GEODIST': (READ, (1, 1, 1)),
+    'GEOHASH': (READ, (1, 1, 1)),
+    'GEOPOS': (READ, (1, 1, 1)),
+    'GEOSEARCH': (READ, (1, 1, 1)),
+    'GEOSEARCHSTORE': (WRITE, (1, 2, 1)),
+    # HyperLogLog
+    'PFADD': (WRITE, (1, 1, 1)),
+    'PFCOUNT': (READ, (1, -1, 1)),
+    'PFMERGE': (WRITE, (1, -1, 1)),
+    # Bloom and cuckoo filters
+    'BF.ADD': (WRITE, (1, 1, 1)),
+    'BF.CARD': (READ, (1, 1, 1)),
+    'BF.EXISTS': (READ, (1, 1, 1)),
+    'BF.INFO': (READ, (1, 1, 1)),
+    'BF.MADD': (WRITE, (1, 1, 1)),
+    'BF.MEXISTS': (READ, (1, 1, 1)),
+    'BF.RESERVE': (WRITE, (1, 1, 1)),
+    'CF.ADD': (WRITE, (1, 1, 1)),
+    'CF.ADDNX': (WRITE, (1, 1, 1)),
+    'CF.COUNT': (READ, (1, 1, 1)),
+    'CF.DEL': (WRITE, (1, 1, 1)),
+    'CF.EXISTS': (READ, (1, 1, 1)),
+    'CF.INFO': (READ, (1, 1, 1)),
+    'CF.INSERT': (WRITE, (1, 1, 1)),
+    'CF.INSERTNX': (WRITE, (1, 1, 1)),
+    'CF.MEXISTS': (READ, (1, 1, 1)),
+    'CF.RESERVE': (WRITE, (1, 1, 1)),
+    # Rate limiting
+    'CL.THROTTLE': (WRITE, (1, 1, 1)),
+    'THROTTLE': (WRITE, (1, 1, 1)),
+    # Time series
+    'TS.ADD': (WRITE, (1, 1, 1)),
+    'TS.CREATE': (WRITE, (1, 1, 1)),
+    'TS.GET': (READ, (1, 1, 1)),
+    'TS.INFO': (READ, (1, 1, 1)),
+    'TS.MADD': (WRITE, (1, -1, 3)),
+    'TS.RANGE': (READ, (1, 1, 1)),
+    'TS.REVRANGE': (READ, (1, 1, 1)),
+    # Server
+    'MEMORY': (READ, (2, 2, 1)),
+    # Streams
+    'XACK': (WRITE, (1, 1, 1)),
+    'XADD': (WRITE, (1, 1, 1)),
+    'XDEL': (WRITE, (1, 1, 1)),
+    'XGROUP': (WRITE, (2, 2, 1)),
+    'XLEN': (READ, (1, 1, 1)),
+    'XPENDING': (READ, (1, 1, 1)),
+    'XRANGE': (READ, (1, 1, 1)),
+    'XREAD': (READ, _streams),
+    'XREADGROUP': (WRITE, _streams),
+    'XREVRANGE': (READ, (1, 1, 1)),
+    'XTRIM': (WRITE, (1, 1, 1)),
+}
+
+
+def command_keys(args):
+    """Return (writes, keys) for a command; (False, []) if it has no keys."""
+    spec = COMMANDS.get(args[0].upper())
+    if spec is None:
+        return READ, []
+    writes, keys = spec
+    if callable(writes):
+        writes = writes(args)
+    if callable(keys):
+        return writes, keys(args)
+    first, last, step = keys
+    if last < 0:
+        last += len(args)
+    return writes, list(args[first:last+1:step])
@@ -0,0 +1,196 @@
+# -*- coding: utf-8 -*-
+
+"""
+Geospatial indexing on top of sorted sets (the GEO* commands).
+
+Like in Redis, a location is stored as a zset member whose score is a
+52-bit geohash: 26 bits of latitude and 26 bits of longitude, interleaved.
+Scores of points in the same geohash cell share a prefix, so every cell is
+one contiguous score range and a radius or box search turns into a handful
+of score-range scans: the cell containing the center plus its eight
+neighbours, at the finest level whose cells still cover the search area.
+The exact distance filter then runs over the candidates only, with NumPy
+when it's available.
+"""
+
+import math
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+STEP = 26
+BITS = STEP * 2
+
+LON_MIN = -180.0
+LON_MAX = 180.0
+# limits of the Web Mercator projection, as in Redis
+LAT_MIN = -85.05112878
+LAT_MAX = 85.05112878
+
+EARTH_RADIUS = 6372797.560856
+
+UNITS = {
+    'm': 1.0,
+    'km': 1000.0,
+    'ft': 0.3048,
+    'mi': 1609.34,
+}
+
+_BASE32 = '0123456789bcdefghjkmnpqrstuvwxyz'
+
+_B = (0x5555555555555555, 0x3333333333333333, 0x0F0F0F0F0F0F0F0F,
+      0x00FF00FF00FF00FF, 0x0000FFFF0000FFFF, 0x00000000FFFFFFFF)
+
+
+def _interleave(x, y):
+    """Spread the bits of x over even positions and y over odd ones."""
+    for shift, mask in zip((16, 8, 4, 2, 1), _B[4::-1]):
+        x = (x | (x << shift)) & mask
+        y = (y | (y << shift)) & mask
+    return x | (y << 1)
+
+
+def _deinterleave(bits, uint=int):
+    """Inverse of _interleave(); return (x, y). Works on NumPy arrays of
+    uint64 too, given uint=numpy.uint64."""
+    x = bits
+    y = bits >> uint(1)
+    for shift, mask in zip((0, 1, 2, 4, 8, 16), _B):
+        x = (x | (x >> uint(shift))) & uint(mask)
+        y = (y | (y >> uint(shift))) & uint(mask)
+    return x, y
+
+
+def valid(lon, lat):
+    return LON_MIN <= lon <= LON_MAX and LAT_MIN <= lat <= LAT_MAX
+
+
+def _cell(lon, lat, step):
+    """Cell indices (latitude, longitude) of a point at a given step."""
+    cells = 1 << step
+    ilat = int((lat - LAT_MIN) / (LAT_MAX - LAT_MIN) * cells)
+    ilon = int((lon - LON_MIN) / (LON_MAX - LON_MIN) * cells)
+    return min(ilat, cells - 1), min(ilon, cells - 1)
+
+
+def encode(lon, lat):
+    """52-bit geohash score of a point."""
+    ilat, ilon = _cell(lon, lat, STEP)
+    return _interleave(ilat, ilon)
+
+
+def _centers(ilat, ilon):
+    cells = float(1 << STEP)
+    lat = LAT_MIN + (ilat + 0.5) / cells * (LAT_MAX - LAT_MIN)
+    lon = LON_MIN + (ilon + 0.5) / cells * (LON_MAX - LON_MIN)
+    return lon, lat
+
+
+def decode(bits):
+    """Center (longitude, latitude) of the cell a score stands for."""
+    ilat, ilon = _deinterleave(int(bits))
+    return _centers(ilat, ilon)
+
+
+def decode_many(scores):
+    """decode() for a sequence of scores; return (lons, lats)."""
+    if numpy is not None:
+        bits = numpy.asarray(scores, dtype=numpy.float64).astype(numpy.uint64)
+        ilat, ilon = _deinterleave(bits, numpy.uint64)
+        return _centers(ilat.astype(numpy.float64), ilon.astype(numpy.float64))
+    points = [decode(score) for score in scores]
+    return [lon for lon, lat in points], [lat for lon, lat in points]
+
+
+def distance(lon1, lat1, lon2, lat2):
+    """Haversine distance in meters."""
+    lat1 = math.radians(lat1)
+    lat2 = math.radians(lat2)
+    u = math.sin((lat2 - lat1) / 2)
+    v = math.sin(math.radians(lon2 - lon1) / 2)
+    return 2.0 * EARTH_RADIUS * math.asin(math.sqrt(u * u + math.cos(lat1) * math.cos(lat2) * v * v))
+
+
+def geohash(bits):
+    """Standard 11 character geohash string of a score."""
+    lon, lat = decode(bits)
+    # standard geohashes span the full latitude range
+    cells = 1 << STEP
+    ilat = min(int((lat + 90.0) / 180.0 * cells), cells - 1)
+    ilon = min(int((lon + 180.0) / 360.0 * cells), cells - 1)
+    bits = _interleave(ilat, ilon)
+    chars = [_BASE32[(bits >> (BITS - (index + 1) * 5)) & 31] for index in xrange(10)]
+    return ''.join(chars) + _BASE32[0]
+
+
+def search_ranges(lon, lat, width, height):
+    """Score ranges [min, max) that cover a width x height meters box around
+    a point: the point's cell and its neighbours, at the finest step where
+    that's enough."""
+    lat_delta = math.degrees(height / 2.0 / EARTH_RADIUS)
+    edge = min(abs(lat) + lat_delta, 90.0)
+    if edge >= 90.0:
+        lon_delta = LON_MAX - LON_MIN
+    else:
+        lon_delta = math.degrees(width / 2.0 / (EARTH_RADIUS * math.cos(math.radians(edge))))
+    step = STEP
+    while step > 0:
+        cells = 1 << step
+        if (LAT_MAX - LAT_MIN) / cells >= lat_delta and (LON_MAX - LON_MIN) / cells >= lon_delta:
+            break
+        step -= 1
+    cells = 1 << step
+    ilat, ilon = _cell(lon, lat, step)
+    hashes = set()
+    for dlat in (-1, 0, 1):
+        if not 0 <= ilat + dlat < cells:
+            continue
+        for dlon in (-1, 0, 1):
+            hashes.add(_interleave(ilat + dlat, (ilon + dlon) % cells))
+    shift = BITS - 2 * step
+    ranges = []
+    for hash in sorted(hashes):
+        start, stop = hash << shift, (hash + 1) << shift
+        if ranges and ranges[-1][1] == start:
+            ranges[-1][1] = stop
+        else:
+            ranges.append([start, stop])
+    return ranges
+
+
+def within(lon, lat, scores, radius=None, width=None, height=None):
+    """Filter candidate scores by exact distance from a point, either
+    within radius or inside a width x height box (all in meters). Return
+    a list of (index, distance, longitude, latitude)."""
+    lons, lats = decode_many(scores)
+    if numpy is not None:
+        lat1 = math.radians(lat)
+        lats_r = numpy.radians(lats)
+        u = numpy.sin((lats_r - lat1) / 2)
+        v = numpy.sin(numpy.radians(lons - lon) / 2)
+        distances = 2.0 * EARTH_RADIUS * numpy.arcsin(numpy.sqrt(u * u + math.cos(lat1) * numpy.cos(lats_r) * v * v))
+        if radius is not None:
+            mask = distances <= radius
+        else:
+            # north-south distance, and east-west distance along the point's parallel
+            lat_distances = 2.0 * EARTH_RADIUS * numpy.abs(numpy.arcsin(u))
+            w = numpy.sin(numpy.radians(lons - lon) / 2)
+            lon_distances = 2.0 * EARTH_RADIUS * numpy.arcsin(numpy.abs(numpy.cos(lats_r) * w))
+            mask = (lat_distances <= height / 2.0) & (lon_distances <= width / 2.0)
+        indices = numpy.flatnonzero(mask)
+        return zip(indices.tolist(), distances[indices].tolist(),
+                   lons[indices].tolist(), lats[indices].tolist())
+    result = []
+    for index, (point_lon, point_lat) in enumerate(zip(lons, lats)):
+        if radius is None:
+            if distance(lon, point_lat, lon, lat) > height / 2.0 or \
+                    distance(point_lon, point_lat, lon, point_lat) > width / 2.0:
+                continue
+        point_distance = distance(lon, lat, point_lon, point_lat)
+        if radius is not None and point_distance > radius:
+            continue
+        result.append((index, point_distance, point_lon, point_lat))
+    return result
@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+
+"""
+Hot key detection (HOTKEYS).
+
+Server.do() samples one in every `rate` commands that have keys (at
+random, so that periodic traffic doesn't alias with the sampling), and
+counts the sampled keys in a count-min sketch: a few rows of counters,
+each key hashing to one counter per row, with the smallest of its
+counters as the estimate. Alongside it, the k keys with the highest
+estimates are kept in a small dict. Reads and writes are counted apart.
+
+Counts halve every decay_time seconds, so the keys reported are the ones
+hot lately. Reported counts are scaled back up by the sampling rate: they
+estimate commands, not samples. Keys of all databases are counted
+together.
+
+Memory and time don't depend on the number of keys: with the defaults,
+8k counters per class, and a few microseconds per sampled command.
+"""
+
+import time
+import random
+
+
+# One keyed command in this many is sampled; 0 turns sampling off.
+SAMPLE_RATE = 16
+# Seconds it takes for counts to halve; 0 for never.
+DECAY_TIME = 60
+# Counters per row, and rows.
+WIDTH = 2048
+DEPTH = 4
+# Keys with the highest counts kept track of, per class.
+TOP_K = 32
+
+
+class Sketch(object):
+    """Count-min sketch, with conservative update, and the k keys with the
+    highest estimates."""
+
+    def __init__(self, width=WIDTH, depth=DEPTH, k=TOP_K):
+        self.width = width
+        self.rows = [[0] * width for index in xrange(depth)]
+        self.k = k
+        # key -> estimated count
+        self.top = {}
+        # smallest count in top once it's full, or less: counts in top go
+        # up without it following, so it only rules keys out
+        self.floor = 0
+
+    def add(self, key):
+        """Count key once; return its estimated count."""
+        hashed = hash(key)
+        # double hashing: one slot per row out of two halves of the hash
+        first = hashed & 0xffffffff
+        step = (hashed >> 32) & 0xffffffff | 1
+        width = self.width
+        rows = self.rows
+        slots = [(first + index * step) % width for index in xrange(len(rows))]
+        estimate = min([row[slot] for row, slot in zip(rows, slots)]) + 1
+        # only the counters that are behind need to go up
+        for row, slot in zip(rows, slots):
+            if row[slot] < estimate:
+                row[slot] = estimate
+        top = self.top
+        if key in top or len(top) < self.k:
+            top[key] = estimate
+            if len(top) == self.k and not self.floor:
+                self.floor = min(top.itervalues())
+        elif estimate > self.floor:
+            victim = min(top, key=top.get)
+            if estimate > top[victim]:
+                del top[victim]
+                top[key] = estimate
+            self.floor = min(top.itervalues())
+        return estimate
+
+    def estimate(self, key):
+        hashed = hash(key)
+        first = hashed & 0xffffffff
+        step = (hashed >> 32) & 0xffffffff | 1
+        return min(row[(first + index * step) % self.width] for index, row in enumerate(self.rows))
+
+    def decay(self):
+        """Halve every count."""
+        self.rows = [[counter >> 1 for counter in row] for row in self.rows]
+        self.top = dict((key, count >> 1) for key, count in self.top.iteritems() if count > 1)
+        self.floor = min(self.top.itervalues()) if len(self.top) == self.k else 0
+
+
+class HotKeys(object):
+
+    def __init__(self, rate=SAMPLE_RATE, decay_time=DECAY_TIME):
+        # sketches by command class: writes or not
+        self.sketches = {False: Sketch(), True: Sketch()}
+        self.decay_time = decay_time
+        self.decayed = time.time()
+        self.sampled = 0
+        self.set_rate(rate)
+
+    def set_rate(self, rate):
+        self.rate = rate
+        # decremented by Server.do() for every keyed command, which calls
+        # sample() when it gets to zero
+        self.countdown = rate or -1
+
+    def sample(self, writes, keys):
+        sketch = self.sketches[writes]
+        for key in keys:
+            sketch.add(key)
+        self.sampled += 1
+        rate = self.rate
+        self.countdown = random.randint(1, 2 * rate - 1) if rate else -1
+
+    def top(self, writes, count=TOP_K):
+        """[(key, estimated number of commands)], hottest first."""
+        top = self.sketches[writes].top
+        keys = sorted(top, key=top.get, reverse=True)[:count]
+        return [(key, top[key] * max(self.rate, 1)) for key in keys]
+
+    def cron(self, now):
+        if self.decay_time and now - self.decayed >= self.decay_time:
+            self.decayed = now
+            for sketch in self.sketches.itervalues():
+                sketch.decay()
+
+    def reset(self):
+        self.sketches = {False: Sketch(), True: Sketch()}
+        self.sampled = 0
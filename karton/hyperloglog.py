@@ -0,0 +1,365 @@
+# -*- coding: utf-8 -*-
+
+"""
+HyperLogLog cardinality estimation (PFADD/PFCOUNT/PFMERGE).
+
+Registers, hashing and the cardinality estimator follow Redis, and so
+does the serialized form returned by tostring(): GET on a HyperLogLog key
+returns a string Redis itself would accept, and vice versa.
+
+In memory, a fresh HyperLogLog is sparse: a sorted array of the non-zero
+registers, packed as (index << 6 | value). Once it outgrows
+SPARSE_MAX_ENTRIES, or a register gets a value the Redis sparse format
+can't express, it's promoted to the dense 12 KB encoding of 16384 6-bit
+registers. Whole-register operations (PFCOUNT histograms, PFMERGE) use
+NumPy when it's available.
+"""
+
+import math
+import struct
+from array import array
+from bisect import bisect_left
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+P = 14
+REGISTERS = 1 << P
+Q = 64 - P
+MAX_VALUE = 63
+DENSE_SIZE = REGISTERS * 6 // 8
+
+# Sparse HyperLogLogs with more non-zero registers are made dense.
+SPARSE_MAX_ENTRIES = 750
+# Largest value the Redis sparse encoding can store.
+SPARSE_MAX_VALUE = 32
+
+MAGIC = 'HYLL'
+DENSE = 0
+SPARSE = 1
+_header = struct.Struct('<4sB3xQ')
+_CARD_INVALID = 1 << 63
+
+_M64 = 0xffffffffffffffff
+_SEED = 0xadc83b19
+
+
+def murmurhash64a(key, seed=_SEED):
+    """MurmurHash64A, as used by Redis to hash HyperLogLog elements."""
+    m = 0xc6a4a7935bd1e995
+    r = 47
+    length = len(key)
+    h = (seed ^ (length * m)) & _M64
+    tail = length & ~7
+    for k in struct.unpack('<%dQ' % (tail // 8), key[:tail]):
+        k = (k * m) & _M64
+        k ^= k >> r
+        k = (k * m) & _M64
+        h ^= k
+        h = (h * m) & _M64
+    rest = key[tail:]
+    if rest:
+        for shift, char in enumerate(rest):
+            h ^= ord(char) << (8 * shift)
+        h = (h * m) & _M64
+    h ^= h >> r
+    h = (h * m) & _M64
+    h ^= h >> r
+    return h
+
+
+def register_for(member):
+    """Return (register index, run length) for a member."""
+    hash = murmurhash64a(member)
+    index = hash & (REGISTERS - 1)
+    hash = (hash >> P) | (1 << Q)
+    # position of the lowest set bit, counting from one
+    return index, (hash & -hash).bit_length()
+
+
+# Dense register packing: 6 bits per register, least significant bit first,
+# so every 3 bytes hold exactly 4 registers.
+
+def _unpack(data):
+    if numpy is not None:
+        raw = numpy.frombuffer(bytes(data), dtype=numpy.uint8).reshape(-1, 3).astype(numpy.uint32)
+        words = raw[:, 0] | raw[:, 1] << 8 | raw[:, 2] << 16
+        registers = numpy.empty((len(words), 4), dtype=numpy.uint8)
+        for slot in xrange(4):
+            registers[:, slot] = (words >> (6 * slot)) & 63
+        return registers.ravel()
+    registers = array('B')
+    for offset in xrange(0, len(data), 3):
+        word = data[offset] | data[offset+1] << 8 | data[offset+2] << 16
+        registers.extend((word & 63, word >> 6 & 63, word >> 12 & 63, word >> 18))
+    return registers
+
+
+def _pack(registers):
+    if numpy is not None:
+        registers = numpy.asarray(registers, dtype=numpy.uint32).reshape(-1, 4)
+        words = registers[:, 0] | registers[:, 1] << 6 | registers[:, 2] << 12 | registers[:, 3] << 18
+        raw = numpy.empty((len(words), 3), dtype=numpy.uint8)
+        for slot in xrange(3):
+            raw[:, slot] = (words >> (8 * slot)) & 255
+        return bytearray(raw.tostring())
+    data = bytearray(DENSE_SIZE)
+    for index in xrange(0, REGISTERS, 4):
+        word = registers[index] | registers[index+1] << 6 | \
+            registers[index+2] << 12 | registers[index+3] << 18
+        offset = index // 4 * 3
+        data[offset] = word & 255
+        data[offset+1] = word >> 8 & 255
+        data[offset+2] = word >> 16
+    return data
+
+
+def _get_dense(data, index):
+    offset, bit = divmod(index * 6, 8)
+    value = data[offset] >> bit
+    if bit > 2:
+        value |= data[offset+1] << (8 - bit)
+    return value & 63
+
+
+def _set_dense(data, index, value):
+    offset, bit = divmod(index * 6, 8)
+    data[offset] = (data[offset] & ~(63 << bit) & 255) | (value << bit & 255)
+    if bit > 2:
+        data[offset+1] = (data[offset+1] & ~(63 >> (8 - bit)) & 255) | (value >> (8 - bit))
+
+
+# Cardinality estimator (Otmar Ertl's improved raw estimator, as in Redis).
+
+def _sigma(x):
+    if x == 1.0:
+        return float('inf')
+    y = 1.0
+    z = x
+    while True:
+        x *= x
+        previous = z
+        z += x * y
+        y += y
+        if z == previous:
+            return z
+
+
+def _tau(x):
+    if x == 0.0 or x == 1.0:
+        return 0.0
+    y = 1.0
+    z = 1 - x
+    while True:
+        x = math.sqrt(x)
+        previous = z
+        y *= 0.5
+        z -= (1 - x) ** 2 * y
+        if z == previous:
+            return z / 3
+
+
+def estimate(histogram):
+    """Estimate cardinality from a histogram of register values."""
+    m = float(REGISTERS)
+    z = m * _tau((m - histogram[Q + 1]) / m)
+    for value in xrange(Q, 0, -1):
+        z += histogram[value]
+        z *= 0.5
+    z += m * _sigma(histogram[0] / m)
+    return int(round(0.5 / math.log(2) * m * m / z))
+
+
+class hyperloglog(object):
+
+    def __init__(self):
+        self.sparse = array('I')
+        self.dense = None
+        self._card = 0
+
+    @property
+    def encoding(self):
+        return 'sparse' if self.dense is None else 'dense'
+
+    def add(self, member):
+        """Add member; return whether any register changed."""
+        index, value = register_for(member)
+        if self.dense is None:
+            changed = self._add_sparse(index, value)
+        else:
+            changed = _get_dense(self.dense, index) < value
+            if changed:
+                _set_dense(self.dense, index, value)
+        if changed:
+            self._card = None
+        return changed
+
+    def _add_sparse(self, index, value):
+        sparse = self.sparse
+        position = bisect_left(sparse, index << 6)
+        if position < len(sparse) and sparse[position] >> 6 == index:
+            if sparse[position] & 63 >= value:
+                return False
+            sparse[position] = index << 6 | value
+        else:
+            sparse.insert(position, index << 6 | value)
+        if value > SPARSE_MAX_VALUE or len(sparse) > SPARSE_MAX_ENTRIES:
+            self._promote()
+        return True
+
+    def _promote(self):
+        data = bytearray(DENSE_SIZE)
+        for entry in self.sparse:
+            _set_dense(data, entry >> 6, entry & 63)
+        self.dense = data
+        self.sparse = None
+
+    def registers(self):
+        """All register values, as a NumPy array if possible."""
+        if self.dense is not None:
+            return _unpack(self.dense)
+        if numpy is not None:
+            registers = numpy.zeros(REGISTERS, dtype=numpy.uint8)
+            entries = numpy.frombuffer(self.sparse.tostring(), dtype=numpy.uint32)
+            registers[entries >> 6] = entries & 63
+            return registers
+        registers = array('B', [0]) * REGISTERS
+        for entry in self.sparse:
+            registers[entry >> 6] = entry & 63
+        return registers
+
+    def histogram(self):
+        if self.dense is None:
+            histogram = [0] * (MAX_VALUE + 1)
+            for entry in self.sparse:
+                histogram[entry & 63] += 1
+            histogram[0] = REGISTERS - len(self.sparse)
+            return histogram
+        registers = self.registers()
+        if numpy is not None:
+            return numpy.bincount(registers, minlength=MAX_VALUE + 1).tolist()
+        histogram = [0] * (MAX_VALUE + 1)
+        for value in registers:
+            histogram[value] += 1
+        return histogram
+
+    def count(self):
+        """Estimated cardinality; cached until the next change."""
+        if self._card is None:
+            self._card = estimate(self.histogram())
+        return self._card
+
+    @classmethod
+    def fromregisters(cls, registers):
+        """Build from register values, picking the smaller encoding."""
+        rv = cls()
+        if numpy is not None:
+            registers = numpy.asarray(registers, dtype=numpy.uint8)
+            indices = numpy.flatnonzero(registers)
+            if len(indices) <= SPARSE_MAX_ENTRIES and registers.max() <= SPARSE_MAX_VALUE:
+                rv.sparse = array('I', (indices << 6 | registers[indices]).tolist())
+            else:
+                rv.sparse = None
+                rv.dense = _pack(registers)
+        else:
+            entries = [index << 6 | value for index, value in enumerate(registers) if value]
+            if len(entries) <= SPARSE_MAX_ENTRIES and max(registers) <= SPARSE_MAX_VALUE:
+                rv.sparse = array('I', entries)
+            else:
+                rv.sparse = None
+                rv.dense = _pack(registers)
+        rv._card = None
+        return rv
+
+    @classmethod
+    def merged(cls, hlls):
+        """Register-wise maximum of several HyperLogLogs."""
+        if numpy is not None:
+            return cls.fromregisters(numpy.maximum.reduce([hll.registers() for hll in hlls]))
+        result = array('B', [0]) * REGISTERS
+        for hll in hlls:
+            result = array('B', map(max, result, hll.registers()))
+        return cls.fromregisters(result)
+
+    # Redis-compatible serialization.
+
+    def tostring(self):
+        card = _CARD_INVALID if self._card is None else self._card
+        if self.dense is not None:
+            return _header.pack(MAGIC, DENSE, card) + str(self.dense)
+        return _header.pack(MAGIC, SPARSE, card) + self._encode_sparse()
+
+    def _encode_sparse(self):
+        out = bytearray()
+
+        def zeros(count):
+            while count:
+                run = min(count, 16384)
+                if run <= 64:
+                    out.append(run - 1)
+                else:
+                    out.append(0x40 | (run - 1) >> 8)
+                    out.append((run - 1) & 255)
+                count -= run
+
+        next_index = 0
+        entries = self.sparse
+        position = 0
+        while position < len(entries):
+            index, value = entries[position] >> 6, entries[position] & 63
+            zeros(index - next_index)
+            # run of up to four consecutive registers with the same value
+            run = 1
+            while run < 4 and position + run < len(entries) and \
+                    entries[position+run] == (index + run) << 6 | value:
+                run += 1
+            out.append(0x80 | (value - 1) << 2 | (run - 1))
+            position += run
+            next_index = index + run
+        zeros(REGISTERS - next_index)
+        return str(out)
+
+    @classmethod
+    def fromstring(cls, string):
+        """Parse a serialized HyperLogLog; raise ValueError if it isn't one."""
+        if len(string) < _header.size:
+            raise ValueError('not a HyperLogLog')
+        magic, encoding, card = _header.unpack_from(string)
+        payload = bytearray(string[_header.size:])
+        rv = cls()
+        if magic != MAGIC:
+            raise ValueError('not a HyperLogLog')
+        if encoding == DENSE:
+            if len(payload) != DENSE_SIZE:
+                raise ValueError('corrupted HyperLogLog')
+            rv.sparse = None
+            rv.dense = payload
+        elif encoding == SPARSE:
+            index = 0
+            position = 0
+            while position < len(payload):
+                opcode = payload[position]
+                if opcode & 0x80:
+                    value = (opcode >> 2 & 31) + 1
+                    run = (opcode & 3) + 1
+                    for offset in xrange(run):
+                        rv.sparse.append((index + offset) << 6 | value)
+                    index += run
+                    position += 1
+                elif opcode & 0x40:
+                    index += ((opcode & 63) << 8 | payload[position+1]) + 1
+                    position += 2
+                else:
+                    index += (opcode & 63) + 1
+                    position += 1
+            if index != REGISTERS:
+                raise ValueError('corrupted HyperLogLog')
+            if len(rv.sparse) > SPARSE_MAX_ENTRIES:
+                rv._promote()
+        else:
+            raise ValueError('unknown HyperLogLog encoding')
+        rv._card = None if card & _CARD_INVALID else card
+        return rv
@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+
+"""
+Compact encoding for small sets of integers.
+
+Sets whose members are all canonical decimal integers are kept as a sorted
+array of 64-bit machine words instead of a hash table of strings, which is
+an order of magnitude smaller. Once a set outgrows MAX_ENTRIES or gets a
+non-integer member, it's converted to a regular Python set for good.
+"""
+
+from array import array
+from bisect import bisect_left
+
+
+# Larger sets are stored as plain Python sets.
+MAX_ENTRIES = 512
+
+_BITS = array('l').itemsize * 8
+_MIN = -2**(_BITS-1)
+_MAX = 2**(_BITS-1) - 1
+
+
+def is_int(member):
+    """Check whether member is a canonical decimal machine integer."""
+    try:
+        value = int(member)
+    except ValueError:
+        return False
+    return _MIN <= value <= _MAX and str(value) == member
+
+
+def fits(members):
+    return len(members) <= MAX_ENTRIES and all(map(is_int, members))
+
+
+def compact(members):
+    """Return members as an intset if possible, as a set otherwise."""
+    if isinstance(members, intset) or not fits(members):
+        return members
+    return intset(members)
+
+
+def upgrade(value, members):
+    """Return value, converted to a plain set if it can't take members."""
+    if not isinstance(value, intset):
+        return value
+    if len(value) + len(members) > MAX_ENTRIES or not all(map(is_int, members)):
+        return set(value)
+    return value
+
+
+class intset(object):
+
+    def __init__(self, members=()):
+        self._array = array('l', sorted(set(int(member) for member in members)))
+
+    @classmethod
+    def _fromarray(cls, values):
+        rv = cls()
+        rv._array = values
+        return rv
+
+    def copy(self):
+        return intset._fromarray(array('l', self._array))
+
+    def _find(self, member):
+        """Return index of member, or -1."""
+        if not is_int(member):
+            return -1
+        value = int(member)
+        index = bisect_left(self._array, value)
+        if index < len(self._array) and self._array[index] == value:
+            return index
+        return -1
+
+    def __len__(self):
+        return len(self._array)
+
+    def __iter__(self):
+        return (str(value) for value in self._array)
+
+    def __getitem__(self, index):
+        return str(self._array[index])
+
+    def __contains__(self, member):
+        return self._find(member) >= 0
+
+    def __eq__(self, other):
+        if isinstance(other, intset):
+            return self._array == other._array
+        return set(self) == other
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __repr__(self):
+        return 'intset(%r)' % list(self._array)
+
+    def add(self, member):
+        value = int(member)
+        index = bisect_left(self._array, value)
+        if index == len(self._array) or self._array[index] != value:
+            self._array.insert(index, value)
+
+    def discard(self, member):
+        index = self._find(member)
+        if index >= 0:
+            del self._array[index]
+
+    def remove(self, member):
+        index = self._find(member)
+        if index < 0:
+            raise KeyError(member)
+        del self._array[index]
+
+    def pop(self):
+        if not self._array:
+            raise KeyError('pop from an empty set')
+        return str(self._array.pop())
+
+    def intersection(self, *others, **kw):
+        """Merge-intersect with other intsets; stop after limit members."""
+        limit = kw.get('limit', 0)
+        if not others:
+            return intset._fromarray(self._array[:limit or None])
+        result = self._array
+        last = len(others) - 1
+        for index, other in enumerate(others):
+            # only the final pass knows which members make it.
+            stop = limit if index == last else 0
+            large = other._array
+            size = len(large)
+            out = array('l')
+            lo = 0
+            for value in result:
+                lo = bisect_left(large, value, lo)
+                if lo == size:
+                    break
+                if large[lo] == value:
+                    out.append(value)
+                    if len(out) == stop:
+                        break
+            result = out
+            if not result:
+                break
+        return intset._fromarray(result)
@@ -0,0 +1,154 @@
+# -*- coding: utf-8 -*-
+
+"""
+Request parsing and reply encoding on a pool of threads (--io-threads).
+
+With many busy connections, the reactor thread spends more time feeding
+data to parsers and encoding replies than running commands. As in Redis'
+io-threads, IOThreads takes over from the reactor for a batch of
+connections at a time, in three steps:
+
+1. parse: every connection that received data turns it into requests,
+   the batch split between the threads (the calling one included);
+2. process: the main thread runs the requests, connection by connection,
+   through Server.do(): commands never run concurrently, and replies and
+   pushed messages are queued as Python objects instead of being written;
+3. encode: the connections that have anything queued encode it, again on
+   all the threads, and the main thread writes the results out.
+
+The main thread waits for the others at the end of each step, so a
+connection is only ever touched by one thread at a time, and there are no
+locks beyond the handing out of work. Batches are whatever came in during
+a turn of the reactor; small ones are done on the calling thread alone.
+
+Replies being written once per connection and batch, rather than one at
+a time, --io-threads 1 (the reactor thread alone) is already quicker than
+none with pipelined requests. Parsing and encoding hold the GIL, though,
+in hiredis as in karton.protocol: on an interpreter with one, more threads
+only take turns, and cost a little. They're meant for interpreters where
+they can run side by side (see benchmarks/io_threads.py).
+
+Connections are objects with parse(), process() and encode() (run as
+described above, encode() returning a string) and write(data), and a
+lost attribute set once they're closed.
+"""
+
+import sys
+import threading
+import Queue
+
+
+# Batches of fewer connections than this are done on the calling thread.
+THRESHOLD = 4
+
+
+class IOThreads(object):
+
+    def __init__(self, threads, call_later, threshold=THRESHOLD):
+        # call_later(function): call function soon, on the main thread
+        # (reactor.callLater(0, function))
+        self.call_later = call_later
+        self.threshold = threshold
+        # connections that received data since the last batch
+        self.ready = []
+        # connections with replies to encode
+        self.dirty = []
+        self.scheduled = False
+        # set while requests are run: replies are queued, not written
+        self.batching = False
+        self.jobs = Queue.Queue()
+        self.done = Queue.Queue()
+        self.threads = []
+        for index in xrange(threads - 1):
+            thread = threading.Thread(target=self._work, name='karton-io-%d' % (index + 1))
+            thread.daemon = True
+            thread.start()
+            self.threads.append(thread)
+
+    def schedule(self, connection):
+        """Parse connection's input with the next batch."""
+        self.ready.append(connection)
+        if not self.scheduled:
+            self.scheduled = True
+            self.call_later(self.run)
+
+    def queued(self, connection):
+        """connection has queued something to encode."""
+        self.dirty.append(connection)
+
+    def run(self):
+        self.scheduled = False
+        batch = [connection for connection in _unique(self.ready) if not connection.lost]
+        self.ready = []
+        self.map(_parse, batch)
+        self.batching = True
+        try:
+            for connection in batch:
+                if not connection.lost:
+                    connection.process()
+        finally:
+            self.batching = False
+        self.flush()
+
+    def flush(self):
+        """Encode and write out what's been queued."""
+        dirty = [connection for connection in _unique(self.dirty) if not connection.lost]
+        self.dirty = []
+        for connection, data in zip(dirty, self.map(_encode, dirty)):
+            if data and not connection.lost:
+                connection.write(data)
+
+    def map(self, function, items):
+        """[function(item) for item in items], spread over the threads."""
+        threads = len(self.threads) + 1
+        if threads == 1 or len(items) < max(self.threshold, 2):
+            return map(function, items)
+        results = [None] * len(items)
+        step = -(-len(items) // threads)
+        slices = range(0, len(items), step)
+        for start in slices[1:]:
+            self.jobs.put((function, items, results, start, start + step))
+        failures = filter(None, [_job(function, items, results, 0, step)] +
+                          [self.done.get() for start in slices[1:]])
+        if failures:
+            raise failures[0][0], failures[0][1], failures[0][2]
+        return results
+
+    def _work(self):
+        while True:
+            job = self.jobs.get()
+            if job is None:
+                return
+            self.done.put(_job(*job))
+
+    def close(self):
+        for thread in self.threads:
+            self.jobs.put(None)
+        for thread in self.threads:
+            thread.join()
+        self.threads = []
+
+
+def _unique(connections):
+    seen = set()
+    return [connection for connection in connections
+            if connection not in seen and not seen.add(connection)]
+
+
+def _job(function, items, results, start, end):
+    """Run function over items[start:end]; return the exception info of a
+    failure, or None."""
+    try:
+        for index in xrange(start, min(end, len(items))):
+            results[index] = function(items[index])
+    except Exception:
+        return sys.exc_info()
+    return None
+
+
+def _parse(connection):
+    connection.parse()
+
+
+def _encode(connection):
+    return connection.encode()
@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+
+"""
+Incremental deallocation of detached values.
+
+Dropping the last reference to a huge container frees all of its elements
+in one go, blocking every client for as long as that takes. UNLINK and
+FLUSHDB/FLUSHALL ASYNC instead detach the value from the keyspace in O(1)
+and hand it over to LazyFree, which then tears it down a bounded chunk at
+a time from Server.cron().
+"""
+
+import time
+import collections
+
+from blist import blist
+
+from .sorteddict import sorteddict
+from .quicklist import quicklist
+
+
+# Containers with at most this many elements are freed on the spot.
+LAZYFREE_THRESHOLD = 64
+
+# Number of elements freed in one step.
+LAZYFREE_CHUNK = 1024
+
+
+# Containers that know how to be torn down piece by piece.
+_containers = (dict, set, list, blist, sorteddict, quicklist)
+
+
+def _effort(value):
+    """Number of elements that have to be freed along with value."""
+    if isinstance(value, _containers):
+        return len(value)
+    return 1
+
+
+class LazyFree(object):
+
+    def __init__(self):
+        self.queue = collections.deque()
+        self.freed = 0
+        # ids of values that must be left alone (they're being streamed)
+        self.pinned = {}
+
+    @property
+    def pending(self):
+        return len(self.queue)
+
+    def free(self, value, force=False):
+        """Release value, deferring the actual work if it's big (or forced)."""
+        if not force and _effort(value) <= LAZYFREE_THRESHOLD:
+            return
+        if id(value) in self.pinned:
+            # whoever is still using it will drop the last reference
+            return
+        if isinstance(value, sorteddict):
+            # both halves are large; tear them down separately.
+            self.queue.append(value._map)
+            self.queue.append(value._sortedkeys._blist)
+        else:
+            self.queue.append(value)
+
+    def _shrink(self, value, count):
+        """Free up to count elements of value; return how many were freed."""
+        count = min(count, len(value))
+        if isinstance(value, dict):
+            popitem = value.popitem
+            free = self.free
+            for _ in xrange(count):
+                # values may be big containers themselves (FLUSHDB ASYNC).
+                free(popitem()[1])
+        elif isinstance(value, set):
+            pop = value.pop
+            for _ in xrange(count):
+                pop()
+        else:
+            del value[-count:]
+        return count
+
+    def step(self, budget=LAZYFREE_CHUNK):
+        """Free at most budget elements. Return the number of pending objects."""
+        queue = self.queue
+        while budget > 0 and queue:
+            value = queue[0]
+            budget -= self._shrink(value, budget)
+            if not value:
+                queue.popleft()
+                self.freed += 1
+        return len(queue)
+
+    def run(self, seconds):
+        """Keep stepping until there's nothing left or time is up."""
+        deadline = time.time() + seconds
+        while self.step() and time.time() < deadline:
+            pass
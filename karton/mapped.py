@@ -0,0 +1,229 @@
+# -*- coding: utf-8 -*-
+
+"""
+Memory-mapped snapshots, for restarts that don't wait for the data.
+
+Loading a big dataset means decoding every value into Python objects
+before the first client can be served. A mapped snapshot instead keeps
+its values encoded in a file that's mmap()ed at startup: only the keys
+are loaded, each with the offset of its value as a placeholder. Offsets
+are plain ints, which no value ever is, so each database comes out of
+its index with a single marshal.loads() call: no per-key Python code
+runs at startup, and a cold key costs its string, an int and a slot.
+
+A cold value is decoded the first time a command touches its key (see
+Server.do()), and a warm-up walker decodes the rest from Server.cron(), a
+little at a time. Once they're all warm, the file is let go of.
+
+File layout (integers big-endian):
+
+    header: magic, version, number of databases
+    directory: (offset, size) of the index of every database
+    records: value length, RDB type byte, RDB-encoded value
+    indexes: marshal.dumps({key: record offset}), one per database
+
+The directory is written last, so a file that's only partially written
+doesn't pass for a good one. Values are encoded as in RDB files and DUMP
+payloads (see karton.rdb).
+"""
+
+import os
+import sys
+import mmap
+import time
+import struct
+import marshal
+import optparse
+
+from . import rdb
+
+
+MAGIC = 'KARTONMM'
+VERSION = 1
+
+_HEADER = struct.Struct('>8sII')
+_ENTRY = struct.Struct('>QQ')
+_RECORD = struct.Struct('>Q')
+
+# Bytes written at a time by save().
+WRITE_CHUNK = 64 * 1024
+# Keys the warm-up walker goes through between looks at the clock.
+WARM_BATCH = 64
+
+# Commands that deal with keys, not their values: cold values stay cold.
+KEYS_ONLY = frozenset(['del', 'exists', 'rename', 'renamenx', 'unlink'])
+
+
+def is_cold(value):
+    return value.__class__ is int
+
+
+def save(dbs, file, mapped=None):
+    """Write databases (a list of dicts) to file, which must be seekable.
+    Values still cold in mapped are copied over as they are."""
+    start = file.tell()
+    directory = _HEADER.size + len(dbs) * _ENTRY.size
+    file.write('\0' * directory)
+    offset = directory
+    buffer = []
+    buffered = 0
+    indexes = []
+    for db in dbs:
+        index = {}
+        for key, value in db.iteritems():
+            if is_cold(value):
+                record = mapped.record(value)
+            else:
+                type, data = rdb.value_type_and_data(value)
+                record = _RECORD.pack(len(data) + 1) + chr(type) + data
+            index[key] = offset
+            offset += len(record)
+            buffer.append(record)
+            buffered += len(record)
+            if buffered >= WRITE_CHUNK:
+                file.write(''.join(buffer))
+                buffer = []
+                buffered = 0
+        indexes.append(index)
+    file.write(''.join(buffer))
+    entries = []
+    for index in indexes:
+        blob = marshal.dumps(index)
+        entries.append(_ENTRY.pack(offset, len(blob)))
+        offset += len(blob)
+        file.write(blob)
+    file.flush()
+    file.seek(start)
+    file.write(_HEADER.pack(MAGIC, VERSION, len(dbs)) + ''.join(entries))
+    file.seek(start + offset)
+    file.flush()
+
+
+def save_path(dbs, path, mapped=None):
+    """save() to a file that replaces path once it's complete."""
+    temporary = '%s.%d.tmp' % (path, os.getpid())
+    try:
+        with open(temporary, 'wb') as file:
+            save(dbs, file, mapped)
+            os.fsync(file.fileno())
+        os.rename(temporary, path)
+    finally:
+        if os.path.exists(temporary):
+            os.unlink(temporary)
+
+
+class Mapped(object):
+    """A mapped snapshot that cold values are decoded from."""
+
+    def __init__(self, path):
+        self.file = open(path, 'rb')
+        self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        if len(self.map) < _HEADER.size:
+            raise ValueError('not a karton snapshot')
+        magic, version, dbs = _HEADER.unpack_from(self.map, 0)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError('not a karton snapshot, or an unsupported version')
+        self.indexes = [_ENTRY.unpack_from(self.map, _HEADER.size + number * _ENTRY.size)
+                        for number in xrange(dbs)]
+        if any(offset == 0 for offset, size in self.indexes):
+            raise ValueError('incomplete snapshot')
+        # warm-up walker position: [db number, db, iterator over its keys]
+        self.walk = None
+        self.warmed = 0
+
+    def load(self, server):
+        """Add the keys of the snapshot to server, with cold values; return
+        the number of keys."""
+        if len(self.indexes) > len(server.dbs):
+            raise ValueError('snapshot has %d databases' % len(self.indexes))
+        count = 0
+        for number, (offset, size) in enumerate(self.indexes):
+            db = marshal.loads(self.map[offset:offset+size])
+            if server.dbs[number]:
+                server.dbs[number].update(db)
+            else:
+                server.dbs[number] = db
+            count += len(db)
+        server.mapped = self
+        return count
+
+    def record(self, offset):
+        size, = _RECORD.unpack_from(self.map, offset)
+        return self.map[offset:offset + _RECORD.size + size]
+
+    def value(self, offset):
+        self.map.seek(offset + _RECORD.size)
+        reader = rdb.Reader(self.map)
+        return reader.value(reader.byte())
+
+    def thaw(self, ht, key, value):
+        """value of key in ht, decoded (and stored) if it's cold."""
+        if is_cold(value):
+            value = ht[key] = self.value(value)
+            self.warmed += 1
+        return value
+
+    def materialize(self, ht, keys):
+        """Decode the cold values of keys in ht."""
+        for key in keys:
+            value = ht.get(key)
+            if is_cold(value):
+                ht[key] = self.value(value)
+                self.warmed += 1
+
+    def warm(self, dbs, timeout):
+        """Decode cold values for up to timeout seconds; return True once
+        there are none left."""
+        deadline = time.time() + timeout
+        if self.walk is None:
+            self.walk = self._walk(dbs, 0)
+        while True:
+            number, db, keys = self.walk
+            if dbs[number] is not db:
+                # flushed asynchronously: walk the new one
+                self.walk = self._walk(dbs, number)
+                continue
+            batch = 0
+            for key in keys:
+                value = db.get(key)
+                if value is not None and is_cold(value):
+                    db[key] = self.value(value)
+                    self.warmed += 1
+                batch += 1
+                if batch == WARM_BATCH:
+                    if time.time() >= deadline:
+                        return False
+                    batch = 0
+            if number + 1 == len(dbs):
+                return True
+            self.walk = self._walk(dbs, number + 1)
+
+    def _walk(self, dbs, number):
+        """Walker position at the start of a database. Its keys are copied
+        in one go: an iterator over the dict itself would have to start
+        over whenever it changes size, as it does with any write, and go
+        past every value warmed so far again. Keys added since are warm
+        anyway, and those deleted are skipped."""
+        db = dbs[number]
+        return [number, db, iter(db.keys())]
+
+    def close(self):
+        self.map.close()
+        self.file.close()
+
+
+def main():
+    parser = optparse.OptionParser(usage='%prog dump.rdb snapshot')
+    options, args = parser.parse_args()
+    if len(args) != 2:
+        parser.error('expected an RDB file and the snapshot to write')
+    from .server import Server
+    server = Server()
+    with open(args[0], 'rb') as file:
+        loaded, expired = rdb.load(server, file)
+    save_path(server.dbs, args[1])
+    print >>sys.stderr, '%s: %d keys' % (args[1], loaded)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,212 @@
+# -*- coding: utf-8 -*-
+
+"""
+Memory introspection (MEMORY USAGE, MEMORY STATS, OBJECT).
+
+Sizes are what CPython reports through sys.getsizeof(), so they include
+object headers and allocator-visible buffers but not malloc overhead.
+Compact encodings (intsets, quicklist chunks, HyperLogLogs) are measured
+exactly, since that only takes a few calls. Large collections of Python
+objects are estimated like Redis does it: the container's own size, plus
+the average size of the first few elements times their number.
+
+Access metadata for OBJECT IDLETIME and OBJECT FREQ lives in AccessInfo:
+one int per key, holding the last access time in seconds and an 8-bit
+logarithmic access counter that decays by one every minute, the way the
+Redis LFU counter does.
+"""
+
+import os
+import sys
+import random
+import struct
+import resource
+from itertools import islice
+
+from .intset import intset, is_int
+from .quicklist import quicklist
+from .sorteddict import sorteddict
+from .hyperloglog import hyperloglog
+from .stream import stream
+from .bloom import bloomfilter, cuckoofilter
+from .timeseries import timeseries
+
+
+getsizeof = sys.getsizeof
+
+# Elements looked at by default to estimate the size of a collection.
+SAMPLES = 5
+
+_POINTER = struct.calcsize('P')
+# a dict slot: hash, key and value
+_DICT_ENTRY = 3 * _POINTER
+
+
+def _estimate(count, samples, size, items):
+    """Total size of count elements, from the first samples of them (or
+    all of them if samples is 0)."""
+    if not count:
+        return 0
+    sampled = 0
+    total = 0
+    for item in (islice(items, samples) if samples else items):
+        total += size(item)
+        sampled += 1
+    if not sampled:
+        return 0
+    return total * count // sampled
+
+
+def value_size(value, samples=SAMPLES):
+    """Estimated number of bytes taken by a value."""
+    if isinstance(value, str):
+        return getsizeof(value)
+    if isinstance(value, intset):
+        return getsizeof(value) + getsizeof(value._array)
+    if isinstance(value, hyperloglog):
+        size = getsizeof(value) + getsizeof(value.sparse)
+        if value.dense is not None:
+            size += getsizeof(value.dense)
+        return size
+    if isinstance(value, quicklist):
+        chunks = value._chunks
+        return getsizeof(value) + getsizeof(chunks) + _estimate(
+            len(chunks), samples, lambda chunk: getsizeof(chunk) + getsizeof(chunk.data) + getsizeof(chunk.sizes),
+            iter(chunks))
+    if isinstance(value, (set, frozenset)):
+        return getsizeof(value) + _estimate(len(value), samples, getsizeof, iter(value))
+    if isinstance(value, dict):
+        return getsizeof(value) + _estimate(
+            len(value), samples, lambda item: getsizeof(item[0]) + getsizeof(item[1]), value.iteritems())
+    if isinstance(value, sorteddict):
+        # members are shared by the score map and the (score, member)
+        # tuples of the sorted list, which also holds a pointer each.
+        pair = getsizeof((0.0, '')) + getsizeof(0.0) + _POINTER
+        return getsizeof(value) + getsizeof(value._map) + _estimate(
+            len(value), samples, lambda member: getsizeof(member) + pair, iter(value._map))
+    if isinstance(value, stream):
+        def node_size(node):
+            return getsizeof(node) + sum(getsizeof(part) for part in (
+                node.ms, node.seq, node.counts, node.sizes, node.data, node.deleted))
+        size = getsizeof(value) + getsizeof(value.nodes) + getsizeof(value.firsts) + \
+            _estimate(len(value.nodes), samples, node_size, iter(value.nodes))
+        for group in value.groups.itervalues():
+            # pending entries: ID tuple, entry and the consumer's reference
+            size += getsizeof(group.pel) + len(group.pel) * (getsizeof((0, 0)) * 2 + 64)
+        return size
+    if isinstance(value, (bloomfilter, cuckoofilter)):
+        return getsizeof(value) + getsizeof(value.layers) + sum(
+            getsizeof(layer) + getsizeof(layer.data) for layer in value.layers)
+    if isinstance(value, timeseries):
+        return getsizeof(value) + getsizeof(value.chunks) + getsizeof(value.timestamps) + \
+            getsizeof(value.values) + getsizeof(value.labels) + sum(
+                getsizeof(chunk) + getsizeof(chunk.data) + getsizeof(chunk.first) + getsizeof(chunk.last)
+                for chunk in value.chunks)
+    return getsizeof(value)
+
+
+def usage(key, value, samples=SAMPLES):
+    """Estimated number of bytes taken by a key, its value and its slot in
+    the keyspace (MEMORY USAGE)."""
+    return getsizeof(key) + _DICT_ENTRY + value_size(value, samples)
+
+
+def encoding(value):
+    """Name of a value's encoding (OBJECT ENCODING)."""
+    if isinstance(value, str):
+        if is_int(value):
+            return 'int'
+        return 'embstr' if len(value) <= 44 else 'raw'
+    if isinstance(value, (hyperloglog, bloomfilter, cuckoofilter)):
+        return 'raw'
+    if isinstance(value, timeseries):
+        return 'compressed'
+    if isinstance(value, quicklist):
+        return 'quicklist'
+    if isinstance(value, intset):
+        return 'intset'
+    if isinstance(value, (set, dict)):
+        return 'hashtable'
+    if isinstance(value, sorteddict):
+        return 'skiplist'
+    if isinstance(value, stream):
+        return 'stream'
+    return 'unknown'
+
+
+def rss():
+    """Resident set size of the process, in bytes."""
+    try:
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except IOError:
+        return peak_rss()
+
+
+def peak_rss():
+    usage = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on OS X
+    return usage if sys.platform == 'darwin' else usage * 1024
+
+
+# LFU counter, as in Redis: new keys start at LFU_INIT_VAL, and the
+# counter grows logarithmically with the number of accesses.
+LFU_INIT_VAL = 5
+LFU_LOG_FACTOR = 10
+# Minutes it takes for the counter to decay by one.
+LFU_DECAY_TIME = 1
+
+# Commands that look at keys without counting as an access to them.
+NOTOUCH = frozenset(['exists', 'memory', 'object', 'type'])
+
+
+def _decayed(meta, seconds):
+    counter = meta & 255
+    periods = (seconds - (meta >> 8)) // 60 // LFU_DECAY_TIME
+    return max(counter - periods, 0) if periods > 0 else counter
+
+
+class AccessInfo(object):
+    """Last access time and access frequency of every key, by database."""
+
+    def __init__(self, dbs, started):
+        self.dbs = [{} for index in xrange(dbs)]
+        # keys nobody has touched yet (loaded from a dump) count as
+        # accessed when the server started
+        self.started = int(started)
+
+    def touch(self, db, ht, keys, now):
+        """Record an access to keys of ht; forget those that are gone."""
+        meta = self.dbs[db]
+        seconds = int(now)
+        for key in keys:
+            if key not in ht:
+                meta.pop(key, None)
+                continue
+            old = meta.get(key)
+            if old is None:
+                counter = LFU_INIT_VAL
+            else:
+                counter = _decayed(old, seconds)
+                if counter < 255:
+                    base = max(counter - LFU_INIT_VAL, 0)
+                    if random.random() < 1.0 / (base * LFU_LOG_FACTOR + 1):
+                        counter += 1
+            meta[key] = seconds << 8 | counter
+
+    def idle(self, db, key, now):
+        meta = self.dbs[db].get(key)
+        return int(now) - (self.started if meta is None else meta >> 8)
+
+    def freq(self, db, key, now):
+        meta = self.dbs[db].get(key)
+        if meta is None:
+            return LFU_INIT_VAL
+        return _decayed(meta, int(now))
+
+    def flush(self, db=None):
+        if db is None:
+            for meta in self.dbs:
+                meta.clear()
+        else:
+            self.dbs[db] = {}
@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+
+"""
+Keyspace notifications (notify-keyspace-events).
+
+Command handlers report events with Server._notify(type, event, key),
+which does nothing but test a bitmask unless the event type is enabled.
+Enabled events are only queued; at the end of the command they're turned
+into __keyspace@<db>__ and __keyevent@<db>__ messages and published in
+one batch, and only if anyone is subscribed at all.
+"""
+
+
+KEYSPACE = 1 << 0
+KEYEVENT = 1 << 1
+GENERIC = 1 << 2
+STRING = 1 << 3
+LIST = 1 << 4
+SET = 1 << 5
+HASH = 1 << 6
+ZSET = 1 << 7
+EXPIRED = 1 << 8
+EVICTED = 1 << 9
+STREAM = 1 << 10
+KEY_MISS = 1 << 11
+NEW = 1 << 12
+MODULE = 1 << 13
+
+# in the order Redis lists them
+FLAGS = [
+    ('g', GENERIC),
+    ('$', STRING),
+    ('l', LIST),
+    ('s', SET),
+    ('h', HASH),
+    ('z', ZSET),
+    ('x', EXPIRED),
+    ('e', EVICTED),
+    ('t', STREAM),
+    ('d', MODULE),
+    ('m', KEY_MISS),
+    ('n', NEW),
+    ('K', KEYSPACE),
+    ('E', KEYEVENT),
+]
+ALL = GENERIC | STRING | LIST | SET | HASH | ZSET | EXPIRED | EVICTED | STREAM | MODULE
+
+
+def parse_flags(string):
+    """Turn a notify-keyspace-events string into a bitmask."""
+    flags = 0
+    table = dict(FLAGS)
+    for char in string:
+        if char == 'A':
+            flags |= ALL
+        elif char in table:
+            flags |= table[char]
+        else:
+            raise ValueError('Invalid event class character. Use \'Ag$lshzxeKEtmdn\'.')
+    return flags
+
+
+def format_flags(flags):
+    string = ''
+    if flags & ALL == ALL:
+        string = 'A'
+        flags &= ~ALL
+    return string + ''.join(char for char, flag in FLAGS if flags & flag)
+
+
+def messages(events):
+    """Turn queued (type, event, key, db) tuples into (channel, payload)
+    messages, according to the KEYSPACE and KEYEVENT bits."""
+    result = []
+    for flags, event, key, db in events:
+        if flags & KEYSPACE:
+            result.append(('__keyspace@%d__:%s' % (db, key), event))
+        if flags & KEYEVENT:
+            result.append(('__keyevent@%d__:%s' % (db, event), key))
+    return result
@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+
+"""
+On-demand profiling of commands (DEBUG PROFILE).
+
+While a Profiler is set on the server, Server.do() runs command handlers
+through Profiler.call(); otherwise nothing at all is done. Two kinds:
+
+* deterministic, with cProfile: exact call counts and times, at the price
+  of slowing every Python call down by a lot;
+* sampling: a SIGPROF timer looks at the stack every interval seconds of
+  CPU time and counts the functions on it, up to Server.do(). Cheap enough
+  for a busy production server, but the counts are samples, not calls.
+
+Either way, dump() writes a file for the pstats module (or snakeviz,
+gprof2dot...). In sampling profiles, "calls" are the samples a function was
+seen in, and times are estimated from the number of samples.
+"""
+
+import signal
+import marshal
+import cProfile
+from collections import defaultdict
+
+
+# Seconds of CPU time between samples.
+INTERVAL = 0.005
+
+
+def _label(code):
+    return (code.co_filename, code.co_firstlineno, code.co_name)
+
+
+class Profiler(object):
+
+    def __init__(self, sampling=False, interval=INTERVAL):
+        self.sampling = sampling
+        self.interval = interval
+        self.running = False
+        if sampling:
+            # stacks (labels, innermost first) -> number of samples
+            self.stacks = defaultdict(int)
+            # samples taken while no command was running
+            self.idle = 0
+            # code of the outermost frame worth counting
+            self.until = None
+            self.active = False
+        else:
+            self.profile = cProfile.Profile()
+
+    def start(self, until=None):
+        """Start profiling; with sampling, stacks are cut at the frame running
+        the until code object (Server.do)."""
+        if self.sampling:
+            self.until = until
+            self.previous = signal.signal(signal.SIGPROF, self._sample)
+            signal.setitimer(signal.ITIMER_PROF, self.interval, self.interval)
+        self.running = True
+
+    def stop(self):
+        if self.running and self.sampling:
+            signal.setitimer(signal.ITIMER_PROF, 0)
+            signal.signal(signal.SIGPROF, self.previous or signal.SIG_DFL)
+        self.running = False
+
+    def call(self, function, *args):
+        if not self.running:
+            return function(*args)
+        if self.sampling:
+            self.active = True
+            try:
+                return function(*args)
+            finally:
+                self.active = False
+        return self.profile.runcall(function, *args)
+
+    def _sample(self, signum, frame):
+        if not self.active:
+            self.idle += 1
+            return
+        stack = []
+        until = self.until
+        while frame is not None:
+            stack.append(_label(frame.f_code))
+            if frame.f_code is until:
+                break
+            frame = frame.f_back
+        self.stacks[tuple(stack)] += 1
+
+    @property
+    def samples(self):
+        return sum(self.stacks.itervalues()) if self.sampling else 0
+
+    def stats(self):
+        """Sampled stacks as pstats wants them: label -> (primitive calls,
+        calls, own time, cumulative time, {caller label: (same for calls
+        from there)})."""
+        interval = self.interval
+        own = defaultdict(int)
+        total = defaultdict(int)
+        callers = defaultdict(lambda: defaultdict(int))
+        for stack, count in self.stacks.iteritems():
+            own[stack[0]] += count
+            # recursive functions are only counted once per sample
+            seen = set()
+            for index, label in enumerate(stack):
+                if label not in seen:
+                    seen.add(label)
+                    total[label] += count
+                if index + 1 < len(stack):
+                    callers[label][stack[index + 1]] += count
+        stats = {}
+        for label, count in total.iteritems():
+            stats[label] = (count, count, own[label] * interval, count * interval, dict(
+                (caller, (calls, calls, 0.0, calls * interval))
+                for caller, calls in callers[label].iteritems()))
+        return stats
+
+    def dump(self, path):
+        """Write what's been profiled so far to path, in pstats format."""
+        if self.sampling:
+            with open(path, 'wb') as file:
+                marshal.dump(self.stats(), file)
+        else:
+            self.profile.dump_stats(path)
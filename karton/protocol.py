@@ -11,12 +11,23 @@ Reply translation table (Redis <- Python):
     Bulk Reply <- str
     NULL Bulk Reply <- None
     Multi Bulk Reply <- list
+    Push (RESP3) <- Push
+    Map (RESP3) <- Map
+    Multi Bulk Reply, encoded lazily <- Stream
+    Any reply, already encoded <- Encoded
 
-Protocol parsing is handled by hiredis at the moment.
+Parsing is done by Reader, or by hiredis.Reader where it's available and
+faster (see reader()).
 """
 
+import platform
 import collections
 
+try:
+    import hiredis
+except ImportError:
+    hiredis = None
+
 class Status(object):
 
     def __init__(self, message):
@@ -35,8 +46,50 @@ class Error(object):
         return '<Error reply -%s>' % self.message
 
 
+class Push(list):
+    """Out-of-band message, such as a client-side caching invalidation."""
+
+    def __repr__(self):
+        return '<Push reply >%s>' % list.__repr__(self)
+
+
+class Map(list):
+    """Map reply, as a flat list of keys and values (HELLO 3)."""
+
+    def __repr__(self):
+        return '<Map reply %%%s>' % list.__repr__(self)
+
+
+class Stream(object):
+    """Multi bulk reply whose items are produced lazily, so that it can be
+    encoded and sent piece by piece with chunks()."""
+
+    def __init__(self, length, items):
+        self.length = length
+        self.items = items
+
+    def __len__(self):
+        return self.length
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __repr__(self):
+        return '<Stream reply *%d>' % self.length
+
+
+class Encoded(list):
+    """Reply that's already been encoded, as a list of pieces."""
+
+    def __repr__(self):
+        return '<Encoded reply %d bytes>' % sum(map(len, self))
+
+
 OK = Status('OK')
 
+# Approximate size of the pieces chunks() yields.
+STREAM_CHUNK = 64 * 1024
+
 
 def python_to_redis(response):
     if response is True:
@@ -55,7 +108,246 @@ def python_to_redis(response):
         return '$%d\r\n%s\r\n' % (len(response), response)
     elif response is None:
         return '$-1\r\n'
+    elif isinstance(response, Encoded):
+        return ''.join(response)
+    elif isinstance(response, Push):
+        return ('>%d\r\n' % len(response)) + ''.join(map(python_to_redis, response))
+    elif isinstance(response, Map):
+        return ('%%%d\r\n' % (len(response) // 2)) + ''.join(map(python_to_redis, response))
     elif isinstance(response, collections.Iterable):
         return ('*%d\r\n' % len(response)) + ''.join(map(python_to_redis, response))
     else:
         raise ValueError("don't know how to handle %s" % repr(response))
+
+
+def chunks(response, size=STREAM_CHUNK):
+    """Encode a reply incrementally: a Stream comes out in pieces of about
+    size bytes, an Encoded reply in its own pieces, anything else in one
+    piece."""
+    if isinstance(response, Encoded):
+        for piece in response:
+            yield piece
+        return
+    if not isinstance(response, Stream):
+        yield python_to_redis(response)
+        return
+    buffer = ['*%d\r\n' % len(response)]
+    buffered = 0
+    for item in response:
+        raw = python_to_redis(item)
+        buffer.append(raw)
+        buffered += len(raw)
+        if buffered >= size:
+            yield ''.join(buffer)
+            buffer = []
+            buffered = 0
+    if buffer:
+        yield ''.join(buffer)
+
+
+class ProtocolError(Exception):
+    """Malformed input: there's no telling where the next message starts."""
+
+
+class ReplyError(Exception):
+    """An error reply, as Reader(replies=True) returns it."""
+
+
+# Limits, as in Redis.
+MAX_INLINE = 64 * 1024
+MAX_BULK = 512 * 1024 * 1024
+# Consumed input is dropped from the buffer once there's this much of it.
+COMPACT = 64 * 1024
+
+_CRLF = '\r\n'
+_STAR, _DOLLAR, _PLUS, _MINUS, _COLON = map(ord, '*$+-:')
+
+
+def _int(text, message):
+    try:
+        return int(text)
+    except ValueError:
+        raise ProtocolError('Protocol error: ' + message)
+
+
+class Reader(object):
+    """Incremental RESP parser with the interface of hiredis.Reader: feed()
+    it data as it arrives, and gets() returns the next complete message, or
+    False until there is one.
+
+    Input accumulates in a bytearray and is parsed where it lies, through a
+    buffer() view and an offset, instead of slicing off what's been read:
+    every argument is copied once, straight into the string returned. A
+    multi bulk message is built up as its items arrive, so one that comes
+    in many pieces is still parsed only once.
+
+    By default it reads requests: multi bulk lists of bulk strings, or
+    inline commands (PING\\r\\n) split on whitespace. With replies=True it
+    reads any RESP2 reply, and returns error replies as ReplyError.
+    """
+
+    def __init__(self, replies=False):
+        self.replies = replies
+        self.data = bytearray()
+        # where the next unread byte is
+        self.pos = 0
+        # request being read, and its number of arguments
+        self.args = None
+        self.count = 0
+        # multi bulk replies being read, innermost last: [items, length]
+        self.stack = []
+
+    def feed(self, data):
+        pos = self.pos
+        if pos and (pos >= COMPACT or pos == len(self.data)):
+            del self.data[:pos]
+            self.pos = 0
+        self.data += data
+
+    def has_data(self):
+        return self.pos < len(self.data) or self.args is not None or bool(self.stack)
+
+    def gets(self):
+        if self.replies:
+            return self._reply()
+        return self._request()
+
+    def _line(self, pos):
+        """End of the line starting at pos, or -1 if it isn't all there."""
+        eol = self.data.find(_CRLF, pos)
+        if eol < 0 and len(self.data) - pos > MAX_INLINE:
+            raise ProtocolError('Protocol error: too big count string')
+        return eol
+
+    def _request(self):
+        data = self.data
+        view = buffer(data)
+        size = len(data)
+        pos = self.pos
+        args = self.args
+        if args is None:
+            # a new request; empty ones are skipped
+            while True:
+                if pos >= size:
+                    return False
+                if data[pos] != _STAR:
+                    eol = data.find('\n', pos)
+                    if eol < 0:
+                        if size - pos > MAX_INLINE:
+                            raise ProtocolError('Protocol error: too big inline request')
+                        return False
+                    args = view[pos:eol].split()
+                    self.pos = pos = eol + 1
+                    if args:
+                        return args
+                    continue
+                eol = data.find(_CRLF, pos)
+                if eol < 0:
+                    self._line(pos)
+                    return False
+                try:
+                    count = int(view[pos+1:eol])
+                except ValueError:
+                    raise ProtocolError('Protocol error: invalid multibulk length')
+                self.pos = pos = eol + 2
+                if count > 0:
+                    break
+            self.args = args = []
+            self.count = count
+        # the arguments, inlined: this is where the time goes
+        find = data.find
+        append = args.append
+        missing = self.count - len(args)
+        while missing:
+            eol = find(_CRLF, pos)
+            if eol < 0:
+                self._line(pos)
+                break
+            if data[pos] != _DOLLAR:
+                raise ProtocolError("Protocol error: expected '$', got '%s'" % chr(data[pos]))
+            try:
+                length = int(view[pos+1:eol])
+            except ValueError:
+                length = -1
+            if not 0 <= length <= MAX_BULK:
+                raise ProtocolError('Protocol error: invalid bulk length')
+            end = eol + 2 + length
+            if end + 2 > size:
+                break
+            if data[end] != 13 or data[end+1] != 10:
+                raise ProtocolError('Protocol error: bulk string not terminated by CRLF')
+            append(view[eol+2:end])
+            pos = end + 2
+            missing -= 1
+        self.pos = pos
+        if missing:
+            return False
+        self.args = None
+        return args
+
+    def _reply(self):
+        data = self.data
+        view = buffer(data)
+        size = len(data)
+        pos = self.pos
+        stack = self.stack
+        while True:
+            if pos >= size:
+                return False
+            eol = self._line(pos)
+            if eol < 0:
+                return False
+            kind = data[pos]
+            if kind == _DOLLAR:
+                length = _int(view[pos+1:eol], 'invalid bulk length')
+                if length < 0:
+                    item = None
+                    pos = eol + 2
+                else:
+                    start = eol + 2
+                    end = start + length
+                    if end + 2 > size:
+                        return False
+                    if view[end:end+2] != _CRLF:
+                        raise ProtocolError('Protocol error: bulk string not terminated by CRLF')
+                    item = view[start:end]
+                    pos = end + 2
+            elif kind == _STAR:
+                length = _int(view[pos+1:eol], 'invalid multibulk length')
+                pos = eol + 2
+                if length > 0:
+                    stack.append([[], length])
+                    self.pos = pos
+                    continue
+                item = [] if length == 0 else None
+            elif kind == _PLUS:
+                item = view[pos+1:eol]
+                pos = eol + 2
+            elif kind == _MINUS:
+                item = ReplyError(view[pos+1:eol])
+                pos = eol + 2
+            elif kind == _COLON:
+                item = _int(view[pos+1:eol], 'invalid integer')
+                pos = eol + 2
+            else:
+                raise ProtocolError('Protocol error, got %r as reply type byte' % chr(kind))
+            self.pos = pos
+            # complete the multi bulk replies it was the last item of
+            while stack:
+                items, length = stack[-1]
+                items.append(item)
+                if len(items) < length:
+                    break
+                stack.pop()
+                item = items
+            if not stack:
+                return item
+
+
+def reader(replies=False):
+    """A new parser for requests (or replies): hiredis' on CPython if it's
+    installed, Reader otherwise. Note that hiredis doesn't understand inline
+    commands."""
+    if hiredis is not None and platform.python_implementation() == 'CPython':
+        return hiredis.Reader()
+    return Reader(replies)
@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+
+"""
+Publish/subscribe message routing.
+
+Subscribers are Client objects; messages reach them through Client.push().
+Messages published together are batched, so that every subscriber gets a
+single push (and a single write on the wire) with all of its messages.
+"""
+
+import re
+import fnmatch
+
+
+def compile_pattern(pattern):
+    """Compile a glob-style pattern the way KEYS does."""
+    pattern = re.sub(r'\\(.)', r'[\1]', pattern)
+    return re.compile(fnmatch.translate(pattern))
+
+
+class PubSub(object):
+
+    def __init__(self):
+        # channel -> set of clients
+        self.channels = {}
+        # pattern -> (compiled pattern, set of clients)
+        self.patterns = {}
+
+    def __nonzero__(self):
+        return bool(self.channels or self.patterns)
+
+    def subscribe(self, client, channel):
+        """Return whether the client wasn't subscribed yet."""
+        clients = self.channels.setdefault(channel, set())
+        if client in clients:
+            return False
+        clients.add(client)
+        client.channels.add(channel)
+        return True
+
+    def unsubscribe(self, client, channel):
+        clients = self.channels.get(channel)
+        if not clients or client not in clients:
+            return False
+        clients.discard(client)
+        if not clients:
+            del self.channels[channel]
+        client.channels.discard(channel)
+        return True
+
+    def psubscribe(self, client, pattern):
+        if pattern not in self.patterns:
+            self.patterns[pattern] = (compile_pattern(pattern), set())
+        clients = self.patterns[pattern][1]
+        if client in clients:
+            return False
+        clients.add(client)
+        client.patterns.add(pattern)
+        return True
+
+    def punsubscribe(self, client, pattern):
+        if pattern not in self.patterns:
+            return False
+        clients = self.patterns[pattern][1]
+        if client not in clients:
+            return False
+        clients.discard(client)
+        if not clients:
+            del self.patterns[pattern]
+        client.patterns.discard(pattern)
+        return True
+
+    def drop(self, client):
+        """Unsubscribe a client from everything."""
+        for channel in list(client.channels):
+            self.unsubscribe(client, channel)
+        for pattern in list(client.patterns):
+            self.punsubscribe(client, pattern)
+
+    def send(self, client, channel, payload):
+        """Deliver payload on channel to client alone, if it's subscribed to
+        it; return whether it was."""
+        if client not in self.channels.get(channel, ()):
+            return False
+        client.push(['message', channel, payload])
+        return True
+
+    def publish(self, messages):
+        """Deliver (channel, payload) pairs; return the number of receivers."""
+        batches = {}
+        receivers = 0
+        for channel, payload in messages:
+            for client in self.channels.get(channel, ()):
+                batches.setdefault(client, []).append(['message', channel, payload])
+                receivers += 1
+            for pattern, (compiled, clients) in self.patterns.iteritems():
+                if compiled.match(channel):
+                    for client in clients:
+                        batches.setdefault(client, []).append(['pmessage', pattern, channel, payload])
+                        receivers += 1
+        for client, batch in batches.iteritems():
+            client.push(*batch)
+        return receivers
@@ -0,0 +1,400 @@
+# -*- coding: utf-8 -*-
+
+"""
+Compact list of strings, modeled after the Redis quicklist.
+
+Values are packed back to back into bytearray chunks of bounded size, and
+the chunks are kept in a deque. This gives O(1) push and pop at both ends,
+O(n/chunk) indexed access, and costs a few bytes of overhead per element
+instead of a full Python string object.
+
+Scans (index, LREM, LPOS) skip whole chunks whose buffer doesn't contain
+the value's bytes anywhere, and can run from either end without reversing.
+"""
+
+from array import array
+from collections import deque
+from itertools import islice
+
+
+# A chunk is full once it holds this many entries...
+CHUNK_ENTRIES = 128
+# ...or this many bytes, whichever comes first.
+CHUNK_BYTES = 8192
+
+
+class _chunk(object):
+    """Strings packed into a single buffer, with their sizes on the side."""
+
+    __slots__ = ('data', 'sizes')
+
+    def __init__(self, values=()):
+        self.data = bytearray().join(values)
+        self.sizes = array('I', map(len, values))
+
+    def __len__(self):
+        return len(self.sizes)
+
+    def full(self, value):
+        return len(self.sizes) >= CHUNK_ENTRIES or \
+            (self.sizes and len(self.data) + len(value) > CHUNK_BYTES)
+
+    def _offset(self, index):
+        return sum(islice(self.sizes, index))
+
+    def values(self):
+        data = self.data
+        values = []
+        start = 0
+        for size in self.sizes:
+            values.append(str(data[start:start+size]))
+            start += size
+        return values
+
+    def get(self, index):
+        start = self._offset(index)
+        return str(self.data[start:start+self.sizes[index]])
+
+    def set(self, index, value):
+        start = self._offset(index)
+        self.data[start:start+self.sizes[index]] = value
+        self.sizes[index] = len(value)
+
+    def insert(self, index, value):
+        start = self._offset(index)
+        self.data[start:start] = value
+        self.sizes.insert(index, len(value))
+
+    def delete(self, index):
+        start = self._offset(index)
+        del self.data[start:start+self.sizes[index]]
+        del self.sizes[index]
+
+    def append(self, value):
+        self.data += value
+        self.sizes.append(len(value))
+
+    def appendleft(self, value):
+        self.data[0:0] = value
+        self.sizes.insert(0, len(value))
+
+    def pop(self):
+        start = len(self.data) - self.sizes.pop()
+        value = str(self.data[start:])
+        del self.data[start:]
+        return value
+
+    def popleft(self):
+        size = self.sizes.pop(0)
+        value = str(self.data[:size])
+        del self.data[:size]
+        return value
+
+    def drop(self, count):
+        """Drop count entries from the right end."""
+        start = len(self.data) - sum(self.sizes[-count:])
+        del self.data[start:]
+        del self.sizes[-count:]
+
+    def dropleft(self, count):
+        """Drop count entries from the left end."""
+        del self.data[:self._offset(count)]
+        del self.sizes[:count]
+
+    def might_contain(self, value):
+        return self.data.find(value) >= 0
+
+
+class quicklist(object):
+
+    def __init__(self, iterable=()):
+        self._chunks = deque()
+        self._len = 0
+        self.extend(iterable)
+
+    def __reduce__(self):
+        return (quicklist, (list(self),))
+
+    def copy(self):
+        rv = quicklist()
+        for chunk in self._chunks:
+            clone = _chunk()
+            clone.data = bytearray(chunk.data)
+            clone.sizes = array('I', chunk.sizes)
+            rv._chunks.append(clone)
+        rv._len = self._len
+        return rv
+
+    def __len__(self):
+        return self._len
+
+    def __iter__(self):
+        for chunk in self._chunks:
+            for value in chunk.values():
+                yield value
+
+    def __reversed__(self):
+        for chunk in reversed(self._chunks):
+            for value in reversed(chunk.values()):
+                yield value
+
+    def __eq__(self, other):
+        return list(self) == list(other)
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __repr__(self):
+        return 'quicklist(%r)' % list(self)
+
+    # Ends.
+
+    def append(self, value):
+        chunks = self._chunks
+        if not chunks or chunks[-1].full(value):
+            chunks.append(_chunk())
+        chunks[-1].append(value)
+        self._len += 1
+
+    def appendleft(self, value):
+        chunks = self._chunks
+        if not chunks or chunks[0].full(value):
+            chunks.appendleft(_chunk())
+        chunks[0].appendleft(value)
+        self._len += 1
+
+    def extend(self, values):
+        for value in values:
+            self.append(value)
+
+    def extend_packed(self, values):
+        """Append a list of values, packing them into new chunks in one go
+        instead of appending them one by one."""
+        start = 0
+        while start < len(values):
+            stop = start + 1
+            size = len(values[start])
+            while stop < len(values) and stop - start < CHUNK_ENTRIES and \
+                    size + len(values[stop]) <= CHUNK_BYTES:
+                size += len(values[stop])
+                stop += 1
+            self._chunks.append(_chunk(values[start:stop]))
+            start = stop
+        self._len += len(values)
+
+    def pop(self, index=-1):
+        if not self._len:
+            raise IndexError('pop from empty list')
+        if index == 0 or index == -self._len:
+            return self.popleft()
+        if index != -1 and index != self._len - 1:
+            value = self[index]
+            del self[index]
+            return value
+        chunk = self._chunks[-1]
+        value = chunk.pop()
+        if not chunk:
+            self._chunks.pop()
+        self._len -= 1
+        return value
+
+    def popleft(self):
+        if not self._len:
+            raise IndexError('pop from empty list')
+        chunk = self._chunks[0]
+        value = chunk.popleft()
+        if not chunk:
+            self._chunks.popleft()
+        self._len -= 1
+        return value
+
+    def trim(self, start, stop):
+        """Keep only [start:stop), dropping whole chunks where possible."""
+        start, stop, step = slice(start, stop).indices(self._len)
+        stop = max(start, stop)
+        self._drop(self._len - stop)
+        self._dropleft(start)
+
+    def _drop(self, count):
+        chunks = self._chunks
+        self._len -= count
+        while count:
+            chunk = chunks[-1]
+            if len(chunk) <= count:
+                count -= len(chunk)
+                chunks.pop()
+            else:
+                chunk.drop(count)
+                count = 0
+
+    def _dropleft(self, count):
+        chunks = self._chunks
+        self._len -= count
+        while count:
+            chunk = chunks[0]
+            if len(chunk) <= count:
+                count -= len(chunk)
+                chunks.popleft()
+            else:
+                chunk.dropleft(count)
+                count = 0
+
+    # Indexed access.
+
+    def _locate(self, index):
+        """Return (position, chunk, offset) of an element, walking from
+        whichever end is closer."""
+        if index < 0:
+            index += self._len
+        if not 0 <= index < self._len:
+            raise IndexError('list index out of range')
+        if index < self._len // 2:
+            for position, chunk in enumerate(self._chunks):
+                if index < len(chunk):
+                    return position, chunk, index
+                index -= len(chunk)
+        else:
+            index = self._len - 1 - index
+            position = len(self._chunks)
+            for chunk in reversed(self._chunks):
+                position -= 1
+                if index < len(chunk):
+                    return position, chunk, len(chunk) - 1 - index
+                index -= len(chunk)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            start, stop, step = index.indices(self._len)
+            assert step == 1, 'extended slices are not supported'
+            return self._range(start, stop)
+        position, chunk, offset = self._locate(index)
+        return chunk.get(offset)
+
+    def _range(self, start, stop):
+        return list(self.irange(start, stop))
+
+    def irange(self, start, stop):
+        """Iterate over [start:stop), unpacking one chunk at a time."""
+        if start >= stop:
+            return
+        for chunk in self._chunks:
+            if start >= len(chunk):
+                # skip without unpacking
+                start -= len(chunk)
+                stop -= len(chunk)
+                continue
+            for value in chunk.values()[start:stop]:
+                yield value
+            stop -= len(chunk)
+            if stop <= 0:
+                break
+            start = 0
+
+    def __setitem__(self, index, value):
+        position, chunk, offset = self._locate(index)
+        chunk.set(offset, value)
+
+    def __delitem__(self, index):
+        if isinstance(index, slice):
+            start, stop, step = index.indices(self._len)
+            assert step == 1, 'extended slices are not supported'
+            if start >= stop:
+                return
+            if start == 0:
+                self._dropleft(stop)
+            elif stop == self._len:
+                self._drop(stop - start)
+            else:
+                values = list(self)
+                del values[start:stop]
+                self.__init__(values)
+            return
+        position, chunk, offset = self._locate(index)
+        chunk.delete(offset)
+        if not chunk:
+            del self._chunks[position]
+        self._len -= 1
+
+    def insert(self, index, value):
+        if index < 0:
+            index = max(index + self._len, 0)
+        if index == 0:
+            return self.appendleft(value)
+        if index >= self._len:
+            return self.append(value)
+        position, chunk, offset = self._locate(index)
+        if chunk.full(value):
+            # split the chunk in two and insert into the proper half
+            values = chunk.values()
+            values.insert(offset, value)
+            half = len(values) // 2
+            chunks = self._chunks
+            chunks[position] = _chunk(values[:half])
+            # no deque.insert() on Python 2
+            chunks.rotate(-(position + 1))
+            chunks.appendleft(_chunk(values[half:]))
+            chunks.rotate(position + 1)
+        else:
+            chunk.insert(offset, value)
+        self._len += 1
+
+    # Scans.
+
+    def find(self, value, reverse=False, maxlen=0):
+        """Yield indices of value, from the tail if reverse is set.
+        Only the first maxlen elements scanned (if nonzero) are considered."""
+        chunks = reversed(self._chunks) if reverse else self._chunks
+        scanned = 0
+        for chunk in chunks:
+            size = len(chunk)
+            if chunk.might_contain(value):
+                values = chunk.values()
+                if maxlen:
+                    values = values[-(maxlen - scanned):] if reverse else values[:maxlen - scanned]
+                offsets = xrange(len(values) - 1, -1, -1) if reverse else xrange(len(values))
+                for offset in offsets:
+                    if values[offset] == value:
+                        if reverse:
+                            yield self._len - scanned - (len(values) - offset)
+                        else:
+                            yield scanned + offset
+            scanned += size
+            if maxlen and scanned >= maxlen:
+                break
+
+    def index(self, value):
+        for index in self.find(value):
+            return index
+        raise ValueError('%r is not in list' % value)
+
+    def remove(self, value, count=0):
+        """Remove up to count occurrences of value (all if count is zero),
+        from the tail if count is negative. Return the number removed."""
+        limit = abs(count)
+        chunks = reversed(self._chunks) if count < 0 else self._chunks
+        removed = 0
+        emptied = False
+        for chunk in chunks:
+            if not chunk.might_contain(value):
+                continue
+            values = chunk.values()
+            if count < 0:
+                values.reverse()
+            kept = []
+            for item in values:
+                if item == value and (not limit or removed < limit):
+                    removed += 1
+                else:
+                    kept.append(item)
+            if len(kept) != len(values):
+                if count < 0:
+                    kept.reverse()
+                fresh = _chunk(kept)
+                chunk.data, chunk.sizes = fresh.data, fresh.sizes
+                emptied = emptied or not kept
+            if limit and removed >= limit:
+                break
+        if emptied:
+            self._chunks = deque(chunk for chunk in self._chunks if chunk)
+        self._len -= removed
+        return removed
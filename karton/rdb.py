@@ -0,0 +1,830 @@
+# -*- coding: utf-8 -*-
+
+"""
+Redis RDB format: reading dump.rdb files, and DUMP/RESTORE payloads.
+
+load() streams an RDB file straight into Server.dbs, one key at a time.
+Every value is built directly in its karton encoding: intset blobs become
+intset arrays without going through strings, ziplists and listpacks are
+decoded into the quicklist chunks or dicts they end up in, and sorted sets
+are bulk-loaded, sorted once. Supported are strings (plain, integer and
+LZF-compressed), lists (linked, ziplist, quicklist and quicklist 2), sets
+(plain, intset and listpack), hashes (plain, zipmap, ziplist and
+listpack), sorted sets (plain, binary scores, ziplist and listpack) and
+streams, and the module values of karton's own Bloom and cuckoo filters
+and time series.
+Other module values and hash field expiration can't be loaded. The
+file's checksum isn't verified, as that would take longer than loading
+it. Expect about 75k keys per second on one core with CPython 2.7
+(benchmarks/rdb_load.py).
+
+dumps() and loads() handle the DUMP payload format: a single value, the
+RDB version and a CRC64 checksum. dumps() writes what Redis 7.0 (RDB 10)
+would for the same data, so payloads can go both ways.
+
+karton has no expires: keys that have already expired are skipped, and
+the others are loaded without their TTL.
+"""
+
+import time
+import struct
+from array import array
+from cStringIO import StringIO
+
+from .intset import intset, is_int, compact, MAX_ENTRIES
+from .quicklist import quicklist
+from .sorteddict import sorteddict
+from .hyperloglog import hyperloglog
+from .stream import stream, consumergroup, pending_entry
+from .bloom import bloomfilter, cuckoofilter
+from .timeseries import timeseries
+
+
+# Newest RDB version we can read, and the one we write.
+RDB_VERSION = 12
+DUMP_VERSION = 10
+
+# Value types.
+TYPE_STRING = 0
+TYPE_LIST = 1
+TYPE_SET = 2
+TYPE_ZSET = 3
+TYPE_HASH = 4
+TYPE_ZSET_2 = 5
+TYPE_MODULE = 6
+TYPE_MODULE_2 = 7
+TYPE_HASH_ZIPMAP = 9
+TYPE_LIST_ZIPLIST = 10
+TYPE_SET_INTSET = 11
+TYPE_ZSET_ZIPLIST = 12
+TYPE_HASH_ZIPLIST = 13
+TYPE_LIST_QUICKLIST = 14
+TYPE_STREAM_LISTPACKS = 15
+TYPE_HASH_LISTPACK = 16
+TYPE_ZSET_LISTPACK = 17
+TYPE_LIST_QUICKLIST_2 = 18
+TYPE_STREAM_LISTPACKS_2 = 19
+TYPE_SET_LISTPACK = 20
+TYPE_STREAM_LISTPACKS_3 = 21
+
+# Opcodes.
+OPCODE_SLOT_INFO = 244
+OPCODE_FUNCTION2 = 245
+OPCODE_FUNCTION_PRE_GA = 246
+OPCODE_MODULE_AUX = 247
+OPCODE_IDLE = 248
+OPCODE_FREQ = 249
+OPCODE_AUX = 250
+OPCODE_RESIZEDB = 251
+OPCODE_EXPIRETIME_MS = 252
+OPCODE_EXPIRETIME = 253
+OPCODE_SELECTDB = 254
+OPCODE_EOF = 255
+
+# Special string encodings.
+ENC_INT8 = 0
+ENC_INT16 = 1
+ENC_INT32 = 2
+ENC_LZF = 3
+
+QUICKLIST_NODE_PLAIN = 1
+
+# Module value fields: an opcode, then the value.
+MODULE_OPCODE_EOF = 0
+MODULE_OPCODE_SINT = 1
+MODULE_OPCODE_UINT = 2
+MODULE_OPCODE_FLOAT = 3
+MODULE_OPCODE_DOUBLE = 4
+MODULE_OPCODE_STRING = 5
+
+_MODULE_CHARSET = 'ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789-_'
+
+STREAM_ITEM_DELETED = 1
+STREAM_ITEM_SAMEFIELDS = 2
+
+# Hashes and sorted sets up to these sizes are written as listpacks, like
+# Redis does with its default configuration.
+LISTPACK_MAX_ENTRIES = 128
+LISTPACK_MAX_VALUE = 64
+
+_uint16 = struct.Struct('<H')
+_int16 = struct.Struct('<h')
+_uint32 = struct.Struct('<I')
+_int32 = struct.Struct('<i')
+_int64 = struct.Struct('<q')
+_uint64 = struct.Struct('<Q')
+_double = struct.Struct('<d')
+_id = struct.Struct('>QQ')
+_float = struct.Struct('<f')
+
+
+def module_id(name, version):
+    """64-bit module type ID: 9 characters of 6 bits, and a 10-bit
+    encoding version."""
+    assert len(name) == 9
+    id = 0
+    for char in name:
+        id = id << 6 | _MODULE_CHARSET.index(char)
+    return id << 10 | version
+
+
+# Module types we know how to load, by ID. Their values have a fields()
+# method, and a fromfields() class method building them back.
+MODULES = dict((module_id(*type.MODULE), type) for type in (bloomfilter, cuckoofilter, timeseries))
+
+
+# CRC64 (Jones polynomial, reflected), as used by Redis.
+
+def _crc64_table():
+    table = []
+    for byte in xrange(256):
+        crc = byte
+        for bit in xrange(8):
+            crc = (crc >> 1) ^ (0x95ac9329ac4bc9b5 if crc & 1 else 0)
+        table.append(crc)
+    return table
+
+_CRC64_TABLE = _crc64_table()
+
+
+def crc64(data, crc=0):
+    table = _CRC64_TABLE
+    for byte in bytearray(data):
+        crc = table[(crc ^ byte) & 0xff] ^ (crc >> 8)
+    return crc
+
+
+def lzf_decompress(data, length):
+    """Expand LZF-compressed data to its expected length."""
+    data = bytearray(data)
+    out = bytearray()
+    position = 0
+    end = len(data)
+    while position < end:
+        ctrl = data[position]
+        position += 1
+        if ctrl < 32:
+            # literal run
+            out += data[position:position+ctrl+1]
+            position += ctrl + 1
+            continue
+        run = ctrl >> 5
+        if run == 7:
+            run += data[position]
+            position += 1
+        ref = len(out) - ((ctrl & 31) << 8) - data[position] - 1
+        position += 1
+        run += 2
+        if ref < 0:
+            raise ValueError('invalid LZF back reference')
+        if ref + run <= len(out):
+            out += out[ref:ref+run]
+        else:
+            # the copy overlaps what it produces
+            for index in xrange(ref, ref + run):
+                out.append(out[index])
+    if len(out) != length:
+        raise ValueError('LZF data has the wrong length')
+    return str(out)
+
+
+# Compact encodings embedded in string values.
+
+def ziplist(blob):
+    """Entries of a ziplist, as strings."""
+    data = bytearray(blob)
+    # the terminating 255
+    end = len(data) - 1
+    if end < 10 or _uint32.unpack_from(data)[0] != len(data) or data[end] != 255:
+        raise ValueError('invalid ziplist header')
+    values = []
+    position = 10
+    while data[position] != 255:
+        # skip the previous entry's length
+        position += 5 if data[position] == 254 else 1
+        encoding = data[position]
+        kind = encoding >> 6
+        if kind == 0:
+            size = encoding & 63
+            position += 1
+        elif kind == 1:
+            size = (encoding & 63) << 8 | data[position+1]
+            position += 2
+        elif kind == 2:
+            size = struct.unpack_from('>I', data, position + 1)[0]
+            position += 5
+        else:
+            position += 1
+            if encoding == 0xc0:
+                value = _int16.unpack_from(data, position)[0]
+                position += 2
+            elif encoding == 0xd0:
+                value = _int32.unpack_from(data, position)[0]
+                position += 4
+            elif encoding == 0xe0:
+                value = _int64.unpack_from(data, position)[0]
+                position += 8
+            elif encoding == 0xf0:
+                value = _int32.unpack_from('\0' + str(data[position:position+3]))[0] >> 8
+                position += 3
+            elif encoding == 0xfe:
+                value = struct.unpack_from('<b', data, position)[0]
+                position += 1
+            elif 0xf1 <= encoding <= 0xfd:
+                value = (encoding & 15) - 1
+            else:
+                raise ValueError('invalid ziplist entry encoding')
+            values.append(str(value))
+            continue
+        if position + size > end:
+            raise ValueError('ziplist entry overflows the ziplist')
+        values.append(str(data[position:position+size]))
+        position += size
+    if position != end:
+        raise ValueError('invalid ziplist entry')
+    return values
+
+
+def _backlen_size(size):
+    if size <= 127:
+        return 1
+    if size < 16383:
+        return 2
+    if size < 2097151:
+        return 3
+    if size < 268435455:
+        return 4
+    return 5
+
+
+def listpack(blob):
+    """Entries of a listpack, as strings."""
+    data = bytearray(blob)
+    # the terminating 255
+    end = len(data) - 1
+    if end < 6 or _uint32.unpack_from(data)[0] != len(data) or data[end] != 255:
+        raise ValueError('invalid listpack header')
+    values = []
+    position = 6
+    while True:
+        if position > end:
+            raise ValueError('listpack entry overflows the listpack')
+        encoding = data[position]
+        if encoding < 0x80:
+            values.append(str(encoding))
+            size = 1
+        elif encoding < 0xc0:
+            size = 1 + (encoding & 63)
+            values.append(str(data[position+1:position+size]))
+        elif encoding < 0xe0:
+            value = (encoding & 31) << 8 | data[position+1]
+            if value >= 1 << 12:
+                value -= 1 << 13
+            values.append(str(value))
+            size = 2
+        elif encoding < 0xf0:
+            size = 2 + ((encoding & 15) << 8 | data[position+1])
+            values.append(str(data[position+2:position+size]))
+        elif encoding == 0xf0:
+            size = 5 + _uint32.unpack_from(data, position + 1)[0]
+            values.append(str(data[position+5:position+size]))
+        elif encoding == 0xf1:
+            values.append(str(_int16.unpack_from(data, position + 1)[0]))
+            size = 3
+        elif encoding == 0xf2:
+            values.append(str(_int32.unpack_from('\0' + str(data[position+1:position+4]))[0] >> 8))
+            size = 4
+        elif encoding == 0xf3:
+            values.append(str(_int32.unpack_from(data, position + 1)[0]))
+            size = 5
+        elif encoding == 0xf4:
+            values.append(str(_int64.unpack_from(data, position + 1)[0]))
+            size = 9
+        elif encoding == 0xff:
+            if position != end:
+                raise ValueError('invalid listpack entry')
+            return values
+        else:
+            raise ValueError('invalid listpack entry encoding')
+        if position + size > end:
+            raise ValueError('listpack entry overflows the listpack')
+        position += size + (1 if size <= 127 else _backlen_size(size))
+
+
+def _intset(blob):
+    """intset (or set, if it's too large for one) from an intset blob."""
+    width, length = struct.unpack_from('<II', blob)
+    code = {2: 'h', 4: 'i', 8: 'q'}.get(width)
+    if code is None:
+        raise ValueError('invalid intset encoding')
+    # before trusting the length with an allocation
+    if len(blob) != 8 + width * length:
+        raise ValueError('intset length and size disagree')
+    values = struct.unpack_from('<%d%s' % (length, code), blob, 8)
+    if length > MAX_ENTRIES:
+        return set(map(str, values))
+    return intset._fromarray(array('l', values))
+
+
+def zipmap(blob):
+    """Keys and values of a zipmap, alternating."""
+    data = bytearray(blob)
+    # the terminating 255
+    end = len(data) - 1
+    if end < 1 or data[end] != 255:
+        raise ValueError('invalid zipmap')
+    values = []
+    position = 1
+    while data[position] != 255:
+        size = data[position]
+        if size == 254:
+            size = _uint32.unpack_from(data, position + 1)[0]
+            position += 5
+        else:
+            position += 1
+        free = 0
+        if len(values) % 2:
+            # values may be followed by some unused space
+            free = data[position]
+            position += 1
+        if position + size + free > end:
+            raise ValueError('zipmap entry overflows the zipmap')
+        values.append(str(data[position:position+size]))
+        position += size + free
+    if position != end:
+        raise ValueError('invalid zipmap entry')
+    return values
+
+
+def _pairs(values):
+    return zip(values[0::2], values[1::2])
+
+
+class Reader(object):
+    """Parser of RDB data from a file-like object."""
+
+    def __init__(self, file):
+        self.read = file.read
+
+    def byte(self):
+        data = self.read(1)
+        if not data:
+            raise ValueError('unexpected end of RDB data')
+        return ord(data)
+
+    def exactly(self, size):
+        data = self.read(size)
+        if len(data) != size:
+            raise ValueError('unexpected end of RDB data')
+        return data
+
+    def length(self, byte=None):
+        """Return (length, special); special lengths are string encodings."""
+        if byte is None:
+            byte = self.byte()
+        kind = byte >> 6
+        if kind == 0:
+            return byte & 63, False
+        if kind == 1:
+            return (byte & 63) << 8 | self.byte(), False
+        if kind == 3:
+            return byte & 63, True
+        if byte == 0x80:
+            return struct.unpack('>I', self.exactly(4))[0], False
+        if byte == 0x81:
+            return struct.unpack('>Q', self.exactly(8))[0], False
+        raise ValueError('invalid RDB length encoding')
+
+    def number(self):
+        length, special = self.length()
+        if special:
+            raise ValueError('unexpected string encoding')
+        return length
+
+    def string(self):
+        byte = self.byte()
+        if byte < 64:
+            # short string, by far the most common case
+            return self.exactly(byte)
+        length, special = self.length(byte)
+        if not special:
+            return self.exactly(length)
+        if length == ENC_INT8:
+            return str(struct.unpack('<b', self.exactly(1))[0])
+        if length == ENC_INT16:
+            return str(_int16.unpack(self.exactly(2))[0])
+        if length == ENC_INT32:
+            return str(_int32.unpack(self.exactly(4))[0])
+        if length == ENC_LZF:
+            compressed = self.number()
+            size = self.number()
+            return lzf_decompress(self.exactly(compressed), size)
+        raise ValueError('invalid RDB string encoding')
+
+    def double(self):
+        """Score in the old, string based format."""
+        size = self.byte()
+        if size == 253:
+            return float('nan')
+        if size == 254:
+            return float('inf')
+        if size == 255:
+            return float('-inf')
+        return float(self.exactly(size))
+
+    def millis(self):
+        return _int64.unpack(self.exactly(8))[0]
+
+    def value(self, type):
+        """Read a value of the given type, in its karton encoding."""
+        if type == TYPE_STRING:
+            return self.string()
+        if type == TYPE_LIST:
+            result = quicklist()
+            for index in xrange(self.number()):
+                result.append(self.string())
+            return result
+        if type in (TYPE_LIST_QUICKLIST, TYPE_LIST_QUICKLIST_2):
+            result = quicklist()
+            for index in xrange(self.number()):
+                if type == TYPE_LIST_QUICKLIST_2:
+                    container = self.number()
+                    blob = self.string()
+                    values = [blob] if container == QUICKLIST_NODE_PLAIN else listpack(blob)
+                else:
+                    values = ziplist(self.string())
+                result.extend_packed(values)
+            return result
+        if type == TYPE_LIST_ZIPLIST:
+            result = quicklist()
+            result.extend_packed(ziplist(self.string()))
+            return result
+        if type == TYPE_SET:
+            return compact(set(self.string() for index in xrange(self.number())))
+        if type == TYPE_SET_INTSET:
+            return _intset(self.string())
+        if type == TYPE_SET_LISTPACK:
+            return compact(set(listpack(self.string())))
+        if type == TYPE_HASH:
+            result = {}
+            for index in xrange(self.number()):
+                field = self.string()
+                result[field] = self.string()
+            return result
+        if type == TYPE_HASH_ZIPMAP:
+            return dict(_pairs(zipmap(self.string())))
+        if type == TYPE_HASH_ZIPLIST:
+            return dict(_pairs(ziplist(self.string())))
+        if type == TYPE_HASH_LISTPACK:
+            return dict(_pairs(listpack(self.string())))
+        if type in (TYPE_ZSET, TYPE_ZSET_2):
+            items = []
+            for index in xrange(self.number()):
+                member = self.string()
+                if type == TYPE_ZSET_2:
+                    score = _double.unpack(self.exactly(8))[0]
+                else:
+                    score = self.double()
+                items.append((member, score))
+            return sorteddict.fromitems(items)
+        if type in (TYPE_ZSET_ZIPLIST, TYPE_ZSET_LISTPACK):
+            values = (ziplist if type == TYPE_ZSET_ZIPLIST else listpack)(self.string())
+            return sorteddict.fromitems((member, float(score)) for member, score in _pairs(values))
+        if type in (TYPE_STREAM_LISTPACKS, TYPE_STREAM_LISTPACKS_2, TYPE_STREAM_LISTPACKS_3):
+            return self.stream(type)
+        if type == TYPE_MODULE_2:
+            return self.module()
+        if type == TYPE_MODULE:
+            raise ValueError('module values are not supported')
+        raise ValueError('unsupported RDB value type %d' % type)
+
+    def module(self):
+        module = MODULES.get(self.number())
+        if module is None:
+            raise ValueError('module values are not supported')
+        fields = []
+        while True:
+            opcode = self.number()
+            if opcode == MODULE_OPCODE_EOF:
+                return module.fromfields(fields)
+            elif opcode in (MODULE_OPCODE_SINT, MODULE_OPCODE_UINT):
+                fields.append(self.number())
+            elif opcode == MODULE_OPCODE_FLOAT:
+                fields.append(_float.unpack(self.exactly(4))[0])
+            elif opcode == MODULE_OPCODE_DOUBLE:
+                fields.append(_double.unpack(self.exactly(8))[0])
+            elif opcode == MODULE_OPCODE_STRING:
+                fields.append(self.string())
+            else:
+                raise ValueError('invalid module value opcode %d' % opcode)
+
+    def stream(self, type):
+        result = stream()
+        for index in xrange(self.number()):
+            master_ms, master_seq = _id.unpack(self.string())
+            values = listpack(self.string())
+            master_fields = values[3:3+int(values[2])]
+            # past the master entry and its terminator
+            position = 4 + len(master_fields)
+            while position < len(values):
+                flags = int(values[position])
+                id = (master_ms + int(values[position+1]), master_seq + int(values[position+2]))
+                position += 3
+                if flags & STREAM_ITEM_SAMEFIELDS:
+                    fields = values[position:position+len(master_fields)]
+                    position += len(fields)
+                    fields = [string for pair in zip(master_fields, fields) for string in pair]
+                else:
+                    count = int(values[position]) * 2
+                    fields = values[position+1:position+1+count]
+                    position += 1 + count
+                # skip the entry's element count
+                position += 1
+                if not flags & STREAM_ITEM_DELETED:
+                    result.add(id, fields)
+        self.number()
+        result.last_id = (self.number(), self.number())
+        if type >= TYPE_STREAM_LISTPACKS_2:
+            # first ID, max deleted ID, entries added
+            for index in xrange(5):
+                self.number()
+        for index in xrange(self.number()):
+            name = self.string()
+            group = consumergroup((self.number(), self.number()))
+            if type >= TYPE_STREAM_LISTPACKS_2:
+                # entries read
+                self.number()
+            for index in xrange(self.number()):
+                id = _id.unpack(self.exactly(16))
+                entry = group.pel[id] = pending_entry(None)
+                entry.delivered = self.millis()
+                entry.count = self.number()
+            for index in xrange(self.number()):
+                reader = group.consumer(self.string())
+                reader.seen = self.millis()
+                if type >= TYPE_STREAM_LISTPACKS_3:
+                    # active time
+                    self.millis()
+                for index in xrange(self.number()):
+                    id = _id.unpack(self.exactly(16))
+                    group.pel[id].consumer = reader.name
+                    reader.pending.add(id)
+            result.groups[name] = group
+        return result
+
+
+def entries(file):
+    """Yield (db, key, value, expire time in ms or None) for every key in
+    an RDB file."""
+    reader = Reader(file)
+    magic = reader.exactly(9)
+    if magic[:5] != 'REDIS' or not magic[5:].isdigit():
+        raise ValueError('not an RDB file')
+    version = int(magic[5:])
+    if version > RDB_VERSION:
+        raise ValueError("can't handle RDB format version %d" % version)
+    db = 0
+    expires = None
+    while True:
+        type = reader.byte()
+        if type == OPCODE_EOF:
+            return
+        elif type == OPCODE_SELECTDB:
+            db = reader.number()
+        elif type == OPCODE_RESIZEDB:
+            reader.number()
+            reader.number()
+        elif type == OPCODE_SLOT_INFO:
+            for index in xrange(3):
+                reader.number()
+        elif type == OPCODE_AUX:
+            reader.string()
+            reader.string()
+        elif type == OPCODE_EXPIRETIME_MS:
+            expires = reader.millis()
+        elif type == OPCODE_EXPIRETIME:
+            expires = _int32.unpack(reader.exactly(4))[0] * 1000
+        elif type == OPCODE_FREQ:
+            reader.byte()
+        elif type == OPCODE_IDLE:
+            reader.number()
+        elif type == OPCODE_FUNCTION2:
+            # functions need a Lua engine
+            reader.string()
+        elif type in (OPCODE_MODULE_AUX, OPCODE_FUNCTION_PRE_GA):
+            raise ValueError('module and function data are not supported')
+        else:
+            key = reader.string()
+            yield db, key, reader.value(type), expires
+            expires = None
+
+
+def load(server, file):
+    """Load an RDB file into server, replacing existing keys. Return the
+    number of keys loaded and the number of expired keys skipped."""
+    now = time.time() * 1000
+    loaded = expired = 0
+    dbs = server.dbs
+    for db, key, value, expires in entries(file):
+        if expires is not None and expires < now:
+            expired += 1
+            continue
+        if db >= len(dbs):
+            raise ValueError('DB index %d is out of range' % db)
+        dbs[db][key] = value
+        loaded += 1
+    return loaded, expired
+
+
+# Writing.
+
+def _length(length):
+    if length < 64:
+        return chr(length)
+    if length < 16384:
+        return chr(0x40 | length >> 8) + chr(length & 255)
+    if length <= 0xffffffff:
+        return '\x80' + struct.pack('>I', length)
+    return '\x81' + struct.pack('>Q', length)
+
+
+def _string(string):
+    return _length(len(string)) + string
+
+
+def _backlen(size):
+    if size <= 127:
+        return chr(size)
+    if size < 16383:
+        return chr(size >> 7) + chr(size & 127 | 128)
+    if size < 2097151:
+        return chr(size >> 14) + chr(size >> 7 & 127 | 128) + chr(size & 127 | 128)
+    if size < 268435455:
+        return chr(size >> 21) + chr(size >> 14 & 127 | 128) + chr(size >> 7 & 127 | 128) + \
+            chr(size & 127 | 128)
+    return chr(size >> 28) + chr(size >> 21 & 127 | 128) + chr(size >> 14 & 127 | 128) + \
+        chr(size >> 7 & 127 | 128) + chr(size & 127 | 128)
+
+
+def _listpack_entry(value):
+    if is_int(value):
+        number = int(value)
+        if 0 <= number <= 127:
+            return chr(number)
+        if -4096 <= number < 4096:
+            number &= 0x1fff
+            return chr(0xc0 | number >> 8) + chr(number & 255)
+        if -2**15 <= number < 2**15:
+            return '\xf1' + _int16.pack(number)
+        if -2**31 <= number < 2**31:
+            return '\xf3' + _int32.pack(number)
+        return '\xf4' + _int64.pack(number)
+    size = len(value)
+    if size < 64:
+        return chr(0x80 | size) + value
+    if size < 4096:
+        return chr(0xe0 | size >> 8) + chr(size & 255) + value
+    return '\xf0' + _uint32.pack(size) + value
+
+
+def make_listpack(values):
+    """Encode strings as a listpack."""
+    entries = []
+    for value in values:
+        entry = _listpack_entry(value)
+        entries.append(entry + _backlen(len(entry)))
+    body = ''.join(entries)
+    return _uint32.pack(6 + len(body) + 1) + _uint16.pack(min(len(entries), 65535)) + body + '\xff'
+
+
+def _small(items):
+    return len(items) <= LISTPACK_MAX_ENTRIES and \
+        all(len(string) <= LISTPACK_MAX_VALUE for pair in items for string in pair)
+
+
+def _score(score):
+    return '%.17g' % score
+
+
+def _stream(value):
+    parts = [_length(len(value.nodes))]
+    for node in value.nodes:
+        entries = node.entries()
+        master_ms, master_seq = entries[0][1]
+        values = [str(len(entries)), '0', '0', '0']
+        for index, (ms, seq), fields in entries:
+            values.extend(('0', str(ms - master_ms), str(seq - master_seq), str(len(fields) // 2)))
+            values.extend(fields)
+            values.append(str(len(fields) + 4))
+        parts.append(_string(_id.pack(master_ms, master_seq)))
+        parts.append(_string(make_listpack(values)))
+    parts.append(_length(len(value)))
+    parts.append(_length(value.last_id[0]) + _length(value.last_id[1]))
+    parts.append(_length(len(value.groups)))
+    for name, group in sorted(value.groups.iteritems()):
+        parts.append(_string(name) + _length(group.last_id[0]) + _length(group.last_id[1]))
+        parts.append(_length(len(group.pel)))
+        for id, entry in sorted(group.pel.iteritems()):
+            parts.append(_id.pack(*id) + _int64.pack(entry.delivered) + _length(entry.count))
+        parts.append(_length(len(group.consumers)))
+        for reader in sorted(group.consumers.itervalues(), key=lambda reader: reader.name):
+            parts.append(_string(reader.name) + _int64.pack(reader.seen) + _length(len(reader.pending)))
+            parts.extend(_id.pack(*id) for id in sorted(reader.pending))
+    return ''.join(parts)
+
+
+def _module(value):
+    parts = [_length(module_id(*value.MODULE))]
+    for field in value.fields():
+        if isinstance(field, float):
+            parts.append(chr(MODULE_OPCODE_DOUBLE) + _double.pack(field))
+        elif isinstance(field, str):
+            parts.append(chr(MODULE_OPCODE_STRING) + _string(field))
+        else:
+            parts.append(chr(MODULE_OPCODE_UINT) + _length(field))
+    parts.append(chr(MODULE_OPCODE_EOF))
+    return ''.join(parts)
+
+
+def value_type_and_data(value):
+    """Return (RDB type, serialized value)."""
+    if isinstance(value, str):
+        return TYPE_STRING, _string(value)
+    if isinstance(value, hyperloglog):
+        return TYPE_STRING, _string(value.tostring())
+    if isinstance(value, quicklist):
+        nodes = [chunk.values() for chunk in value._chunks]
+        return TYPE_LIST_QUICKLIST_2, _length(len(nodes)) + ''.join(
+            '\x02' + _string(make_listpack(values)) for values in nodes)
+    if isinstance(value, intset):
+        values = value._array
+        width = 8
+        if values and -2**15 <= values[0] and values[-1] < 2**15:
+            width = 2
+        elif values and -2**31 <= values[0] and values[-1] < 2**31:
+            width = 4
+        code = {2: 'h', 4: 'i', 8: 'q'}[width]
+        blob = struct.pack('<II', width, len(values)) + struct.pack('<%d%s' % (len(values), code), *values)
+        return TYPE_SET_INTSET, _string(blob)
+    if isinstance(value, set):
+        return TYPE_SET, _length(len(value)) + ''.join(map(_string, value))
+    if isinstance(value, dict):
+        items = value.items()
+        if _small(items):
+            return TYPE_HASH_LISTPACK, _string(make_listpack([string for pair in items for string in pair]))
+        return TYPE_HASH, _length(len(items)) + ''.join(_string(field) + _string(data) for field, data in items)
+    if isinstance(value, sorteddict):
+        items = [(member, _score(score)) for score, member in value.scoreitems(0, len(value))]
+        if _small(items):
+            return TYPE_ZSET_LISTPACK, _string(make_listpack([string for pair in items for string in pair]))
+        # the plain encoding lists members from the highest score down
+        return TYPE_ZSET_2, _length(len(value)) + ''.join(
+            _string(member) + _double.pack(score) for score, member in reversed(value.scoreitems(0, len(value))))
+    if isinstance(value, stream):
+        return TYPE_STREAM_LISTPACKS, _stream(value)
+    if isinstance(value, (bloomfilter, cuckoofilter, timeseries)):
+        return TYPE_MODULE_2, _module(value)
+    raise TypeError("can't serialize %r" % type(value))
+
+
+def dumps(value):
+    """DUMP payload of a value."""
+    type, data = value_type_and_data(value)
+    payload = chr(type) + data + _uint16.pack(DUMP_VERSION)
+    return payload + _uint64.pack(crc64(payload))
+
+
+def loads(payload):
+    """Value of a DUMP payload; raise ValueError if it's not valid."""
+    if len(payload) < 11:
+        raise ValueError('payload too short')
+    version = _uint16.unpack_from(payload, len(payload) - 10)[0]
+    checksum = _uint64.unpack_from(payload, len(payload) - 8)[0]
+    # always checked, as in Redis: a zero checksum is no exemption
+    if version > RDB_VERSION or checksum != crc64(payload[:-8]):
+        raise ValueError('payload version or checksum are wrong')
+    file = StringIO(payload[:-10])
+    reader = Reader(file)
+    value = reader.value(reader.byte())
+    if file.read(1):
+        raise ValueError('trailing data in payload')
+    return value
+
+
+def save(dbs, file):
+    """Write databases (a list of dicts) to file as an RDB. Like Redis with
+    rdbchecksum off, the checksum is left at zero: computing it in Python
+    would take longer than everything else."""
+    file.write('REDIS%04d' % DUMP_VERSION)
+    for index, db in enumerate(dbs):
+        if not db:
+            continue
+        parts = [chr(OPCODE_SELECTDB) + _length(index), chr(OPCODE_RESIZEDB) + _length(len(db)) + _length(0)]
+        for key, value in db.iteritems():
+            type, data = value_type_and_data(value)
+            parts.append(chr(type) + _string(key) + data)
+            if len(parts) >= 1024:
+                file.write(''.join(parts))
+                parts = []
+        file.write(''.join(parts))
+    file.write(chr(OPCODE_EOF) + _uint64.pack(0))
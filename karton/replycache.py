@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+
+"""
+Cache of encoded replies, for keys read much more often than written.
+
+Reading a whole value (GET, HGETALL, SMEMBERS...) builds a reply and
+encodes it with python_to_redis() every time, even when the value hasn't
+changed since the last read. ReplyCache keeps the encoded bytes instead,
+and Server.do() returns them to the next reader as an Encoded reply,
+which the protocol layer writes out as it is.
+
+Entries are dropped by Server.do() whenever a command writes to their key
+(as told by the command table), and by FLUSHDB and FLUSHALL. The cache is
+bounded by the total size of the replies it holds, and evicts keys that
+haven't been read lately first.
+"""
+
+from collections import deque
+
+from .protocol import Encoded, Stream, python_to_redis
+
+
+# Commands whose reply depends on nothing but the value of their key.
+COMMANDS = frozenset(['GET', 'HGETALL', 'HKEYS', 'HVALS', 'SMEMBERS'])
+
+
+class Entry(object):
+    """Cached replies to the commands reading one key."""
+
+    __slots__ = ('replies', 'size', 'used')
+
+    def __init__(self):
+        # command -> Encoded reply
+        self.replies = {}
+        self.size = 0
+        self.used = False
+
+
+class ReplyCache(object):
+    """Approximately LRU: hits only mark an entry as used, and eviction
+    gives used entries a second chance (the CLOCK algorithm), which keeps
+    hits about as cheap as a dict lookup."""
+
+    # Replies bigger than this aren't worth the room they'd take.
+    max_reply = 1024**2
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        # (db, key) -> Entry
+        self.entries = {}
+        # ((db, key), Entry) in the order they were added, or given their
+        # second chance; entries that have been dropped since are skipped
+        self.clock = deque()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evicted = 0
+
+    def get(self, db, args):
+        """Cached reply to a command, or None."""
+        if len(args) != 2:
+            return None
+        command = args[0].upper()
+        if command not in COMMANDS:
+            return None
+        entry = self.entries.get((db, args[1]))
+        reply = None if entry is None else entry.replies.get(command)
+        if reply is None:
+            self.misses += 1
+        else:
+            entry.used = True
+            self.hits += 1
+        return reply
+
+    def put(self, db, args, reply):
+        """Cache the reply to a command if it's worth it; return the reply,
+        encoded if it's been cached."""
+        if len(args) != 2 or reply is None or isinstance(reply, (Exception, Stream)):
+            return reply
+        command = args[0].upper()
+        if command not in COMMANDS:
+            return reply
+        data = python_to_redis(reply)
+        if len(data) > min(self.max_reply, self.max_bytes):
+            return reply
+        encoded = Encoded([data])
+        key = (db, args[1])
+        entry = self.entries.get(key)
+        if entry is None:
+            entry = self.entries[key] = Entry()
+            self.clock.append((key, entry))
+        old = entry.replies.get(command)
+        if old is not None:
+            entry.size -= len(old[0])
+            self.bytes -= len(old[0])
+        entry.replies[command] = encoded
+        entry.size += len(data)
+        self.bytes += len(data)
+        if self.bytes > self.max_bytes:
+            self._evict()
+        return encoded
+
+    def _evict(self):
+        entries = self.entries
+        clock = self.clock
+        while self.bytes > self.max_bytes:
+            key, entry = clock.popleft()
+            if entries.get(key) is not entry:
+                continue
+            if entry.used:
+                entry.used = False
+                clock.append((key, entry))
+                continue
+            del entries[key]
+            self.bytes -= entry.size
+            self.evicted += 1
+
+    def invalidate(self, db, keys):
+        entries = self.entries
+        for key in keys:
+            entry = entries.pop((db, key), None)
+            if entry is not None:
+                self.bytes -= entry.size
+        # don't let dropped entries pile up in the clock
+        if len(self.clock) > 2 * len(entries) + 1024:
+            self.clock = deque(item for item in self.clock if entries.get(item[0]) is item[1])
+
+    def flush(self, db=None):
+        if db is None:
+            self.entries.clear()
+            self.clock.clear()
+            self.bytes = 0
+        else:
+            self.invalidate(db, [key for key_db, key in self.entries if key_db == db])
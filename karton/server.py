@@ -8,18 +8,35 @@ import math
 import random
 import signal
 import fnmatch
+import heapq
+import itertools
 import re
+import struct
 import traceback
 from functools import partial
-try:
-    import cPickle as pickle
-except ImportError:
-    import pickle
+from collections import OrderedDict
+from itertools import islice
 
 from blist import blist
 
-from .protocol import Status, Error, OK
+from .protocol import Status, Error, Stream, Map, OK
 from .sorteddict import sorteddict as zdict
+from .lazyfree import LazyFree
+from .intset import intset, upgrade, compact
+from .quicklist import quicklist
+from .hyperloglog import hyperloglog
+from .bloom import bloomfilter, cuckoofilter
+from .timeseries import timeseries
+from .stream import stream, consumergroup, parse_id, format_id, MIN_ID, MAX_ID, MAX_PART
+from .blocking import Blocking
+from .tracking import Tracking, State as TrackingState
+from .commands import command_keys
+from .pubsub import PubSub
+from .hotkeys import HotKeys
+from .throttle import Throttles, gcra
+from . import notify
+from . import zsetops, setops, geo, rdb, memory, mapped, profiling, bloom
+from . import timeseries as tsdb
 
 
 def redis_slice(start, end):
@@ -27,6 +44,85 @@ def redis_slice(start, end):
     return slice(int(start), (int(end)+1) or None)
 
 
+def sort_score(value):
+    """Convert a SORT weight to a number; missing weights count as zero."""
+    if value is None:
+        return 0.0
+    try:
+        score = float(value)
+    except ValueError:
+        score = float('nan')
+    assert not math.isnan(score), "ERR One or more scores can't be converted into double"
+    return score
+
+
+def score_bound(string):
+    """Parse a ZRANGEBYSCORE bound; return (score, exclusive)."""
+    exclusive = string.startswith('(')
+    if exclusive:
+        string = string[1:]
+    try:
+        score = float(string)
+    except ValueError:
+        raise AssertionError('ERR min or max is not a float')
+    assert not math.isnan(score), 'ERR min or max is not a float'
+    return score, exclusive
+
+
+def stream_id(string, seq=0):
+    """Parse a stream ID argument, turning errors into Redis errors."""
+    try:
+        return parse_id(string, seq)
+    except ValueError as exc:
+        raise AssertionError('ERR %s' % exc)
+
+
+def stream_range_id(string, end=False):
+    """Parse an XRANGE boundary: "-", "+", "ms", "ms-seq" or "(ms-seq"."""
+    if string == '-':
+        return MIN_ID
+    if string == '+':
+        return MAX_ID
+    exclusive = string.startswith('(')
+    if exclusive:
+        string = string[1:]
+    ms, seq = stream_id(string, MAX_PART if end else 0)
+    if exclusive:
+        # step past the boundary itself
+        if end:
+            assert (ms, seq) != MIN_ID, 'ERR invalid end ID for the interval'
+            return (ms, seq - 1) if seq else (ms - 1, MAX_PART)
+        assert (ms, seq) != MAX_ID, 'ERR invalid start ID for the interval'
+        return (ms, seq + 1) if seq < MAX_PART else (ms + 1, 0)
+    return ms, seq
+
+
+def stream_entries(entries):
+    return [[format_id(id), fields] for id, fields in entries]
+
+
+def memory_size(string):
+    """Parse a size such as 1024, 64kb or 32mb."""
+    units = {'kb': 1024, 'mb': 1024**2, 'gb': 1024**3, 'k': 1000, 'm': 1000**2, 'g': 1000**3}
+    string = string.lower()
+    for suffix in ('kb', 'mb', 'gb', 'k', 'm', 'g'):
+        if string.endswith(suffix):
+            return int(string[:-len(suffix)]) * units[suffix]
+    return int(string)
+
+
+def format_addr(addr):
+    """host:port of a Twisted address or an (host, port) tuple."""
+    if hasattr(addr, 'host'):
+        return '%s:%d' % (addr.host, addr.port)
+    return '%s:%d' % tuple(addr[:2])
+
+
+def quote(string):
+    """string in double quotes, with C-style escapes, as MONITOR shows it."""
+    return '"%s"' % string.encode('string_escape').replace("\\'", "'").replace('"', '\\"')
+
+
 def floaty(number):
     string = '%.17f' % number
     return string.rstrip('0').rstrip('.')
@@ -37,6 +133,8 @@ def pass_value(value_type):
     def decorator(method):
         def decorated(self, key, *args):
             value = self._ht_get(key, value_type)
+            # for _notify()
+            self.key = key
             result = method(self, value, *args)
             self.client.ht[key] = value
             self._ht_check(key)
@@ -48,10 +146,18 @@ def pass_value(value_type):
 
 set_type = set
 hash_type = dict
-list_type = blist
+list_type = quicklist
 zset_type = zdict
+hll_type = hyperloglog
+stream_type = stream
+bloom_type = bloomfilter
+cuckoo_type = cuckoofilter
+ts_type = timeseries
+
+# new sets start out compact; SADD and SMOVE upgrade them as needed.
+set_types = (intset, set_type)
 
-setmethod = pass_value(set_type)
+setmethod = pass_value(set_types)
 hashmethod = pass_value(hash_type)
 listmethod = pass_value(list_type)
 zsetmethod = pass_value(zset_type)
@@ -77,50 +183,340 @@ class Client(object):
     def __init__(self, server, addr):
         self.server = server
         self.addr = addr
+        self.id = next(server.client_ids)
+        self.name = ''
+        self.db = 0
+        self.blocked = None
+        # statistics
+        self.created = self.last = time.time()
+        # when it last ran a write command
+        self.wrote = 0
+        self.cmd = 'NULL'
+        self.commands = 0
+        self.net_input = 0
+        self.net_output = 0
+        # unsent output, as last reported by the connection, and since
+        # when it's been over the soft limit
+        self.obuf = 0
+        self.soft_limit_since = None
+        # protocol version (HELLO): 3 for clients that take Push messages
+        self.resp = 2
+        # CLIENT TRACKING state, and the CLIENT CACHING yes|no flag
+        self.tracking = None
+        self.caching = None
+        # Pub/Sub subscriptions
+        self.channels = set()
+        self.patterns = set()
+        # out-of-band messages go to writer(), or pile up in pushed
+        self.writer = None
+        self.pushed = []
+        # closes the connection, if there's one
+        self.closer = None
+        self.killed = False
+
+    @property
+    def ht(self):
+        # looked up every time: FLUSHDB ASYNC swaps the dict out from under us.
+        return self.server.dbs[self.db]
 
     def do(self, request):
         return self.server.do(self, *request)
 
+    def push(self, *messages):
+        """Send messages out of band, all in one go."""
+        if self.writer is not None:
+            self.writer(messages)
+        else:
+            self.pushed.extend(messages)
+
+    @property
+    def kind(self):
+        """Output buffer limit class."""
+        return 'pubsub' if self.channels or self.patterns else 'normal'
+
+    def check_output(self, size, now=None):
+        """Record the amount of unsent output; return False if the client
+        is over its hard limit, or over its soft limit for too long."""
+        self.obuf = size
+        hard, soft, seconds = self.server.output_limits[self.kind]
+        if hard and size >= hard:
+            return False
+        if soft and size >= soft:
+            now = time.time() if now is None else now
+            if self.soft_limit_since is None:
+                self.soft_limit_since = now
+            elif now - self.soft_limit_since > seconds:
+                return False
+        else:
+            self.soft_limit_since = None
+        return True
+
+    def kill(self):
+        """Close the connection (once it's done sending, if it can)."""
+        self.killed = True
+        if self.closer is not None:
+            self.closer()
+
+    def info(self, now=None):
+        """A line of CLIENT LIST."""
+        now = time.time() if now is None else now
+        flags = ''.join(flag for flag, on in (('b', self.blocked is not None),
+                                              ('O', self in self.server.monitors),
+                                              ('P', self.channels or self.patterns),
+                                              ('t', self.tracking is not None)) if on) or 'N'
+        return 'id=%d addr=%s name=%s age=%d idle=%d flags=%s db=%d sub=%d psub=%d ' \
+            'omem=%d tot-cmds=%d tot-net-in=%d tot-net-out=%d cmd=%s resp=%d' % (
+                self.id, format_addr(self.addr), self.name, now - self.created,
+                now - self.last, flags, self.db, len(self.channels), len(self.patterns),
+                self.obuf, self.commands, self.net_input, self.net_output, self.cmd, self.resp)
+
     def die(self):
+        if self.blocked is not None:
+            self.server.blocking.cancel(self.blocked)
+        self.server.tracking.disable(self)
+        self.server.pubsub.drop(self)
+        self.server.monitors.discard(self)
+        self.server.clients.pop(self.id, None)
         # break circular references!
         del self.server
 
 
 class Server(object):
 
+    # Time budget for background work in a single cron() run.
+    cron_timeout = 0.025
+    # Close connections idle for this many seconds (0: never).
+    timeout = 0
+    # Replies with at least this many items are streamed.
+    stream_threshold = 1024
+    # SCAN iterations kept open; the oldest ones start over.
+    max_scans = 1024
+    # snapshot.Snapshots running expensive reads in forked children, if any
+    snapshots = None
+    # mapped.Mapped snapshot that cold values are decoded from, if any
+    mapped = None
+    # where SAVE writes a mapped snapshot
+    dbfilename = None
+    # replycache.ReplyCache of encoded replies to whole-value reads, if any
+    reply_cache = None
+    # profiling.Profiler that command handlers run through (DEBUG PROFILE),
+    # while it's running
+    profiler = None
+    # the last one started, kept for DEBUG PROFILE DUMP
+    profiled = None
+
     def __init__(self, dbs=16):
         self.dbs = [{} for index in xrange(dbs)]
+        self.started = time.time()
+        self.startup_rss = memory.rss()
+        # last access and LFU counter of every key (OBJECT IDLETIME/FREQ)
+        self.access = memory.AccessInfo(dbs, self.started)
+        # open SCAN iterations: cursor -> [db, iterator over its keys]
+        self.scans = OrderedDict()
+        self.scan_ids = itertools.count(1)
+        self.lazyfree = LazyFree()
+        # values being streamed to clients: id -> [value, number of streams].
+        # Writers get a copy of them instead, and LazyFree keeps off.
+        self.streaming = {}
+        self.lazyfree.pinned = self.streaming
+        self.blocking = Blocking()
+        self.client_ids = itertools.count(1)
+        self.clients = {}
+        # client-output-buffer-limit: class -> (hard, soft, soft seconds)
+        self.output_limits = {
+            'normal': (0, 0, 0),
+            'pubsub': (32 * 1024**2, 8 * 1024**2, 60),
+        }
+        self.pubsub = PubSub()
+        self.tracking = Tracking(self.clients, self.pubsub)
+        # clients every command is echoed to (MONITOR)
+        self.monitors = set()
+        # notify-keyspace-events, as configured and as a bitmask which is
+        # zero unless there's a K or E in there.
+        self.notify_config = ''
+        self.notify_flags = 0
+        self.events = []
+        # sampled counts of the most used keys (HOTKEYS)
+        self.hotkeys = HotKeys()
+        # keys written by THROTTLE, dropped once idle
+        self.throttles = Throttles()
+        # key of the current pass_value command
+        self.key = None
 
     def new_client(self, addr):
         client = Client(self, addr)
+        self.clients[client.id] = client
         self.do(client, 'SELECT', '0')
         return client
 
     def do(self, client, *args):
+        writes, keys = False, ()
+        failed = False
         try:
             # setup context.
             self.client = client
+            client.last = time.time()
+            client.commands += 1
             # run the command
             command = args[0]
-            handler = getattr(self, '%s' % command.upper())
-            result = handler(*args[1:])
+            client.cmd = command.lower()
+            if self.monitors:
+                self._feed_monitors(client, args)
+            # computed once, for the reply cache, hotkeys, access times and
+            # tracking; commands without arguments have no keys
+            if len(args) > 1:
+                writes, keys = command_keys(args)
+            if keys:
+                # the test is inlined, as it's done for most commands
+                hotkeys = self.hotkeys
+                hotkeys.countdown -= 1
+                if not hotkeys.countdown:
+                    hotkeys.sample(writes, keys)
+            cache = self.reply_cache
+            if cache is not None:
+                if writes:
+                    cache.invalidate(client.db, keys)
+                else:
+                    reply = cache.get(client.db, args)
+                    if reply is not None:
+                        return reply
+            if self.mapped is not None and client.cmd not in mapped.KEYS_ONLY:
+                self.mapped.materialize(client.ht, keys)
+            if self.snapshots is not None:
+                deferred = self.snapshots.run(client, args)
+                if deferred is not None:
+                    return deferred
+            if writes:
+                client.wrote = client.last
+                if self.streaming:
+                    self._unshare(keys)
+            # module-style commands (BF.ADD) are methods with an underscore
+            handler = getattr(self, command.upper().replace('.', '_'))
+            if self.profiler is None:
+                result = handler(*args[1:])
+            else:
+                result = self.profiler.call(handler, *args[1:])
+            if cache is not None and not writes:
+                result = cache.put(client.db, args, result)
         except Exception as exc:
+            failed = True
             print traceback.format_exc()
             return exc
         else:
             return result
         finally:
+            if self.events:
+                self._publish_events()
+            # a failed command has read nothing, and written nothing
+            if self.tracking.clients and not failed:
+                self.tracking.command(client, args, writes, keys)
+            if keys and client.cmd not in memory.NOTOUCH:
+                self.access.touch(client.db, client.ht, keys, client.last)
             # teardown context.
             del self.client
 
+    def _feed_monitors(self, client, args):
+        if client.cmd == 'monitor':
+            return
+        line = Status('%.6f [%d %s] %s' % (client.last, client.db, format_addr(client.addr),
+                                           ' '.join(map(quote, args))))
+        for monitor in self.monitors:
+            monitor.push(line)
+
+    def cron(self):
+        """Periodic housekeeping; to be called a few times per second."""
+        now = time.time()
+        self.blocking.expire(now)
+        if self.timeout:
+            self._close_idle(now)
+        self.lazyfree.run(self.cron_timeout)
+        if self.mapped is not None and self.mapped.warm(self.dbs, self.cron_timeout):
+            self.mapped.close()
+            self.mapped = None
+        if self.snapshots is not None:
+            self.snapshots.cron(now)
+        self.hotkeys.cron(now)
+        self.throttles.expire(self.dbs, now, self.cron_timeout, self._expired)
+        if self.events:
+            self._publish_events()
+
+    def _close_idle(self, now):
+        # blocked clients have timeouts of their own, and subscribers are
+        # expected to sit quietly.
+        for client in self.clients.values():
+            if now - client.last > self.timeout and client.blocked is None and \
+                    not (client.channels or client.patterns):
+                client.kill()
+
+    def _unshare(self, keys):
+        """Copy on write: before a command modifies a value that's being
+        streamed, give the key a copy of its own."""
+        ht = self.client.ht
+        for key in keys:
+            value = ht.get(key)
+            if value is not None and id(value) in self.streaming:
+                ht[key] = value.copy()
+
+    def _stream(self, value, length, items):
+        """Reply with length items, lazily if there are enough of them to
+        make it worth it. value is what items come from; it's protected
+        from changes until the reply is done."""
+        if length < self.stream_threshold:
+            return list(items)
+        entry = self.streaming.setdefault(id(value), [value, 0])
+        entry[1] += 1
+
+        def generate():
+            try:
+                yield
+                for item in items:
+                    yield item
+            finally:
+                entry[1] -= 1
+                if not entry[1]:
+                    del self.streaming[id(value)]
+
+        generator = generate()
+        # step into the try block, so that the pin is released even if the
+        # reply is dropped without being sent.
+        next(generator)
+        return Stream(length, generator)
+
     def _ht_get(self, key, type):
-        value = self.client.ht.get(key, type())
+        value = self.client.ht.get(key)
+        if value is None:
+            value = type[0]() if isinstance(type, tuple) else type()
         assert isinstance(value, type), 'ERR Operation against a key holding the wrong kind of value'
         return value
 
     def _ht_check(self, key):
         if key in self.client.ht and not self.client.ht[key]:
             del self.client.ht[key]
+            self._notify(notify.GENERIC, 'del', key)
+
+    def _notify(self, type, event, key=None, db=None):
+        """Queue a keyspace event; key defaults to the one pass_value got,
+        and db to the current client's."""
+        if not self.notify_flags & type:
+            return
+        self.events.append((self.notify_flags, event, self.key if key is None else key,
+                            self.client.db if db is None else db))
+
+    def _expired(self, db, key):
+        """Drop a key that has expired, outside of any command: invalidate
+        what a write to it would, and send the expired event."""
+        del self.dbs[db][key]
+        self.access.dbs[db].pop(key, None)
+        if self.reply_cache is not None:
+            self.reply_cache.invalidate(db, [key])
+        if self.tracking.clients:
+            self.tracking.invalidate([key])
+        self._notify(notify.EXPIRED, 'expired', key, db)
+
+    def _publish_events(self):
+        events, self.events = self.events, []
+        if self.pubsub:
+            self.pubsub.publish(notify.messages(events))
 
     # Keys
 
@@ -131,13 +527,25 @@ class Server(object):
         for key in keys:
             if key in self.client.ht:
                 del self.client.ht[key]
+                self._notify(notify.GENERIC, 'del', key)
+                count += 1
+        return count
+
+    def UNLINK(self, *keys):
+        """Fully compatible."""
+        assert keys
+        count = 0
+        for key in keys:
+            if key in self.client.ht:
+                self.lazyfree.free(self.client.ht.pop(key))
+                self._notify(notify.GENERIC, 'del', key)
                 count += 1
         return count
 
     def DUMP(self, key):
-        """Non-standard: uses Pickle instead of Redis format."""
+        """Fully compatible (Redis 7.0 payload format)."""
         if key in self.client.ht:
-            return pickle.dumps(self.client.ht[key])
+            return rdb.dumps(self.client.ht[key])
 
     def EXISTS(self, key):
         """Fully compatible."""
@@ -160,6 +568,25 @@ class Server(object):
     def MOVE(self, key, db):
         raise NotImplementedError
 
+    def OBJECT(self, subcommand, *args):
+        """Mostly compatible: ENCODING, FREQ, IDLETIME, REFCOUNT. IDLETIME and
+        FREQ both work whatever the eviction policy."""
+        subcommand = subcommand.upper()
+        assert len(args) == 1 and subcommand in ('ENCODING', 'FREQ', 'IDLETIME', 'REFCOUNT'), \
+            "ERR Unknown subcommand or wrong number of arguments for '%s'. Try OBJECT HELP." % subcommand
+        key = args[0]
+        value = self.client.ht.get(key)
+        if value is None:
+            return None
+        if subcommand == 'ENCODING':
+            return memory.encoding(value)
+        elif subcommand == 'FREQ':
+            return self.access.freq(self.client.db, key, time.time())
+        elif subcommand == 'IDLETIME':
+            return self.access.idle(self.client.db, key, time.time())
+        else:
+            return 1
+
     def PERSIST(self, key):
         raise NotImplementedError
 
@@ -173,6 +600,8 @@ class Server(object):
         assert key != newkey
         self.client.ht[newkey] = self.client.ht[key]
         del self.client.ht[key]
+        self._notify(notify.GENERIC, 'rename_from', key)
+        self._notify(notify.GENERIC, 'rename_to', newkey)
         return OK
 
     def RENAMENX(self, key, newkey):
@@ -184,52 +613,198 @@ class Server(object):
         else:
             self.client.ht[newkey] = self.client.ht[key]
             del self.client.ht[key]
+            self._notify(notify.GENERIC, 'rename_from', key)
+            self._notify(notify.GENERIC, 'rename_to', newkey)
             return 1
 
-    def RESTORE(self, key, ttl, serialized_value):
-        """Non-standard; uses Pickle instead of Redis format."""
+    def RESTORE(self, key, ttl, serialized_value, *args):
+        """Mostly compatible (no TTLs; IDLETIME and FREQ are ignored)."""
         if ttl != '0':
             raise NotImplementedError
-        self.client.ht[key] = pickle.loads(serialized_value)
+        args = list(args)
+        replace = False
+        while args:
+            option = args.pop(0).upper()
+            if option == 'REPLACE':
+                replace = True
+            elif option in ('IDLETIME', 'FREQ') and args:
+                args.pop(0)
+            elif option != 'ABSTTL':
+                raise AssertionError('ERR syntax error')
+        assert replace or key not in self.client.ht, 'BUSYKEY Target key name already exists.'
+        try:
+            value = rdb.loads(serialized_value)
+        except (ValueError, struct.error, IndexError):
+            raise AssertionError('ERR DUMP payload version or checksum are wrong')
+        self.client.ht[key] = value
+        self._notify(notify.GENERIC, 'restore', key)
         return OK
 
+    def SCAN(self, cursor, *args):
+        """Mostly compatible, with weaker guarantees: keys are taken straight
+        off the dict for as long as it keeps its size. Once it has grown or
+        shrunk, the iteration goes on over a copy of the keys made then, which
+        stalls the server for as long as that takes (some 25 ms per million
+        keys, once per iteration at most) and repeats the keys returned
+        before it. Python only notices changes of size, too: if the table is
+        rebuilt between two calls with as many keys as before (as many keys
+        added as deleted), keys may come up twice, or not at all."""
+        try:
+            cursor = int(cursor)
+        except ValueError:
+            raise AssertionError('ERR invalid cursor')
+        pattern = type = None
+        count = 10
+        args = list(args)
+        while args:
+            option = args.pop(0).upper()
+            assert args, 'ERR syntax error'
+            if option == 'MATCH':
+                pattern = re.sub(r'\\(.)', r'[\1]', args.pop(0))
+            elif option == 'COUNT':
+                try:
+                    count = int(args.pop(0))
+                except ValueError:
+                    raise AssertionError('ERR value is not an integer or out of range')
+                assert count > 0, 'ERR syntax error'
+            elif option == 'TYPE':
+                type = args.pop(0).lower()
+            else:
+                raise AssertionError('ERR syntax error')
+        ht = self.client.ht
+        scan = self.scans.pop(cursor, None)
+        if scan is not None and scan[0] is not ht:
+            # the database was flushed asynchronously; nothing's left of it
+            return ['0', []]
+        if scan is None:
+            # a new iteration (or an unknown cursor, which means starting over)
+            scan = [ht, ht.iterkeys()]
+        keys = []
+        for index in xrange(count):
+            try:
+                keys.append(next(scan[1]))
+            except StopIteration:
+                scan[1] = None
+                break
+            except RuntimeError:
+                # the table changed size: go on over a copy of the keys,
+                # made here in one go (see above)
+                scan[1] = iter(ht.keys())
+        if pattern is not None:
+            keys = [key for key in keys if fnmatch.fnmatchcase(key, pattern)]
+        if type is not None:
+            if self.mapped is not None:
+                self.mapped.materialize(ht, keys)
+            keys = [key for key in keys if key in ht and self._typemap[ht[key].__class__] == type]
+        if scan[1] is None:
+            return ['0', keys]
+        cursor = next(self.scan_ids)
+        self.scans[cursor] = scan
+        if len(self.scans) > self.max_scans:
+            self.scans.popitem(last=False)
+        return [str(cursor), keys]
+
+    def _sort_lookup(self, pattern, elements):
+        """Substitute elements into a BY/GET pattern and fetch the values,
+        looking up every distinct key only once."""
+        if pattern == '#':
+            return list(elements)
+        key_pattern, arrow, field = pattern.partition('->')
+        if not field:
+            key_pattern, field = pattern, None
+        prefix, star, suffix = key_pattern.partition('*')
+        if not star:
+            return [None] * len(elements)
+        keys = [prefix + element + suffix for element in elements]
+        values = {}
+        if self.mapped is not None:
+            self.mapped.materialize(self.client.ht, set(keys))
+        for key in set(keys):
+            value = self.client.ht.get(key)
+            if field is not None:
+                value = value.get(field) if isinstance(value, hash_type) else None
+            elif not isinstance(value, str):
+                value = None
+            values[key] = value
+        return [values[key] for key in keys]
+
     def SORT(self, key, *args):
         """Mostly compatible."""
         # default values
         pattern = None
         offset = 0
-        count = None
+        count = -1
         patterns = []
         reverse = False
         alpha = False
         store = None
         # parse args
-        curr_arg = lambda: args[0].upper()
-        next_arg = lambda: args.pop(0)
-        if curr_arg() == 'BY':
-            next_arg()
-            pattern = next_arg()
-        if curr_arg() == 'LIMIT':
-            next_arg()
-            offset = int(next_arg())
-            count = int(next_arg())
-        while curr_arg() == 'GET':
-            next_arg()
-            patterns.append(next_arg())
-        if curr_arg() == 'ASC':
-            next_arg()
-        elif curr_arg() == 'DESC':
-            next_arg()
-            reverse = True
-        if curr_arg() == 'ALPHA':
-            next_arg()
-            alpha = True
-        if curr_arg() == 'STORE':
-            next_arg()
-            store = next_arg()
-        assert not args
-        # to be continued...
-        raise NotImplementedError
+        args = list(args)
+        while args:
+            option = args.pop(0).upper()
+            if option == 'BY' and args:
+                pattern = args.pop(0)
+            elif option == 'LIMIT' and len(args) >= 2:
+                offset = int(args.pop(0))
+                count = int(args.pop(0))
+            elif option == 'GET' and args:
+                patterns.append(args.pop(0))
+            elif option == 'ASC':
+                reverse = False
+            elif option == 'DESC':
+                reverse = True
+            elif option == 'ALPHA':
+                alpha = True
+            elif option == 'STORE' and args:
+                store = args.pop(0)
+            else:
+                raise AssertionError('ERR syntax error')
+        value = self.client.ht.get(key)
+        assert value is None or isinstance(value, (list_type, zset_type) + set_types), \
+            'ERR Operation against a key holding the wrong kind of value'
+        dontsort = pattern is not None and '*' not in pattern
+        if value is None:
+            elements = []
+        elif dontsort and reverse and isinstance(value, zset_type):
+            elements = list(reversed(value))
+        else:
+            elements = list(value)
+        # clamp LIMIT to the actual range
+        start = min(max(offset, 0), len(elements))
+        stop = len(elements) if count < 0 else min(start + count, len(elements))
+        if dontsort:
+            selected = elements[start:stop]
+        elif start < stop:
+            weights = elements if pattern is None else self._sort_lookup(pattern, elements)
+            if alpha:
+                # missing BY keys sort first
+                keys = [(weight is not None, weight, element)
+                        for weight, element in zip(weights, elements)]
+            else:
+                keys = [(sort_score(weight), element)
+                        for weight, element in zip(weights, elements)]
+            if stop * 8 < len(keys):
+                # a small page: no need to sort everything
+                select = heapq.nlargest if reverse else heapq.nsmallest
+                keys = select(stop, keys)
+            else:
+                keys.sort(reverse=reverse)
+            selected = [item[-1] for item in keys[start:stop]]
+        else:
+            selected = []
+        if patterns:
+            columns = [self._sort_lookup(get, selected) for get in patterns]
+            result = [column[index] for index in xrange(len(selected)) for column in columns]
+        else:
+            result = selected
+        if store is None:
+            return result
+        if result:
+            self.client.ht[store] = list_type('' if item is None else item for item in result)
+            self._notify(notify.LIST, 'sortstore', store)
+        elif self.client.ht.pop(store, None) is not None:
+            self._notify(notify.GENERIC, 'del', store)
+        return len(result)
 
     def TTL(self, key):
         raise NotImplementedError
@@ -238,7 +813,16 @@ class Server(object):
         str: 'string',
         list_type: 'list',
         set_type: 'set',
+        intset: 'set',
         hash_type: 'hash',
+        zset_type: 'zset',
+        # like in Redis, HyperLogLogs are strings as far as users can tell.
+        hll_type: 'string',
+        stream_type: 'stream',
+        # type names of RedisBloom
+        bloom_type: 'MBbloom--',
+        cuckoo_type: 'MBbloomCF',
+        ts_type: 'TSDB-TYPE',
         type(None): 'none',
     }
 
@@ -248,11 +832,22 @@ class Server(object):
 
     # Strings
 
+    def _string_get(self, key, default=''):
+        """Value of a string key, or default if it's missing. HyperLogLogs
+        are strings too, as far as string commands are concerned."""
+        value = self.client.ht.get(key)
+        if value is None:
+            return default
+        if isinstance(value, hll_type):
+            return value.tostring()
+        assert isinstance(value, str), 'WRONGTYPE Operation against a key holding the wrong kind of value'
+        return value
+
     def APPEND(self, key, value):
         """Fully compatible."""
-        old_value = self.client.ht.get(key, '')
-        assert isinstance(old_value, str)
+        old_value = self._string_get(key)
         self.client.ht[key] = old_value + value
+        self._notify(notify.STRING, 'append', key)
         return len(self.client.ht[key])
 
     def BITCOUNT(self, key):
@@ -271,13 +866,7 @@ class Server(object):
 
     def GET(self, key):
         """Fully compatible."""
-        value = self.client.ht.get(key)
-        if isinstance(value, str):
-            return value
-        elif value is None:
-            return None
-        else:
-            raise ValueError('wrong type for GET')
+        return self._string_get(key, None)
 
     def GETBIT(self, key, offset):
         raise NotImplementedError
@@ -286,14 +875,14 @@ class Server(object):
         """Fully compatible."""
         start = int(start)
         end = int(end)
-        value = self.client.ht.get(key, '')
+        value = self._string_get(key)
         return value[redis_slice(start, end)]
 
     def GETSET(self, key, value):
         """Fully compatible."""
-        old_value = self.client.ht.get(key, '')
-        assert isinstance(value, str)
+        old_value = self._string_get(key)
         self.client.ht[key] = value
+        self._notify(notify.STRING, 'set', key)
         return old_value
 
     def INCR(self, key):
@@ -302,17 +891,16 @@ class Server(object):
 
     def INCRBY(self, key, increment):
         """Fully compatible."""
-        value = self.client.ht.get(key, '0')
-        assert isinstance(value, str), 'ERR operation on a key holding a wrong kind of value'
+        value = self._string_get(key, '0')
         assert not value[0].isspace(), 'ERR invalid value'
         assert not value[-1].isspace(), 'ERR invalid value'
         self.client.ht[key] = str(int(value) + int(increment))
+        self._notify(notify.STRING, 'incrby', key)
         return self.client.ht[key]
 
     def INCRBYFLOAT(self, key, increment):
         """Fully compatible."""
-        value = self.client.ht.get(key, '0')
-        assert isinstance(value, str), 'ERR operation on a key holding a wrong kind of value'
+        value = self._string_get(key, '0')
         assert not value[0].isspace(), 'ERR invalid value'
         assert not value[-1].isspace(), 'ERR invalid value'
         increment = float(increment)
@@ -320,6 +908,7 @@ class Server(object):
         assert not math.isinf(increment), 'ERR would produce Infinity'
         result = '%.17f' % (float(value) + increment)
         self.client.ht[key] = result.rstrip('0').rstrip('.')
+        self._notify(notify.STRING, 'incrbyfloat', key)
         return self.client.ht[key]
  
     def MGET(self, *keys):
@@ -327,9 +916,11 @@ class Server(object):
         assert keys
         values = []
         for key in keys:
-            value = self.client.ht.get(key, '')
+            value = self.client.ht.get(key)
             if isinstance(value, str):
                 values.append(value)
+            elif isinstance(value, hll_type):
+                values.append(value.tostring())
             else:
                 values.append(None)
         return values
@@ -342,6 +933,7 @@ class Server(object):
             key = args[index]
             value = args[index+1]
             self.client.ht[key] = value
+            self._notify(notify.STRING, 'set', key)
         return OK
 
     def MSETNX(self, *args):
@@ -356,6 +948,7 @@ class Server(object):
             key = args[index]
             value = args[index+1]
             self.client.ht[key] = value
+            self._notify(notify.STRING, 'set', key)
         return 1
 
     def PSETEX(self, key, milliseconds, value):
@@ -364,6 +957,7 @@ class Server(object):
     def SET(self, key, value):
         """Fully compatible."""
         self.client.ht[key] = value
+        self._notify(notify.STRING, 'set', key)
         return OK
 
     def SETBIT(self, key, offset, value):
@@ -376,6 +970,7 @@ class Server(object):
         """Fully compatible."""
         if key not in self.client.ht:
             self.client.ht[key] = value
+            self._notify(notify.STRING, 'set', key)
             return 1
         else:
             return 0
@@ -383,16 +978,15 @@ class Server(object):
     def SETRANGE(self, key, offset, value):
         """Fully compatible."""
         offset = int(offset)
-        old_value = self.client.ht.get(key, '')
-        assert isinstance(old_value, str)
-        self.client.ht[key] = old_value[:offset] + value + old_value[offset+len(value)]
+        old_value = self._string_get(key)
+        old_value = old_value.ljust(offset, '\0')
+        self.client.ht[key] = old_value[:offset] + value + old_value[offset+len(value):]
+        self._notify(notify.STRING, 'setrange', key)
         return len(self.client.ht[key])
 
     def STRLEN(self, key):
         """Fully compatible."""
-        value = self.client.ht.get(key, '')
-        assert isinstance(value, str)
-        return len(value)
+        return len(self._string_get(key))
 
     # Hashes
 
@@ -403,6 +997,9 @@ class Server(object):
         for field in fields:
             if field in hash:
                 del hash[field]
+                deleted += 1
+        if deleted:
+            self._notify(notify.HASH, 'hdel')
         return deleted
 
     @hashmethod
@@ -421,16 +1018,14 @@ class Server(object):
     @hashmethod
     def HGETALL(self, hash):
         """Fully compatible."""
-        result = []
-        for field, value in hash:
-            result.append(field)
-            result.append(value)
-        return result
+        items = (item for pair in hash.iteritems() for item in pair)
+        return self._stream(hash, len(hash) * 2, items)
 
     @hashmethod
     def HINCRBY(self, hash, field, increment):
         """Fully compatible."""
         hash[field] = str(int(hash.get(field, 0)) + int(increment))
+        self._notify(notify.HASH, 'hincrby')
         return hash[field]
 
 
@@ -439,12 +1034,13 @@ class Server(object):
         """Fully compatible."""
         result = '%.17f' % (float(hash.get(field, 0)) + float(increment))
         hash[field] = result.rstrip('0').rstrip('.')
+        self._notify(notify.HASH, 'hincrbyfloat')
         return hash[field]
 
     @hashmethod
     def HKEYS(self, hash):
         """Fully compatible."""
-        return hash.keys()
+        return self._stream(hash, len(hash), hash.iterkeys())
 
     @hashmethod
     def HLEN(self, hash):
@@ -462,13 +1058,15 @@ class Server(object):
         """Fully compatible."""
         assert args
         assert len(args) % 2 == 0
-        for field, value in args:
-            hash[field ] = value
+        for index in xrange(0, len(args), 2):
+            hash[args[index]] = args[index+1]
+        self._notify(notify.HASH, 'hset')
         return OK
 
     @hashmethod
     def HSET(self, hash, field, value):
         """Fully compatible."""
+        self._notify(notify.HASH, 'hset')
         if field not in hash:
             hash[field] = value
             return 1
@@ -481,6 +1079,7 @@ class Server(object):
         """Fully compatible."""
         if field not in hash:
             hash[field] = value
+            self._notify(notify.HASH, 'hset')
             return 1
         else:
             return 0
@@ -488,7 +1087,7 @@ class Server(object):
     @hashmethod
     def HVALS(self, hash):
         """Fully compatible."""
-        return hash.values()
+        return self._stream(hash, len(hash), hash.itervalues())
 
     # Lists
 
@@ -513,6 +1112,7 @@ class Server(object):
                 list.insert(index, value)
             else:
                 list.insert(index+1, value)
+            self._notify(notify.LIST, 'linsert')
             return len(list)
 
     @listmethod
@@ -524,59 +1124,70 @@ class Server(object):
     def LPOP(self, list):
         """Fully compatible."""
         try:
-            return list.pop(0)
+            value = list.popleft()
         except IndexError:
             return None
+        self._notify(notify.LIST, 'lpop')
+        return value
+
+    @listmethod
+    def LPOS(self, list, element, *args):
+        """Fully compatible."""
+        rank = 1
+        count = None
+        maxlen = 0
+        # ("list" is taken here)
+        args = iter(args)
+        for option in args:
+            option = option.upper()
+            value = next(args, None)
+            assert value is not None, 'ERR syntax error'
+            if option == 'RANK':
+                rank = int(value)
+                assert rank != 0, "ERR RANK can't be zero: use 1 to start from the first match, 2 from the second ... or use negative to start from the end of the list"
+            elif option == 'COUNT':
+                count = int(value)
+                assert count >= 0, "ERR COUNT can't be negative"
+            elif option == 'MAXLEN':
+                maxlen = int(value)
+                assert maxlen >= 0, "ERR MAXLEN can't be negative"
+            else:
+                raise AssertionError('ERR syntax error')
+        matches = list.find(element, reverse=rank < 0, maxlen=maxlen)
+        matches = islice(matches, abs(rank) - 1, None)
+        if count is None:
+            return next(matches, None)
+        return [index for index in islice(matches, count or None)]
 
     @listmethod
     def LPUSH(self, list, *values):
         """Fully compatible."""
         assert values
         for value in values:
-            list.insert(0, value)
+            list.appendleft(value)
+        self._notify(notify.LIST, 'lpush')
         return len(list)
 
     @listmethod
     def LPUSHX(self, list, value):
         """Fully compatible."""
         if list:
-            list.insert(0, value)
+            list.appendleft(value)
+            self._notify(notify.LIST, 'lpush')
         return len(list)
 
     @listmethod
     def LRANGE(self, list, start, stop):
         """More-or-less compatible, breaks sometimes."""
-        return list[redis_slice(start, stop)]
+        start, stop, step = redis_slice(start, stop).indices(len(list))
+        return self._stream(list, max(stop - start, 0), list.irange(start, stop))
 
     @listmethod
     def LREM(self, list, count, value):
-        """Compatible, but slower in some cases."""
-        count = int(count)
-        removed = 0
-        if count > 0:
-            while removed < count:
-                try:
-                    list.remove(value)
-                    removed += 1
-                except ValueError:
-                    break
-        elif count == 0:
-            while True:
-                try:
-                    list.remove(value)
-                    removed += 1
-                except ValueError:
-                    break
-        else:
-            count = -count
-            list.reverse()
-            while removed < count:
-                try:
-                    list.remove(value)
-                    removed += 1
-                except ValueError:
-                    break
-            list.reverse()
+        """Fully compatible."""
+        removed = list.remove(value, int(count))
+        if removed:
+            self._notify(notify.LIST, 'lrem')
         return removed
 
     @listmethod
@@ -588,56 +1199,83 @@ class Server(object):
             list[int(index)] = value
         except IndexError:
             return Error('ERR index out of range')
+        self._notify(notify.LIST, 'lset')
         return OK
 
     @listmethod
     def LTRIM(self, list, start, stop):
         """Fully compatible."""
-        list[:] = list[redis_slice(start, stop)]
+        range = redis_slice(start, stop)
+        list.trim(range.start, range.stop)
+        self._notify(notify.LIST, 'ltrim')
         return OK
 
     @listmethod
     def RPOP(self, list):
         """Fully compatible."""
         try:
-            return list.pop()
+            value = list.pop()
         except IndexError:
             return None
+        self._notify(notify.LIST, 'rpop')
+        return value
 
-    def RPOPLPUSH(self, source_key, destination_key):
+    def LMOVE(self, source_key, destination_key, wherefrom, whereto):
         """Fully compatible."""
+        wherefrom = wherefrom.upper()
+        whereto = whereto.upper()
+        assert wherefrom in ('LEFT', 'RIGHT'), 'ERR syntax error'
+        assert whereto in ('LEFT', 'RIGHT'), 'ERR syntax error'
         source = self._ht_get(source_key, list_type)
         if not source:
             return None
         destination = self._ht_get(destination_key, list_type)
-        item = source.pop()
-        destination.insert(0, item)
+        if wherefrom == 'LEFT':
+            item = source.popleft()
+        else:
+            item = source.pop()
+        if whereto == 'LEFT':
+            destination.appendleft(item)
+        else:
+            destination.append(item)
         self.client.ht[destination_key] = destination
+        self._notify(notify.LIST, wherefrom == 'LEFT' and 'lpop' or 'rpop', source_key)
+        self._notify(notify.LIST, whereto == 'LEFT' and 'lpush' or 'rpush', destination_key)
+        self._ht_check(source_key)
         return item
 
+    def RPOPLPUSH(self, source_key, destination_key):
+        """Fully compatible."""
+        return self.LMOVE(source_key, destination_key, 'RIGHT', 'LEFT')
+
     @listmethod
     def RPUSH(self, list, *values):
         assert values
         list.extend(values)
+        self._notify(notify.LIST, 'rpush')
         return len(list)
 
     @listmethod
     def RPUSHX(self, list, value):
         if list:
             list.append(value)
+            self._notify(notify.LIST, 'rpush')
         return len(list)
 
     # Sets
 
-    @setmethod
-    def SADD(self, set, *members):
+    def SADD(self, key, *members):
         """Fully compatible."""
         assert members
+        set = upgrade(self._ht_get(key, set_types), members)
+        self.client.ht[key] = set
         added = 0
         for member in members:
             if member not in set:
                 set.add(member)
                 added += 1
+        if added:
+            self._notify(notify.SET, 'sadd', key)
         return added
 
     @setmethod
@@ -645,29 +1283,65 @@ class Server(object):
         """Fully compatible."""
         return len(set)
 
-    @setmethod
-    def SDIFF(self, set, *keys):
+    def _set_lookup(self, keys):
+        """Like _ht_get, but missing keys are None instead of new sets."""
+        assert keys, 'ERR wrong number of arguments'
+        values = []
+        for key in keys:
+            value = self.client.ht.get(key)
+            assert value is None or isinstance(value, set_types), 'ERR Operation against a key holding the wrong kind of value'
+            values.append(value)
+        return values
+
+    def _set_store(self, event, operation, destination, keys, inplace):
+        """Run operation and store its result; inplace tells whether the
+        destination set may be updated in place if it's among the inputs."""
+        sets = self._set_lookup(keys)
+        target = self.client.ht.get(destination)
+        if not (isinstance(target, set_type) and inplace(target, sets)):
+            target = None
+        result = operation(sets, target=target)
+        if result is not target:
+            result = compact(result)
+        if result:
+            self.client.ht[destination] = result
+            self._notify(notify.SET, event, destination)
+        elif self.client.ht.pop(destination, None) is not None:
+            self._notify(notify.GENERIC, 'del', destination)
+        return len(result)
+
+    def SDIFF(self, *keys):
         """Fully compatible."""
-        return set.difference(*[self._ht_get(key, set_type) for key in keys])
+        result = setops.difference(self._set_lookup(keys))
+        return self._stream(result, len(result), result)
 
-    def SDIFFSTORE(self, destination, key, *keys):
+    def SDIFFSTORE(self, destination, *keys):
         """Fully compatible."""
-        self.client.ht[destination] = self._ht_get(key, set_type).difference(*[self._ht_get(key, set_type) for key in keys])
-        result = len(self.client.ht[destination])
-        self._ht_check(destination)
-        return result
+        return self._set_store('sdiffstore', setops.difference, destination, keys,
+                               lambda target, sets: sets[0] is target)
 
-    @setmethod
-    def SINTER(self, set, *keys):
+    def SINTER(self, *keys):
         """Fully compatible."""
-        return set.intersection(*[self._ht_get(key, set_type) for key in keys])
+        result = setops.intersection(self._set_lookup(keys))
+        return self._stream(result, len(result), result)
 
-    def SINTERSTORE(self, destination, key, *keys):
+    def SINTERCARD(self, numkeys, *args):
         """Fully compatible."""
-        self.client.ht[destination] = self._ht_get(key, set_type).intersection(*[self._ht_get(key, set_type) for key in keys])
-        result = len(self.client.ht[destination])
-        self._ht_check(destination)
-        return result
+        numkeys = int(numkeys)
+        assert numkeys > 0, "ERR numkeys should be greater than 0"
+        assert len(args) >= numkeys, "ERR Number of keys can't be greater than number of args"
+        keys, args = args[:numkeys], args[numkeys:]
+        limit = 0
+        if args:
+            assert len(args) == 2 and args[0].upper() == 'LIMIT', 'ERR syntax error'
+            limit = int(args[1])
+            assert limit >= 0, "ERR LIMIT can't be negative"
+        return setops.intersection_card(self._set_lookup(keys), limit)
+
+    def SINTERSTORE(self, destination, *keys):
+        """Fully compatible."""
+        return self._set_store('sinterstore', setops.intersection, destination, keys,
+                               lambda target, sets: any(value is target for value in sets))
 
     @setmethod
     def SISMEMBER(self, set, member):
@@ -677,17 +1351,20 @@ class Server(object):
     @setmethod
     def SMEMBERS(self, set):
         """Fully compatible."""
-        return set
+        return self._stream(set, len(set), set)
 
     def SMOVE(self, source, destination, member):
-        source_set = self._ht_get(source, set_type)
-        destination_set = self._ht_get(destination, set_type)
+        source_set = self._ht_get(source, set_types)
+        destination_set = self._ht_get(destination, set_types)
         if member not in source_set:
             return 0
         else:
+            destination_set = upgrade(destination_set, [member])
             self.client.ht[destination] = destination_set
             source_set.remove(member)
             destination_set.add(member)
+            self._notify(notify.SET, 'srem', source)
+            self._notify(notify.SET, 'sadd', destination)
             self._ht_check(source)
             return 1
 
@@ -695,6 +1372,7 @@ class Server(object):
     def SPOP(self, set):
         """Fully compatible."""
         if set:
+            self._notify(notify.SET, 'spop')
             return set.pop()
         else:
             return None
@@ -729,20 +1407,20 @@ class Server(object):
             if member in set:
                 set.remove(member)
                 removed += 1
+        if removed:
+            self._notify(notify.SET, 'srem')
         return removed
 
 
-    @setmethod
-    def SUNION(self, set, *keys):
+    def SUNION(self, *keys):
         """Fully compatible."""
-        return set.union(*[self._ht_get(key, set_type) for key in keys])
+        result = setops.union(self._set_lookup(keys))
+        return self._stream(result, len(result), result)
 
-    def SUNIONSTORE(self, destination, key, *keys):
+    def SUNIONSTORE(self, destination, *keys):
         """Fully compatible."""
-        self.client.ht[destination] = self._ht_get(key, set_type).union(*[self._ht_get(key, set_type) for key in keys])
-        result = len(self.client.ht[destination])
-        self._ht_check(destination)
-        return result
+        return self._set_store('sunionstore', setops.union, destination, keys,
+                               lambda target, sets: any(value is target for value in sets))
 
     # Sorted Sets
 
@@ -762,6 +1440,7 @@ class Server(object):
             if member not in zset:
                 added += 1
             zset[member] = score
+        self._notify(notify.ZSET, 'zadd')
         return added
 
     @zsetmethod
@@ -770,7 +1449,11 @@ class Server(object):
 
     @zsetmethod
     def ZCOUNT(self, zset, min, max):
-        raise NotImplementedError
+        """Fully compatible."""
+        min, min_exclusive = score_bound(min)
+        max, max_exclusive = score_bound(max)
+        start, stop = zset.score_range(min, max, min_exclusive, max_exclusive)
+        return stop - start
 
     @zsetmethod
     def ZINCRBY(self, zset, increment, member):
@@ -779,29 +1462,61 @@ class Server(object):
         score = zset.get(member, 0.0) + increment
         assert not math.isnan(score), "ERR resulting score is NaN"
         zset[member] = score
+        self._notify(notify.ZSET, 'zincr')
         return floaty(score)
 
-    def ZINTERSTORE(self, destination, numkeys, *args):
-        raise NotImplementedError
-
     @zsetmethod
     def ZRANGE(self, zset, start, stop, *flags):
         # TODO: better flags checking
+        start, stop, step = redis_slice(start, stop).indices(len(zset))
+        items = zset.scoreitems(start, stop) if start < stop else []
         if len(flags) == 1 and flags[0].upper() == 'WITHSCORES':
-            result = blist()
-            for key, value in zset.items()[redis_slice(start, stop)]:
-                result.append(key)
-                astext = '%.17f' % value
-                astext = astext.rstrip('0').rstrip('.')
-                result.append(astext)
-            return result
+            pairs = (item for score, member in items for item in (member, floaty(score)))
+            return self._stream(zset, len(items) * 2, pairs)
+        else:
+            return self._stream(zset, len(items), (member for score, member in items))
+
+    def _zrangebyscore(self, zset, low, high, args, reverse):
+        low, low_exclusive = score_bound(low)
+        high, high_exclusive = score_bound(high)
+        withscores = False
+        offset, count = 0, -1
+        args = list(args)
+        while args:
+            option = args.pop(0).upper()
+            if option == 'WITHSCORES':
+                withscores = True
+            elif option == 'LIMIT' and len(args) >= 2:
+                offset, count = int(args[0]), int(args[1])
+                del args[:2]
+            else:
+                raise AssertionError('ERR syntax error')
+        start, stop = zset.score_range(low, high, low_exclusive, high_exclusive)
+        if offset < 0:
+            return []
+        # only slice out the requested window
+        if reverse:
+            stop -= offset
+            if count >= 0:
+                start = max(start, stop - count)
         else:
-            print 'keys'
-            return zset.viewkeys()[redis_slice(start, stop)]
+            start += offset
+            if count >= 0:
+                stop = min(stop, start + count)
+        items = zset.scoreitems(start, stop) if start < stop else []
+        if reverse:
+            items = reversed(items)
+        result = []
+        for score, member in items:
+            result.append(member)
+            if withscores:
+                result.append(floaty(score))
+        return result
 
     @zsetmethod
     def ZRANGEBYSCORE(self, zset, min, max, *args):
-        raise NotImplementedError
+        """Fully compatible."""
+        return self._zrangebyscore(zset, min, max, args, reverse=False)
 
     @zsetmethod
     def ZRANK(self, zset, member):
@@ -815,6 +1530,8 @@ class Server(object):
             if member in zset:
                 del zset[member]
                 deleted += 1
+        if deleted:
+            self._notify(notify.ZSET, 'zrem')
         return deleted
 
     @zsetmethod
@@ -823,7 +1540,15 @@ class Server(object):
 
     @zsetmethod
     def ZREMRANGEBYSCORE(self, zset, min, max):
-        raise NotImplementedError
+        """Fully compatible."""
+        min, min_exclusive = score_bound(min)
+        max, max_exclusive = score_bound(max)
+        start, stop = zset.score_range(min, max, min_exclusive, max_exclusive)
+        for score, member in zset.scoreitems(start, stop):
+            del zset[member]
+        if stop > start:
+            self._notify(notify.ZSET, 'zremrangebyscore')
+        return stop - start
 
     @zsetmethod
     def ZREVRANGE(self, zset, start, stop, *args):
@@ -831,7 +1556,8 @@ class Server(object):
 
     @zsetmethod
     def ZREVRANGEBYSCORE(self, zset, max, min, *args):
-        raise NotImplementedError
+        """Fully compatible."""
+        return self._zrangebyscore(zset, min, max, args, reverse=True)
 
     @zsetmethod
     def ZREVRANK(self, zset, member):
@@ -841,14 +1567,1192 @@ class Server(object):
     def ZSCORE(self, zset, member):
         return floaty(zset[member])
 
+    def _zstore(self, event, operation, destination, numkeys, *args):
+        numkeys = int(numkeys)
+        assert numkeys > 0, 'ERR at least 1 input key is needed for ZUNIONSTORE/ZINTERSTORE'
+        assert len(args) >= numkeys, 'ERR syntax error'
+        keys = args[:numkeys]
+        args = list(args[numkeys:])
+        weights = [1.0] * numkeys
+        aggregate = 'SUM'
+        while args:
+            option = args.pop(0).upper()
+            if option == 'WEIGHTS':
+                assert len(args) >= numkeys, 'ERR syntax error'
+                try:
+                    weights = [float(weight) for weight in args[:numkeys]]
+                except ValueError:
+                    raise AssertionError('ERR weight value is not a float')
+                del args[:numkeys]
+            elif option == 'AGGREGATE':
+                assert args, 'ERR syntax error'
+                aggregate = args.pop(0).upper()
+                assert aggregate in zsetops.AGGREGATES, 'ERR syntax error'
+            else:
+                raise AssertionError('ERR syntax error')
+        sources = []
+        for key in keys:
+            value = self.client.ht.get(key, set_type())
+            assert isinstance(value, (zset_type,) + set_types), 'ERR Operation against a key holding the wrong kind of value'
+            sources.append(value)
+        result = operation(sources, weights, aggregate)
+        if result:
+            self.client.ht[destination] = result
+            self._notify(notify.ZSET, event, destination)
+        elif self.client.ht.pop(destination, None) is not None:
+            self._notify(notify.GENERIC, 'del', destination)
+        return len(result)
+
     def ZINTERSTORE(self, destination, numkeys, *args):
-        raise NotImplementedError
+        """Fully compatible."""
+        return self._zstore('zinterstore', zsetops.intersection, destination, numkeys, *args)
+
+    def ZUNIONSTORE(self, destination, numkeys, *args):
+        """Fully compatible."""
+        return self._zstore('zunionstore', zsetops.union, destination, numkeys, *args)
+
+    # Geo
+
+    def _geo_get(self, key):
+        value = self.client.ht.get(key)
+        assert value is None or isinstance(value, zset_type), 'WRONGTYPE Operation against a key holding the wrong kind of value'
+        return value
+
+    @zsetmethod
+    def GEOADD(self, zset, *args):
+        """Fully compatible."""
+        args = list(args)
+        nx = xx = ch = False
+        while args and args[0].upper() in ('NX', 'XX', 'CH'):
+            option = args.pop(0).upper()
+            nx, xx, ch = nx or option == 'NX', xx or option == 'XX', ch or option == 'CH'
+        assert not (nx and xx), 'ERR XX and NX options at the same time are not compatible'
+        assert args and len(args) % 3 == 0, "ERR wrong number of arguments for 'geoadd' command"
+        pairs = []
+        # check for errors before doing anything
+        for index in xrange(0, len(args), 3):
+            try:
+                lon, lat = float(args[index]), float(args[index+1])
+            except ValueError:
+                raise AssertionError('ERR value is not a valid float')
+            assert geo.valid(lon, lat), 'ERR invalid longitude,latitude pair %f,%f' % (lon, lat)
+            pairs.append((float(geo.encode(lon, lat)), args[index+2]))
+        changed = 0
+        for score, member in pairs:
+            exists = member in zset
+            if (nx and exists) or (xx and not exists):
+                continue
+            if not exists or (ch and zset[member] != score):
+                changed += 1
+            zset[member] = score
+        self._notify(notify.ZSET, 'zadd')
+        return changed
+
+    def GEODIST(self, key, member1, member2, unit='m'):
+        """Fully compatible."""
+        unit = unit.lower()
+        assert unit in geo.UNITS, 'ERR unsupported unit provided. please use M, KM, FT, MI'
+        zset = self._geo_get(key)
+        if zset is None or member1 not in zset or member2 not in zset:
+            return None
+        lon1, lat1 = geo.decode(zset[member1])
+        lon2, lat2 = geo.decode(zset[member2])
+        return '%.4f' % (geo.distance(lon1, lat1, lon2, lat2) / geo.UNITS[unit])
+
+    def GEOHASH(self, key, *members):
+        """Fully compatible."""
+        zset = self._geo_get(key) or {}
+        return [geo.geohash(zset[member]) if member in zset else None for member in members]
+
+    def GEOPOS(self, key, *members):
+        """Fully compatible."""
+        zset = self._geo_get(key) or {}
+        result = []
+        for member in members:
+            if member in zset:
+                result.append([floaty(coordinate) for coordinate in geo.decode(zset[member])])
+            else:
+                result.append(None)
+        return result
+
+    def _geosearch(self, key, args, store=False):
+        """Run a GEOSEARCH query; return a list of (member, score, distance,
+        longitude, latitude) and the reply flags."""
+        args = list(args)
+        center = shape = unit = None
+        order = None
+        count = 0
+        first_found = False
+        flags = set()
+        zset = self._geo_get(key)
+        while args:
+            option = args.pop(0).upper()
+            if option == 'FROMMEMBER' and args and center is None:
+                member = args.pop(0)
+                assert zset is not None and member in zset, 'ERR could not decode requested zset member'
+                center = geo.decode(zset[member])
+            elif option == 'FROMLONLAT' and len(args) >= 2 and center is None:
+                try:
+                    center = float(args[0]), float(args[1])
+                except ValueError:
+                    raise AssertionError('ERR value is not a valid float')
+                assert geo.valid(*center), 'ERR invalid longitude,latitude pair %f,%f' % center
+                del args[:2]
+            elif option == 'BYRADIUS' and len(args) >= 2 and shape is None:
+                shape = (float(args[0]),)
+                unit = args[1].lower()
+                del args[:2]
+            elif option == 'BYBOX' and len(args) >= 3 and shape is None:
+                shape = (float(args[0]), float(args[1]))
+                unit = args[2].lower()
+                del args[:3]
+            elif option in ('ASC', 'DESC'):
+                order = option
+            elif option == 'COUNT' and args:
+                count = int(args.pop(0))
+                assert count > 0, 'ERR COUNT must be > 0'
+                if args and args[0].upper() == 'ANY':
+                    first_found = bool(args.pop(0))
+            elif option in ('WITHCOORD', 'WITHDIST', 'WITHHASH') and not store:
+                flags.add(option)
+            elif option == 'STOREDIST' and store:
+                flags.add(option)
+            else:
+                raise AssertionError('ERR syntax error')
+        assert center is not None, 'ERR exactly one of FROMMEMBER or FROMLONLAT can be specified for GEOSEARCH'
+        assert shape is not None, 'ERR exactly one of BYRADIUS and BYBOX can be specified for GEOSEARCH'
+        assert unit in geo.UNITS, 'ERR unsupported unit provided. please use M, KM, FT, MI'
+        assert not first_found or count, 'ERR the ANY argument requires COUNT argument'
+        if zset is None:
+            return [], flags
+        lon, lat = center
+        scale = geo.UNITS[unit]
+        if len(shape) == 1:
+            radius = shape[0] * scale
+            width = height = radius * 2
+        else:
+            radius = None
+            width, height = shape[0] * scale, shape[1] * scale
+        candidates = []
+        for start, stop in geo.search_ranges(lon, lat, width, height):
+            start, stop = zset.score_range(start, stop, high_exclusive=True)
+            candidates.extend(zset.scoreitems(start, stop))
+        matches = geo.within(lon, lat, [score for score, member in candidates],
+                             radius=radius, width=width, height=height)
+        if first_found:
+            matches = matches[:count]
+        if order is not None or (count and not first_found):
+            matches.sort(key=lambda match: match[1], reverse=order == 'DESC')
+        if count:
+            matches = matches[:count]
+        results = []
+        for index, match_distance, match_lon, match_lat in matches:
+            score, member = candidates[index]
+            results.append((member, score, match_distance / scale, match_lon, match_lat))
+        return results, flags
+
+    def GEOSEARCH(self, key, *args):
+        """Fully compatible."""
+        results, flags = self._geosearch(key, args)
+        if not flags:
+            return [member for member, score, distance, lon, lat in results]
+        reply = []
+        for member, score, distance, lon, lat in results:
+            item = [member]
+            if 'WITHDIST' in flags:
+                item.append('%.4f' % distance)
+            if 'WITHHASH' in flags:
+                item.append(int(score))
+            if 'WITHCOORD' in flags:
+                item.append([floaty(lon), floaty(lat)])
+            reply.append(item)
+        return reply
+
+    def GEOSEARCHSTORE(self, destination, source, *args):
+        """Fully compatible."""
+        results, flags = self._geosearch(source, args, store=True)
+        if 'STOREDIST' in flags:
+            items = [(member, distance) for member, score, distance, lon, lat in results]
+        else:
+            items = [(member, score) for member, score, distance, lon, lat in results]
+        if items:
+            self.client.ht[destination] = zset_type.fromitems(items)
+            self._notify(notify.ZSET, 'geosearchstore', destination)
+        elif self.client.ht.pop(destination, None) is not None:
+            self._notify(notify.GENERIC, 'del', destination)
+        return len(items)
+
+    # HyperLogLog
+
+    def _hll_get(self, key):
+        """Return the HyperLogLog at key or None, parsing it if it was SET
+        as a string."""
+        value = self.client.ht.get(key)
+        if isinstance(value, str):
+            try:
+                value = hll_type.fromstring(value)
+            except ValueError:
+                raise AssertionError('WRONGTYPE Key is not a valid HyperLogLog string value.')
+            self.client.ht[key] = value
+        assert value is None or isinstance(value, hll_type), 'WRONGTYPE Operation against a key holding the wrong kind of value'
+        return value
+
+    def PFADD(self, key, *elements):
+        """Fully compatible."""
+        hll = self._hll_get(key)
+        changed = hll is None
+        if changed:
+            hll = self.client.ht[key] = hll_type()
+        for element in elements:
+            if hll.add(element):
+                changed = True
+        if changed:
+            self._notify(notify.STRING, 'pfadd', key)
+        return int(changed)
+
+    def PFCOUNT(self, key, *keys):
+        """Fully compatible."""
+        if not keys:
+            hll = self._hll_get(key)
+            return hll.count() if hll is not None else 0
+        hlls = filter(None, map(self._hll_get, (key,) + keys))
+        if not hlls:
+            return 0
+        return hll_type.merged(hlls).count()
+
+    def PFMERGE(self, destkey, *sourcekeys):
+        """Fully compatible."""
+        hlls = filter(None, map(self._hll_get, (destkey,) + sourcekeys))
+        if hlls:
+            self.client.ht[destkey] = hll_type.merged(hlls)
+        else:
+            self.client.ht[destkey] = hll_type()
+        self._notify(notify.STRING, 'pfadd', destkey)
+        return OK
+
+    # Bloom and cuckoo filters
+
+    def _filter_get(self, key, type, create=False):
+        value = self.client.ht.get(key)
+        assert value is None or isinstance(value, type), 'WRONGTYPE Operation against a key holding the wrong kind of value'
+        if value is None and create:
+            value = self.client.ht[key] = type()
+        return value
+
+    def BF_RESERVE(self, key, error_rate, capacity, *args):
+        """Compatible with RedisBloom."""
+        try:
+            error_rate = float(error_rate)
+        except ValueError:
+            raise AssertionError('ERR bad error rate')
+        try:
+            capacity = int(capacity)
+        except ValueError:
+            raise AssertionError('ERR bad capacity')
+        assert 0 < error_rate < 1, 'ERR (0 < error rate range < 1)'
+        assert capacity > 0, 'ERR (capacity should be larger than 0)'
+        expansion = bloom.BLOOM_EXPANSION
+        args = list(args)
+        while args:
+            option = args.pop(0).upper()
+            if option == 'NONSCALING':
+                expansion = 0
+            elif option == 'EXPANSION' and args:
+                try:
+                    expansion = int(args.pop(0))
+                except ValueError:
+                    raise AssertionError('ERR bad expansion')
+                assert expansion > 0, 'ERR expansion should be greater or equal to 1'
+            else:
+                raise AssertionError('ERR syntax error')
+        assert key not in self.client.ht, 'ERR item exists'
+        self.client.ht[key] = bloom_type(error_rate, capacity, expansion)
+        return OK
+
+    def BF_ADD(self, key, item):
+        """Compatible with RedisBloom."""
+        result = self.BF_MADD(key, item)[0]
+        assert not isinstance(result, Error), result.message
+        return result
+
+    def BF_MADD(self, key, *items):
+        """Compatible with RedisBloom."""
+        assert items, "ERR wrong number of arguments for 'bf.madd' command"
+        bf = self._filter_get(key, bloom_type, create=True)
+        result = []
+        for hashed in bloom.hash_all(items):
+            try:
+                result.append(int(bf.add(hashed)))
+            except ValueError as exc:
+                result.append(Error('ERR %s' % exc))
+        return result
+
+    def BF_EXISTS(self, key, item):
+        """Compatible with RedisBloom."""
+        return self.BF_MEXISTS(key, item)[0]
+
+    def BF_MEXISTS(self, key, *items):
+        """Compatible with RedisBloom."""
+        assert items, "ERR wrong number of arguments for 'bf.mexists' command"
+        bf = self._filter_get(key, bloom_type)
+        if bf is None:
+            return [0] * len(items)
+        return [int(bf.contains(hashed)) for hashed in bloom.hash_all(items)]
+
+    def BF_CARD(self, key):
+        """Compatible with RedisBloom."""
+        bf = self._filter_get(key, bloom_type)
+        return 0 if bf is None else bf.count
+
+    def BF_INFO(self, key):
+        """Mostly compatible with RedisBloom (no single-field form)."""
+        bf = self._filter_get(key, bloom_type)
+        assert bf is not None, 'ERR not found'
+        return ['Capacity', bf.capacity, 'Size', bf.size, 'Number of filters', len(bf.layers),
+                'Number of items inserted', bf.count, 'Expansion rate', bf.expansion or None]
+
+    def CF_RESERVE(self, key, capacity, *args):
+        """Compatible with RedisBloom."""
+        options = {'BUCKETSIZE': bloom.CUCKOO_BUCKET_SIZE, 'MAXITERATIONS': bloom.CUCKOO_MAX_ITERATIONS,
+                   'EXPANSION': bloom.CUCKOO_EXPANSION}
+        try:
+            capacity = int(capacity)
+        except ValueError:
+            raise AssertionError('ERR Bad capacity')
+        assert capacity > 0, 'ERR Capacity must be positive'
+        args = list(args)
+        while args:
+            option = args.pop(0).upper()
+            assert option in options and args, 'ERR syntax error'
+            try:
+                options[option] = int(args.pop(0))
+            except ValueError:
+                raise AssertionError('ERR Bad %s' % option.lower())
+        assert 1 <= options['BUCKETSIZE'] <= 255, 'ERR Bad bucket size'
+        assert options['MAXITERATIONS'] > 0, 'ERR Bad max iterations'
+        assert options['EXPANSION'] >= 0, 'ERR Bad expansion'
+        assert key not in self.client.ht, 'ERR item exists'
+        self.client.ht[key] = cuckoo_type(capacity, options['BUCKETSIZE'], options['MAXITERATIONS'],
+                                          options['EXPANSION'])
+        return OK
+
+    def _cf_add(self, cf, items, nx):
+        result = []
+        for hashed in bloom.hash_all(items):
+            if nx and cf.contains(hashed):
+                result.append(0)
+                continue
+            try:
+                result.append(int(cf.add(hashed)))
+            except ValueError as exc:
+                result.append(Error('ERR %s' % exc))
+        return result
+
+    def CF_ADD(self, key, item):
+        """Compatible with RedisBloom."""
+        result = self._cf_add(self._filter_get(key, cuckoo_type, create=True), [item], False)[0]
+        assert not isinstance(result, Error), result.message
+        return result
+
+    def CF_ADDNX(self, key, item):
+        """Compatible with RedisBloom."""
+        result = self._cf_add(self._filter_get(key, cuckoo_type, create=True), [item], True)[0]
+        assert not isinstance(result, Error), result.message
+        return result
+
+    def _cf_insert(self, key, args, nx):
+        capacity = bloom.CUCKOO_CAPACITY
+        create = True
+        args = list(args)
+        while args:
+            option = args.pop(0).upper()
+            if option == 'ITEMS':
+                break
+            elif option == 'NOCREATE':
+                create = False
+            elif option == 'CAPACITY' and args:
+                try:
+                    capacity = int(args.pop(0))
+                except ValueError:
+                    raise AssertionError('ERR Bad capacity')
+                assert capacity > 0, 'ERR Capacity must be positive'
+            else:
+                raise AssertionError('ERR syntax error')
+        else:
+            raise AssertionError('ERR syntax error')
+        assert args, 'ERR syntax error'
+        cf = self._filter_get(key, cuckoo_type)
+        if cf is None:
+            assert create, 'ERR not found'
+            cf = self.client.ht[key] = cuckoo_type(capacity)
+        return self._cf_add(cf, args, nx)
+
+    def CF_INSERT(self, key, *args):
+        """Compatible with RedisBloom."""
+        return self._cf_insert(key, args, False)
+
+    def CF_INSERTNX(self, key, *args):
+        """Compatible with RedisBloom."""
+        return self._cf_insert(key, args, True)
+
+    def CF_EXISTS(self, key, item):
+        """Compatible with RedisBloom."""
+        return self.CF_MEXISTS(key, item)[0]
+
+    def CF_MEXISTS(self, key, *items):
+        """Compatible with RedisBloom."""
+        assert items, "ERR wrong number of arguments for 'cf.mexists' command"
+        cf = self._filter_get(key, cuckoo_type)
+        if cf is None:
+            return [0] * len(items)
+        return [int(cf.contains(hashed)) for hashed in bloom.hash_all(items)]
+
+    def CF_COUNT(self, key, item):
+        """Compatible with RedisBloom."""
+        cf = self._filter_get(key, cuckoo_type)
+        return 0 if cf is None else cf.occurrences(bloom.hash_one(item))
+
+    def CF_DEL(self, key, item):
+        """Compatible with RedisBloom."""
+        cf = self._filter_get(key, cuckoo_type)
+        assert cf is not None, 'ERR Not found'
+        return int(cf.delete(bloom.hash_one(item)))
+
+    def CF_INFO(self, key):
+        """Compatible with RedisBloom."""
+        cf = self._filter_get(key, cuckoo_type)
+        assert cf is not None, 'ERR not found'
+        return ['Size', cf.size, 'Number of buckets', cf.buckets, 'Number of filters', len(cf.layers),
+                'Number of items inserted', cf.count, 'Number of items deleted', cf.deleted,
+                'Bucket size', cf.bucket_size, 'Expansion rate', cf.expansion,
+                'Max iterations', cf.max_iterations]
+
+    # Rate limiting
+
+    def THROTTLE(self, key, max_burst, count, period, quantity='1'):
+        """Compatible with redis-cell's CL.THROTTLE (see karton.throttle)."""
+        try:
+            max_burst, count, period, quantity = map(int, (max_burst, count, period, quantity))
+        except ValueError:
+            raise AssertionError('ERR value is not an integer or out of range')
+        assert max_burst >= 0, 'ERR invalid max_burst'
+        assert count > 0 and period > 0, 'ERR invalid rate'
+        assert quantity >= 0, 'ERR invalid quantity'
+        ht = self.client.ht
+        value = ht.get(key)
+        assert value is None or isinstance(value, str), 'WRONGTYPE Operation against a key holding the wrong kind of value'
+        try:
+            tat = None if value is None else int(value)
+        except ValueError:
+            raise AssertionError('ERR key does not hold a throttle')
+        limited, remaining, retry, reset, tat = gcra(
+            tat, int(self.client.last * 1e6), max_burst, count, period, quantity)
+        if tat is not None:
+            value = ht[key] = str(tat)
+            self.throttles.stored(self.client.db, key, value, tat)
+            self._notify(notify.STRING, 'set', key)
+        seconds = lambda microseconds: int(math.ceil(microseconds / 1e6)) if microseconds >= 0 else -1
+        return [int(limited), max_burst + 1, remaining, seconds(retry), seconds(reset)]
+
+    CL_THROTTLE = THROTTLE
+
+    # Time series
+
+    def _ts_get(self, key, exists=True):
+        value = self.client.ht.get(key)
+        assert value is None or isinstance(value, ts_type), 'WRONGTYPE Operation against a key holding the wrong kind of value'
+        assert value is not None or not exists, 'ERR TSDB: the key does not exist'
+        return value
+
+    def _ts_timestamp(self, timestamp, default=None):
+        if timestamp == '*':
+            return int(self.client.last * 1000)
+        if default is not None and timestamp in ('-', '+'):
+            return default
+        try:
+            timestamp = int(timestamp)
+        except ValueError:
+            timestamp = -1
+        assert timestamp >= 0, 'ERR TSDB: invalid timestamp'
+        return timestamp
+
+    def _ts_options(self, args):
+        """RETENTION and LABELS of TS.CREATE and TS.ADD."""
+        retention = 0
+        labels = {}
+        args = list(args)
+        while args:
+            option = args.pop(0).upper()
+            if option == 'RETENTION' and args:
+                try:
+                    retention = int(args.pop(0))
+                except ValueError:
+                    retention = -1
+                assert retention >= 0, 'ERR TSDB: invalid retention'
+            elif option == 'LABELS':
+                assert args and len(args) % 2 == 0, 'ERR TSDB: invalid labels'
+                labels = dict(zip(args[0::2], args[1::2]))
+                args = []
+            else:
+                raise AssertionError('ERR TSDB: unknown option %s' % option)
+        return ts_type(retention, labels)
+
+    def _ts_add(self, series, timestamp, value):
+        timestamp = self._ts_timestamp(timestamp)
+        try:
+            value = float(value)
+        except ValueError:
+            raise AssertionError('ERR TSDB: invalid value')
+        try:
+            series.add(timestamp, value)
+        except ValueError as exc:
+            raise AssertionError('ERR %s' % exc)
+        return timestamp
+
+    def TS_CREATE(self, key, *args):
+        """Mostly compatible with RedisTimeSeries (no CHUNK_SIZE,
+        ENCODING or DUPLICATE_POLICY)."""
+        series = self._ts_options(args)
+        assert key not in self.client.ht, 'ERR TSDB: key already exists'
+        self.client.ht[key] = series
+        return OK
+
+    def TS_ADD(self, key, timestamp, value, *args):
+        """Mostly compatible with RedisTimeSeries (samples can only be
+        appended); options only apply to a series being created."""
+        series = self._ts_get(key, exists=False)
+        if series is None:
+            series = self._ts_options(args)
+            result = self._ts_add(series, timestamp, value)
+            self.client.ht[key] = series
+            return result
+        return self._ts_add(series, timestamp, value)
+
+    def TS_MADD(self, *args):
+        """Mostly compatible with RedisTimeSeries (samples can only be
+        appended)."""
+        assert args and len(args) % 3 == 0, "ERR wrong number of arguments for 'ts.madd' command"
+        result = []
+        for index in xrange(0, len(args), 3):
+            key, timestamp, value = args[index:index+3]
+            try:
+                result.append(self._ts_add(self._ts_get(key), timestamp, value))
+            except AssertionError as exc:
+                result.append(Error(str(exc)))
+        return result
+
+    def TS_GET(self, key):
+        """Compatible with RedisTimeSeries."""
+        sample = self._ts_get(key).last()
+        return [] if sample is None else [sample[0], tsdb.format_value(sample[1])]
+
+    def _ts_range(self, args, reverse):
+        """Parse from, to and the options of a range query; return a function
+        of a series returning the reply."""
+        args = list(args)
+        assert len(args) >= 2, 'ERR wrong number of arguments'
+        start = self._ts_timestamp(args.pop(0), 0)
+        end = self._ts_timestamp(args.pop(0), sys.maxint)
+        count = None
+        aggregation = None
+        while args and args[0].upper() in ('COUNT', 'AGGREGATION'):
+            option = args.pop(0).upper()
+            try:
+                if option == 'COUNT':
+                    count = int(args.pop(0))
+                    assert count >= 0, 'ERR TSDB: invalid COUNT value'
+                else:
+                    aggregation = args.pop(0).lower()
+                    bucket = int(args.pop(0))
+                    assert aggregation in tsdb.AGGREGATIONS, 'ERR TSDB: unknown aggregation type'
+                    assert bucket > 0, 'ERR TSDB: invalid time bucket'
+            except (IndexError, ValueError):
+                raise AssertionError('ERR TSDB: wrong %s arguments' % option)
+
+        def query(series):
+            timestamps, values = series.range(start, end)
+            if aggregation is None:
+                samples = zip(timestamps, values)
+            else:
+                samples = tsdb.aggregate(timestamps, values, aggregation, bucket)
+            if reverse:
+                samples.reverse()
+            if count is not None:
+                samples = samples[:count]
+            return [[timestamp, tsdb.format_value(value)] for timestamp, value in samples]
+
+        return query, args
+
+    def TS_RANGE(self, key, *args):
+        """Mostly compatible with RedisTimeSeries: COUNT and AGGREGATION
+        (avg, sum, min, max, count, first, last and range) only."""
+        query, rest = self._ts_range(args, False)
+        assert not rest, 'ERR TSDB: wrong arguments'
+        return query(self._ts_get(key))
+
+    def TS_REVRANGE(self, key, *args):
+        """Mostly compatible with RedisTimeSeries, like TS.RANGE."""
+        query, rest = self._ts_range(args, True)
+        assert not rest, 'ERR TSDB: wrong arguments'
+        return query(self._ts_get(key))
+
+    def _ts_filtered(self, filters):
+        """(key, series) of every series matching filters, by key. Series are
+        found by going through the whole database."""
+        try:
+            filters = map(tsdb.parse_filter, filters)
+        except ValueError:
+            raise AssertionError('ERR TSDB: failed parsing labels')
+        assert filters, 'ERR TSDB: missing FILTER'
+        ht = self.client.ht
+        result = []
+        for key, value in ht.iteritems():
+            if self.mapped is not None:
+                value = self.mapped.thaw(ht, key, value)
+            if isinstance(value, ts_type) and tsdb.matches(value.labels, filters):
+                result.append((key, value))
+        result.sort()
+        return result
+
+    def _ts_mrange(self, args, reverse):
+        query, args = self._ts_range(args, reverse)
+        withlabels = False
+        if args and args[0].upper() == 'WITHLABELS':
+            withlabels = True
+            args.pop(0)
+        assert args and args[0].upper() == 'FILTER', 'ERR TSDB: missing FILTER'
+        return [[key, sorted(map(list, series.labels.iteritems())) if withlabels else [], query(series)]
+                for key, series in self._ts_filtered(args[1:])]
+
+    def TS_MRANGE(self, *args):
+        """Mostly compatible with RedisTimeSeries: COUNT, AGGREGATION,
+        WITHLABELS and FILTER only."""
+        return self._ts_mrange(args, False)
+
+    def TS_MREVRANGE(self, *args):
+        """Mostly compatible with RedisTimeSeries, like TS.MRANGE."""
+        return self._ts_mrange(args, True)
+
+    def TS_QUERYINDEX(self, *filters):
+        """Compatible with RedisTimeSeries."""
+        return [key for key, series in self._ts_filtered(filters)]
+
+    def TS_INFO(self, key):
+        """Mostly compatible with RedisTimeSeries (fewer fields)."""
+        series = self._ts_get(key)
+        first = series.first_timestamp
+        last = series.last_timestamp
+        return ['totalSamples', series.count, 'memoryUsage', memory.value_size(series),
+                'firstTimestamp', 0 if first is None else first,
+                'lastTimestamp', 0 if last is None else last,
+                'retentionTime', series.retention, 'chunkCount', len(series.chunks) + 1,
+                'labels', sorted(map(list, series.labels.iteritems()))]
+
+    # Streams
+
+    def _stream_get(self, key):
+        value = self.client.ht.get(key)
+        assert value is None or isinstance(value, stream_type), 'WRONGTYPE Operation against a key holding the wrong kind of value'
+        return value
+
+    def _group_get(self, key, group, command='XREADGROUP'):
+        stream = self._stream_get(key)
+        assert stream is not None and group in stream.groups, \
+            "NOGROUP No such key '%s' or consumer group '%s' in %s with GROUP option" % (key, group, command)
+        return stream, stream.groups[group]
+
+    def _stream_trim_args(self, args):
+        """Parse [=|~] threshold following MAXLEN; return (maxlen, approximate)."""
+        approximate = False
+        if args and args[0] in ('=', '~'):
+            approximate = args.pop(0) == '~'
+        assert args, 'ERR syntax error'
+        maxlen = int(args.pop(0))
+        assert maxlen >= 0, 'ERR The MAXLEN argument must be >= 0.'
+        return maxlen, approximate
+
+    def XADD(self, key, *args):
+        """Mostly compatible (no MINID trimming)."""
+        args = list(args)
+        nomkstream = False
+        maxlen = None
+        while args and args[0].upper() in ('NOMKSTREAM', 'MAXLEN'):
+            if args.pop(0).upper() == 'NOMKSTREAM':
+                nomkstream = True
+            else:
+                maxlen, approximate = self._stream_trim_args(args)
+        assert len(args) >= 3 and len(args) % 2 == 1, "ERR wrong number of arguments for 'xadd' command"
+        id, fields = args[0], args[1:]
+        stream = self._stream_get(key)
+        if stream is None:
+            if nomkstream:
+                return None
+            stream = stream_type()
+        if id == '*':
+            id = stream.next_id()
+        elif id.endswith('-*'):
+            id = stream.next_id(stream_id(id[:-2])[0])
+        else:
+            id = stream_id(id)
+        assert id > MIN_ID, 'ERR The ID specified in XADD must be greater than 0-0'
+        assert id > stream.last_id, 'ERR The ID specified in XADD is equal or smaller than the target stream top item'
+        stream.add(id, fields)
+        self.client.ht[key] = stream
+        self._notify(notify.STREAM, 'xadd', key)
+        if maxlen is not None and stream.trim(maxlen, approximate):
+            self._notify(notify.STREAM, 'xtrim', key)
+        self.blocking.signal(self.client.db, key)
+        return format_id(id)
+
+    def XDEL(self, key, *ids):
+        """Fully compatible."""
+        assert ids
+        ids = map(stream_id, ids)
+        stream = self._stream_get(key)
+        if stream is None:
+            return 0
+        deleted = sum(1 for id in ids if stream.delete(id))
+        if deleted:
+            self._notify(notify.STREAM, 'xdel', key)
+        return deleted
+
+    def XLEN(self, key):
+        """Fully compatible."""
+        stream = self._stream_get(key)
+        return len(stream) if stream is not None else 0
+
+    def _xrange(self, key, start, end, args, reverse):
+        count = 0
+        if args:
+            assert len(args) == 2 and args[0].upper() == 'COUNT', 'ERR syntax error'
+            count = int(args[1])
+            if count <= 0:
+                return []
+        start = stream_range_id(start)
+        end = stream_range_id(end, end=True)
+        stream = self._stream_get(key)
+        if stream is None:
+            return []
+        return stream_entries(stream.range(start, end, count, reverse))
+
+    def XRANGE(self, key, start, end, *args):
+        """Fully compatible."""
+        return self._xrange(key, start, end, args, reverse=False)
+
+    def XREVRANGE(self, key, end, start, *args):
+        """Fully compatible."""
+        return self._xrange(key, start, end, args, reverse=True)
+
+    def XTRIM(self, key, strategy, *args):
+        """Mostly compatible (no MINID trimming)."""
+        assert strategy.upper() == 'MAXLEN', 'ERR syntax error'
+        args = list(args)
+        maxlen, approximate = self._stream_trim_args(args)
+        assert not args, 'ERR syntax error'
+        stream = self._stream_get(key)
+        if stream is None:
+            return 0
+        removed = stream.trim(maxlen, approximate)
+        if removed:
+            self._notify(notify.STREAM, 'xtrim', key)
+        return removed
+
+    def _xread_args(self, args, options):
+        """Parse [option value...] STREAMS key... id...; return (options, keys, ids)."""
+        args = list(args)
+        parsed = {}
+        while args:
+            option = args.pop(0).upper()
+            if option == 'STREAMS':
+                break
+            elif option == 'NOACK' and 'NOACK' in options:
+                parsed[option] = True
+            elif option in options and args:
+                parsed[option] = args.pop(0)
+            else:
+                raise AssertionError('ERR syntax error')
+        else:
+            raise AssertionError('ERR syntax error')
+        assert args and len(args) % 2 == 0, "ERR Unbalanced XREAD list of streams: for each stream key an ID or '$' must be specified."
+        half = len(args) // 2
+        return parsed, args[:half], args[half:]
+
+    def _block(self, keys, block, retry):
+        """Serve retry() right away if possible, otherwise block on keys."""
+        reply = retry()
+        if reply is not None or block is None:
+            return reply
+        block = int(block)
+        assert block >= 0, 'ERR timeout is negative'
+        deadline = time.time() + block / 1000.0 if block else None
+        db = self.client.db
+        return self.blocking.block(self.client, [(db, key) for key in keys], deadline, retry)
+
+    def XREAD(self, *args):
+        """Fully compatible."""
+        options, keys, ids = self._xread_args(args, ('COUNT', 'BLOCK'))
+        count = int(options.get('COUNT', 0))
+        # resolve "$" right now, so that blocking waits for anything newer
+        starts = []
+        for key, id in zip(keys, ids):
+            stream = self._stream_get(key)
+            if id == '$':
+                id = stream.last_id if stream is not None else MIN_ID
+            else:
+                id = stream_id(id)
+            starts.append(id)
+        client = self.client
+
+        def read():
+            # the client's db, as it is when this runs: FLUSHDB ASYNC may
+            # have replaced it since
+            ht = client.ht
+            reply = []
+            for key, start in zip(keys, starts):
+                stream = ht.get(key)
+                if isinstance(stream, stream_type):
+                    entries = list(stream.range(stream_range_id('(' + format_id(start)), MAX_ID, count))
+                    if entries:
+                        reply.append([key, stream_entries(entries)])
+            return reply or None
+
+        return self._block(keys, options.get('BLOCK'), read)
+
+    def XREADGROUP(self, group_keyword, group, consumer, *args):
+        """Mostly compatible (no XCLAIM/XAUTOCLAIM to go with it yet)."""
+        assert group_keyword.upper() == 'GROUP', 'ERR syntax error'
+        options, keys, ids = self._xread_args(args, ('COUNT', 'BLOCK', 'NOACK'))
+        count = int(options.get('COUNT', 0))
+        noack = options.get('NOACK', False)
+        for key in keys:
+            self._group_get(key, group)
+        history = [id != '>' for id in ids]
+        starts = [stream_id(id) if old else None for id, old in zip(ids, history)]
+        client = self.client
+
+        def read():
+            reply = []
+            for key, start, old in zip(keys, starts, history):
+                # looked up again every time, as for XREAD: the key may have
+                # been deleted or replaced while blocked
+                stream = client.ht.get(key)
+                if not isinstance(stream, stream_type) or group not in stream.groups:
+                    return Error("NOGROUP No such key '%s' or consumer group '%s' in XREADGROUP with GROUP option" % (key, group))
+                cgroup = stream.groups[group]
+                reader = cgroup.consumer(consumer)
+                entries = []
+                if old:
+                    # re-deliver this consumer's own pending entries
+                    for id in sorted(reader.pending):
+                        if id > start:
+                            cgroup.deliver(reader, id)
+                            entries.append((id, stream.get(id)))
+                            if len(entries) == count:
+                                break
+                    reply.append([key, stream_entries(entries)])
+                    continue
+                first = stream_range_id('(' + format_id(cgroup.last_id))
+                for id, fields in stream.range(first, MAX_ID, count):
+                    if not noack:
+                        cgroup.deliver(reader, id)
+                    cgroup.last_id = id
+                    entries.append((id, fields))
+                if entries:
+                    reply.append([key, stream_entries(entries)])
+            return reply or None
+
+        if any(history):
+            return read()
+        return self._block(keys, options.get('BLOCK'), read)
+
+    def XACK(self, key, group, *ids):
+        """Fully compatible."""
+        assert ids
+        ids = map(stream_id, ids)
+        stream = self._stream_get(key)
+        if stream is None or group not in stream.groups:
+            return 0
+        cgroup = stream.groups[group]
+        return sum(1 for id in ids if cgroup.ack(id))
+
+    def XGROUP(self, subcommand, key, group, *args):
+        """Mostly compatible: CREATE, SETID, DESTROY, CREATECONSUMER, DELCONSUMER."""
+        subcommand = subcommand.upper()
+        if subcommand == 'CREATE':
+            assert args, 'ERR syntax error'
+            stream = self._stream_get(key)
+            if stream is None:
+                assert args[1:] and args[1].upper() == 'MKSTREAM', \
+                    'ERR The XGROUP subcommand requires the key to exist. Note that for CREATE you may want to use the MKSTREAM option to create an empty stream automatically.'
+                stream = self.client.ht[key] = stream_type()
+            assert group not in stream.groups, 'BUSYGROUP Consumer Group name already exists'
+            last_id = stream.last_id if args[0] == '$' else stream_id(args[0])
+            stream.groups[group] = consumergroup(last_id)
+            self._notify(notify.STREAM, 'xgroup-create', key)
+            return OK
+        elif subcommand == 'SETID':
+            assert len(args) == 1, 'ERR syntax error'
+            stream, cgroup = self._group_get(key, group, 'XGROUP')
+            cgroup.last_id = stream.last_id if args[0] == '$' else stream_id(args[0])
+            self._notify(notify.STREAM, 'xgroup-setid', key)
+            return OK
+        elif subcommand == 'DESTROY':
+            stream = self._stream_get(key)
+            if stream is None or group not in stream.groups:
+                return 0
+            del stream.groups[group]
+            self._notify(notify.STREAM, 'xgroup-destroy', key)
+            # its blocked consumers get a NOGROUP error
+            self.blocking.signal(self.client.db, key)
+            return 1
+        elif subcommand == 'CREATECONSUMER':
+            assert len(args) == 1, 'ERR syntax error'
+            stream, cgroup = self._group_get(key, group, 'XGROUP')
+            if args[0] in cgroup.consumers:
+                return 0
+            cgroup.consumer(args[0])
+            self._notify(notify.STREAM, 'xgroup-createconsumer', key)
+            return 1
+        elif subcommand == 'DELCONSUMER':
+            assert len(args) == 1, 'ERR syntax error'
+            stream, cgroup = self._group_get(key, group, 'XGROUP')
+            reader = cgroup.consumers.pop(args[0], None)
+            if reader is None:
+                return 0
+            for id in reader.pending:
+                del cgroup.pel[id]
+            self._notify(notify.STREAM, 'xgroup-delconsumer', key)
+            return len(reader.pending)
+        else:
+            raise AssertionError('ERR Unknown XGROUP subcommand or wrong number of arguments')
+
+    def XPENDING(self, key, group, *args):
+        """Fully compatible."""
+        stream, cgroup = self._group_get(key, group, 'XPENDING')
+        if not args:
+            if not cgroup.pel:
+                return [0, None, None, None]
+            ids = sorted(cgroup.pel)
+            consumers = sorted((name, len(reader.pending))
+                               for name, reader in cgroup.consumers.iteritems() if reader.pending)
+            return [len(ids), format_id(ids[0]), format_id(ids[-1]),
+                    [[name, str(pending)] for name, pending in consumers]]
+        args = list(args)
+        idle = 0
+        if args[0].upper() == 'IDLE':
+            assert len(args) >= 2, 'ERR syntax error'
+            args.pop(0)
+            idle = int(args.pop(0))
+        assert len(args) in (3, 4), 'ERR syntax error'
+        start = stream_range_id(args[0])
+        end = stream_range_id(args[1], end=True)
+        count = int(args[2])
+        if len(args) == 4:
+            ids = cgroup.consumers[args[3]].pending if args[3] in cgroup.consumers else ()
+        else:
+            ids = cgroup.pel
+        now = int(time.time() * 1000)
+        reply = []
+        for id in sorted(id for id in ids if start <= id <= end):
+            if len(reply) >= count:
+                break
+            entry = cgroup.pel[id]
+            if now - entry.delivered >= idle:
+                reply.append([format_id(id), entry.consumer, now - entry.delivered, entry.count])
+        return reply
+
+    # Pub/Sub
+
+    def _subscribe(self, kind, method, names):
+        """Reply to (P)SUBSCRIBE and (P)UNSUBSCRIBE: one message per name,
+        all but the last one pushed right away."""
+        replies = []
+        for name in names:
+            method(self.client, name)
+            replies.append([kind, name, len(self.client.channels) + len(self.client.patterns)])
+        if not replies:
+            replies.append([kind, None, len(self.client.channels) + len(self.client.patterns)])
+        if len(replies) > 1:
+            self.client.push(*replies[:-1])
+        return replies[-1]
+
+    def SUBSCRIBE(self, *channels):
+        """Fully compatible."""
+        assert channels, "ERR wrong number of arguments for 'subscribe' command"
+        return self._subscribe('subscribe', self.pubsub.subscribe, channels)
+
+    def UNSUBSCRIBE(self, *channels):
+        """Fully compatible."""
+        return self._subscribe('unsubscribe', self.pubsub.unsubscribe,
+                               channels or sorted(self.client.channels))
+
+    def PSUBSCRIBE(self, *patterns):
+        """Fully compatible."""
+        assert patterns, "ERR wrong number of arguments for 'psubscribe' command"
+        return self._subscribe('psubscribe', self.pubsub.psubscribe, patterns)
+
+    def PUNSUBSCRIBE(self, *patterns):
+        """Fully compatible."""
+        return self._subscribe('punsubscribe', self.pubsub.punsubscribe,
+                               patterns or sorted(self.client.patterns))
+
+    def PUBLISH(self, channel, message):
+        """Fully compatible."""
+        return self.pubsub.publish([(channel, message)])
 
     # Connection
 
     def AUTH(self, password):
         return NotImplementedError
 
+    def CLIENT(self, subcommand, *args):
+        """Partially implemented: ID, LIST, KILL, SETNAME, GETNAME, TRACKING,
+        CACHING, GETREDIR."""
+        subcommand = subcommand.upper()
+        if subcommand == 'ID':
+            return self.client.id
+        elif subcommand == 'LIST':
+            clients = sorted(self.clients.values(), key=lambda client: client.id)
+            if args:
+                assert args[0].upper() == 'ID' and len(args) > 1, 'ERR syntax error'
+                ids = set(int(id) for id in args[1:])
+                clients = [client for client in clients if client.id in ids]
+            now = time.time()
+            return ''.join(client.info(now) + '\n' for client in clients)
+        elif subcommand == 'KILL':
+            return self._client_kill(*args)
+        elif subcommand == 'SETNAME':
+            assert len(args) == 1, 'ERR syntax error'
+            self._client_setname(args[0])
+            return OK
+        elif subcommand == 'GETNAME':
+            return self.client.name or None
+        elif subcommand == 'TRACKING':
+            return self._client_tracking(*args)
+        elif subcommand == 'CACHING':
+            assert len(args) == 1 and args[0].lower() in ('yes', 'no'), 'ERR syntax error'
+            state = self.client.tracking
+            assert state is not None and (state.optin or state.optout), \
+                'ERR CLIENT CACHING can be called only when the client is in tracking mode with OPTIN or OPTOUT mode enabled'
+            caching = args[0].lower() == 'yes'
+            assert caching == state.optin, \
+                'ERR CLIENT CACHING %s is only valid when tracking is enabled in %s mode.' % \
+                (args[0].upper(), 'OPTIN' if caching else 'OPTOUT')
+            self.client.caching = caching
+            return OK
+        elif subcommand == 'GETREDIR':
+            state = self.client.tracking
+            if state is None:
+                return -1
+            return state.redirect
+        else:
+            raise AssertionError('ERR Unknown subcommand or wrong number of arguments for %r' % subcommand)
+
+    def _client_setname(self, name):
+        assert not any(char <= ' ' or char > '~' for char in name), \
+            'ERR Client names cannot contain spaces, newlines or special characters.'
+        self.client.name = name
+
+    def _client_kill(self, *args):
+        assert args, 'ERR syntax error'
+        if len(args) == 1:
+            # old style: CLIENT KILL addr:port
+            for client in self.clients.values():
+                if format_addr(client.addr) == args[0]:
+                    client.kill()
+                    return OK
+            raise AssertionError('ERR No such client')
+        assert len(args) % 2 == 0, 'ERR syntax error'
+        filters = []
+        skipme = True
+        for index in xrange(0, len(args), 2):
+            option, value = args[index].upper(), args[index+1]
+            if option == 'ID':
+                filters.append(lambda client, id=int(value): client.id == id)
+            elif option == 'ADDR':
+                filters.append(lambda client, addr=value: format_addr(client.addr) == addr)
+            elif option == 'TYPE':
+                assert value.lower() in self.output_limits, 'ERR Unknown client type %r' % value
+                filters.append(lambda client, kind=value.lower(): client.kind == kind)
+            elif option == 'SKIPME':
+                assert value.lower() in ('yes', 'no'), 'ERR syntax error'
+                skipme = value.lower() == 'yes'
+            else:
+                raise AssertionError('ERR syntax error')
+        killed = 0
+        for client in self.clients.values():
+            if skipme and client is self.client:
+                continue
+            if all(match(client) for match in filters):
+                client.kill()
+                killed += 1
+        return killed
+
+    def _client_tracking(self, mode=None, *args):
+        assert mode is not None and mode.upper() in ('ON', 'OFF'), 'ERR syntax error'
+        if mode.upper() == 'OFF':
+            self.tracking.disable(self.client)
+            return OK
+        options = {}
+        prefixes = []
+        args = list(args)
+        while args:
+            option = args.pop(0).upper()
+            if option == 'REDIRECT' and args:
+                redirect = int(args.pop(0))
+                assert redirect in self.clients, 'ERR The client ID you want redirect to does not exist'
+                options['redirect'] = redirect
+            elif option == 'PREFIX' and args:
+                prefixes.append(args.pop(0))
+            elif option in ('BCAST', 'OPTIN', 'OPTOUT', 'NOLOOP'):
+                options[option.lower()] = True
+            else:
+                raise AssertionError('ERR syntax error')
+        assert not prefixes or options.get('bcast'), 'ERR PREFIX option requires BCAST mode to be enabled'
+        assert not (options.get('optin') and options.get('optout')), \
+            "ERR You can't use both OPTIN and OPTOUT"
+        assert not (options.get('bcast') and (options.get('optin') or options.get('optout'))), \
+            'ERR OPTIN and OPTOUT are not compatible with BCAST'
+        self.tracking.enable(self.client, TrackingState(prefixes=prefixes, **options))
+        return OK
+
+    def HELLO(self, protover=None, *args):
+        """Mostly compatible (no AUTH). RESP3 clients get invalidations (CLIENT
+        TRACKING) as Push messages, and this reply as a map; other replies
+        are the same in both versions."""
+        if protover is not None:
+            try:
+                protover = int(protover)
+            except ValueError:
+                raise AssertionError('ERR Protocol version is not an integer or out of range')
+            assert protover in (2, 3), 'NOPROTO unsupported protocol version'
+        args = list(args)
+        name = None
+        while args:
+            option = args.pop(0).upper()
+            if option == 'SETNAME' and args:
+                name = args.pop(0)
+            elif option == 'AUTH' and len(args) >= 2:
+                raise AssertionError('ERR AUTH is not supported')
+            else:
+                raise AssertionError('ERR Syntax error in HELLO option %r' % option)
+        if name is not None:
+            self._client_setname(name)
+        if protover is not None:
+            self.client.resp = protover
+        reply = [
+            'server', 'karton',
+            # the Redis version whose commands these follow, for clients
+            # that go by it
+            'version', '6.0.0',
+            'proto', self.client.resp,
+            'id', self.client.id,
+            'mode', 'standalone',
+            'role', 'master',
+            'modules', [],
+        ]
+        return Map(reply) if self.client.resp == 3 else reply
+
     def ECHO(self, message):
         """Fully compatible."""
         return message
@@ -862,14 +2766,75 @@ class Server(object):
 
     def SELECT(self, db):
         """Fully compatible."""
-        self.client.ht = self.dbs[int(db)]
+        db = int(db)
+        assert 0 <= db < len(self.dbs), 'ERR invalid DB index'
+        self.client.db = db
         return OK
 
     # Server
 
     def CONFIG(self, command, option, value=None):
-        """FIXME: kludge for Redis unit tests."""
-        if command.upper() == 'SET' and value is not None:
+        """Only notify-keyspace-events, timeout, client-output-buffer-limit and
+        hotkeys-*;
+        FIXME: kludge for Redis unit tests."""
+        command = command.upper()
+        if option.lower() == 'timeout':
+            if command == 'GET':
+                return ['timeout', str(self.timeout)]
+            elif command == 'SET' and value is not None:
+                timeout = int(value)
+                assert timeout >= 0, "ERR Invalid argument '%s' for CONFIG SET 'timeout'" % value
+                self.timeout = timeout
+                return OK
+        if option.lower() == 'client-output-buffer-limit':
+            if command == 'GET':
+                return ['client-output-buffer-limit', ' '.join(
+                    '%s %d %d %d' % ((kind,) + self.output_limits[kind]) for kind in sorted(self.output_limits))]
+            elif command == 'SET' and value is not None:
+                words = value.split()
+                assert words and len(words) % 4 == 0, \
+                    "ERR Invalid argument '%s' for CONFIG SET 'client-output-buffer-limit'" % value
+                limits = {}
+                for index in xrange(0, len(words), 4):
+                    kind = words[index].lower()
+                    assert kind in self.output_limits, \
+                        "ERR Invalid argument '%s' for CONFIG SET 'client-output-buffer-limit'" % value
+                    try:
+                        limits[kind] = (memory_size(words[index+1]), memory_size(words[index+2]), int(words[index+3]))
+                    except ValueError:
+                        raise AssertionError("ERR Invalid argument '%s' for CONFIG SET 'client-output-buffer-limit'" % value)
+                self.output_limits.update(limits)
+                return OK
+        if option.lower() in ('hotkeys-sample-rate', 'hotkeys-decay-time'):
+            attribute = 'rate' if option.lower() == 'hotkeys-sample-rate' else 'decay_time'
+            if command == 'GET':
+                return [option.lower(), str(getattr(self.hotkeys, attribute))]
+            elif command == 'SET' and value is not None:
+                try:
+                    number = int(value)
+                except ValueError:
+                    number = -1
+                assert number >= 0, "ERR Invalid argument '%s' for CONFIG SET '%s'" % (value, option.lower())
+                if attribute == 'rate':
+                    self.hotkeys.set_rate(number)
+                else:
+                    self.hotkeys.decay_time = number
+                return OK
+        if option.lower() == 'notify-keyspace-events':
+            if command == 'GET':
+                return [option.lower(), self.notify_config]
+            elif command == 'SET' and value is not None:
+                try:
+                    flags = notify.parse_flags(value)
+                except ValueError as exc:
+                    raise AssertionError('ERR %s' % exc)
+                self.notify_config = notify.format_flags(flags)
+                # events need somewhere to go
+                if not flags & (notify.KEYSPACE | notify.KEYEVENT):
+                    flags = 0
+                self.notify_flags = flags
+                return OK
+        if command == 'SET' and value is not None:
             return OK
         raise NotImplementedError
 
@@ -885,24 +2850,116 @@ class Server(object):
             assert not args
             os.kill(os.getpid(), signal.SIGSEGV)
             return OK
+        elif subcommand == 'PROFILE':
+            return self._debug_profile(*args)
         elif subcommand == 'HT':
-            return str(self.client.ht)
+            # one line per key, so that it can be streamed
+            ht = self.client.ht
+            keys = ht.keys()
+            lines = ('%r: %r' % (key, ht.get(key)) for key in keys)
+            return self._stream(ht, len(keys), lines)
         else:
             #raise ValueError
             # oh kludge I love you
             return OK
 
-    def FLUSHALL(self):
+    def _debug_profile(self, action=None, *args):
+        """DEBUG PROFILE START [SAMPLING [milliseconds]] | STOP | DUMP [path]"""
+        action = (action or '').upper()
+        profiler = self.profiled
+        if action == 'START':
+            assert self.profiler is None, 'ERR profiler already running'
+            assert not args or args[0].upper() == 'SAMPLING', 'ERR syntax error'
+            if not args:
+                profiler = profiling.Profiler()
+            else:
+                assert len(args) <= 2, 'ERR syntax error'
+                try:
+                    interval = float(args[1]) / 1000 if len(args) == 2 else None
+                except ValueError:
+                    raise AssertionError('ERR value is not a valid float')
+                assert interval is None or interval > 0, 'ERR value is out of range'
+                profiler = profiling.Profiler(sampling=True, interval=interval or profiling.INTERVAL)
+            profiler.start(until=Server.do.__func__.__code__)
+            self.profiler = self.profiled = profiler
+            return OK
+        elif action == 'STOP':
+            assert not args, 'ERR syntax error'
+            assert self.profiler is not None, 'ERR profiler not running'
+            profiler.stop()
+            # commands go straight to their handlers again
+            self.profiler = None
+            return OK
+        elif action == 'DUMP':
+            assert len(args) <= 1, 'ERR syntax error'
+            assert profiler is not None, 'ERR nothing was profiled'
+            path = args[0] if args else 'karton-%d.prof' % os.getpid()
+            try:
+                profiler.dump(path)
+            except (IOError, OSError) as exc:
+                raise AssertionError('ERR %s' % exc)
+            return path
+        raise AssertionError('ERR DEBUG PROFILE START [SAMPLING [milliseconds]] | STOP | DUMP [path]')
+
+    def _flush_mode(self, mode):
+        """Return True for ASYNC, False for SYNC or no argument."""
+        if mode is None:
+            return False
+        mode = mode.upper()
+        assert mode in ('ASYNC', 'SYNC'), 'ERR syntax error'
+        return mode == 'ASYNC'
+
+    def FLUSHALL(self, mode=None):
         """Fully compatible."""
-        for db in self.dbs:
-            db.clear()
+        if self._flush_mode(mode):
+            for index, db in enumerate(self.dbs):
+                self.dbs[index] = {}
+                self.lazyfree.free(db, force=True)
+        else:
+            for db in self.dbs:
+                db.clear()
+        self.access.flush()
+        if self.reply_cache is not None:
+            self.reply_cache.flush()
+        self.tracking.flush()
         return OK
 
-    def FLUSHDB(self):
+    def FLUSHDB(self, mode=None):
         """Fully compatible."""
-        self.client.ht.clear()
+        if self._flush_mode(mode):
+            self.lazyfree.free(self.client.ht, force=True)
+            self.dbs[self.client.db] = {}
+        else:
+            self.client.ht.clear()
+        self.access.flush(self.client.db)
+        if self.reply_cache is not None:
+            self.reply_cache.flush(self.client.db)
+        self.tracking.flush()
         return OK
 
+    def HOTKEYS(self, *args):
+        """Non-standard: HOTKEYS [READ|WRITE] [COUNT count], or HOTKEYS RESET.
+        Keys and their estimated number of commands, hottest first."""
+        if len(args) == 1 and args[0].upper() == 'RESET':
+            self.hotkeys.reset()
+            return OK
+        writes = False
+        count = 10
+        args = list(args)
+        if args and args[0].upper() in ('READ', 'WRITE'):
+            writes = args.pop(0).upper() == 'WRITE'
+        if args:
+            assert len(args) == 2 and args[0].upper() == 'COUNT', 'ERR syntax error'
+            try:
+                count = int(args[1])
+            except ValueError:
+                raise AssertionError('ERR value is not an integer or out of range')
+            assert count > 0, 'ERR value is not an integer or out of range'
+        result = []
+        for key, estimate in self.hotkeys.top(writes, count):
+            result.extend([key, estimate])
+        return result
+
     def INFO(self):
         """Non-standard (implementation-specific command)."""
         sysname, nodename, release, version, machine = os.uname()
@@ -910,12 +2967,92 @@ class Server(object):
             'server:karton',
             'os:%s %s %s' % (sysname, release, machine),
             'python:%s.%s.%s' % sys.version_info[0:3],
+            'used_memory_rss:%d' % memory.rss(),
+            'used_memory_peak:%d' % memory.peak_rss(),
+            'lazyfree_pending_objects:%d' % self.lazyfree.pending,
+            'lazyfreed_objects:%d' % self.lazyfree.freed,
+            'throttle_keys:%d' % len(self.throttles),
+            'throttle_expired_keys:%d' % self.throttles.expired,
+            'connected_clients:%d' % len(self.clients),
+            'blocked_clients:%d' % self.blocking.count,
+            'tracking_clients:%d' % self.tracking.clients,
+            'tracking_total_keys:%d' % len(self.tracking.table),
+            'tracking_evicted_keys:%d' % self.tracking.evicted,
         ]
+        if self.reply_cache is not None:
+            cache = self.reply_cache
+            lines.extend([
+                'reply_cache_keys:%d' % len(cache.entries),
+                'reply_cache_bytes:%d' % cache.bytes,
+                'reply_cache_hits:%d' % cache.hits,
+                'reply_cache_misses:%d' % cache.misses,
+                'reply_cache_evicted_keys:%d' % cache.evicted,
+            ])
+        hotkeys = self.hotkeys
+        lines.append('hotkeys_sample_rate:%d' % hotkeys.rate)
+        lines.append('hotkeys_sampled_commands:%d' % hotkeys.sampled)
+        for name, writes in (('read', False), ('write', True)):
+            lines.append('hotkeys_%s:%s' % (name, ','.join(
+                '%s=%d' % (key, estimate) for key, estimate in hotkeys.top(writes, 3))))
         for dbid, db in enumerate(self.dbs):
             if len(db) > 0:
                 lines.append('db%d:keys=%d' % (dbid, len(db)))
         return ''.join([line+'\r\n' for line in lines])
 
+    def MEMORY(self, subcommand, *args):
+        """Mostly compatible: USAGE and STATS; sizes are as CPython sees them."""
+        subcommand = subcommand.upper()
+        if subcommand == 'USAGE':
+            assert len(args) == 1 or (len(args) == 3 and args[1].upper() == 'SAMPLES'), 'ERR syntax error'
+            samples = memory.SAMPLES
+            if len(args) == 3:
+                try:
+                    samples = int(args[2])
+                except ValueError:
+                    raise AssertionError('ERR value is not an integer or out of range')
+                assert samples >= 0, 'ERR syntax error'
+            value = self.client.ht.get(args[0])
+            if value is None:
+                return None
+            return memory.usage(args[0], value, samples)
+        elif subcommand == 'STATS':
+            assert not args, 'ERR syntax error'
+            rss = memory.rss()
+            keys = sum(map(len, self.dbs))
+            stats = [
+                'peak.allocated', memory.peak_rss(),
+                'total.allocated', rss,
+                'startup.allocated', self.startup_rss,
+                'clients.normal', sum(client.obuf for client in self.clients.itervalues()),
+                'lazyfree.pending', self.lazyfree.pending,
+                'tracking.keys', len(self.tracking.table),
+            ]
+            for index, db in enumerate(self.dbs):
+                if db:
+                    stats.extend(['db.%d' % index, [
+                        'overhead.hashtable.main', sys.getsizeof(db),
+                        'overhead.hashtable.access', sys.getsizeof(self.access.dbs[index]),
+                    ]])
+            stats.extend([
+                'keys.count', keys,
+                'keys.bytes-per-key', max(rss - self.startup_rss, 0) // keys if keys else 0,
+            ])
+            return stats
+        else:
+            raise AssertionError("ERR unknown subcommand '%s'. Try MEMORY HELP." % subcommand)
+
+    def MONITOR(self):
+        """Fully compatible, but the client can go on sending commands."""
+        self.monitors.add(self.client)
+        return OK
+
+    def SAVE(self):
+        """Mostly compatible: writes a mapped snapshot (see karton.mapped)
+        rather than an RDB file, and only if there's a file to write to."""
+        assert self.dbfilename is not None, 'ERR no snapshot file configured'
+        mapped.save_path(self.dbs, self.dbfilename, self.mapped)
+        return OK
+
     def TIME(self):
         """Fully compatible."""
         now = time.time()
@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+
+"""
+Set algebra behind SINTER/SUNION/SDIFF, SINTERCARD and the *STORE variants.
+
+Inputs are sets, intsets or None for missing keys, which are never
+allocated. They're ordered by cardinality: intersections iterate over the
+smallest input and short-circuit as soon as any input is empty, and
+intersections of intsets merge their sorted arrays.
+
+Passing a target (a plain set which is also one of the inputs) makes the
+operation update it in place instead of building a new set.
+"""
+
+from itertools import islice
+
+from .intset import intset
+
+
+def _intersect(sets):
+    """Yield members of the intersection of sets, smallest one first."""
+    smallest, rest = sets[0], sets[1:]
+    for member in smallest:
+        for other in rest:
+            if member not in other:
+                break
+        else:
+            yield member
+
+
+def intersection(sets, target=None):
+    if not all(sets):
+        if target is not None:
+            target.clear()
+            return target
+        return set()
+    sets = sorted(sets, key=len)
+    if target is not None:
+        target.intersection_update(*[value for value in sets if value is not target])
+        return target
+    if len(set(map(type, sets))) == 1:
+        # all intsets merge their arrays, all sets let C do the work.
+        return sets[0].intersection(*sets[1:])
+    return set(_intersect(sets))
+
+
+def intersection_card(sets, limit=0):
+    """Cardinality of the intersection, counting at most limit members."""
+    if not all(sets):
+        return 0
+    sets = sorted(sets, key=len)
+    if all(isinstance(value, intset) for value in sets):
+        return len(sets[0].intersection(*sets[1:], limit=limit))
+    if not limit:
+        return len(intersection(sets))
+    return sum(1 for member in islice(_intersect(sets), limit))
+
+
+def union(sets, target=None):
+    sets = [value for value in sets if value]
+    if target is not None:
+        target.update(*[value for value in sets if value is not target])
+        return target
+    if not sets:
+        return set()
+    sets.sort(key=len, reverse=True)
+    result = set(sets[0])
+    result.update(*sets[1:])
+    return result
+
+
+def difference(sets, target=None):
+    """First set minus all the others; target may only be the first set."""
+    first = sets[0]
+    others = [value for value in sets[1:] if value]
+    if not first or any(value is first for value in others):
+        if target is not None:
+            target.clear()
+            return target
+        return set()
+    if target is not None:
+        target.difference_update(*others)
+        return target
+    if not others:
+        return set(first)
+    if len(first) * len(others) <= sum(map(len, others)):
+        # first is small: probe each member, biggest sets first.
+        others.sort(key=len, reverse=True)
+        return set(member for member in first
+                   if not any(member in value for value in others))
+    result = set(first)
+    result.difference_update(*others)
+    return result
@@ -0,0 +1,333 @@
+# -*- coding: utf-8 -*-
+
+"""
+Expensive read-only commands, run against a forked copy of the databases.
+
+Commands that walk a whole database or a huge value (KEYS, SUNION,
+HGETALL...) block every client for as long as they take. With snapshots
+enabled, Server.do() offers such commands to Snapshots, which keeps a few
+forked children around. Each child sees the databases as they were when
+it was forked, runs the commands it's sent one at a time, and streams the
+encoded replies back through a pipe while the parent goes on serving
+everyone else. The client gets a Deferred, as for blocking commands.
+
+The price is staleness: a reply can be up to max_age seconds old. A client
+is never served from a snapshot older than its own last write, though.
+Children are replaced from cron() as they age, one fork per run at most,
+so the cost of forking is paid in the background and spread out.
+
+Children share the parent's memory until either side writes to it, and
+CPython writes to every object it merely looks at (reference counts): a
+busy child can end up costing as much memory as the data it has read.
+"""
+
+import os
+import sys
+import gc
+import time
+import errno
+import fcntl
+import select
+import signal
+import struct
+import resource
+import collections
+import traceback
+
+from twisted.internet import defer, main
+
+from . import protocol
+from .protocol import Encoded, Error
+
+
+# Read-only commands that are O(N) in a database or in a value.
+COMMANDS = frozenset([
+    'KEYS', 'SMEMBERS', 'SUNION', 'SINTER', 'SDIFF', 'HGETALL', 'HKEYS', 'HVALS', 'SORT',
+])
+
+# Bytes read from a pipe at a time.
+READ_CHUNK = 64 * 1024
+
+# Replies come back as frames: a 4-byte length and that many bytes of RESP,
+# FRAME_SIZE at most, so that neither side ever holds more than one. An
+# empty frame ends a reply.
+FRAME_SIZE = 64 * 1024
+_FRAME = struct.Struct('>I')
+_END = _FRAME.pack(0)
+
+
+def _size(value):
+    try:
+        return len(value)
+    except TypeError:
+        return 0
+
+
+def _write(fd, data):
+    while data:
+        data = data[os.write(fd, data):]
+
+
+def _close_fds(keep):
+    """Close every file descriptor but stdio and keep: the listening socket
+    and client connections, most importantly, which would otherwise stay
+    open for as long as the child lives."""
+    low = 3
+    for fd in sorted(keep):
+        os.closerange(low, fd)
+        low = fd + 1
+    os.closerange(low, resource.getrlimit(resource.RLIMIT_NOFILE)[0])
+
+
+def _serve(server, requests, replies):
+    """Child side: run the requests (a db number and a command) that come
+    in until the parent hangs up."""
+    # the collector would touch, and so copy, every object there is
+    gc.disable()
+    # whatever stdout, stderr and the reactor's signal handlers have been
+    # replaced with may write to a descriptor that's been closed
+    sys.stdout, sys.stderr = sys.__stdout__, sys.__stderr__
+    for signum in (signal.SIGINT, signal.SIGTERM, signal.SIGCHLD):
+        signal.signal(signum, signal.SIG_DFL)
+    signal.set_wakeup_fd(-1)
+    server.snapshots = None
+    # nobody's listening in the child
+    server.monitors.clear()
+    server.profiler = None
+    client = server.new_client(('snapshot', os.getpid()))
+    reader = protocol.reader()
+    while True:
+        data = os.read(requests, READ_CHUNK)
+        if not data:
+            return
+        reader.feed(data)
+        request = reader.gets()
+        while request is not False:
+            server.do(client, 'SELECT', request[0])
+            reply = server.do(client, *request[1:])
+            # replies other than Streams come out of chunks() whole
+            for chunk in protocol.chunks(reply):
+                for start in xrange(0, len(chunk), FRAME_SIZE):
+                    frame = chunk[start:start+FRAME_SIZE]
+                    _write(replies, _FRAME.pack(len(frame)) + frame)
+            _write(replies, _END)
+            request = reader.gets()
+
+
+class Worker(object):
+    """A forked child serving commands from its snapshot of the databases.
+
+    Also a reactor read descriptor (fileno/doRead/connectionLost) for the
+    pipe its replies come through."""
+
+    def __init__(self, server):
+        self.created = time.time()
+        requests, self.requests = os.pipe()
+        self.replies, replies = os.pipe()
+        self.pid = os.fork()
+        if self.pid == 0:
+            # never return to the caller, let alone to the reactor
+            status = 0
+            try:
+                _close_fds([requests, replies])
+                _serve(server, requests, replies)
+            except BaseException:
+                traceback.print_exc()
+                status = 1
+            finally:
+                os._exit(status)
+        os.close(requests)
+        os.close(replies)
+        flags = fcntl.fcntl(self.replies, fcntl.F_GETFL)
+        fcntl.fcntl(self.replies, fcntl.F_SETFL, flags | os.O_NONBLOCK)
+        # Deferreds of the commands sent, in order
+        self.pending = collections.deque()
+        # the start of a frame length that's been cut off
+        self.header = ''
+        # pieces of the frame being received, and the bytes it still lacks
+        self.pieces = []
+        self.missing = 0
+        # frames of the reply being received
+        self.chunks = []
+        # retired workers take no new commands
+        self.retired = False
+        self.closed = False
+
+    def send(self, db, args):
+        """Run a command in the child; return a Deferred firing with the
+        reply, already encoded."""
+        try:
+            _write(self.requests, protocol.python_to_redis([str(db)] + list(args)))
+        except OSError:
+            # the child died, and the reactor hasn't noticed yet
+            self.connectionLost(None)
+            return defer.succeed(Error('ERR snapshot worker died'))
+        deferred = defer.Deferred()
+        self.pending.append(deferred)
+        return deferred
+
+    def fileno(self):
+        return self.replies
+
+    def logPrefix(self):
+        return 'snapshot %d' % self.pid
+
+    def doRead(self):
+        try:
+            data = os.read(self.replies, READ_CHUNK)
+        except OSError as exc:
+            if exc.errno in (errno.EAGAIN, errno.EINTR):
+                return
+            data = ''
+        if not data:
+            return main.CONNECTION_DONE
+        if self.header:
+            data = self.header + data
+            self.header = ''
+        offset = 0
+        while offset < len(data):
+            if self.missing:
+                piece = data[offset:offset+self.missing]
+                self.pieces.append(piece)
+                self.missing -= len(piece)
+                offset += len(piece)
+                if not self.missing:
+                    pieces, self.pieces = self.pieces, []
+                    self.chunks.append(''.join(pieces))
+                continue
+            if len(data) - offset < _FRAME.size:
+                self.header = data[offset:]
+                break
+            size, = _FRAME.unpack_from(data, offset)
+            offset += _FRAME.size
+            if size:
+                self.missing = size
+            else:
+                chunks, self.chunks = self.chunks, []
+                self.pending.popleft().callback(Encoded(chunks))
+
+    def connectionLost(self, reason):
+        """The child died: fail whatever it had been sent."""
+        self.retired = True
+        while self.pending:
+            self.pending.popleft().callback(Error('ERR snapshot worker died'))
+
+    def close(self):
+        """Hang up; the child exits once it reads the end of its input."""
+        if not self.closed:
+            self.closed = True
+            self.retired = True
+            os.close(self.requests)
+            os.close(self.replies)
+
+
+class Snapshots(object):
+    """Pool of snapshot workers."""
+
+    # Commands involving fewer elements than this run in the parent.
+    threshold = 100000
+    # Workers aren't replaced once no command has asked for one in this
+    # many seconds; the next one that does runs in the parent, and brings
+    # them back.
+    idle = 60
+
+    def __init__(self, server, workers=2, max_age=1.0, add_reader=None, remove_reader=None):
+        self.server = server
+        self.size = workers
+        # staleness bound, in seconds
+        self.max_age = max_age
+        # reactor.addReader and removeReader, or None to poll()
+        self.add_reader = add_reader
+        self.remove_reader = remove_reader
+        self.workers = []
+        # pids of the closed workers that haven't exited yet
+        self.zombies = []
+        # when a command last asked for a worker
+        self.wanted = 0
+        self.forks = 0
+        self.offloaded = 0
+
+    def cost(self, client, args):
+        """Number of elements a command has to go through."""
+        ht = client.ht
+        command = args[0].upper()
+        if command == 'KEYS':
+            return len(ht)
+        keys = args[1:] if command in ('SUNION', 'SINTER', 'SDIFF') else args[1:2]
+        return sum(_size(ht.get(key)) for key in keys)
+
+    def run(self, client, args):
+        """Deferred reply to a command, if it's worth running in a snapshot
+        and there's one fresh enough for client; None otherwise."""
+        command = args[0].upper()
+        if command not in COMMANDS or len(args) < 2:
+            return None
+        if command == 'SORT' and any(arg.upper() == 'STORE' for arg in args[2:]):
+            return None
+        if self.cost(client, args) < self.threshold:
+            return None
+        now = self.wanted = time.time()
+        workers = [worker for worker in self.workers if not worker.retired and
+                   worker.created > client.wrote and now - worker.created <= self.max_age]
+        if not workers:
+            return None
+        worker = min(workers, key=lambda worker: len(worker.pending))
+        self.offloaded += 1
+        return worker.send(client.db, args)
+
+    def cron(self, now=None):
+        """Retire workers getting old, fork a replacement, and let go of
+        retired workers once they're done."""
+        now = time.time() if now is None else now
+        # replaced halfway through their life, there's always a worker
+        # fresh enough (while a fork is cheap enough)
+        for worker in self.workers:
+            if now - worker.created >= self.max_age / 2.0:
+                worker.retired = True
+        for worker in [worker for worker in self.workers if worker.retired and not worker.pending]:
+            self._close(worker)
+        if now - self.wanted < self.idle and \
+                sum(1 for worker in self.workers if not worker.retired) < self.size:
+            worker = Worker(self.server)
+            self.forks += 1
+            self.workers.append(worker)
+            if self.add_reader is not None:
+                self.add_reader(worker)
+        self._reap()
+
+    def _close(self, worker):
+        if self.remove_reader is not None and not worker.closed:
+            self.remove_reader(worker)
+        worker.close()
+        self.workers.remove(worker)
+        self.zombies.append(worker.pid)
+
+    def _reap(self):
+        for pid in self.zombies[:]:
+            try:
+                done, status = os.waitpid(pid, os.WNOHANG)
+            except OSError:
+                done = pid
+            if done:
+                self.zombies.remove(pid)
+
+    def poll(self, timeout=None):
+        """Wait for replies for up to timeout seconds, for use without a
+        reactor."""
+        workers = [worker for worker in self.workers if not worker.closed]
+        if not workers:
+            return
+        readable, _, _ = select.select(workers, [], [], timeout)
+        for worker in readable:
+            if worker.doRead():
+                worker.connectionLost(None)
+
+    def close(self):
+        for worker in self.workers[:]:
+            self._close(worker)
+        for pid in self.zombies:
+            try:
+                os.waitpid(pid, 0)
+            except OSError:
+                pass
+        self.zombies = []
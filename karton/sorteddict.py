@@ -1,6 +1,6 @@
-from _sortedlist import sortedset
+from blist._sortedlist import sortedset
 import collections, sys
-from _blist import blist
+from blist import blist
 from functools import partial
 
 class missingdict(dict):
@@ -144,6 +144,58 @@ class sorteddict(collections.MutableMapping):
             rv[key] = value
         return rv
 
+    @classmethod
+    def fromitems(cls, items):
+        """Bulk-load (key, value) pairs, sorting once instead of inserting
+        keys one by one. Only valid with the default (by value) ordering."""
+        rv = cls()
+        rv._map.update(items)
+        rv._sortedkeys._blist = blist(sorted((value, key) for key, value
+                                             in rv._map.iteritems()))
+        return rv
+
+    def score_bisect_left(self, score):
+        """Index of the first key whose value is >= score (by value
+        ordering only, like fromitems())."""
+        items = self._sortedkeys._blist
+        lo, hi = 0, len(items)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if items[mid][0] < score:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def score_bisect_right(self, score):
+        """Index just past the last key whose value is <= score."""
+        items = self._sortedkeys._blist
+        lo, hi = 0, len(items)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if score < items[mid][0]:
+                hi = mid
+            else:
+                lo = mid + 1
+        return lo
+
+    def score_range(self, low, high, low_exclusive=False, high_exclusive=False):
+        """Return (start, stop) indices of keys with values within bounds,
+        in O(log n)."""
+        if low_exclusive:
+            start = self.score_bisect_right(low)
+        else:
+            start = self.score_bisect_left(low)
+        if high_exclusive:
+            stop = self.score_bisect_left(high)
+        else:
+            stop = self.score_bisect_right(high)
+        return start, max(start, stop)
+
+    def scoreitems(self, start, stop):
+        """(value, key) pairs between two indices, in order."""
+        return self._sortedkeys._blist[start:stop]
+
     def __repr__(self):
         return 'sorteddict(%s)' % repr(self._map)
 
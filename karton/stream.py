@@ -0,0 +1,287 @@
+# -*- coding: utf-8 -*-
+
+"""
+Append-only log with monotonically increasing IDs (the stream type).
+
+Entries are packed into nodes of up to NODE_MAX_ENTRIES entries or
+NODE_MAX_BYTES bytes: IDs go into two integer arrays, and all field and
+value strings of a node share one bytearray. A sorted list of the first
+ID of every node makes locating an ID a bisection, so a range of m
+entries costs O(log n + m). Trimming by length drops whole nodes from the
+head; deleted entries are only flagged until their node empties out.
+
+IDs are (milliseconds, sequence) tuples, which compare the right way.
+"""
+
+import time
+from array import array
+from bisect import bisect_right
+
+
+NODE_MAX_ENTRIES = 100
+NODE_MAX_BYTES = 4096
+
+MAX_PART = 2**64 - 1
+MIN_ID = (0, 0)
+MAX_ID = (MAX_PART, MAX_PART)
+
+
+def parse_id(string, seq=0):
+    """Parse "ms-seq" or "ms" (using seq for the missing part)."""
+    ms, dash, seq_string = string.partition('-')
+    try:
+        ms = int(ms)
+        if dash:
+            seq = int(seq_string)
+    except ValueError:
+        raise ValueError('Invalid stream ID specified as stream command argument')
+    if not (0 <= ms <= MAX_PART and 0 <= seq <= MAX_PART):
+        raise ValueError('Invalid stream ID specified as stream command argument')
+    return ms, seq
+
+
+def format_id(id):
+    return '%d-%d' % id
+
+
+def now():
+    return int(time.time() * 1000)
+
+
+class _node(object):
+
+    __slots__ = ('ms', 'seq', 'counts', 'sizes', 'data', 'deleted', 'live')
+
+    def __init__(self):
+        self.ms = array('L')
+        self.seq = array('L')
+        # number of strings (fields and values) of every entry
+        self.counts = array('I')
+        self.sizes = array('I')
+        self.data = bytearray()
+        self.deleted = bytearray()
+        self.live = 0
+
+    def __len__(self):
+        return len(self.ms)
+
+    def full(self):
+        return len(self.ms) >= NODE_MAX_ENTRIES or len(self.data) >= NODE_MAX_BYTES
+
+    def first(self):
+        return self.ms[0], self.seq[0]
+
+    def append(self, id, fields):
+        self.ms.append(id[0])
+        self.seq.append(id[1])
+        self.counts.append(len(fields))
+        self.sizes.extend(map(len, fields))
+        self.data += ''.join(fields)
+        self.deleted.append(0)
+        self.live += 1
+
+    def entries(self):
+        """Return [(index, id, fields)] of live entries, oldest first."""
+        data = self.data
+        sizes = self.sizes
+        result = []
+        start = 0
+        string = 0
+        for index in xrange(len(self.ms)):
+            count = self.counts[index]
+            if self.deleted[index]:
+                start += sum(sizes[string:string+count])
+            else:
+                fields = []
+                for size in sizes[string:string+count]:
+                    fields.append(str(data[start:start+size]))
+                    start += size
+                result.append((index, (self.ms[index], self.seq[index]), fields))
+            string += count
+        return result
+
+    def find(self, id):
+        """Index of a live entry with the given ID, or -1."""
+        lo, hi = 0, len(self.ms)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if (self.ms[mid], self.seq[mid]) < id:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo < len(self.ms) and (self.ms[lo], self.seq[lo]) == id and not self.deleted[lo]:
+            return lo
+        return -1
+
+    def delete(self, index):
+        self.deleted[index] = 1
+        self.live -= 1
+
+
+class consumer(object):
+
+    def __init__(self, name):
+        self.name = name
+        self.seen = now()
+        self.pending = set()
+
+
+class pending_entry(object):
+
+    __slots__ = ('consumer', 'delivered', 'count')
+
+    def __init__(self, consumer):
+        self.consumer = consumer
+        self.delivered = now()
+        self.count = 1
+
+
+class consumergroup(object):
+
+    def __init__(self, last_id):
+        self.last_id = last_id
+        # pending entries list: ID -> pending_entry
+        self.pel = {}
+        self.consumers = {}
+
+    def consumer(self, name):
+        """Return the named consumer, creating it if needed."""
+        if name not in self.consumers:
+            self.consumers[name] = consumer(name)
+        return self.consumers[name]
+
+    def deliver(self, consumer, id):
+        entry = self.pel.get(id)
+        if entry is None:
+            self.pel[id] = pending_entry(consumer.name)
+        else:
+            if entry.consumer != consumer.name:
+                self.consumers[entry.consumer].pending.discard(id)
+            entry.consumer = consumer.name
+            entry.delivered = now()
+            entry.count += 1
+        consumer.pending.add(id)
+
+    def ack(self, id):
+        entry = self.pel.pop(id, None)
+        if entry is None:
+            return False
+        self.consumers[entry.consumer].pending.discard(id)
+        return True
+
+
+class stream(object):
+
+    def __init__(self):
+        self.nodes = []
+        # first ID of every node, for bisection
+        self.firsts = []
+        self.length = 0
+        self.last_id = MIN_ID
+        self.groups = {}
+
+    def __len__(self):
+        return self.length
+
+    def __nonzero__(self):
+        # unlike other types, empty streams stay around.
+        return True
+
+    def next_id(self, ms=None):
+        """Generate an ID greater than last_id (within ms if given)."""
+        last_ms, last_seq = self.last_id
+        if ms is None:
+            ms = max(now(), last_ms)
+        if ms == last_ms:
+            if last_seq == MAX_PART:
+                if ms == MAX_PART:
+                    raise ValueError('The stream has exhausted the last possible ID, unable to add more items')
+                return ms + 1, 0
+            return ms, last_seq + 1
+        return ms, 0
+
+    def add(self, id, fields):
+        assert id > self.last_id
+        if not self.nodes or self.nodes[-1].full():
+            self.nodes.append(_node())
+            self.firsts.append(id)
+        self.nodes[-1].append(id, fields)
+        self.length += 1
+        self.last_id = id
+
+    def range(self, start=MIN_ID, end=MAX_ID, count=0, reverse=False):
+        """Yield (id, fields) of entries with start <= id <= end."""
+        if start > end:
+            return
+        if not reverse:
+            position = max(bisect_right(self.firsts, start) - 1, 0)
+            positions = xrange(position, len(self.nodes))
+        else:
+            position = bisect_right(self.firsts, end) - 1
+            positions = xrange(position, -1, -1)
+        for position in positions:
+            node = self.nodes[position]
+            entries = node.entries()
+            if reverse:
+                entries.reverse()
+            for index, id, fields in entries:
+                if id < start:
+                    if reverse:
+                        return
+                    continue
+                if id > end:
+                    if reverse:
+                        continue
+                    return
+                yield id, fields
+                if count:
+                    count -= 1
+                    if not count:
+                        return
+
+    def _locate(self, id):
+        """Return (node position, index within node) of an entry, or None."""
+        position = bisect_right(self.firsts, id) - 1
+        if position < 0:
+            return None
+        index = self.nodes[position].find(id)
+        if index < 0:
+            return None
+        return position, index
+
+    def get(self, id):
+        """Return fields of an entry, or None if there's no such entry."""
+        for entry_id, fields in self.range(id, id):
+            return fields
+        return None
+
+    def delete(self, id):
+        location = self._locate(id)
+        if location is None:
+            return False
+        position, index = location
+        node = self.nodes[position]
+        node.delete(index)
+        self.length -= 1
+        if not node.live:
+            del self.nodes[position]
+            del self.firsts[position]
+        return True
+
+    def trim(self, maxlen, approximate=False):
+        """Trim to maxlen entries, dropping whole nodes from the head. Unless
+        approximate, finish off by deleting entries from the first node."""
+        removed = 0
+        nodes = self.nodes
+        while nodes and self.length - nodes[0].live >= maxlen:
+            removed += nodes[0].live
+            self.length -= nodes[0].live
+            del nodes[0]
+            del self.firsts[0]
+        if not approximate and self.length > maxlen:
+            node = nodes[0]
+            for index, id, fields in node.entries()[:self.length - maxlen]:
+                node.delete(index)
+                removed += 1
+            self.length = maxlen
+        return removed
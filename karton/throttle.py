@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+
+"""
+Rate limiting with GCRA (THROTTLE), as in redis-cell's CL.THROTTLE.
+
+The generic cell rate algorithm keeps a single number per key: the
+theoretical arrival time (TAT), when the limiter would be back to empty
+if nothing else came in. Each request pushes it forward by the time its
+quantity is worth (period / count per unit), and is let through as long
+as that doesn't put the TAT more than max_burst + 1 units past now. That
+is, count requests per period, with up to max_burst more at once.
+
+The TAT is stored as a plain string, in microseconds. Once it has passed,
+the key is as good as missing, and Throttles drops it from cron(): idle
+keys go away on their own, as Redis' would with a TTL, with the same
+invalidations and expired event. Keys that are
+rewritten by anything but THROTTLE, or loaded from a dump, aren't dropped
+until THROTTLE has seen them again.
+"""
+
+import time
+import math
+import heapq
+
+
+def gcra(tat, now, burst, count, period, quantity=1):
+    """Run a request of quantity units against tat (None for a new key),
+    at now, in microseconds; return (limited, remaining, retry after,
+    reset after, new tat). Times are in microseconds too; retry after is
+    -1 if the request is let through, or if it never could be. The new tat
+    is None when it doesn't change."""
+    interval = period * 1e6 / count
+    tolerance = interval * (burst + 1)
+    increment = interval * quantity
+    tat = now if tat is None else max(tat, now)
+    new = tat + increment
+    wait = new - tolerance - now
+    if wait > 0:
+        retry = wait if increment <= tolerance else -1
+        reset = tat - now
+        new = None
+    else:
+        retry = -1
+        reset = new - now
+        new = int(math.ceil(new)) if quantity else None
+    remaining = max(0, int((tolerance - reset) // interval))
+    return wait > 0, remaining, retry, reset, new
+
+
+class Throttles(object):
+    """Keys THROTTLE has written, and when they go idle."""
+
+    def __init__(self):
+        # (db, key) -> the string THROTTLE last stored there
+        self.values = {}
+        # heap of (TAT, db, key)
+        self.due = []
+        self.expired = 0
+
+    def __len__(self):
+        return len(self.values)
+
+    def stored(self, db, key, value, tat):
+        """THROTTLE stored value, of TAT tat, in key."""
+        if (db, key) not in self.values:
+            heapq.heappush(self.due, (tat, db, key))
+        self.values[db, key] = value
+
+    def expire(self, dbs, now, timeout, expired):
+        """Drop the keys that have gone idle by now (in seconds), for up
+        to timeout seconds, with expired(db, key) (Server._expired)."""
+        deadline = time.time() + timeout
+        due = self.due
+        now = now * 1e6
+        popped = 0
+        while due and due[0][0] <= now:
+            tat, db, key = heapq.heappop(due)
+            value = self.values.pop((db, key))
+            ht = dbs[db]
+            # unless something else has been stored there since
+            if ht.get(key) is value:
+                tat = int(value)
+                if tat <= now:
+                    expired(db, key)
+                    self.expired += 1
+                else:
+                    self.stored(db, key, value, tat)
+            popped += 1
+            if not popped % 100 and time.time() > deadline:
+                break
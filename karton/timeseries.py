@@ -0,0 +1,385 @@
+# -*- coding: utf-8 -*-
+
+"""
+Compressed time series (TS.*), as in RedisTimeSeries.
+
+Samples (a timestamp in milliseconds and a float) are appended to a head
+of two plain arrays. Every CHUNK_SAMPLES samples, the head is sealed into
+a chunk compressed the way Gorilla (Facebook's TSDB) does it:
+
+* timestamps as the difference between consecutive deltas: one bit when
+  samples come at a steady pace, a few more when they don't;
+* values XORed with the previous one: one bit when a value repeats, and
+  otherwise only the bits between the leading and trailing zeros, reusing
+  the previous window of meaningful bits when they fit in it.
+
+Regular metrics come out at one to two bytes per sample. Chunks are never
+modified: samples are appended only, and retention drops whole chunks, as
+soon as their newest sample is older than the retention period (so some
+older samples can still be seen until their whole chunk goes).
+
+Decoding goes through a string of '0' and '1' characters, which is much
+quicker to slice and parse in Python than the bytes themselves. Range
+queries only decode the chunks that overlap the range; aggregation into
+time buckets (avg, sum, min, max...) uses NumPy when it's available.
+"""
+
+import struct
+import binascii
+import itertools
+from array import array
+from bisect import bisect_left, bisect_right
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+# Samples per compressed chunk.
+CHUNK_SAMPLES = 1024
+
+AGGREGATIONS = ('avg', 'sum', 'min', 'max', 'count', 'first', 'last', 'range')
+
+# Timestamp delta-of-delta encodings, after a '0' for zero: prefix, bits,
+# and the offset added to make the value non-negative.
+_DOD_RANGES = [
+    ('10', 7, 63),
+    ('110', 9, 255),
+    ('1110', 12, 2047),
+    ('1111', 64, 1 << 63),
+]
+_DOD_FORMATS = [(prefix, -offset, (1 << bits) - 1 - offset, '{0:0%db}' % bits, offset)
+                for prefix, bits, offset in _DOD_RANGES]
+
+
+def _words(values):
+    """Floats as 64-bit integers."""
+    return struct.unpack('<%dQ' % len(values), struct.pack('<%dd' % len(values), *values))
+
+
+def _floats(words):
+    return struct.unpack('<%dd' % len(words), struct.pack('<%dQ' % len(words), *words))
+
+
+def encode(timestamps, values):
+    """Compress samples (at least one); return the bytes."""
+    words = _words(values)
+    pieces = ['{0:064b}'.format(words[0])]
+    append = pieces.append
+    previous = timestamps[0]
+    delta = 0
+    word = words[0]
+    # window of meaningful bits: leading zeros and length
+    leading = length = -1
+    for index in xrange(1, len(timestamps)):
+        timestamp = timestamps[index]
+        dod = timestamp - previous - delta
+        delta = timestamp - previous
+        previous = timestamp
+        if dod == 0:
+            append('0')
+        else:
+            for prefix, low, high, format, offset in _DOD_FORMATS:
+                if low <= dod <= high:
+                    append(prefix + format.format(dod + offset))
+                    break
+        xor = words[index] ^ word
+        word = words[index]
+        if xor == 0:
+            append('0')
+            continue
+        zeros = 64 - xor.bit_length()
+        trailing = (xor & -xor).bit_length() - 1
+        if leading >= 0 and zeros >= leading and trailing >= 64 - leading - length:
+            append('10' + '{0:0{1}b}'.format(xor >> (64 - leading - length), length))
+        else:
+            leading = min(zeros, 63)
+            length = 64 - leading - trailing
+            append('11{0:06b}{1:06b}{2:0{3}b}'.format(leading, length - 1, xor >> trailing, length))
+    bits = ''.join(pieces)
+    bits += '0' * (-len(bits) % 8)
+    return binascii.unhexlify('{0:0{1}x}'.format(int(bits, 2), len(bits) // 4))
+
+
+def decode(first, count, data):
+    """(timestamps, values) of a compressed chunk, whose first timestamp
+    is first."""
+    bits = '{0:0{1}b}'.format(int(binascii.hexlify(data), 16), len(data) * 8)
+    word = int(bits[:64], 2)
+    position = 64
+    timestamp = first
+    delta = 0
+    leading = length = 0
+    timestamps = [first]
+    words = [word]
+    add_timestamp = timestamps.append
+    add_word = words.append
+    for index in xrange(count - 1):
+        if bits[position] == '0':
+            position += 1
+        else:
+            if bits[position + 1] == '0':
+                size, offset, position = 7, 63, position + 2
+            elif bits[position + 2] == '0':
+                size, offset, position = 9, 255, position + 3
+            elif bits[position + 3] == '0':
+                size, offset, position = 12, 2047, position + 4
+            else:
+                size, offset, position = 64, 1 << 63, position + 4
+            delta += int(bits[position:position + size], 2) - offset
+            position += size
+        timestamp += delta
+        add_timestamp(timestamp)
+        if bits[position] == '0':
+            position += 1
+        else:
+            if bits[position + 1] == '1':
+                leading = int(bits[position + 2:position + 8], 2)
+                length = int(bits[position + 8:position + 14], 2) + 1
+                position += 14
+            else:
+                position += 2
+            word ^= int(bits[position:position + length], 2) << (64 - leading - length)
+            position += length
+        add_word(word)
+    return timestamps, _floats(words)
+
+
+class chunk(object):
+    """Compressed samples."""
+
+    __slots__ = ('first', 'last', 'count', 'data')
+
+    def __init__(self, first, last, count, data):
+        self.first = first
+        self.last = last
+        self.count = count
+        self.data = data
+
+    def samples(self):
+        return decode(self.first, self.count, self.data)
+
+
+class timeseries(object):
+
+    # RDB module type name and encoding version
+    MODULE = ('KRtseries', 1)
+
+    def __init__(self, retention=0, labels=None, chunk_samples=CHUNK_SAMPLES):
+        # in milliseconds; 0 keeps everything
+        self.retention = retention
+        self.labels = labels or {}
+        self.chunk_samples = chunk_samples
+        # sealed chunks, oldest first
+        self.chunks = []
+        # samples not sealed yet
+        self.timestamps = array('l')
+        self.values = array('d')
+        self.count = 0
+
+    def __nonzero__(self):
+        # an empty series still has its settings and labels to keep
+        return True
+
+    @property
+    def first_timestamp(self):
+        if self.chunks:
+            return self.chunks[0].first
+        return self.timestamps[0] if self.timestamps else None
+
+    @property
+    def last_timestamp(self):
+        if self.timestamps:
+            return self.timestamps[-1]
+        return self.chunks[-1].last if self.chunks else None
+
+    def last(self):
+        """The newest sample, or None."""
+        if self.timestamps:
+            return self.timestamps[-1], self.values[-1]
+        if self.chunks:
+            timestamps, values = self.chunks[-1].samples()
+            return timestamps[-1], values[-1]
+        return None
+
+    def add(self, timestamp, value):
+        """Append a sample; raise ValueError unless it's newer than the
+        newest one."""
+        last = self.last_timestamp
+        if last is not None and timestamp <= last:
+            raise ValueError('TSDB: timestamp must be higher than the maximum existing timestamp')
+        self.timestamps.append(timestamp)
+        self.values.append(value)
+        self.count += 1
+        if len(self.timestamps) >= self.chunk_samples:
+            self.seal()
+        if self.retention and self.chunks:
+            self.trim()
+
+    def seal(self):
+        """Compress the head into a chunk."""
+        timestamps = self.timestamps
+        if timestamps:
+            self.chunks.append(chunk(timestamps[0], timestamps[-1], len(timestamps),
+                                     encode(timestamps, self.values)))
+            self.timestamps = array('l')
+            self.values = array('d')
+
+    def trim(self):
+        """Drop the chunks that are entirely out of the retention period."""
+        cutoff = self.last_timestamp - self.retention
+        chunks = self.chunks
+        drop = 0
+        while drop < len(chunks) and chunks[drop].last < cutoff:
+            self.count -= chunks[drop].count
+            drop += 1
+        if drop:
+            del chunks[:drop]
+
+    def range(self, start, end):
+        """(timestamps, values) of the samples from start to end, inclusive."""
+        timestamps = []
+        values = []
+        parts = [(part.first, part.last, part.samples) for part in self.chunks]
+        if self.timestamps:
+            parts.append((self.timestamps[0], self.timestamps[-1],
+                          lambda: (self.timestamps, self.values)))
+        for first, last, samples in parts:
+            if last < start or first > end:
+                continue
+            some_timestamps, some_values = samples()
+            if first < start or last > end:
+                low = bisect_left(some_timestamps, start)
+                high = bisect_right(some_timestamps, end)
+                some_timestamps = some_timestamps[low:high]
+                some_values = some_values[low:high]
+            timestamps.extend(some_timestamps)
+            values.extend(some_values)
+        return timestamps, values
+
+    def size(self):
+        """Bytes of sample data."""
+        return sum(len(part.data) for part in self.chunks) + \
+            len(self.timestamps) * self.timestamps.itemsize + len(self.values) * self.values.itemsize
+
+    def fields(self):
+        """Values saved in RDB files, as karton.rdb wants them."""
+        fields = [self.retention, self.chunk_samples, len(self.labels)]
+        for label, value in sorted(self.labels.iteritems()):
+            fields.extend([label, value])
+        parts = list(self.chunks)
+        if self.timestamps:
+            parts.append(chunk(self.timestamps[0], self.timestamps[-1], len(self.timestamps),
+                               encode(self.timestamps, self.values)))
+        fields.append(len(parts))
+        for part in parts:
+            fields.extend([part.first, part.last, part.count, part.data])
+        return fields
+
+    @classmethod
+    def fromfields(cls, fields):
+        retention, chunk_samples, labels = fields[:3]
+        position = 3 + 2 * labels
+        self = cls(retention, dict(zip(fields[3:position:2], fields[4:position:2])), chunk_samples)
+        for index in xrange(position + 1, position + 1 + 4 * fields[position], 4):
+            first, last, count, data = fields[index:index+4]
+            self.chunks.append(chunk(first, last, count, data))
+            self.count += count
+        # the last chunk was the head: append to it again
+        if self.chunks and self.chunks[-1].count < chunk_samples:
+            head = self.chunks.pop()
+            timestamps, values = head.samples()
+            self.timestamps.extend(timestamps)
+            self.values.extend(values)
+        return self
+
+
+def aggregate(timestamps, values, aggregation, bucket):
+    """[(bucket start, aggregated value)] of samples, in buckets of bucket
+    milliseconds."""
+    if not timestamps:
+        return []
+    if numpy is not None:
+        return _aggregate_numpy(timestamps, values, aggregation, bucket)
+    result = []
+    for start, group in itertools.groupby(itertools.izip(timestamps, values),
+                                          lambda sample: sample[0] - sample[0] % bucket):
+        group = [value for timestamp, value in group]
+        if aggregation == 'avg':
+            value = sum(group) / len(group)
+        elif aggregation == 'sum':
+            value = sum(group)
+        elif aggregation == 'min':
+            value = min(group)
+        elif aggregation == 'max':
+            value = max(group)
+        elif aggregation == 'count':
+            value = len(group)
+        elif aggregation == 'first':
+            value = group[0]
+        elif aggregation == 'last':
+            value = group[-1]
+        else:
+            value = max(group) - min(group)
+        result.append((start, float(value)))
+    return result
+
+
+def _aggregate_numpy(timestamps, values, aggregation, bucket):
+    timestamps = numpy.asarray(timestamps, dtype=numpy.int64)
+    values = numpy.asarray(values, dtype=numpy.float64)
+    keys = timestamps - timestamps % bucket
+    starts = numpy.flatnonzero(numpy.concatenate(([True], keys[1:] != keys[:-1])))
+    if aggregation == 'avg':
+        result = numpy.add.reduceat(values, starts) / numpy.diff(numpy.append(starts, len(values)))
+    elif aggregation == 'sum':
+        result = numpy.add.reduceat(values, starts)
+    elif aggregation == 'min':
+        result = numpy.minimum.reduceat(values, starts)
+    elif aggregation == 'max':
+        result = numpy.maximum.reduceat(values, starts)
+    elif aggregation == 'count':
+        result = numpy.diff(numpy.append(starts, len(values))).astype(numpy.float64)
+    elif aggregation == 'first':
+        result = values[starts]
+    elif aggregation == 'last':
+        result = values[numpy.append(starts[1:], len(values)) - 1]
+    else:
+        result = numpy.maximum.reduceat(values, starts) - numpy.minimum.reduceat(values, starts)
+    return zip(keys[starts].tolist(), result.tolist())
+
+
+def format_value(value):
+    """A sample value as replies show it: shortest exact form, no '.0'."""
+    string = repr(value)
+    return string[:-2] if string.endswith('.0') else string
+
+
+def parse_filter(string):
+    """(label, values, equal) of a TS.MRANGE filter: label=value,
+    label!=value, label=(value,value...), and label= or label!= for labels
+    that must be missing or present. Raise ValueError for anything else."""
+    label, equal, values = string.partition('!=')
+    if equal:
+        equal = False
+    else:
+        label, equal, values = string.partition('=')
+        if not equal:
+            raise ValueError(string)
+        equal = True
+    if not label:
+        raise ValueError(string)
+    if values.startswith('(') and values.endswith(')'):
+        values = values[1:-1].split(',')
+    else:
+        values = [values]
+    return label, frozenset(values), equal
+
+
+def matches(labels, filters):
+    for label, values, equal in filters:
+        # a missing label matches an empty value
+        if (labels.get(label, '') in values) != equal:
+            return False
+    return True
@@ -0,0 +1,166 @@
+# -*- coding: utf-8 -*-
+
+"""
+Client-side caching support (CLIENT TRACKING).
+
+In the default mode, the server remembers which clients read which keys
+in a table from key to client IDs, and when a key is written, pops its
+entry and sends an invalidation message to exactly those clients, so each
+invalidation costs O(clients interested in the key). The table is bounded:
+past max_keys, the oldest entries are evicted, and since the server
+forgets about them, their clients are told to drop them right away.
+
+In broadcasting mode (BCAST), clients subscribe to key prefixes instead
+and get invalidated for every matching key, whether they read it or not.
+Prefixes are looked up by slicing the key at every distinct prefix length,
+so the cost doesn't depend on the number of subscriptions either.
+
+Invalidations go out as Push messages to clients that speak RESP3 (HELLO
+3). A RESP2 connection has no room for them between replies: like in
+Redis, RESP2 clients have to REDIRECT them to another connection,
+subscribed to __redis__:invalidate, where they come as Pub/Sub messages,
+and get none otherwise.
+
+Like in Redis, the table doesn't distinguish between databases.
+"""
+
+from collections import OrderedDict
+
+from .protocol import Push
+
+
+TRACKING_TABLE_MAX_KEYS = 1000000
+
+# Channel RESP2 clients get invalidations on.
+INVALIDATE_CHANNEL = '__redis__:invalidate'
+
+
+class State(object):
+    """Tracking options of a single client."""
+
+    def __init__(self, redirect=0, bcast=False, prefixes=(), optin=False,
+                 optout=False, noloop=False):
+        self.redirect = redirect
+        self.bcast = bcast
+        self.prefixes = list(prefixes)
+        self.optin = optin
+        self.optout = optout
+        self.noloop = noloop
+
+
+class Tracking(object):
+
+    def __init__(self, clients, pubsub, max_keys=TRACKING_TABLE_MAX_KEYS):
+        # client registry: ID -> Client
+        self.clients_by_id = clients
+        self.pubsub = pubsub
+        self.max_keys = max_keys
+        # key -> set of client IDs, oldest first
+        self.table = OrderedDict()
+        # BCAST prefix -> set of client IDs
+        self.prefixes = {}
+        # prefix length -> number of prefixes of that length
+        self.lengths = {}
+        # IDs of clients with tracking enabled
+        self.tracking = set()
+        self.evicted = 0
+
+    @property
+    def clients(self):
+        return len(self.tracking)
+
+    def enable(self, client, state):
+        self.disable(client)
+        client.tracking = state
+        self.tracking.add(client.id)
+        if state.bcast:
+            for prefix in state.prefixes or ['']:
+                ids = self.prefixes.setdefault(prefix, set())
+                if not ids:
+                    self.lengths[len(prefix)] = self.lengths.get(len(prefix), 0) + 1
+                ids.add(client.id)
+
+    def disable(self, client):
+        """Turn tracking off; entries in the table go away lazily."""
+        state = client.tracking
+        if state is None:
+            return
+        if state.bcast:
+            for prefix in state.prefixes or ['']:
+                ids = self.prefixes[prefix]
+                ids.discard(client.id)
+                if not ids:
+                    del self.prefixes[prefix]
+                    self.lengths[len(prefix)] -= 1
+                    if not self.lengths[len(prefix)]:
+                        del self.lengths[len(prefix)]
+        self.tracking.discard(client.id)
+        client.tracking = None
+        client.caching = None
+
+    def command(self, client, args, writes, keys):
+        """Account for a command that has just run, writing or reading keys
+        (as commands.command_keys() found them)."""
+        if writes:
+            self.invalidate(keys, client)
+        elif keys and client.tracking is not None and not client.tracking.bcast:
+            state = client.tracking
+            if (state.optin and client.caching) or (state.optout and client.caching is not False) or \
+                    not (state.optin or state.optout):
+                self.remember(client, keys)
+        # CLIENT CACHING only applies to the command right after it
+        if client.caching is not None and args[0].upper() != 'CLIENT':
+            client.caching = None
+
+    def remember(self, client, keys):
+        table = self.table
+        for key in keys:
+            ids = table.get(key)
+            if ids is None:
+                ids = table[key] = set()
+            ids.add(client.id)
+        while len(table) > self.max_keys:
+            key, ids = table.popitem(last=False)
+            self.evicted += 1
+            self._send(dict((id, [key]) for id in ids), None)
+
+    def invalidate(self, keys, origin=None):
+        """Notify clients interested in keys that they've changed."""
+        pending = {}
+        for key in keys:
+            ids = self.table.pop(key, None)
+            if ids:
+                for id in ids:
+                    pending.setdefault(id, []).append(key)
+            for length in self.lengths:
+                ids = self.prefixes.get(key[:length]) if len(key) >= length else None
+                if ids:
+                    for id in ids:
+                        pending.setdefault(id, []).append(key)
+        if pending:
+            self._send(pending, origin)
+
+    def flush(self):
+        """Everything's gone (FLUSHDB, FLUSHALL): tell everyone."""
+        self.table.clear()
+        self._send(dict((id, None) for id in self.tracking), None)
+
+    def _send(self, pending, origin):
+        for id, keys in pending.iteritems():
+            client = self.clients_by_id.get(id)
+            if client is None or client.tracking is None:
+                continue
+            state = client.tracking
+            if state.noloop and client is origin:
+                continue
+            if state.redirect:
+                client = self.clients_by_id.get(state.redirect)
+                if client is None:
+                    continue
+            if keys is not None:
+                # a key can match several prefixes
+                keys = sorted(set(keys))
+            if client.resp == 3:
+                client.push(Push(['invalidate', keys]))
+            elif state.redirect:
+                self.pubsub.send(client, INVALIDATE_CHANNEL, keys)
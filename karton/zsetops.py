@@ -0,0 +1,151 @@
+# -*- coding: utf-8 -*-
+
+"""
+Weighted union and intersection of sorted sets (ZUNIONSTORE/ZINTERSTORE).
+
+Inputs are sorteddicts or plain sets (every member scoring 1). Scores are
+combined one whole input at a time rather than member by member, using
+NumPy arrays when NumPy is available, and the result is bulk-loaded into
+a fresh sorteddict.
+"""
+
+from itertools import izip
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from .sorteddict import sorteddict
+
+
+AGGREGATES = ('SUM', 'MIN', 'MAX')
+
+
+def _members(source):
+    """Return a container supporting fast membership tests."""
+    if isinstance(source, sorteddict):
+        return source._map
+    return source
+
+
+def _items(source):
+    """Return (members, scores) of source as two sequences."""
+    if isinstance(source, sorteddict):
+        return source._map.keys(), source._map.values()
+    return list(source), [1.0] * len(source)
+
+
+def _scores(source, members):
+    """Return scores of members, all of which must be in source."""
+    if isinstance(source, sorteddict):
+        return map(source._map.__getitem__, members)
+    return [1.0] * len(members)
+
+
+def _nan_to_zero(score):
+    # inf * 0 and inf + -inf are defined to be 0, like in Redis.
+    return 0.0 if score != score else score
+
+
+def _sum(a, b):
+    return _nan_to_zero(a + b)
+
+
+_python_aggregates = {
+    'SUM': _sum,
+    'MIN': min,
+    'MAX': max,
+}
+
+if numpy is not None:
+    _numpy_aggregates = {
+        'SUM': numpy.add,
+        'MIN': numpy.minimum,
+        'MAX': numpy.maximum,
+    }
+
+
+def _weighted(scores, weight):
+    if numpy is not None:
+        column = numpy.fromiter(scores, float, len(scores))
+        if weight != 1.0:
+            with numpy.errstate(invalid='ignore'):
+                column *= weight
+            column[numpy.isnan(column)] = 0.0
+        return column
+    if weight == 1.0:
+        return scores
+    return [_nan_to_zero(score * weight) for score in scores]
+
+
+def _combine(result, column, aggregate):
+    """Combine two equally long score columns."""
+    if numpy is not None:
+        with numpy.errstate(invalid='ignore'):
+            result = _numpy_aggregates[aggregate](result, column)
+        result[numpy.isnan(result)] = 0.0
+        return result
+    return map(_python_aggregates[aggregate], result, column)
+
+
+def _build(members, scores):
+    if numpy is not None:
+        scores = scores.tolist()
+    return sorteddict.fromitems(izip(members, scores))
+
+
+def intersection(sources, weights, aggregate):
+    """Intersect sources, iterating over the smallest one first."""
+    inputs = sorted(zip(sources, weights), key=lambda input: len(input[0]))
+    if not inputs or not inputs[0][0]:
+        return sorteddict()
+    # narrow down the candidates one whole input at a time.
+    members = list(_members(inputs[0][0]))
+    for source, weight in inputs[1:]:
+        lookup = _members(source)
+        members = [member for member in members if member in lookup]
+        if not members:
+            return sorteddict()
+    result = None
+    for source, weight in inputs:
+        column = _weighted(_scores(source, members), weight)
+        if result is None:
+            result = column
+        else:
+            result = _combine(result, column, aggregate)
+    return _build(members, result)
+
+
+def union(sources, weights, aggregate):
+    """Union of sources."""
+    index = {}
+    members = []
+    for source in sources:
+        for member in _members(source):
+            if member not in index:
+                index[member] = len(members)
+                members.append(member)
+    if numpy is not None:
+        initial = {'SUM': 0.0, 'MIN': float('inf'), 'MAX': float('-inf')}[aggregate]
+        result = numpy.empty(len(members))
+        result.fill(initial)
+        for source, weight in zip(sources, weights):
+            if not source:
+                continue
+            source_members, scores = _items(source)
+            # positions are unique within one source, so plain fancy
+            # indexing is safe here.
+            positions = numpy.fromiter(map(index.__getitem__, source_members),
+                                       numpy.intp, len(source_members))
+            result[positions] = _combine(result[positions], _weighted(scores, weight), aggregate)
+    else:
+        result = [None] * len(members)
+        combine = _python_aggregates[aggregate]
+        for source, weight in zip(sources, weights):
+            source_members, scores = _items(source)
+            for member, score in izip(source_members, _weighted(scores, weight)):
+                position = index[member]
+                current = result[position]
+                result[position] = score if current is None else combine(current, score)
+    return _build(members, result)
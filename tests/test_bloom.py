@@ -0,0 +1,139 @@
+# -*- coding: utf-8 -*-
+
+from cStringIO import StringIO
+
+from karton.server import Server
+from karton.bloom import bloomfilter, cuckoofilter, hash_one, hash_all
+from karton.protocol import OK, Error
+from karton import rdb, bulk
+
+
+def make_client():
+    server = Server()
+    return server, server.new_client(('127.0.0.1', 0))
+
+
+def test_bloomfilter():
+    bf = bloomfilter(0.01, 1000)
+    members = ['member:%d' % index for index in xrange(5000)]
+    # a few may look like they've been added already
+    added = sum(bf.add(hashed) for hashed in hash_all(members[:3000]))
+    assert 2950 < added <= 3000
+    assert not bf.add(hash_one(members[0]))
+    assert bf.count == added
+    # scaled: 1000, then 2000 more
+    assert [layer.capacity for layer in bf.layers] == [1000, 2000]
+    assert all(bf.contains(hashed) for hashed in hash_all(members[:3000]))
+    false_positives = sum(bf.contains(hashed) for hashed in hash_all(members[3000:]))
+    assert false_positives < 2000 * 0.03
+    fixed = bloomfilter(0.01, 10, expansion=0)
+    for hashed in hash_all(map(str, xrange(10))):
+        fixed.add(hashed)
+    try:
+        fixed.add(hash_one('one too many'))
+    except ValueError:
+        pass
+    else:
+        assert False
+
+
+def test_cuckoofilter():
+    cf = cuckoofilter(1000, bucket_size=4)
+    members = ['member:%d' % index for index in xrange(5000)]
+    for hashed in hash_all(members[:3000]):
+        cf.add(hashed)
+    assert cf.count == 3000 and len(cf.layers) > 1
+    assert all(cf.contains(hashed) for hashed in hash_all(members[:3000]))
+    false_positives = sum(cf.contains(hashed) for hashed in hash_all(members[3000:]))
+    assert false_positives < 2000 * 0.1
+    # duplicates are counted, and deleted one at a time
+    hashed = hash_one(members[0])
+    cf.add(hashed)
+    assert cf.occurrences(hashed) >= 2
+    assert cf.delete(hashed) and cf.delete(hashed)
+    assert cf.count == 2999 and cf.deleted == 2
+    assert all(cf.contains(hashed) for hashed in hash_all(members[1:3000]))
+    fixed = cuckoofilter(4, bucket_size=1, max_iterations=5, expansion=0)
+    added = 0
+    try:
+        for hashed in hash_all(map(str, xrange(100))):
+            fixed.add(hashed)
+            added += 1
+    except ValueError:
+        # a failed insertion leaves the other members where they were
+        assert all(fixed.contains(hashed) for hashed in hash_all(map(str, xrange(added))))
+    else:
+        assert False
+
+
+def test_bloom_commands():
+    server, client = make_client()
+    assert client.do(['BF.RESERVE', 'bf', '0.001', '100', 'EXPANSION', '4']) == OK
+    assert str(client.do(['BF.RESERVE', 'bf', '0.001', '100'])) == 'ERR item exists'
+    assert str(client.do(['BF.RESERVE', 'other', '2', '100'])) == 'ERR (0 < error rate range < 1)'
+    assert client.do(['TYPE', 'bf']) == 'MBbloom--'
+    assert client.do(['BF.ADD', 'bf', 'a']) == 1
+    assert client.do(['BF.ADD', 'bf', 'a']) == 0
+    assert client.do(['BF.MADD', 'bf', 'a', 'b', 'c']) == [0, 1, 1]
+    assert client.do(['BF.EXISTS', 'bf', 'b']) == 1
+    assert client.do(['BF.MEXISTS', 'bf', 'a', 'x']) == [1, 0]
+    assert client.do(['BF.MEXISTS', 'nope', 'a']) == [0]
+    assert client.do(['BF.CARD', 'bf']) == 3
+    info = client.do(['BF.INFO', 'bf'])
+    assert info[info.index('Expansion rate') + 1] == 4
+    # BF.ADD creates a filter
+    assert client.do(['BF.ADD', 'new', 'a']) == 1
+    assert client.do(['BF.INFO', 'new'])[1] == 100
+    client.do(['SET', 'string', 'x'])
+    assert str(client.do(['BF.ADD', 'string', 'a'])).startswith('WRONGTYPE')
+    client.do(['BF.RESERVE', 'fixed', '0.01', '2', 'NONSCALING'])
+    assert client.do(['BF.ADD', 'fixed', 'a']) == 1
+    reply = client.do(['BF.MADD', 'fixed', 'b', 'c'])
+    assert reply[0] == 1 and isinstance(reply[1], Error)
+    assert str(client.do(['BF.ADD', 'fixed', 'd'])) == 'ERR non scaling filter is full'
+
+
+def test_cuckoo_commands():
+    server, client = make_client()
+    assert client.do(['CF.RESERVE', 'cf', '100', 'BUCKETSIZE', '4']) == OK
+    assert client.do(['TYPE', 'cf']) == 'MBbloomCF'
+    assert client.do(['CF.ADD', 'cf', 'a']) == 1
+    assert client.do(['CF.ADD', 'cf', 'a']) == 1
+    assert client.do(['CF.ADDNX', 'cf', 'a']) == 0
+    assert client.do(['CF.COUNT', 'cf', 'a']) == 2
+    assert client.do(['CF.INSERT', 'cf', 'ITEMS', 'b', 'c']) == [1, 1]
+    assert client.do(['CF.INSERTNX', 'cf', 'ITEMS', 'b', 'd']) == [0, 1]
+    assert str(client.do(['CF.INSERT', 'nope', 'NOCREATE', 'ITEMS', 'a'])) == 'ERR not found'
+    assert client.do(['CF.INSERT', 'new', 'CAPACITY', '10', 'ITEMS', 'a']) == [1]
+    assert client.do(['CF.MEXISTS', 'cf', 'a', 'b', 'x']) == [1, 1, 0]
+    assert client.do(['CF.DEL', 'cf', 'a']) == 1
+    assert client.do(['CF.EXISTS', 'cf', 'a']) == 1
+    assert client.do(['CF.DEL', 'cf', 'a']) == 1
+    assert client.do(['CF.EXISTS', 'cf', 'a']) == 0
+    assert client.do(['CF.DEL', 'cf', 'a']) == 0
+    info = dict(zip(*[iter(client.do(['CF.INFO', 'cf']))] * 2))
+    assert info['Number of items inserted'] == 3 and info['Number of items deleted'] == 2
+    assert info['Bucket size'] == 4 and info['Number of buckets'] == 32
+    # empty filters stay
+    client.do(['CF.DEL', 'new', 'a'])
+    assert client.do(['EXISTS', 'new']) == 1
+
+
+def test_filter_persistence():
+    server, client = make_client()
+    client.do(['BF.MADD', 'bf'] + map(str, xrange(1000)))
+    client.do(['CF.INSERT', 'cf', 'ITEMS'] + map(str, xrange(2000)))
+    client.do(['CF.DEL', 'cf', '0'])
+    for key in ('bf', 'cf'):
+        value = server.dbs[0][key]
+        copy = rdb.loads(rdb.dumps(value))
+        assert type(copy) is type(value)
+        assert copy.fields() == value.fields()
+    payload = client.do(['DUMP', 'cf'])
+    assert client.do(['RESTORE', 'cf2', '0', payload]) == OK
+    assert client.do(['CF.MEXISTS', 'cf2', '0', '1', '1999']) == [0, 1, 1]
+    other = Server()
+    bulk.load(other, StringIO(''.join(bulk.export(server))))
+    assert other.dbs[0]['bf'].fields() == server.dbs[0]['bf'].fields()
+    assert client.do(['OBJECT', 'ENCODING', 'bf']) == 'raw'
+    assert client.do(['MEMORY', 'USAGE', 'bf']) > server.dbs[0]['bf'].size
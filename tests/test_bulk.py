@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+
+import json
+from cStringIO import StringIO
+
+import pytest
+
+from karton.server import Server
+from karton import bulk
+
+
+def populate(server):
+    client = server.new_client(('127.0.0.1', 0))
+    client.do(['SET', 'string', '\xff\x00binary'])
+    client.do(['RPUSH', 'list'] + map(str, xrange(3000)))
+    client.do(['SADD', 'intset', '3', '1', '2'])
+    client.do(['SADD', 'set', 'a', 'b', 'c'])
+    client.do(['HMSET', 'hash', 'f1', 'v1', 'f2', 'v2'])
+    client.do(['ZADD', 'zset', '1.5', 'a', '-inf', 'b', '0.1', 'c'])
+    client.do(['PFADD', 'hll', 'a', 'b', 'c'])
+    client.do(['XADD', 'stream', '1-1', 'f', 'v'])
+    client.do(['XADD', 'stream', '2-0', 'f', 'w'])
+    client.do(['XGROUP', 'CREATE', 'stream', 'group', '1-1'])
+    client.do(['XGROUP', 'CREATE', 'empty', 'group', '0', 'MKSTREAM'])
+    client.do(['SELECT', '3'])
+    client.do(['SET', 'other', 'db'])
+    return client
+
+
+def contents(client):
+    """Everything in db 0, as plain Python data."""
+    return {
+        'string': client.do(['GET', 'string']),
+        'list': list(client.do(['LRANGE', 'list', '0', '-1'])),
+        'intset': sorted(client.do(['SMEMBERS', 'intset'])),
+        'set': sorted(client.do(['SMEMBERS', 'set'])),
+        'hash': sorted(client.do(['HGETALL', 'hash'])),
+        'zset': list(client.do(['ZRANGE', 'zset', '0', '-1', 'WITHSCORES'])),
+        'hll': client.do(['PFCOUNT', 'hll']),
+        'stream': client.do(['XRANGE', 'stream', '-', '+']),
+        'groups': client.do(['XPENDING', 'stream', 'group']),
+        'empty': (client.do(['TYPE', 'empty']), client.do(['XLEN', 'empty'])),
+    }
+
+
+def test_round_trip():
+    source = Server()
+    client = populate(source)
+    client.do(['SELECT', '0'])
+    dump = ''.join(bulk.export(source, chunk=100))
+
+    target = Server()
+    result = bulk.load(target, StringIO(dump), chunk=7)
+    assert result.errors == 0
+    copy = target.new_client(('127.0.0.1', 0))
+    assert contents(copy) == contents(client)
+    assert contents(copy)['hll'] == 3
+    # a list of 3000 items takes three commands
+    assert dump.count('RPUSH') == 3
+    copy.do(['SELECT', '3'])
+    assert copy.do(['GET', 'other']) == 'db'
+
+
+def test_export_json():
+    server = Server()
+    populate(server)
+    lines = ''.join(bulk.export(server, 'json', dbs=[0])).splitlines()
+    records = [json.loads(line) for line in lines]
+    assert all(record['db'] == 0 for record in records)
+    by_key = {}
+    for record in records:
+        by_key.setdefault(record['key'], []).append(record)
+    assert by_key['string'] == [{'db': 0, 'key': 'string', 'type': 'string',
+                                 'value': '\xff\x00binary'.decode('latin-1')}]
+    assert [len(record['value']) for record in by_key['list']] == [1024, 1024, 952]
+    assert sorted(by_key['hash'][0]['value']) == [['f1', 'v1'], ['f2', 'v2']]
+    assert by_key['zset'][0]['value'] == [['b', float('-inf')], ['c', 0.1], ['a', 1.5]]
+    assert by_key['stream'][0]['value'] == [['1-1', ['f', 'v']], ['2-0', ['f', 'w']]]
+
+
+def test_load_errors():
+    dump = bulk.encode(['SET', 'a', '1']) + bulk.encode(['INCR', 'a']) + \
+        bulk.encode(['SADD', 'a', 'x']) + bulk.encode(['NOSUCHCOMMAND'])
+    server = Server()
+    result = bulk.load(server, StringIO(dump))
+    assert result.replies == 4
+    assert result.errors == 2
+    assert [command for command, error in result.first_errors] == ['SADD', 'NOSUCHCOMMAND']
+    assert server.dbs[0] == {'a': '2'}
+    # the loading client is gone
+    assert not server.clients
+
+    with pytest.raises(ValueError):
+        bulk.load(server, StringIO(dump[:-3]))
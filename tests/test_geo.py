@@ -0,0 +1,41 @@
+# -*- coding: utf-8 -*-
+
+import random
+
+from karton import geo
+
+
+def test_encode_decode():
+    bits = geo.encode(13.361389, 38.115556)
+    # same score as Redis gives Palermo
+    assert bits == 3479099956230698
+    lon, lat = geo.decode(bits)
+    assert abs(lon - 13.361389) < 1e-5 and abs(lat - 38.115556) < 1e-5
+    assert geo.geohash(bits) == 'sqc8b49rny0'
+    assert round(geo.distance(13.361389, 38.115556, 15.087269, 37.502669)) == 166274
+
+
+def check_search(radius=None, width=None, height=None):
+    random.seed(3)
+    points = [(random.uniform(-180, 180), random.uniform(-85, 85)) for i in xrange(20000)]
+    scores = sorted(geo.encode(lon, lat) for lon, lat in points)
+    for lon, lat in [(0, 0), (179.9, 10), (-30, 70), (120, -60)]:
+        expected = set(index for index, distance, plon, plat
+                       in geo.within(lon, lat, scores, radius, width, height))
+        found = set()
+        for start, stop in geo.search_ranges(lon, lat, width or radius * 2, height or radius * 2):
+            found.update(index for index, score in enumerate(scores) if start <= score < stop)
+        # the covering cells find everything, and are much less than a full scan
+        assert expected <= found
+        assert len(found) < len(scores) / 10
+
+
+def test_search():
+    check_search(radius=500000)
+    check_search(width=800000, height=300000)
+
+
+def test_search_without_numpy(monkeypatch):
+    monkeypatch.setattr(geo, 'numpy', None)
+    check_search(radius=500000)
+    check_search(width=800000, height=300000)
@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+
+from karton.server import Server
+from karton.hotkeys import Sketch, HotKeys
+from karton.protocol import OK
+
+
+def make_client():
+    server = Server()
+    return server, server.new_client(('127.0.0.1', 0))
+
+
+def test_sketch():
+    sketch = Sketch(width=64, depth=4, k=4)
+    for index in xrange(1000):
+        sketch.add('hot')
+        if index % 2:
+            sketch.add('warm')
+        sketch.add('cold:%d' % index)
+    # count-min never underestimates
+    assert sketch.estimate('hot') >= 1000
+    assert sketch.estimate('warm') >= 500
+    top = sorted(sketch.top, key=sketch.top.get, reverse=True)
+    assert top[:2] == ['hot', 'warm']
+    assert len(sketch.top) == 4
+    hot = sketch.top['hot']
+    sketch.decay()
+    assert sketch.top['hot'] == hot >> 1
+    assert sketch.estimate('hot') >= 500
+
+
+def test_sketch_top_eviction():
+    sketch = Sketch(k=2)
+    for index in xrange(11):
+        sketch.add('a')
+        sketch.add('b')
+    sketch.add('c')
+    sketch.add('c')
+    # c doesn't beat either
+    assert sketch.top == {'a': 11, 'b': 11}
+    for index in xrange(10):
+        sketch.add('c')
+    assert sketch.top == {'a': 11, 'c': 12} or sketch.top == {'b': 11, 'c': 12}
+
+
+def test_hotkeys_sampling():
+    hotkeys = HotKeys(rate=4)
+    samples = 0
+    for index in xrange(40000):
+        hotkeys.countdown -= 1
+        if not hotkeys.countdown:
+            hotkeys.sample(False, ['hot' if index % 2 else 'key:%d' % index])
+            samples += 1
+    assert hotkeys.sampled == samples
+    assert 8000 < samples < 12000
+    (key, estimate), = hotkeys.top(False, 1)
+    # scaled back up to commands
+    assert key == 'hot' and 15000 < estimate < 25000
+    assert hotkeys.top(True) == []
+    hotkeys.set_rate(0)
+    for index in xrange(100):
+        hotkeys.countdown -= 1
+        assert hotkeys.countdown
+    hotkeys.reset()
+    assert hotkeys.sampled == 0 and hotkeys.top(False) == []
+
+
+def test_hotkeys_command():
+    server, client = make_client()
+    assert client.do(['CONFIG', 'SET', 'hotkeys-sample-rate', '1']) == OK
+    assert client.do(['CONFIG', 'GET', 'hotkeys-sample-rate']) == ['hotkeys-sample-rate', '1']
+    assert isinstance(client.do(['CONFIG', 'SET', 'hotkeys-decay-time', 'soon']), AssertionError)
+    for index in xrange(10):
+        client.do(['SET', 'written', str(index)])
+        client.do(['GET', 'read'])
+        client.do(['GET', 'other'])
+    client.do(['GET', 'other'])
+    client.do(['PING'])
+    assert client.do(['HOTKEYS']) == ['other', 11, 'read', 10]
+    assert client.do(['HOTKEYS', 'READ', 'COUNT', '1']) == ['other', 11]
+    assert client.do(['HOTKEYS', 'WRITE']) == ['written', 10]
+    assert isinstance(client.do(['HOTKEYS', 'COUNT', '0']), AssertionError)
+    assert isinstance(client.do(['HOTKEYS', 'SOME']), AssertionError)
+    info = client.do(['INFO'])
+    assert 'hotkeys_sampled_commands:31\r\n' in info
+    assert 'hotkeys_read:other=11,read=10\r\n' in info
+    assert 'hotkeys_write:written=10\r\n' in info
+    # decay
+    client.do(['CONFIG', 'SET', 'hotkeys-decay-time', '1'])
+    server.hotkeys.cron(server.hotkeys.decayed + 1)
+    assert sorted(client.do(['HOTKEYS'])) == [5, 5, 'other', 'read']
+    assert client.do(['HOTKEYS', 'RESET']) == OK
+    assert client.do(['HOTKEYS']) == []
@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+
+from karton import hyperloglog as hyperloglog_module
+from karton.hyperloglog import hyperloglog, SPARSE_MAX_ENTRIES
+
+
+def check_hyperloglog():
+    small = hyperloglog()
+    for i in xrange(100):
+        small.add('member:%d' % i)
+    assert small.encoding == 'sparse'
+    assert small.add('member:0') is False
+    assert 97 <= small.count() <= 103
+
+    big = hyperloglog()
+    for i in xrange(50000):
+        big.add('member:%d' % i)
+    assert big.encoding == 'dense'
+    assert abs(big.count() - 50000) < 50000 * 0.03
+
+    for hll in (small, big):
+        copy = hyperloglog.fromstring(hll.tostring())
+        assert copy.encoding == hll.encoding
+        assert list(copy.registers()) == list(hll.registers())
+        assert copy.count() == hll.count()
+
+    merged = hyperloglog.merged([small, big])
+    assert list(merged.registers()) == list(big.registers())
+    assert hyperloglog.merged([small, small]).encoding == 'sparse'
+
+
+def test_hyperloglog():
+    check_hyperloglog()
+
+
+def test_hyperloglog_without_numpy(monkeypatch):
+    monkeypatch.setattr(hyperloglog_module, 'numpy', None)
+    check_hyperloglog()
+
+
+def test_promotion():
+    hll = hyperloglog()
+    i = 0
+    while hll.encoding == 'sparse':
+        hll.add(str(i))
+        i += 1
+    assert i > SPARSE_MAX_ENTRIES // 2
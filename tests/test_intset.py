@@ -0,0 +1,44 @@
+# -*- coding: utf-8 -*-
+
+from karton.intset import intset, is_int, upgrade, compact, MAX_ENTRIES
+
+
+def test_is_int():
+    assert is_int('0')
+    assert is_int('-42')
+    assert is_int('9223372036854775807')
+    assert not is_int('9223372036854775808')
+    assert not is_int('007')
+    assert not is_int('+1')
+    assert not is_int(' 1')
+    assert not is_int('foo')
+
+
+def test_intset():
+    members = intset(['3', '1', '2', '1'])
+    assert len(members) == 3
+    assert list(members) == ['1', '2', '3']
+    assert '2' in members
+    assert '02' not in members
+    assert 'x' not in members
+    members.add('-5')
+    members.discard('2')
+    members.remove('3')
+    assert list(members) == ['-5', '1']
+    assert members.pop() == '1'
+
+    a = intset(map(str, xrange(0, 100, 2)))
+    b = intset(map(str, xrange(0, 100, 3)))
+    c = intset(map(str, xrange(0, 100, 5)))
+    assert list(a.intersection(b, c)) == ['0', '30', '60', '90']
+    assert list(a.intersection(b, c, limit=2)) == ['0', '30']
+    assert list(a.intersection()) == list(a)
+
+
+def test_conversions():
+    assert isinstance(compact(set(['1', '2'])), intset)
+    assert isinstance(compact(set(['1', 'a'])), set)
+    members = intset(['1'])
+    assert upgrade(members, ['2']) is members
+    assert isinstance(upgrade(members, ['a']), set)
+    assert isinstance(upgrade(members, map(str, xrange(MAX_ENTRIES))), set)
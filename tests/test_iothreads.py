@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+
+from twisted.internet.testing import StringTransport
+
+from karton.server import Server
+from karton.iothreads import IOThreads
+from karton.protocol import python_to_redis
+from twisted_karton import RedisProtocol
+
+
+def make_connections(count, threads=3):
+    server = Server()
+    calls = []
+    io = IOThreads(threads, calls.append, threshold=1)
+    connections = []
+    for index in xrange(count):
+        connection = RedisProtocol(server, ('127.0.0.1', index), io)
+        connection.makeConnection(StringTransport())
+        connections.append(connection)
+    return io, calls, connections
+
+
+def test_map():
+    io = IOThreads(4, None, threshold=1)
+    try:
+        assert io.map(lambda item: item * 2, range(10)) == range(0, 20, 2)
+        try:
+            io.map(lambda item: 1 / item, range(-5, 5))
+        except ZeroDivisionError:
+            pass
+        else:
+            assert False
+        # the threads are still there
+        assert io.map(str, range(3)) == ['0', '1', '2']
+    finally:
+        io.close()
+
+
+def test_batch():
+    io, calls, connections = make_connections(8)
+    try:
+        subscriber = connections[0]
+        subscriber.dataReceived(python_to_redis(['SUBSCRIBE', 'news']))
+        # one batch for everything received in the meantime
+        assert len(calls) == 1
+        calls.pop()()
+        assert subscriber.transport.value() == python_to_redis(['subscribe', 'news', 1])
+        for index, connection in enumerate(connections[1:]):
+            request = python_to_redis(['RPUSH', 'list', 'x']) + python_to_redis(['PUBLISH', 'news', str(index)])
+            # in pieces, as it may come in
+            connection.dataReceived(request[:10])
+            connection.dataReceived(request[10:])
+        assert len(calls) == 1
+        calls.pop()()
+        for index, connection in enumerate(connections[1:]):
+            # run in the order they came in
+            assert connection.transport.value() == ':%d\r\n:1\r\n' % (index + 1)
+        assert subscriber.transport.value().count('message') == 7
+    finally:
+        io.close()
+
+
+def test_protocol_error():
+    io, calls, connections = make_connections(2)
+    try:
+        good, bad = connections
+        good.dataReceived(python_to_redis(['SET', 'a', '1']))
+        bad.dataReceived(python_to_redis(['SET', 'b', '1']) + '*1\r\n@oops\r\n')
+        calls.pop()()
+        assert good.transport.value() == '+OK\r\n'
+        # what came before the error has been run
+        assert bad.transport.value() == '+OK\r\n' and bad.transport.disconnecting
+    finally:
+        io.close()
@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+
+import os
+
+import pytest
+
+from karton import mapped, bulk
+from karton.server import Server
+from karton.protocol import OK
+
+
+def fill(client):
+    client.do(['SET', 'string', 'value'])
+    client.do(['RPUSH', 'list'] + map(str, xrange(500)))
+    client.do(['SADD', 'intset', '1', '2', '3'])
+    client.do(['SADD', 'set', 'a', 'b'])
+    client.do(['HMSET', 'hash', 'a', '1', 'b', '2'])
+    client.do(['ZADD', 'zset', '1.5', 'a', '2', 'b'])
+    client.do(['PFADD', 'hll', 'a', 'b'])
+    client.do(['XADD', 'stream', '1-1', 'f', 'v'])
+    client.do(['SET', 'weight_a', '2'])
+    client.do(['SET', 'weight_b', '1'])
+    client.do(['SELECT', '3'])
+    client.do(['SET', 'other', 'db'])
+    client.do(['SELECT', '0'])
+
+
+def replies(client):
+    return [client.do(command) for command in [
+        ['GET', 'string'], ['LRANGE', 'list', '0', '-1'], ['SMEMBERS', 'intset'], ['HGETALL', 'hash'],
+        ['ZRANGE', 'zset', '0', '-1', 'WITHSCORES'], ['PFCOUNT', 'hll'], ['XRANGE', 'stream', '-', '+'],
+        ['TYPE', 'set'], ['SORT', 'set', 'BY', 'weight_*', 'ALPHA'],
+    ]]
+
+
+def load(path):
+    server = Server()
+    snapshot = mapped.Mapped(str(path))
+    assert snapshot.load(server) == 11
+    return server, server.new_client(('127.0.0.1', 0))
+
+
+def test_mapped(tmpdir):
+    path = tmpdir.join('snapshot')
+    original = Server()
+    client = original.new_client(('127.0.0.1', 0))
+    fill(client)
+    expected = replies(client)
+    mapped.save_path(original.dbs, str(path))
+
+    server, client = load(path)
+    # values stay cold until they're used
+    assert all(mapped.is_cold(value) for value in server.dbs[0].itervalues())
+    assert client.do(['DBSIZE']) == 10
+    assert client.do(['EXISTS', 'list']) == 1
+    assert client.do(['RENAME', 'set', 'set2']) is OK
+    assert mapped.is_cold(server.dbs[0]['list']) and mapped.is_cold(server.dbs[0]['set2'])
+    client.do(['RENAME', 'set2', 'set'])
+    assert replies(client) == expected
+    assert not mapped.is_cold(server.dbs[0]['list'])
+    assert mapped.is_cold(server.dbs[3]['other'])
+    assert client.do(['SCAN', '0', 'COUNT', '100', 'TYPE', 'hash'])[1] == ['hash']
+
+    # the walker warms up the rest, and lets go of the file
+    assert server.mapped.warm(server.dbs, 1.0)
+    server.cron()
+    assert server.mapped is None
+    assert not any(mapped.is_cold(value) for db in server.dbs for value in db.itervalues())
+    assert replies(client) == expected
+    client.do(['SELECT', '3'])
+    assert client.do(['GET', 'other']) == 'db'
+
+
+def test_mapped_save(tmpdir):
+    path = tmpdir.join('snapshot')
+    original = Server()
+    client = original.new_client(('127.0.0.1', 0))
+    fill(client)
+    expected = replies(client)
+    export = ''.join(bulk.export(original))
+    mapped.save_path(original.dbs, str(path))
+
+    # saved again, with most values cold
+    server, client = load(path)
+    server.dbfilename = str(tmpdir.join('copy'))
+    client.do(['RPUSH', 'list', 'new'])
+    assert client.do(['SAVE']) is OK
+    server, client = load(tmpdir.join('copy'))
+    assert client.do(['LINDEX', 'list', '-1']) == 'new'
+    client.do(['RPOP', 'list'])
+    assert replies(client) == expected
+    assert ''.join(bulk.export(server)) == export
+
+    assert str(Server().new_client(('127.0.0.1', 0)).do(['SAVE'])) == 'ERR no snapshot file configured'
+    path.write('garbage')
+    with pytest.raises(ValueError):
+        mapped.Mapped(str(path))
+
+
+def test_mapped_warm_while_writing(tmpdir):
+    path = tmpdir.join('snapshot')
+    original = Server()
+    client = original.new_client(('127.0.0.1', 0))
+    client.do(['MSET'] + ['key:%d' % (index // 2) if index % 2 == 0 else 'x' for index in xrange(2000)])
+    mapped.save_path(original.dbs, str(path))
+
+    server = Server()
+    snapshot = mapped.Mapped(str(path))
+    snapshot.load(server)
+    client = server.new_client(('127.0.0.1', 0))
+    assert not snapshot.warm(server.dbs, 0)
+    # resized under the walker's feet
+    client.do(['MSET'] + ['new:%d' % (index // 2) if index % 2 == 0 else 'y' for index in xrange(2000)])
+    # and written to between every step, without it going back over what
+    # it's done already
+    for step in xrange(1000 // mapped.WARM_BATCH + 1):
+        if snapshot.warm(server.dbs, 0):
+            break
+        client.do(['SET', 'step:%d' % step, 'z'])
+        client.do(['DEL', 'key:%d' % (999 - step)])
+    else:
+        assert False, 'still warming up'
+    assert 1000 - step <= snapshot.warmed <= 1000
+    assert not any(mapped.is_cold(value) for value in server.dbs[0].itervalues())
@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+
+import sys
+import time
+
+from karton import memory, bigkeys
+from karton.server import Server
+from karton.intset import intset
+from karton.quicklist import quicklist
+
+
+def test_value_size():
+    assert memory.value_size('abc') == sys.getsizeof('abc')
+    members = set('member:%d' % index for index in xrange(100))
+    exact = sys.getsizeof(members) + sum(map(sys.getsizeof, members))
+    assert memory.value_size(members, 0) == exact
+    assert abs(memory.value_size(members) - exact) < exact * 0.05
+    assert memory.value_size(intset(map(str, xrange(100)))) < memory.value_size(set(map(str, xrange(100))))
+    assert memory.value_size(quicklist(['x'] * 1000)) > 1000
+    assert memory.usage('key', 'value') > memory.value_size('value')
+
+
+def test_access_info():
+    access = memory.AccessInfo(1, 1000)
+    ht = {'a': 'x'}
+    assert access.idle(0, 'a', 1100) == 100
+    assert access.freq(0, 'a', 1100) == memory.LFU_INIT_VAL
+    for index in xrange(10000):
+        access.touch(0, ht, ['a'], 2000)
+    freq = access.freq(0, 'a', 2000)
+    assert memory.LFU_INIT_VAL < freq < 100
+    assert access.idle(0, 'a', 2030) == 30
+    # decays by one a minute
+    assert access.freq(0, 'a', 2000 + 180) == freq - 3
+    del ht['a']
+    access.touch(0, ht, ['a'], 2000)
+    assert access.dbs[0] == {}
+
+
+def test_bigkeys():
+    server = Server()
+    client = server.new_client(('127.0.0.1', 0))
+    for index in xrange(200):
+        client.do(['SET', 'string:%d' % index, 'x' * index])
+    client.do(['RPUSH', 'list'] + ['item'] * 5000)
+    client.do(['SADD', 'set', 'a'])
+    server.access.dbs[0]['set'] -= 10 << 8
+    report = bigkeys.sample(lambda commands: map(client.do, commands), top=3, count=50)
+    assert report.keys == 202
+    assert report.types['string'][0] == 200
+    assert [key for size, key in report.biggest('string')] == ['string:199', 'string:198', 'string:197']
+    assert report.biggest('list')[0][1] == 'list'
+    # the list takes most of the memory
+    assert report.share(0.01) > 0.5
+    assert 'The biggest 1% of keys' in report.format()
+    # sampling doesn't count as an access
+    assert client.do(['OBJECT', 'IDLETIME', 'set']) >= 10
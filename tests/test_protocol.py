@@ -1,6 +1,9 @@
 # -*- coding: utf-8 -*-
 
-from karton.protocol import python_to_redis, Status, Error
+import pytest
+
+from karton.protocol import python_to_redis, chunks, Status, Error, Push, Map, Stream, \
+    Reader, ReplyError, ProtocolError
 
 
 def test_python_to_redis():
@@ -36,4 +39,80 @@ def test_python_to_redis():
     assert python_to_redis([True, False, 42, 'wat']) == '*4\r\n+OK\r\n-ERR\r\n:42\r\n$3\r\nwat\r\n'
     assert python_to_redis([True, ['foo', 'bar'], True]) == '*3\r\n+OK\r\n*2\r\n$3\r\nfoo\r\n$3\r\nbar\r\n+OK\r\n'
 
+    # Push reply (RESP3)
+    assert python_to_redis(Push(['invalidate', ['foo']])) == '>2\r\n$10\r\ninvalidate\r\n*1\r\n$3\r\nfoo\r\n'
+
+    # Map reply (RESP3)
+    assert python_to_redis(Map(['proto', 3])) == '%1\r\n$5\r\nproto\r\n:3\r\n'
+
     # Not supported: NULL multi-bulk reply (*-1)
+
+
+def test_chunks():
+    items = ['x' * 100] * 1000
+    stream = Stream(len(items), iter(items))
+    pieces = list(chunks(stream, size=4096))
+    assert len(pieces) > 10
+    assert ''.join(pieces) == python_to_redis(items)
+    assert list(chunks('foo')) == ['$3\r\nfoo\r\n']
+
+
+def read_all(reader, data, step=None):
+    step = step or len(data)
+    messages = []
+    for start in xrange(0, len(data), step):
+        reader.feed(data[start:start+step])
+        message = reader.gets()
+        while message is not False:
+            messages.append(message)
+            message = reader.gets()
+    return messages
+
+
+def test_reader_requests():
+    requests = [['SET', 'key', 'value'], ['GET', ''], ['SET', 'x', 'a\r\nb\0' * 100], ['PING']]
+    data = ''.join(map(python_to_redis, requests))
+    for step in (1, 2, 7, 100, None):
+        reader = Reader()
+        assert read_all(reader, data, step) == requests
+        assert not reader.has_data()
+
+    # inline commands; empty lines and empty multi bulks are skipped
+    reader = Reader()
+    assert read_all(reader, 'PING\r\n\r\nSET  a b\n*0\r\nGET a\r\n') == [['PING'], ['SET', 'a', 'b'], ['GET', 'a']]
+    reader.feed('*2\r\n$3\r\nGET\r\n$1\r')
+    assert reader.gets() is False
+    assert reader.has_data()
+
+
+def test_reader_like_hiredis():
+    # Reader stands in for hiredis where it's missing (PyPy)
+    hiredis = pytest.importorskip('hiredis')
+    # over enough input to be compacted along the way
+    data = ''.join(python_to_redis(['SET', 'key:%d' % index, 'v' * (index % 50)]) for index in xrange(10000))
+    assert read_all(Reader(), data, 4096) == read_all(hiredis.Reader(), data)
+
+
+def test_reader_errors():
+    for data, message in [
+            ('*x\r\n', 'invalid multibulk length'),
+            ('*1\r\n$-1\r\n', 'invalid bulk length'),
+            ('*1\r\n:1\r\n', "expected '$', got ':'"),
+            ('*1\r\n$1\r\nab\r\n', 'not terminated by CRLF'),
+            ('x' * 70000, 'too big inline request')]:
+        reader = Reader()
+        reader.feed(data)
+        with pytest.raises(ProtocolError) as info:
+            reader.gets()
+        assert message in str(info.value)
+
+
+def test_reader_replies():
+    data = '+OK\r\n-ERR oops\r\n:42\r\n$-1\r\n*-1\r\n*0\r\n$3\r\nfoo\r\n*2\r\n*2\r\n:1\r\n$1\r\na\r\n*1\r\n+b\r\n'
+    for step in (1, 5, None):
+        replies = read_all(Reader(replies=True), data, step)
+        assert replies[0] == 'OK'
+        assert isinstance(replies[1], ReplyError) and str(replies[1]) == 'ERR oops'
+        assert replies[2:] == [42, None, None, [], 'foo', [[1, 'a'], ['b']]]
+    with pytest.raises(ProtocolError):
+        read_all(Reader(replies=True), '?\r\n')
@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+
+import random
+
+from karton import quicklist as ql
+from karton.quicklist import quicklist
+
+
+def test_ends():
+    items = quicklist()
+    for i in xrange(1000):
+        items.append(str(i))
+        items.appendleft(str(-i))
+    assert len(items) == 2000
+    assert items[0] == '-999'
+    assert items[-1] == '999'
+    assert items[1000] == '0'
+    assert items.pop() == '999'
+    assert items.popleft() == '-999'
+    assert items.pop(0) == '-998'
+    assert len(items) == 1997
+    assert list(reversed(items))[:2] == ['998', '997']
+
+
+def test_against_list():
+    random.seed(42)
+    reference = []
+    items = quicklist()
+    for step in xrange(5000):
+        value = random.choice(['a', 'bb', 'x' * 300, '', str(step)])
+        op = random.randint(0, 7)
+        if op == 0:
+            items.append(value)
+            reference.append(value)
+        elif op == 1:
+            items.appendleft(value)
+            reference.insert(0, value)
+        elif op == 2 and reference:
+            index = random.randint(-len(reference), len(reference) - 1)
+            assert items.pop(index) == reference.pop(index)
+        elif op == 3:
+            index = random.randint(-5, len(reference) + 5)
+            items.insert(index, value)
+            reference.insert(index, value)
+        elif op == 4 and reference:
+            index = random.randrange(len(reference))
+            items[index] = value
+            reference[index] = value
+        elif op == 5:
+            count = random.randint(-2, 2)
+            removed = items.remove(value, count)
+            if count >= 0:
+                for _ in xrange(removed):
+                    reference.remove(value)
+            else:
+                reference.reverse()
+                for _ in xrange(removed):
+                    reference.remove(value)
+                reference.reverse()
+        elif op == 6 and random.random() < 0.05:
+            start = random.randint(-10, 10)
+            stop = random.randint(-10, len(reference) + 10)
+            items.trim(start, stop)
+            reference = reference[start:stop]
+        else:
+            items.extend([value] * 50)
+            reference.extend([value] * 50)
+        assert len(items) == len(reference)
+    assert list(items) == reference
+    assert items[10:200] == reference[10:200]
+
+
+def test_big_values_and_chunks():
+    items = quicklist(['x' * (ql.CHUNK_BYTES * 2), 'a', 'b'])
+    assert len(items._chunks) == 2
+    items = quicklist(map(str, xrange(ql.CHUNK_ENTRIES * 10)))
+    assert len(items._chunks) == 10
+    del items[-ql.CHUNK_ENTRIES * 3:]
+    assert len(items._chunks) == 7
+
+
+def test_find():
+    items = quicklist(['a', 'b', 'a', 'c', 'a'] * 100)
+    assert list(items.find('a'))[:4] == [0, 2, 4, 5]
+    assert list(items.find('a', reverse=True))[:4] == [499, 497, 495, 494]
+    assert list(items.find('c', maxlen=10)) == [3, 8]
+    assert list(items.find('c', reverse=True, maxlen=10)) == [498, 493]
+    assert list(items.find('zzz')) == []
+    assert items.index('c') == 3
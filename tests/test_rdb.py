@@ -0,0 +1,237 @@
+# -*- coding: utf-8 -*-
+
+import struct
+import time
+from cStringIO import StringIO
+
+import pytest
+
+from karton import rdb
+from karton.intset import intset
+from karton.quicklist import quicklist
+from karton.sorteddict import sorteddict
+from karton.stream import stream
+from karton.server import Server
+from karton.protocol import OK
+
+
+def string(value):
+    return rdb._string(value)
+
+
+def length(value):
+    return rdb._length(value)
+
+
+def make_ziplist(entries):
+    body = ''
+    previous = 0
+    for entry in entries:
+        if isinstance(entry, int):
+            if 0 <= entry <= 12:
+                encoded = chr(0xf1 + entry)
+            elif -128 <= entry < 128:
+                encoded = '\xfe' + struct.pack('<b', entry)
+            else:
+                encoded = '\xc0' + struct.pack('<h', entry)
+        else:
+            encoded = chr(len(entry)) + entry
+        raw = chr(previous) + encoded
+        body += raw
+        previous = len(raw)
+    return struct.pack('<IIH', 10 + len(body) + 1, 0, len(entries)) + body + '\xff'
+
+
+def make_zipmap(pairs):
+    body = ''
+    for key, value in pairs:
+        # one byte of free space after every value
+        body += chr(len(key)) + key + chr(len(value)) + '\x01' + value + '\x00'
+    return chr(len(pairs)) + body + '\xff'
+
+
+def make_rdb(*records):
+    aux = chr(rdb.OPCODE_AUX) + string('redis-ver') + string('7.2.0')
+    return StringIO('REDIS0011' + aux + ''.join(records) + chr(rdb.OPCODE_EOF) + '\0' * 8)
+
+
+def test_crc64():
+    assert rdb.crc64('123456789') == 0xe9c6d914c4b8d9ca
+
+
+def test_lzf():
+    compressed = '\x02abc' + '\xe0\x00\x02' + '\x00!'
+    assert rdb.lzf_decompress(compressed, 13) == 'abcabcabcabc!'
+    with pytest.raises(ValueError):
+        rdb.lzf_decompress(compressed, 14)
+    with pytest.raises(ValueError):
+        rdb.lzf_decompress('\x20\x05', 2)
+
+
+def test_listpack():
+    values = ['a', '0', '127', '128', '-4096', '4095', '70000', '-12345678901', 'x' * 100, 'y' * 5000, '007']
+    assert rdb.listpack(rdb.make_listpack(values)) == values
+
+
+def test_encoding_sizes():
+    ziplist = make_ziplist(['a', 5, 'bc'])
+    listpack = rdb.make_listpack(['a', 'b'])
+    zipmap = make_zipmap([('a', 'b')])
+    assert rdb.ziplist(ziplist) == ['a', '5', 'bc']
+    assert rdb.zipmap(zipmap) == ['a', 'b']
+    for parse, blob in [(rdb.ziplist, ziplist), (rdb.listpack, listpack), (rdb.zipmap, zipmap)]:
+        # truncated, or with an entry running past the end
+        for broken in (blob[:-2] + '\xff', blob[:len(blob) // 2], blob + '\xff'):
+            with pytest.raises((ValueError, IndexError, struct.error)):
+                parse(broken)
+    assert len(rdb._intset(struct.pack('<II', 2, 2) + struct.pack('<hh', 1, 2))) == 2
+    # a huge length isn't trusted
+    with pytest.raises(ValueError):
+        rdb._intset(struct.pack('<II', 8, 0x7fffffff) + '\0' * 22)
+
+
+def test_load_encodings():
+    future = int((time.time() + 3600) * 1000)
+    intset_blob = struct.pack('<II3h', 2, 3, -3, 1, 700)
+    lzf = '\x02abc\xe0\x00\x02'
+    file = make_rdb(
+        chr(rdb.OPCODE_SELECTDB) + length(0),
+        chr(rdb.OPCODE_RESIZEDB) + length(14) + length(2),
+        '\x00' + string('plain') + string('value'),
+        '\x00' + string('int') + '\xc1' + struct.pack('<h', -300),
+        '\x00' + string('lzf') + '\xc3' + length(len(lzf)) + length(12) + lzf,
+        '\x01' + string('linked') + length(2) + string('a') + string('b'),
+        '\x0a' + string('ziplist') + string(make_ziplist(['a', 5, -100, 1000])),
+        '\x0e' + string('quicklist') + length(2) + string(make_ziplist(['a', 'b'])) + string(make_ziplist(['c'])),
+        '\x12' + string('quicklist2') + length(2) + '\x02' + string(rdb.make_listpack(['a', '1'])) +
+        '\x01' + string('plain node'),
+        '\x0b' + string('intset') + string(intset_blob),
+        '\x14' + string('setlistpack') + string(rdb.make_listpack(['a', 'b'])),
+        '\x09' + string('zipmap') + string(make_zipmap([('f1', 'v1'), ('f2', 'v2')])),
+        '\x0d' + string('hashziplist') + string(make_ziplist(['f', 1])),
+        '\x03' + string('zset') + length(2) + string('a') + '\x031.5' + string('b') + '\xfe',
+        '\x0c' + string('zsetziplist') + string(make_ziplist(['a', 2, 'b', '-0.5'])),
+        chr(rdb.OPCODE_EXPIRETIME_MS) + struct.pack('<q', 1000) + '\x00' + string('expired') + string('x'),
+        chr(rdb.OPCODE_EXPIRETIME_MS) + struct.pack('<q', future) + chr(rdb.OPCODE_FREQ) + '\x05' +
+        '\x00' + string('expiring') + string('x'),
+        chr(rdb.OPCODE_SELECTDB) + length(2),
+        '\x00' + string('other') + string('db'),
+    )
+    server = Server()
+    assert rdb.load(server, file) == (15, 1)
+    db = server.dbs[0]
+    assert db['plain'] == 'value'
+    assert db['int'] == '-300'
+    assert db['lzf'] == 'abcabcabcabc'
+    assert isinstance(db['linked'], quicklist) and list(db['linked']) == ['a', 'b']
+    assert list(db['ziplist']) == ['a', '5', '-100', '1000']
+    assert list(db['quicklist']) == ['a', 'b', 'c']
+    assert list(db['quicklist2']) == ['a', '1', 'plain node']
+    assert isinstance(db['intset'], intset) and list(db['intset']) == ['-3', '1', '700']
+    assert db['setlistpack'] == set(['a', 'b'])
+    assert db['zipmap'] == {'f1': 'v1', 'f2': 'v2'}
+    assert db['hashziplist'] == {'f': '1'}
+    assert isinstance(db['zset'], sorteddict) and list(db['zset'].scoreitems(0, 2)) == [(1.5, 'a'), (float('inf'), 'b')]
+    assert list(db['zsetziplist'].scoreitems(0, 2)) == [(-0.5, 'b'), (2.0, 'a')]
+    assert 'expired' not in db
+    assert db['expiring'] == 'x'
+    assert server.dbs[2] == {'other': 'db'}
+
+    with pytest.raises(ValueError):
+        rdb.load(server, StringIO('REDIS0099'))
+    with pytest.raises(ValueError):
+        rdb.load(server, make_rdb('\x06' + string('module') + length(0)))
+
+
+def test_load_stream():
+    master = struct.pack('>QQ', 1000, 0)
+    entries = rdb.make_listpack([
+        # master entry: 2 live, 1 deleted, master fields, terminator
+        '2', '1', '1', 'f', '0',
+        # same fields as the master entry
+        '2', '0', '0', 'v1', '4',
+        # deleted
+        '3', '0', '1', 'v2', '4',
+        # fields of its own
+        '0', '5', '0', '2', 'a', 'b', 'c', 'd', '8',
+    ])
+    pel_id = struct.pack('>QQ', 1005, 0)
+    file = make_rdb(
+        '\x13' + string('stream') + length(1) + string(master) + string(entries) +
+        # length, last ID, first ID, max deleted ID, entries added
+        length(2) + length(1005) + length(0) + length(1000) + length(0) + length(1000) + length(1) + length(3) +
+        # one group, with one pending entry delivered to one consumer
+        length(1) + string('group') + length(1005) + length(0) + length(2) +
+        length(1) + pel_id + struct.pack('<q', 123) + length(2) +
+        length(1) + string('alice') + struct.pack('<q', 456) + length(1) + pel_id,
+    )
+    server = Server()
+    assert rdb.load(server, file) == (1, 0)
+    value = server.dbs[0]['stream']
+    assert isinstance(value, stream)
+    assert list(value.range()) == [((1000, 0), ['f', 'v1']), ((1005, 0), ['a', 'b', 'c', 'd'])]
+    assert value.last_id == (1005, 0)
+    group = value.groups['group']
+    assert group.last_id == (1005, 0)
+    assert group.pel[(1005, 0)].consumer == 'alice'
+    assert group.pel[(1005, 0)].count == 2
+    assert group.consumers['alice'].pending == set([(1005, 0)])
+
+
+def test_dump_restore():
+    server = Server()
+    client = server.new_client(('127.0.0.1', 0))
+    # the example from the Redis documentation
+    payload = '\x00\xc0\n\t\x00\xbem\x06\x89Z(\x00\n'
+    assert client.do(['RESTORE', 'ten', '0', payload]) is OK
+    assert client.do(['GET', 'ten']) == '10'
+    assert str(client.do(['RESTORE', 'ten', '0', payload])).startswith('BUSYKEY')
+    assert client.do(['RESTORE', 'ten', '0', payload, 'REPLACE']) is OK
+    broken = payload[:-1] + 'x'
+    assert str(client.do(['RESTORE', 'broken', '0', broken])) == 'ERR DUMP payload version or checksum are wrong'
+    # nor is a zero checksum taken for none
+    unchecked = payload[:-8] + '\0' * 8
+    assert str(client.do(['RESTORE', 'broken', '0', unchecked])) == 'ERR DUMP payload version or checksum are wrong'
+    huge = chr(rdb.TYPE_SET_INTSET) + string(struct.pack('<II', 8, 0x7fffffff) + '\0' * 8) + '\x0a\x00'
+    huge += struct.pack('<Q', rdb.crc64(huge))
+    assert str(client.do(['RESTORE', 'huge', '0', huge])).startswith('ERR')
+
+    client.do(['SET', 'string', 'value'])
+    client.do(['RPUSH', 'list'] + map(str, xrange(500)))
+    client.do(['SADD', 'intset', '1', '-70000', '5000000000'])
+    client.do(['SADD', 'set', 'a', 'b'])
+    client.do(['HMSET', 'hash', 'a', '1', 'b', '2'])
+    client.do(['HMSET', 'bighash', 'a', 'x' * 100])
+    client.do(['ZADD', 'zset', '1.5', 'a', '-inf', 'b', '0.1', 'c'])
+    client.do(['ZADD', 'bigzset'] + [item for index in xrange(200) for item in (str(index), 'm%d' % index)])
+    client.do(['PFADD', 'hll', 'a', 'b'])
+    client.do(['XADD', 'stream', '1-1', 'f', 'v'])
+    client.do(['XGROUP', 'CREATE', 'stream', 'group', '0'])
+    client.do(['XREADGROUP', 'GROUP', 'group', 'alice', 'STREAMS', 'stream', '>'])
+    for key in ['string', 'list', 'intset', 'set', 'hash', 'bighash', 'zset', 'bigzset', 'hll', 'stream']:
+        payload = client.do(['DUMP', key])
+        assert client.do(['RESTORE', key + ':copy', '0', payload]) is OK
+        assert client.do(['DUMP', key + ':copy']) == payload
+    assert client.do(['DUMP', 'nope']) is None
+    assert isinstance(server.dbs[0]['intset:copy'], intset)
+    assert client.do(['LRANGE', 'list:copy', '0', '-1']) == client.do(['LRANGE', 'list', '0', '-1'])
+    assert client.do(['ZRANGE', 'zset:copy', '0', '-1', 'WITHSCORES']) == \
+        client.do(['ZRANGE', 'zset', '0', '-1', 'WITHSCORES'])
+    assert client.do(['PFCOUNT', 'hll:copy']) == 2
+    assert client.do(['XPENDING', 'stream:copy', 'group'])[3] == [['alice', '1']]
+
+
+def test_save_and_load():
+    server = Server()
+    client = server.new_client(('127.0.0.1', 0))
+    client.do(['SET', 'a', '1'])
+    client.do(['RPUSH', 'list', 'x', 'y'])
+    client.do(['SELECT', '5'])
+    client.do(['SADD', 'set', 'm'])
+    file = StringIO()
+    rdb.save(server.dbs, file)
+    copy = Server()
+    assert rdb.load(copy, StringIO(file.getvalue())) == (3, 0)
+    assert copy.dbs[0]['a'] == '1'
+    assert list(copy.dbs[0]['list']) == ['x', 'y']
+    assert list(copy.dbs[5]['set']) == ['m']
@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+
+from karton.server import Server
+from karton.replycache import ReplyCache
+from karton.protocol import Encoded, python_to_redis
+
+
+def make_client(max_bytes=1024**2):
+    server = Server()
+    server.reply_cache = ReplyCache(max_bytes)
+    return server, server.new_client(('127.0.0.1', 0))
+
+
+def test_reply_cache():
+    server, client = make_client()
+    cache = server.reply_cache
+    client.do(['SET', 'string', 'value'])
+    client.do(['HMSET', 'hash', 'a', '1', 'b', '2'])
+    assert client.do(['GET', 'string']) == Encoded(['$5\r\nvalue\r\n'])
+    assert (cache.hits, cache.misses) == (0, 1)
+    reply = client.do(['GET', 'string'])
+    assert reply is client.do(['GET', 'string'])
+    assert cache.hits == 2
+    hgetall = client.do(['HGETALL', 'hash'])
+    assert ''.join(hgetall) == python_to_redis(server.dbs[0]['hash'].items()[0] + server.dbs[0]['hash'].items()[1])
+    assert client.do(['HGETALL', 'hash']) is hgetall
+    # misses and errors aren't cached
+    assert client.do(['GET', 'nope']) is None
+    assert isinstance(client.do(['GET', 'hash']), Exception)
+    assert len(cache.entries) == 2
+
+    # writes invalidate, in the right db only
+    client.do(['SELECT', '1'])
+    client.do(['SET', 'string', 'other'])
+    client.do(['SELECT', '0'])
+    assert client.do(['GET', 'string']) is reply
+    client.do(['APPEND', 'string', '!'])
+    assert ''.join(client.do(['GET', 'string'])) == '$6\r\nvalue!\r\n'
+    client.do(['HSET', 'hash', 'c', '3'])
+    assert len(''.join(client.do(['HGETALL', 'hash']))) > len(''.join(hgetall))
+    client.do(['RENAME', 'string', 'renamed'])
+    assert client.do(['GET', 'string']) is None
+    assert ''.join(client.do(['GET', 'renamed'])) == '$6\r\nvalue!\r\n'
+    client.do(['FLUSHDB'])
+    assert cache.entries == {} and cache.bytes == 0
+
+    info = client.do(['INFO'])
+    assert 'reply_cache_hits:4' in info
+    assert 'reply_cache_bytes:0' in info
+
+
+def test_reply_cache_eviction():
+    server, client = make_client(max_bytes=1000)
+    cache = server.reply_cache
+    for index in xrange(20):
+        client.do(['SET', 'key:%d' % index, 'x' * 90])
+        client.do(['GET', 'key:%d' % index])
+    assert cache.bytes <= 1000
+    assert cache.evicted == 10
+    assert (0, 'key:9') not in cache.entries and (0, 'key:10') in cache.entries
+    # recently used keys stay
+    client.do(['GET', 'key:10'])
+    client.do(['SET', 'key:20', 'y' * 90])
+    client.do(['GET', 'key:20'])
+    assert (0, 'key:10') in cache.entries and (0, 'key:11') not in cache.entries
+    # too big to cache
+    client.do(['SET', 'big', 'x' * 2000])
+    assert client.do(['GET', 'big']) == 'x' * 2000
+    assert cache.bytes == sum(len(reply[0]) for entry in cache.entries.values() for reply in entry.replies.values())
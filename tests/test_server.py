@@ -0,0 +1,713 @@
+# -*- coding: utf-8 -*-
+
+import time
+
+from karton.server import Server
+from karton.protocol import OK, Stream, Push, Map
+
+
+def make_client():
+    server = Server()
+    return server, server.new_client(('127.0.0.1', 0))
+
+
+def test_unlink():
+    server, client = make_client()
+    client.do(['SADD', 'big'] + map(str, xrange(10000)))
+    client.do(['SADD', 'small', 'a', 'b'])
+    assert client.do(['UNLINK', 'big', 'small', 'nope']) == 2
+    assert client.do(['EXISTS', 'big']) == 0
+    # only the big one is worth deferring
+    assert server.lazyfree.pending == 1
+    assert server.lazyfree.step(budget=5000) == 1
+    assert server.lazyfree.step(budget=5000) == 0
+    assert server.lazyfree.freed == 1
+
+
+def test_flush_async():
+    server, client = make_client()
+    client.do(['SET', 'foo', 'bar'])
+    client.do(['RPUSH', 'list'] + map(str, xrange(1000)))
+    client.do(['SELECT', '1'])
+    client.do(['SET', 'foo', 'baz'])
+    assert client.do(['FLUSHDB', 'ASYNC']) is OK
+    assert client.do(['DBSIZE']) == 0
+    client.do(['SELECT', '0'])
+    assert client.do(['GET', 'foo']) == 'bar'
+    assert client.do(['FLUSHALL', 'async']) is OK
+    assert client.do(['DBSIZE']) == 0
+    # the old db 1 plus all sixteen current ones
+    assert server.lazyfree.pending == 17
+    client.do(['SET', 'foo', 'new'])
+    server.cron()
+    assert server.lazyfree.pending == 0
+    assert client.do(['GET', 'foo']) == 'new'
+
+
+def check_zstore(client):
+    client.do(['ZADD', 'z1', '1', 'a', '2', 'b', '3', 'c'])
+    client.do(['ZADD', 'z2', '10', 'b', '20', 'c', '30', 'd'])
+    client.do(['SADD', 's', 'c', 'd'])
+    assert client.do(['ZUNIONSTORE', 'out', '2', 'z1', 'z2']) == 4
+    assert client.do(['ZRANGE', 'out', '0', '-1', 'WITHSCORES']) == \
+        ['a', '1', 'b', '12', 'c', '23', 'd', '30']
+    assert client.do(['ZUNIONSTORE', 'out', '2', 'z1', 'z2', 'WEIGHTS', '2', '0.5', 'AGGREGATE', 'MAX']) == 4
+    assert client.do(['ZRANGE', 'out', '0', '-1', 'WITHSCORES']) == \
+        ['a', '2', 'b', '5', 'c', '10', 'd', '15']
+    assert client.do(['ZINTERSTORE', 'out', '3', 'z1', 'z2', 's', 'AGGREGATE', 'MIN']) == 1
+    assert client.do(['ZRANGE', 'out', '0', '-1', 'WITHSCORES']) == ['c', '1']
+    assert client.do(['ZINTERSTORE', 'out', '2', 'z1', 'nope']) == 0
+    assert client.do(['EXISTS', 'out']) == 0
+    assert client.do(['TYPE', 'z1']) == 'zset'
+
+
+def test_zstore():
+    server, client = make_client()
+    check_zstore(client)
+
+
+def test_zstore_without_numpy(monkeypatch):
+    from karton import zsetops
+    monkeypatch.setattr(zsetops, 'numpy', None)
+    server, client = make_client()
+    check_zstore(client)
+
+
+def test_set_algebra():
+    server, client = make_client()
+    client.do(['SADD', 'ints', '1', '2', '3', '4'])
+    client.do(['SADD', 'more', '3', '4', '5'])
+    client.do(['SADD', 'words', 'a', '3', '4'])
+    assert type(server.dbs[0]['ints']).__name__ == 'intset'
+    assert type(server.dbs[0]['words']).__name__ == 'set'
+    assert sorted(client.do(['SINTER', 'ints', 'more'])) == ['3', '4']
+    assert sorted(client.do(['SINTER', 'ints', 'more', 'words'])) == ['3', '4']
+    assert sorted(client.do(['SINTER', 'ints', 'missing'])) == []
+    assert sorted(client.do(['SUNION', 'ints', 'missing', 'more'])) == ['1', '2', '3', '4', '5']
+    assert sorted(client.do(['SDIFF', 'ints', 'more', 'missing'])) == ['1', '2']
+    assert client.do(['SINTERCARD', '2', 'ints', 'more']) == 2
+    assert client.do(['SINTERCARD', '2', 'ints', 'more', 'LIMIT', '1']) == 1
+    assert client.do(['SINTERCARD', '2', 'words', 'more', 'LIMIT', '1']) == 1
+    assert 'missing' not in server.dbs[0]
+    # in place when the destination is one of the sources
+    words = server.dbs[0]['words']
+    assert client.do(['SUNIONSTORE', 'words', 'words', 'more']) == 4
+    assert server.dbs[0]['words'] is words
+    assert client.do(['SDIFFSTORE', 'words', 'words', 'ints']) == 2
+    assert sorted(client.do(['SMEMBERS', 'words'])) == ['5', 'a']
+    assert client.do(['SINTERSTORE', 'out', 'ints', 'more']) == 2
+    assert type(server.dbs[0]['out']).__name__ == 'intset'
+    assert client.do(['SINTERSTORE', 'out', 'ints', 'missing']) == 0
+    assert client.do(['EXISTS', 'out']) == 0
+    # outgrowing the compact encoding
+    client.do(['SADD', 'ints', 'x'])
+    assert type(server.dbs[0]['ints']).__name__ == 'set'
+    assert client.do(['SCARD', 'ints']) == 5
+
+
+def test_sort():
+    server, client = make_client()
+    client.do(['RPUSH', 'ids', '3', '1', '10', '2'])
+    client.do(['MSET', 'w_1', '40', 'w_2', '30', 'w_3', '20', 'w_10', '10'])
+    client.do(['HSET', 'h_1', 'name', 'one'])
+    client.do(['HSET', 'h_2', 'name', 'two'])
+    assert client.do(['SORT', 'ids']) == ['1', '2', '3', '10']
+    assert client.do(['SORT', 'ids', 'DESC']) == ['10', '3', '2', '1']
+    assert client.do(['SORT', 'ids', 'ALPHA']) == ['1', '10', '2', '3']
+    assert client.do(['SORT', 'ids', 'LIMIT', '1', '2']) == ['2', '3']
+    assert client.do(['SORT', 'ids', 'BY', 'w_*']) == ['10', '3', '2', '1']
+    assert client.do(['SORT', 'ids', 'BY', 'nosort']) == ['3', '1', '10', '2']
+    assert client.do(['SORT', 'ids', 'BY', 'w_*', 'GET', '#', 'GET', 'h_*->name', 'LIMIT', '2', '5']) == \
+        ['2', 'two', '1', 'one']
+    assert client.do(['SORT', 'ids', 'GET', 'w_*', 'STORE', 'out']) == 4
+    assert client.do(['LRANGE', 'out', '0', '-1']) == ['40', '30', '20', '10']
+    client.do(['SADD', 'words', 'b', 'a'])
+    assert isinstance(client.do(['SORT', 'words']), AssertionError)
+    assert client.do(['SORT', 'words', 'ALPHA']) == ['a', 'b']
+    assert client.do(['SORT', 'missing']) == []
+    # partial selection path
+    client.do(['RPUSH', 'many'] + map(str, xrange(1000, 0, -1)))
+    assert client.do(['SORT', 'many', 'LIMIT', '5', '3']) == ['6', '7', '8']
+    assert client.do(['SORT', 'many', 'LIMIT', '5', '3', 'DESC']) == ['995', '994', '993']
+
+
+def test_lists():
+    server, client = make_client()
+    assert client.do(['RPUSH', 'list', 'a', 'b', 'c', 'a', 'b', 'c']) == 6
+    assert client.do(['LPUSH', 'list', 'z', 'y']) == 8
+    assert client.do(['LRANGE', 'list', '0', '-1']) == ['y', 'z', 'a', 'b', 'c', 'a', 'b', 'c']
+    assert client.do(['LPOS', 'list', 'c']) == 4
+    assert client.do(['LPOS', 'list', 'c', 'RANK', '-1']) == 7
+    assert client.do(['LPOS', 'list', 'c', 'COUNT', '0']) == [4, 7]
+    assert client.do(['LPOS', 'list', 'c', 'MAXLEN', '3']) is None
+    assert client.do(['LREM', 'list', '-1', 'a']) == 1
+    assert client.do(['LRANGE', 'list', '0', '-1']) == ['y', 'z', 'a', 'b', 'c', 'b', 'c']
+    assert client.do(['LTRIM', 'list', '1', '-2']) is OK
+    assert client.do(['LRANGE', 'list', '0', '-1']) == ['z', 'a', 'b', 'c', 'b']
+    assert client.do(['LMOVE', 'list', 'other', 'LEFT', 'RIGHT']) == 'z'
+    assert client.do(['RPOPLPUSH', 'list', 'other']) == 'b'
+    assert client.do(['LRANGE', 'other', '0', '-1']) == ['b', 'z']
+    assert client.do(['LMOVE', 'other', 'other', 'RIGHT', 'LEFT']) == 'z'
+    assert client.do(['LRANGE', 'other', '0', '-1']) == ['z', 'b']
+    client.do(['LTRIM', 'other', '1', '0'])
+    assert client.do(['EXISTS', 'other']) == 0
+
+
+def test_pf():
+    server, client = make_client()
+    assert client.do(['PFADD', 'hll', 'a', 'b', 'c']) == 1
+    assert client.do(['PFADD', 'hll', 'a']) == 0
+    assert client.do(['PFCOUNT', 'hll']) == 3
+    assert client.do(['PFADD', 'other', 'c', 'd']) == 1
+    assert client.do(['PFCOUNT', 'hll', 'other', 'missing']) == 4
+    assert client.do(['PFMERGE', 'merged', 'hll', 'other']) is OK
+    assert client.do(['PFCOUNT', 'merged']) == 4
+    assert client.do(['TYPE', 'merged']) == 'string'
+    # round trip through a plain string
+    client.do(['SET', 'copy', client.do(['GET', 'merged'])])
+    assert client.do(['PFCOUNT', 'copy']) == 4
+    client.do(['SET', 'junk', 'foo'])
+    assert isinstance(client.do(['PFADD', 'junk', 'a']), AssertionError)
+
+
+def test_pf_as_string():
+    server, client = make_client()
+    client.do(['PFADD', 'hll', 'a', 'b', 'c'])
+    raw = client.do(['GET', 'hll'])
+    # every string command sees the same bytes
+    assert client.do(['MGET', 'hll', 'missing']) == [raw, None]
+    assert client.do(['STRLEN', 'hll']) == len(raw)
+    assert client.do(['GETRANGE', 'hll', '0', '3']) == 'HYLL'
+    client.do(['PFADD', 'other', 'x'])
+    old = client.do(['GET', 'other'])
+    assert client.do(['GETSET', 'other', 'plain']) == old and old.startswith('HYLL')
+    client.do(['PFADD', 'appended', 'a'])
+    before = client.do(['GET', 'appended'])
+    assert client.do(['APPEND', 'appended', 'xyz']) == len(before) + 3
+    assert client.do(['GET', 'appended']) == before + 'xyz'
+    client.do(['PFADD', 'ranged', 'a'])
+    before = client.do(['GET', 'ranged'])
+    assert client.do(['SETRANGE', 'ranged', '0', 'HYLX']) == len(before)
+    assert client.do(['GET', 'ranged']) == 'HYLX' + before[4:]
+    client.do(['RPUSH', 'list', 'a'])
+    assert str(client.do(['STRLEN', 'list'])).startswith('WRONGTYPE')
+    assert client.do(['SETRANGE', 'padded', '3', 'x']) == 4
+    assert client.do(['GET', 'padded']) == '\0\0\0x'
+
+
+def test_streams():
+    server, client = make_client()
+    assert client.do(['XADD', 's', '1-1', 'a', '1']) == '1-1'
+    assert client.do(['XADD', 's', '1-*', 'b', '2']) == '1-2'
+    assert isinstance(client.do(['XADD', 's', '1-1', 'c', '3']), AssertionError)
+    for ms in xrange(2, 300):
+        client.do(['XADD', 's', str(ms), 'n', str(ms)])
+    assert client.do(['XLEN', 's']) == 300
+    assert client.do(['TYPE', 's']) == 'stream'
+    assert client.do(['XRANGE', 's', '-', '1']) == [['1-1', ['a', '1']], ['1-2', ['b', '2']]]
+    assert client.do(['XRANGE', 's', '(1-2', '+', 'COUNT', '2']) == [['2-0', ['n', '2']], ['3-0', ['n', '3']]]
+    assert client.do(['XREVRANGE', 's', '+', '-', 'COUNT', '1']) == [['299-0', ['n', '299']]]
+    assert client.do(['XDEL', 's', '2-0', '2-0', '1000-0']) == 1
+    assert client.do(['XRANGE', 's', '2', '2']) == []
+    assert client.do(['XTRIM', 's', 'MAXLEN', '100']) == 199
+    assert client.do(['XRANGE', 's', '-', '+', 'COUNT', '1']) == [['200-0', ['n', '200']]]
+    # approximate trimming only drops whole nodes
+    client.do(['XADD', 's', 'MAXLEN', '~', '10', '*', 'x', 'y'])
+    assert 10 <= client.do(['XLEN', 's']) <= 101
+    assert client.do(['XADD', 'nope', 'NOMKSTREAM', '*', 'a', 'b']) is None
+    assert client.do(['EXISTS', 'nope']) == 0
+
+
+def test_stream_groups():
+    server, client = make_client()
+    assert isinstance(client.do(['XGROUP', 'CREATE', 's', 'g', '$']), AssertionError)
+    assert client.do(['XGROUP', 'CREATE', 's', 'g', '$', 'MKSTREAM']) is OK
+    client.do(['XADD', 's', '1-0', 'a', '1'])
+    client.do(['XADD', 's', '2-0', 'b', '2'])
+    reply = client.do(['XREADGROUP', 'GROUP', 'g', 'alice', 'COUNT', '1', 'STREAMS', 's', '>'])
+    assert reply == [['s', [['1-0', ['a', '1']]]]]
+    reply = client.do(['XREADGROUP', 'GROUP', 'g', 'bob', 'STREAMS', 's', '>'])
+    assert reply == [['s', [['2-0', ['b', '2']]]]]
+    assert client.do(['XREADGROUP', 'GROUP', 'g', 'bob', 'STREAMS', 's', '>']) is None
+    # history of own pending entries
+    reply = client.do(['XREADGROUP', 'GROUP', 'g', 'alice', 'STREAMS', 's', '0'])
+    assert reply == [['s', [['1-0', ['a', '1']]]]]
+    assert client.do(['XPENDING', 's', 'g']) == [2, '1-0', '2-0', [['alice', '1'], ['bob', '1']]]
+    pending = client.do(['XPENDING', 's', 'g', '-', '+', '10', 'alice'])
+    assert [(id, consumer, count) for id, consumer, idle, count in pending] == [('1-0', 'alice', 2)]
+    assert client.do(['XACK', 's', 'g', '1-0', '1-0']) == 1
+    assert client.do(['XPENDING', 's', 'g'])[0] == 1
+    assert client.do(['XGROUP', 'DELCONSUMER', 's', 'g', 'bob']) == 1
+    assert client.do(['XPENDING', 's', 'g']) == [0, None, None, None]
+    assert client.do(['XGROUP', 'DESTROY', 's', 'g']) == 1
+    assert isinstance(client.do(['XREADGROUP', 'GROUP', 'g', 'c', 'STREAMS', 's', '>']), AssertionError)
+
+
+def test_xread_block():
+    server, reader = make_client()
+    writer = server.new_client(('127.0.0.1', 1))
+    replies = []
+    deferred = reader.do(['XREAD', 'BLOCK', '0', 'STREAMS', 's', '$'])
+    deferred.addCallback(replies.append)
+    assert reader.blocked is not None
+    writer.do(['SET', 'other', 'x'])
+    assert replies == []
+    writer.do(['XADD', 's', '5-0', 'a', 'b'])
+    assert replies == [[['s', [['5-0', ['a', 'b']]]]]]
+    assert reader.blocked is None
+    # timeouts are enforced by cron
+    deferred = reader.do(['XREAD', 'BLOCK', '1', 'STREAMS', 's', '$'])
+    deferred.addCallback(replies.append)
+    server.blocking.expire(time.time() + 1)
+    assert replies[-1] is None
+    assert server.blocking.count == 0
+    # clients going away stop waiting
+    reader.do(['XREAD', 'BLOCK', '0', 'STREAMS', 's', '$'])
+    reader.die()
+    assert server.blocking.waiters == {}
+
+
+def test_xread_block_after_flush():
+    server, reader = make_client()
+    writer = server.new_client(('127.0.0.1', 1))
+    writer.do(['XADD', 's', '1-0', 'a', 'b'])
+    replies = []
+    reader.do(['XREAD', 'BLOCK', '0', 'STREAMS', 's', '$']).addCallback(replies.append)
+    # the waiter reads from the new db, not the one being freed
+    writer.do(['FLUSHDB', 'ASYNC'])
+    writer.do(['XADD', 's', '2-0', 'c', 'd'])
+    assert replies == [[['s', [['2-0', ['c', 'd']]]]]]
+
+
+def test_xreadgroup_block_after_flush():
+    server, reader = make_client()
+    writer = server.new_client(('127.0.0.1', 1))
+    writer.do(['XGROUP', 'CREATE', 's', 'g', '$', 'MKSTREAM'])
+    replies = []
+    reader.do(['XREADGROUP', 'GROUP', 'g', 'c', 'BLOCK', '0', 'STREAMS', 's', '>']).addCallback(replies.append)
+    writer.do(['FLUSHDB', 'ASYNC'])
+    writer.do(['XGROUP', 'CREATE', 's', 'g', '$', 'MKSTREAM'])
+    writer.do(['XADD', 's', '1-0', 'a', 'b'])
+    # read from the new stream's group
+    assert replies == [[['s', [['1-0', ['a', 'b']]]]]]
+    assert writer.do(['XPENDING', 's', 'g'])[0] == 1
+    # the group goes away
+    reader.do(['XREADGROUP', 'GROUP', 'g', 'c', 'BLOCK', '0', 'STREAMS', 's', '>']).addCallback(replies.append)
+    assert writer.do(['XGROUP', 'DESTROY', 's', 'g']) == 1
+    assert replies[1].message.startswith('NOGROUP ')
+    assert reader.blocked is None
+
+
+def test_zset_score_ranges():
+    server, client = make_client()
+    client.do(['ZADD', 'z'] + sum([[str(i), 'm%d' % i] for i in xrange(10)], []))
+    assert client.do(['ZCOUNT', 'z', '2', '(5']) == 3
+    assert client.do(['ZRANGEBYSCORE', 'z', '(7', '+inf']) == ['m8', 'm9']
+    assert client.do(['ZRANGEBYSCORE', 'z', '-inf', '5', 'WITHSCORES', 'LIMIT', '1', '2']) == ['m1', '1', 'm2', '2']
+    assert client.do(['ZREVRANGEBYSCORE', 'z', '5', '0', 'LIMIT', '1', '2']) == ['m4', 'm3']
+    assert client.do(['ZREMRANGEBYSCORE', 'z', '0', '(8']) == 8
+    assert client.do(['ZCARD', 'z']) == 2
+    assert isinstance(client.do(['ZCOUNT', 'z', 'x', '1']), AssertionError)
+
+
+def test_geo():
+    server, client = make_client()
+    assert client.do(['GEOADD', 'Sicily', '13.361389', '38.115556', 'Palermo',
+                      '15.087269', '37.502669', 'Catania']) == 2
+    assert isinstance(client.do(['GEOADD', 'Sicily', '0', '89', 'pole']), AssertionError)
+    assert client.do(['GEODIST', 'Sicily', 'Palermo', 'Catania']) == '166274.1516'
+    assert client.do(['GEODIST', 'Sicily', 'Palermo', 'Catania', 'km']) == '166.2742'
+    assert client.do(['GEODIST', 'Sicily', 'Palermo', 'nope']) is None
+    assert client.do(['GEOHASH', 'Sicily', 'Palermo', 'nope']) == ['sqc8b49rny0', None]
+    lon, lat = client.do(['GEOPOS', 'Sicily', 'Palermo'])[0]
+    assert abs(float(lon) - 13.361389) < 1e-5
+    client.do(['GEOADD', 'Sicily', '12.758489', '38.788135', 'edge1', '17.241510', '38.788135', 'edge2'])
+    assert client.do(['GEOSEARCH', 'Sicily', 'FROMLONLAT', '15', '37', 'BYRADIUS', '200', 'km', 'ASC']) == ['Catania', 'Palermo']
+    reply = client.do(['GEOSEARCH', 'Sicily', 'FROMLONLAT', '15', '37', 'BYBOX', '400', '400', 'km',
+                       'ASC', 'COUNT', '1', 'WITHDIST', 'WITHCOORD'])
+    assert reply[0][:2] == ['Catania', '56.4413']
+    assert client.do(['GEOSEARCH', 'Sicily', 'FROMMEMBER', 'Palermo', 'BYRADIUS', '1', 'm']) == ['Palermo']
+    assert client.do(['GEOSEARCHSTORE', 'near', 'Sicily', 'FROMLONLAT', '15', '37', 'BYRADIUS', '200', 'km', 'STOREDIST']) == 2
+    assert list(client.do(['ZRANGE', 'near', '0', '0'])) == ['Catania']
+
+
+def test_client_tracking():
+    server, client = make_client()
+    writer = server.new_client(('127.0.0.1', 1))
+    client.do(['HELLO', '3'])
+    assert client.do(['CLIENT', 'TRACKING', 'ON']) is OK
+    client.do(['SET', 'foo', 'bar'])
+    client.do(['GET', 'foo'])
+    client.do(['MGET', 'a', 'b'])
+    assert client.pushed == []
+    writer.do(['SET', 'foo', 'baz'])
+    assert client.pushed == [['invalidate', ['foo']]]
+    # forgotten until read again
+    writer.do(['SET', 'foo', 'qux'])
+    writer.do(['MSET', 'a', '1', 'b', '2', 'c', '3'])
+    assert client.pushed[1:] == [['invalidate', ['a', 'b']]]
+    assert writer.pushed == []
+    # redirection, broadcasting
+    assert writer.do(['CLIENT', 'TRACKING', 'ON', 'BCAST', 'PREFIX', 'user:', 'REDIRECT', str(client.do(['CLIENT', 'ID']))]) is OK
+    del client.pushed[:]
+    writer.do(['SET', 'user:1', 'x'])
+    writer.do(['SET', 'other', 'x'])
+    assert client.pushed == [['invalidate', ['user:1']]]
+    assert client.do(['FLUSHDB']) is OK
+    assert client.pushed[-2:] == [['invalidate', None], ['invalidate', None]]
+    # OPTIN only tracks reads right after CLIENT CACHING yes
+    assert writer.do(['CLIENT', 'TRACKING', 'ON', 'OPTIN']) is OK
+    writer.do(['GET', 'x'])
+    writer.do(['CLIENT', 'CACHING', 'yes'])
+    writer.do(['GET', 'y'])
+    assert server.tracking.table.keys() == ['y']
+    assert isinstance(client.do(['CLIENT', 'TRACKING', 'ON', 'PREFIX', 'x']), AssertionError)
+
+
+def test_client_tracking_resp2():
+    server, client = make_client()
+    listener = server.new_client(('127.0.0.1', 1))
+    # no room for invalidations between RESP2 replies
+    client.do(['CLIENT', 'TRACKING', 'ON'])
+    client.do(['GET', 'foo'])
+    client.do(['SET', 'foo', 'x'])
+    assert client.pushed == []
+    # so they go to another connection, as Pub/Sub messages
+    assert listener.do(['SUBSCRIBE', '__redis__:invalidate']) == ['subscribe', '__redis__:invalidate', 1]
+    client.do(['CLIENT', 'TRACKING', 'ON', 'REDIRECT', str(listener.id)])
+    client.do(['GET', 'foo'])
+    client.do(['SET', 'foo', 'y'])
+    assert listener.pushed == [['message', '__redis__:invalidate', ['foo']]]
+    assert client.pushed == []
+    # switching to RESP3
+    reply = client.do(['HELLO'])
+    assert not isinstance(reply, Map) and reply[reply.index('proto') + 1] == 2
+    reply = client.do(['HELLO', '3', 'SETNAME', 'cache'])
+    assert isinstance(reply, Map) and reply[reply.index('proto') + 1] == 3
+    assert client.name == 'cache' and 'resp=3' in client.do(['CLIENT', 'LIST'])
+    assert str(client.do(['HELLO', '4'])).startswith('NOPROTO ')
+    assert isinstance(client.do(['HELLO', '3', 'AUTH', 'user', 'password']), AssertionError)
+    client.do(['CLIENT', 'TRACKING', 'ON'])
+    client.do(['GET', 'foo'])
+    client.do(['SET', 'foo', 'z'])
+    assert client.pushed == [['invalidate', ['foo']]]
+    assert isinstance(client.pushed[0], Push)
+
+
+def test_client_tracking_failed_commands():
+    server, client = make_client()
+    writer = server.new_client(('127.0.0.1', 1))
+    client.do(['HELLO', '3'])
+    client.do(['CLIENT', 'TRACKING', 'ON'])
+    client.do(['RPUSH', 'list', 'a'])
+    # nothing was read
+    assert isinstance(client.do(['GET', 'list']), AssertionError)
+    assert 'list' not in server.tracking.table
+    client.do(['GET', 'foo'])
+    # nothing was written
+    assert isinstance(writer.do(['INCR', 'list']), AssertionError)
+    assert isinstance(writer.do(['LPUSH', 'foo']), Exception)
+    assert client.pushed == []
+
+
+def test_client_tracking_sort():
+    server, client = make_client()
+    writer = server.new_client(('127.0.0.1', 1))
+    client.do(['HELLO', '3'])
+    client.do(['CLIENT', 'TRACKING', 'ON'])
+    client.do(['RPUSH', 'list', '2', '1'])
+    client.do(['LRANGE', 'list', '0', '-1'])
+    # a plain SORT only reads
+    assert writer.do(['SORT', 'list']) == ['1', '2']
+    assert client.pushed == [] and not writer.wrote
+    assert writer.do(['SORT', 'list', 'STORE', 'list']) == 2
+    assert client.pushed == [['invalidate', ['list']]] and writer.wrote
+
+
+def test_client_tracking_eviction():
+    server, client = make_client()
+    server.tracking.max_keys = 10
+    client.do(['HELLO', '3'])
+    client.do(['CLIENT', 'TRACKING', 'ON'])
+    client.do(['MGET'] + map(str, xrange(15)))
+    assert len(server.tracking.table) == 10
+    assert client.pushed == [['invalidate', [str(i)]] for i in xrange(5)]
+    client.die()
+    assert server.tracking.clients == 0
+
+
+def test_pubsub():
+    server, client = make_client()
+    other = server.new_client(('127.0.0.1', 1))
+    assert client.do(['SUBSCRIBE', 'a', 'b']) == ['subscribe', 'b', 2]
+    assert client.pushed == [['subscribe', 'a', 1]]
+    assert client.do(['PSUBSCRIBE', 'n*']) == ['psubscribe', 'n*', 3]
+    del client.pushed[:]
+    assert other.do(['PUBLISH', 'a', 'hello']) == 1
+    assert other.do(['PUBLISH', 'news', 'x']) == 1
+    assert other.do(['PUBLISH', 'nobody', 'x']) == 1
+    assert other.do(['PUBLISH', 'c', 'x']) == 0
+    assert client.pushed == [['message', 'a', 'hello'], ['pmessage', 'n*', 'news', 'x'],
+                             ['pmessage', 'n*', 'nobody', 'x']]
+    assert client.do(['UNSUBSCRIBE']) == ['unsubscribe', 'b', 1]
+    client.die()
+    assert not server.pubsub
+
+
+
+def test_monitor():
+    server, client = make_client()
+    monitor = server.new_client(('127.0.0.1', 1))
+    assert monitor.do(['MONITOR']) == OK
+    assert 'flags=O' in client.do(['CLIENT', 'LIST'])
+    client.do(['SELECT', '2'])
+    client.do(['SET', 'key', 'a "quoted"\nvalue\x00'])
+    lines = [message.message for message in monitor.pushed]
+    assert len(lines) == 3
+    assert lines[0].endswith(' [0 127.0.0.1:0] "CLIENT" "LIST"')
+    assert lines[2].endswith(' [2 127.0.0.1:0] "SET" "key" "a \\"quoted\\"\\nvalue\\x00"')
+    float(lines[2].split()[0])
+    monitor.die()
+    client.do(['PING'])
+    assert not server.monitors
+
+
+def test_debug_profile(tmpdir):
+    import pstats
+    server, client = make_client()
+    assert isinstance(client.do(['DEBUG', 'PROFILE', 'DUMP']), AssertionError)
+    assert client.do(['DEBUG', 'PROFILE', 'START']) == OK
+    assert isinstance(client.do(['DEBUG', 'PROFILE', 'START']), AssertionError)
+    client.do(['SADD', 'set'] + map(str, xrange(100)))
+    client.do(['SMEMBERS', 'set'])
+    assert client.do(['DEBUG', 'PROFILE', 'STOP']) == OK
+    assert server.profiler is None
+    assert isinstance(client.do(['DEBUG', 'PROFILE', 'STOP']), AssertionError)
+    path = str(tmpdir.join('commands.prof'))
+    assert client.do(['DEBUG', 'PROFILE', 'DUMP', path]) == path
+    functions = set(name for filename, line, name in pstats.Stats(path).stats)
+    assert 'SMEMBERS' in functions and 'SADD' in functions
+    # sampling: spend some CPU time in a command
+    assert client.do(['DEBUG', 'PROFILE', 'START', 'SAMPLING', '1']) == OK
+    started = time.clock()
+    while server.profiler.samples < 20 and time.clock() - started < 5:
+        client.do(['SINTER', 'set', 'set'])
+    client.do(['DEBUG', 'PROFILE', 'STOP'])
+    assert server.profiled.samples >= 20
+    assert client.do(['DEBUG', 'PROFILE', 'DUMP', path]) == path
+    stats = pstats.Stats(path).stats
+    do = [label for label in stats if label[2] == 'do']
+    sinter = [label for label in stats if label[2] == 'SINTER']
+    assert len(do) == 1 and len(sinter) == 1
+    # the stacks stop at Server.do(), which is in all of them
+    assert stats[do[0]][1] == server.profiled.samples
+    assert stats[sinter[0]][1] <= server.profiled.samples
+    assert not [label for label in stats if stats[label][1] > server.profiled.samples]
+
+def test_keyspace_notifications():
+    server, client = make_client()
+    listener = server.new_client(('127.0.0.1', 1))
+    listener.do(['PSUBSCRIBE', '__key*__:*'])
+    del listener.pushed[:]
+    # disabled by default
+    client.do(['SET', 'foo', 'bar'])
+    assert listener.pushed == [] and server.events == []
+    assert isinstance(client.do(['CONFIG', 'SET', 'notify-keyspace-events', 'Kq']), AssertionError)
+    # without K or E, nothing is queued
+    assert client.do(['CONFIG', 'SET', 'notify-keyspace-events', 'l']) is OK
+    client.do(['RPUSH', 'list', 'a'])
+    assert listener.pushed == []
+    assert client.do(['CONFIG', 'SET', 'notify-keyspace-events', 'KEl$g']) is OK
+    assert client.do(['CONFIG', 'GET', 'notify-keyspace-events']) == ['notify-keyspace-events', 'g$lKE']
+    client.do(['LPOP', 'list'])
+    messages = [message[2:] for message in listener.pushed]
+    assert messages == [['__keyspace@0__:list', 'lpop'], ['__keyevent@0__:lpop', 'list'],
+                        ['__keyspace@0__:list', 'del'], ['__keyevent@0__:del', 'list']]
+    # zsets aren't enabled
+    del listener.pushed[:]
+    client.do(['ZADD', 'z', '1', 'a'])
+    client.do(['SELECT', '2'])
+    client.do(['MSET', 'a', '1', 'b', '2'])
+    assert [message[2] for message in listener.pushed] == [
+        '__keyspace@2__:a', '__keyevent@2__:set', '__keyspace@2__:b', '__keyevent@2__:set']
+    assert server.events == []
+
+
+def test_client_registry():
+    server, client = make_client()
+    other = server.new_client(('10.0.0.1', 4242))
+    closed = []
+    other.closer = lambda: closed.append(other.id)
+    assert client.do(['CLIENT', 'SETNAME', 'worker']) is OK
+    assert isinstance(client.do(['CLIENT', 'SETNAME', 'a b']), AssertionError)
+    assert client.do(['CLIENT', 'GETNAME']) == 'worker'
+    other.do(['SELECT', '3'])
+    lines = client.do(['CLIENT', 'LIST']).splitlines()
+    assert len(lines) == 2
+    assert lines[0].startswith('id=%d addr=127.0.0.1:0 name=worker ' % client.id)
+    assert ' cmd=client' in lines[0]
+    assert 'db=3' in lines[1] and 'tot-cmds=2' in lines[1]
+    assert client.do(['CLIENT', 'LIST', 'ID', str(other.id)]).startswith('id=%d ' % other.id)
+    # SKIPME defaults to yes
+    assert client.do(['CLIENT', 'KILL', 'ID', str(client.id)]) == 0
+    assert client.do(['CLIENT', 'KILL', 'ADDR', '10.0.0.1:4242']) == 1
+    assert closed == [other.id]
+    assert isinstance(client.do(['CLIENT', 'KILL', '10.0.0.2:1']), AssertionError)
+
+
+def test_idle_timeout():
+    server, client = make_client()
+    subscriber = server.new_client(('127.0.0.1', 1))
+    subscriber.do(['SUBSCRIBE', 'news'])
+    assert client.do(['CONFIG', 'SET', 'timeout', '10']) is OK
+    server.cron()
+    assert not client.killed
+    client.last -= 11
+    subscriber.last -= 11
+    server.cron()
+    assert client.killed
+    assert not subscriber.killed
+
+
+def test_output_limits():
+    server, client = make_client()
+    assert client.do(['CONFIG', 'SET', 'client-output-buffer-limit', 'normal 1mb 1kb 10']) is OK
+    assert client.do(['CONFIG', 'GET', 'client-output-buffer-limit']) == \
+        ['client-output-buffer-limit', 'normal 1048576 1024 10 pubsub 33554432 8388608 60']
+    assert client.check_output(100, now=0)
+    assert client.check_output(2000, now=0)
+    assert client.check_output(2000, now=10)
+    assert not client.check_output(2000, now=10.5)
+    # dropping below the soft limit resets the clock
+    assert client.check_output(0, now=11)
+    assert client.check_output(2000, now=30)
+    assert not client.check_output(2 * 1024**2, now=30)
+
+
+def test_streamed_replies():
+    server, client = make_client()
+    other = server.new_client(('127.0.0.1', 1))
+    members = map(str, xrange(5000))
+    client.do(['SADD', 'set'] + members + ['x'])
+    client.do(['HMSET', 'hash'] + [item for member in members for item in (member, member)])
+    client.do(['RPUSH', 'list'] + members)
+    assert isinstance(client.do(['SMEMBERS', 'set']), Stream)
+    assert sorted(client.do(['HKEYS', 'hash'])) == sorted(members)
+    assert len(client.do(['HGETALL', 'hash'])) == 10000
+    assert list(client.do(['LRANGE', 'list', '10', '-10'])) == members[10:-9]
+    assert list(client.do(['LRANGE', 'list', '0', '2'])) == ['0', '1', '2']
+    client.do(['ZADD', 'zset'] + [item for member in members for item in (member, 'm' + member)])
+    assert list(client.do(['ZRANGE', 'zset', '-2', '-1', 'WITHSCORES'])) == ['m4998', '4998', 'm4999', '4999']
+    # writers get a copy of a value that is being streamed
+    reply = client.do(['SMEMBERS', 'set'])
+    items = iter(reply)
+    first = [next(items) for i in xrange(100)]
+    assert other.do(['SREM', 'set'] + members) == 5000
+    assert other.do(['UNLINK', 'set']) == 1
+    assert len(first + list(items)) == len(reply) == 5001
+    assert server.streaming == {}
+    assert client.do(['EXISTS', 'set']) == 0
+    # a small set
+    client.do(['SADD', 'small', 'a'])
+    assert client.do(['SMEMBERS', 'small']) == ['a']
+
+
+def test_object():
+    server, client = make_client()
+    client.do(['SET', 'int', '12345'])
+    client.do(['SET', 'short', 'hello'])
+    client.do(['SET', 'long', 'x' * 100])
+    client.do(['RPUSH', 'list', 'a'])
+    client.do(['SADD', 'intset', '1', '2'])
+    client.do(['SADD', 'set', 'a'])
+    client.do(['HSET', 'hash', 'f', 'v'])
+    client.do(['ZADD', 'zset', '1', 'a'])
+    client.do(['XADD', 'stream', '*', 'f', 'v'])
+    encodings = [client.do(['OBJECT', 'ENCODING', key]) for key in
+                 ['int', 'short', 'long', 'list', 'intset', 'set', 'hash', 'zset', 'stream']]
+    assert encodings == ['int', 'embstr', 'raw', 'quicklist', 'intset', 'hashtable', 'hashtable', 'skiplist', 'stream']
+    assert client.do(['OBJECT', 'ENCODING', 'nope']) is None
+    assert client.do(['OBJECT', 'REFCOUNT', 'int']) == 1
+    assert client.do(['OBJECT', 'FREQ', 'short']) == 5
+    for index in xrange(1000):
+        client.do(['GET', 'short'])
+    assert client.do(['OBJECT', 'FREQ', 'short']) > 5
+    # the access time is kept to the second
+    server.access.dbs[0]['short'] -= 10 << 8
+    assert client.do(['OBJECT', 'IDLETIME', 'short']) >= 10
+    client.do(['TYPE', 'short'])
+    assert client.do(['OBJECT', 'IDLETIME', 'short']) >= 10
+    client.do(['GET', 'short'])
+    assert client.do(['OBJECT', 'IDLETIME', 'short']) == 0
+    client.do(['DEL', 'short'])
+    assert 'short' not in server.access.dbs[0]
+    client.do(['FLUSHDB'])
+    assert server.access.dbs[0] == {}
+    assert str(client.do(['OBJECT', 'BOGUS', 'int'])).startswith('ERR Unknown subcommand')
+
+
+def test_memory():
+    server, client = make_client()
+    client.do(['SET', 'small', 'x'])
+    client.do(['SET', 'big', 'x' * 10000])
+    assert client.do(['MEMORY', 'USAGE', 'small']) < 200
+    assert 10000 < client.do(['MEMORY', 'USAGE', 'big']) < 10200
+    assert client.do(['MEMORY', 'USAGE', 'nope']) is None
+    client.do(['SADD', 'set'] + ['member:%d' % index for index in xrange(1000)])
+    estimate = client.do(['MEMORY', 'USAGE', 'set'])
+    exact = client.do(['MEMORY', 'USAGE', 'set', 'SAMPLES', '0'])
+    assert abs(estimate - exact) < exact * 0.1
+    assert str(client.do(['MEMORY', 'USAGE', 'set', 'SAMPLES'])) == 'ERR syntax error'
+    stats = client.do(['MEMORY', 'STATS'])
+    stats = dict(zip(stats[0::2], stats[1::2]))
+    assert stats['keys.count'] == 3
+    assert stats['total.allocated'] > 0
+    assert 'db.0' in stats and 'db.1' not in stats
+    assert str(client.do(['MEMORY', 'DOCTOR'])).startswith('ERR unknown subcommand')
+
+
+def scan_all(client, *args):
+    keys = []
+    cursor = '0'
+    while True:
+        cursor, batch = client.do(['SCAN', cursor] + list(args))
+        keys.extend(batch)
+        if cursor == '0':
+            return keys
+
+
+def test_scan():
+    server, client = make_client()
+    assert client.do(['SCAN', '0']) == ['0', []]
+    for index in xrange(100):
+        client.do(['SET', 'key:%d' % index, 'x'])
+    client.do(['SADD', 'set:1', 'a'])
+    keys = scan_all(client, 'COUNT', '7')
+    assert sorted(keys) == sorted(server.dbs[0])
+    assert sorted(scan_all(client, 'MATCH', 'key:1?')) == ['key:%d' % index for index in xrange(10, 20)]
+    assert scan_all(client, 'TYPE', 'set') == ['set:1']
+    assert str(client.do(['SCAN', 'x'])) == 'ERR invalid cursor'
+    assert str(client.do(['SCAN', '0', 'COUNT'])) == 'ERR syntax error'
+    assert str(client.do(['SCAN', '0', 'COUNT', '0'])) == 'ERR syntax error'
+
+
+def test_scan_while_writing():
+    server, client = make_client()
+    for index in xrange(100):
+        client.do(['SET', 'old:%d' % index, 'x'])
+    seen = set()
+    cursor, keys = client.do(['SCAN', '0', 'COUNT', '10'])
+    seen.update(keys)
+    # grow the table well past a resize, and delete what's been seen
+    for index in xrange(1000):
+        client.do(['SET', 'new:%d' % index, 'x'])
+    client.do(['DEL'] + keys)
+    while cursor != '0':
+        cursor, keys = client.do(['SCAN', cursor, 'COUNT', '100'])
+        seen.update(keys)
+    assert set('old:%d' % index for index in xrange(100)) <= seen
+    assert server.scans == {}
+    # an iteration over a database that's been flushed asynchronously
+    cursor, keys = client.do(['SCAN', '0', 'COUNT', '10'])
+    client.do(['FLUSHDB', 'ASYNC'])
+    assert client.do(['SCAN', cursor]) == ['0', []]
@@ -0,0 +1,148 @@
+# -*- coding: utf-8 -*-
+
+import os
+import signal
+import time
+
+from twisted.internet import defer
+
+from karton.server import Server
+from karton.snapshot import Snapshots
+from karton.protocol import Encoded, Reader, python_to_redis
+
+
+def result(snapshots, deferred):
+    """Wait for a snapshot reply, and decode it."""
+    results = []
+    deferred.addCallback(results.append)
+    deadline = time.time() + 10
+    while not results and time.time() < deadline:
+        snapshots.poll(0.1)
+    reply = results[0]
+    if not isinstance(reply, Encoded):
+        return reply
+    reader = Reader(replies=True)
+    reader.feed(''.join(reply))
+    return reader.gets()
+
+
+def make_server():
+    server = Server()
+    server.snapshots = snapshots = Snapshots(server, workers=1, max_age=60)
+    snapshots.threshold = 100
+    client = server.new_client(('127.0.0.1', 0))
+    return server, snapshots, client
+
+
+def test_snapshot_reads():
+    server, snapshots, client = make_server()
+    other = server.new_client(('127.0.0.1', 1))
+    try:
+        client.do(['SADD', 'big'] + map(str, xrange(1000)))
+        client.do(['SADD', 'small', 'a'])
+        # no worker yet: runs in the parent, and gets one forked
+        assert len(client.do(['SMEMBERS', 'big'])) == 1000
+        snapshots.cron()
+        assert len(snapshots.workers) == 1
+        # the client wrote before the fork
+        deferred = client.do(['SMEMBERS', 'big'])
+        assert isinstance(deferred, defer.Deferred)
+        # others' writes aren't seen by the snapshot
+        other.do(['SADD', 'big', 'new'])
+        assert sorted(result(snapshots, deferred)) == sorted(map(str, xrange(1000)))
+        assert len(result(snapshots, client.do(['SUNION', 'big', 'small']))) == 1001
+        assert str(result(snapshots, client.do(['HGETALL', 'big']))).startswith('ERR Operation against a key')
+        # small and write commands stay in the parent
+        assert client.do(['SMEMBERS', 'small']) == ['a']
+        assert not isinstance(client.do(['SORT', 'big', 'STORE', 'sorted']), defer.Deferred)
+        # ... and a client reads its own writes
+        assert len(client.do(['SMEMBERS', 'big'])) == 1001
+        assert snapshots.offloaded == 3
+    finally:
+        snapshots.close()
+    assert snapshots.workers == [] and snapshots.zombies == []
+
+
+def test_snapshot_big_reply():
+    server, snapshots, client = make_server()
+    keys = ['key:%06d' % index for index in xrange(50000)]
+    client.do(['MSET'] + [arg for key in keys for arg in (key, 'x')])
+    try:
+        client.do(['KEYS', '*'])
+        snapshots.cron()
+        # encoded in one piece by the child, and sent in many frames
+        deferred = client.do(['KEYS', '*'])
+        assert isinstance(deferred, defer.Deferred)
+        assert sorted(result(snapshots, deferred)) == keys
+        worker = snapshots.workers[0]
+        assert worker.pieces == [] and not worker.missing and not worker.header
+    finally:
+        snapshots.close()
+
+
+def test_snapshot_refresh():
+    server, snapshots, client = make_server()
+    client.do(['SADD', 'big'] + map(str, xrange(1000)))
+    try:
+        snapshots.wanted = time.time()
+        snapshots.cron()
+        worker = snapshots.workers[0]
+        # halfway through its life, a worker is replaced
+        snapshots.cron(worker.created + 29)
+        assert snapshots.workers == [worker]
+        snapshots.cron(worker.created + 30)
+        assert len(snapshots.workers) == 1 and snapshots.workers[0] is not worker
+        assert worker.closed and snapshots.forks == 2
+        # a stale worker isn't used
+        snapshots.max_age = 0
+        assert len(client.do(['SMEMBERS', 'big'])) == 1000
+        snapshots.max_age = 60
+        # nor replaced, once it's not wanted
+        snapshots.wanted = 0
+        snapshots.cron(time.time() + 30)
+        assert snapshots.workers == []
+    finally:
+        snapshots.close()
+
+
+def test_snapshot_worker_death():
+    server, snapshots, client = make_server()
+    client.do(['SADD', 'big'] + map(str, xrange(1000)))
+    try:
+        snapshots.wanted = time.time()
+        snapshots.cron()
+        worker = snapshots.workers[0]
+        os.kill(worker.pid, signal.SIGKILL)
+        # dead before it's sent anything: writing to it fails
+        os.waitpid(worker.pid, 0)
+        deferred = client.do(['SMEMBERS', 'big'])
+        assert str(result(snapshots, deferred).message) == 'ERR snapshot worker died'
+        assert worker.retired
+    finally:
+        snapshots.close()
+
+
+def test_disconnect_while_pending():
+    from twisted.internet.testing import StringTransport
+    from twisted_karton import RedisProtocol
+    server, snapshots, client = make_server()
+    try:
+        client.do(['SADD', 'big'] + map(str, xrange(1000)))
+        # asks for a worker
+        client.do(['SMEMBERS', 'big'])
+        snapshots.cron()
+        connection = RedisProtocol(server, ('127.0.0.1', 1))
+        connection.makeConnection(StringTransport())
+        connection.dataReceived(python_to_redis(['SMEMBERS', 'big']))
+        assert connection.blocked
+        deferred = snapshots.workers[0].pending[0]
+        connection.connectionLost(None)
+        failures = []
+        deferred.addErrback(failures.append)
+        deadline = time.time() + 10
+        while snapshots.workers[0].pending and time.time() < deadline:
+            snapshots.poll(0.1)
+        assert not snapshots.workers[0].pending
+        assert failures == []
+    finally:
+        snapshots.close()
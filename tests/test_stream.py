@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+
+import random
+
+from karton import stream as st
+from karton.stream import stream
+
+
+def test_against_list():
+    random.seed(7)
+    reference = []
+    log = stream()
+    for ms in xrange(1, 1000):
+        fields = ['f', 'x' * random.randint(0, 200)]
+        log.add((ms, 0), fields)
+        reference.append(((ms, 0), fields))
+        if random.random() < 0.2:
+            id, fields = reference.pop(random.randrange(len(reference)))
+            assert log.delete(id)
+            assert not log.delete(id)
+    assert len(log) == len(reference)
+    assert list(log.range()) == reference
+    assert list(log.range(reverse=True)) == reference[::-1]
+    assert list(log.range((500, 0), (600, 0))) == [entry for entry in reference if (500, 0) <= entry[0] <= (600, 0)]
+    assert list(log.range((500, 0), count=3)) == [entry for entry in reference if entry[0] >= (500, 0)][:3]
+    assert log.get(reference[10][0]) == reference[10][1]
+    assert len(log.nodes) > 1
+
+
+def test_trim():
+    log = stream()
+    for ms in xrange(1, 1001):
+        log.add((ms, 0), ['a', 'b'])
+    assert log.trim(1000) == 0
+    assert log.trim(950, approximate=True) == 0
+    assert log.trim(250, approximate=True) == 700
+    assert len(log) == 300
+    assert log.trim(250) == 50
+    assert [id for id, fields in log.range()] == [(ms, 0) for ms in xrange(751, 1001)]
+
+
+def test_ids():
+    log = stream()
+    assert log.next_id(5) == (5, 0)
+    log.add((5, 0), ['a', 'b'])
+    assert log.next_id(5) == (5, 1)
+    assert st.parse_id('7') == (7, 0)
+    assert st.parse_id('7', st.MAX_PART) == (7, st.MAX_PART)
+    assert st.parse_id('7-3') == (7, 3)
+    for junk in ('', 'x', '1-x', '-1', '1-2-3'):
+        try:
+            st.parse_id(junk)
+        except ValueError:
+            pass
+        else:
+            assert False, junk
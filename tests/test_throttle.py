@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+
+import time
+
+from karton.server import Server
+from karton.throttle import gcra
+from karton.replycache import ReplyCache
+
+
+def make_client():
+    server = Server()
+    return server, server.new_client(('127.0.0.1', 0))
+
+
+def test_gcra():
+    # 10 per second, bursts of 5 more
+    now = 10 ** 12
+    tat = None
+    replies = []
+    for index in xrange(7):
+        limited, remaining, retry, reset, new = gcra(tat, now, 5, 10, 1)
+        tat = new if new is not None else tat
+        replies.append((limited, remaining))
+    assert replies == [(False, 5), (False, 4), (False, 3), (False, 2), (False, 1), (False, 0), (True, 0)]
+    # one more is allowed a tenth of a second later
+    limited, remaining, retry, reset, new = gcra(tat, now, 5, 10, 1)
+    assert retry == 100000 and reset == 600000 and new is None
+    assert not gcra(tat, now + retry, 5, 10, 1)[0]
+    # back to full after reset
+    assert gcra(tat, now + reset, 5, 10, 1)[1] == 5
+    # more than a burst can ever take
+    limited, remaining, retry, reset, new = gcra(None, now, 5, 10, 1, quantity=7)
+    assert limited and retry == -1
+    # quantity 0 looks without counting
+    assert gcra(tat, now, 5, 10, 1, quantity=0)[:2] == (False, 0)
+
+
+def test_throttle(monkeypatch):
+    server, client = make_client()
+    now = [1700000000.0]
+    monkeypatch.setattr(time, 'time', lambda: now[0])
+    replies = [client.do(['THROTTLE', 'user:1', '2', '30', '60']) for index in xrange(4)]
+    assert replies == [[0, 3, 2, -1, 2], [0, 3, 1, -1, 4], [0, 3, 0, -1, 6], [1, 3, 0, 2, 6]]
+    assert client.do(['CL.THROTTLE', 'user:1', '2', '30', '60', '0']) == [0, 3, 0, -1, 6]
+    assert client.do(['TYPE', 'user:1']) == 'string'
+    now[0] += 2
+    assert client.do(['THROTTLE', 'user:1', '2', '30', '60'])[:3] == [0, 3, 0]
+    assert str(client.do(['THROTTLE', 'user:1', '2', '0', '60'])) == 'ERR invalid rate'
+    assert str(client.do(['THROTTLE', 'user:1', 'x', '30', '60'])).startswith('ERR value is not an integer')
+    client.do(['SET', 'string', 'x'])
+    assert str(client.do(['THROTTLE', 'string', '2', '30', '60'])) == 'ERR key does not hold a throttle'
+    client.do(['THROTTLE', 'user:2', '0', '1', '1'])
+    client.do(['THROTTLE', 'user:3', '0', '1', '1'])
+    client.do(['SET', 'user:3', 'mine now'])
+    # idle keys go away, and only those
+    now[0] += 3
+    server.cron()
+    assert client.do(['EXISTS', 'user:1']) == 1
+    assert client.do(['EXISTS', 'user:2']) == 0
+    assert client.do(['GET', 'user:3']) == 'mine now'
+    now[0] += 10
+    server.cron()
+    assert client.do(['EXISTS', 'user:1']) == 0
+    assert len(server.throttles) == 0 and server.throttles.expired == 2
+
+
+def test_throttle_expiry_invalidates(monkeypatch):
+    server, client = make_client()
+    server.reply_cache = ReplyCache(1024 * 1024)
+    now = [1700000000.0]
+    monkeypatch.setattr(time, 'time', lambda: now[0])
+    reader = server.new_client(('127.0.0.1', 1))
+    listener = server.new_client(('127.0.0.1', 2))
+    client.do(['CONFIG', 'SET', 'notify-keyspace-events', 'Ex'])
+    listener.do(['SUBSCRIBE', '__keyevent@0__:expired'])
+    client.do(['THROTTLE', 'user:1', '0', '1', '1'])
+    reader.do(['HELLO', '3'])
+    reader.do(['CLIENT', 'TRACKING', 'ON'])
+    # cached, and tracked
+    assert reader.do(['GET', 'user:1']) is not None
+    assert reader.do(['GET', 'user:1']) is not None
+    del listener.pushed[:]
+    now[0] += 2
+    server.cron()
+    assert reader.pushed == [['invalidate', ['user:1']]]
+    assert listener.pushed == [['message', '__keyevent@0__:expired', 'user:1']]
+    # nothing left of it for OBJECT IDLETIME either
+    assert 'user:1' not in server.access.dbs[0]
+    assert reader.do(['GET', 'user:1']) is None
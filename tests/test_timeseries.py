@@ -0,0 +1,127 @@
+# -*- coding: utf-8 -*-
+
+import random
+from cStringIO import StringIO
+
+from karton.server import Server
+from karton import timeseries as tsdb
+from karton.timeseries import timeseries, encode, decode
+from karton.protocol import OK, Error
+from karton import rdb, bulk
+
+
+def make_client():
+    server = Server()
+    return server, server.new_client(('127.0.0.1', 0))
+
+
+def test_encode():
+    timestamps = [1000, 2000, 3000, 3001, 3100, 10 ** 12, 10 ** 12 + 5000, 10 ** 12 + 5000 + 2 ** 40]
+    values = [1.0, 1.0, 2.5, -3.75, 1e300, float('inf'), 0.1, 0.1]
+    assert decode(timestamps[0], len(timestamps), encode(timestamps, values)) == (timestamps, tuple(values))
+    timestamps = range(0, 10000, 10)
+    values = [random.random() for timestamp in timestamps]
+    assert decode(0, len(timestamps), encode(timestamps, values)) == (timestamps, tuple(values))
+
+
+def test_compression():
+    series = timeseries()
+    counter = timeseries()
+    for index in xrange(10240):
+        # scraped every 10s, give or take a few milliseconds
+        timestamp = 1600000000000 + index * 10000 + random.randint(0, 3)
+        series.add(timestamp, 42.0)
+        counter.add(index * 1000, float(index * 3))
+    assert len(series.chunks) == 10 and not series.timestamps
+    assert series.size() < 1.5 * 10240
+    assert counter.size() < 2 * 10240
+    timestamps, values = counter.range(0, 10240 * 1000)
+    assert values == [float(index * 3) for index in xrange(10240)]
+
+
+def test_retention():
+    series = timeseries(retention=5000, chunk_samples=100)
+    for timestamp in xrange(0, 20000, 10):
+        series.add(timestamp, 1.0)
+    # whole chunks only: the oldest one left ends within the period
+    assert series.chunks[0].last >= 19990 - 5000
+    assert series.chunks[0].first < 19990 - 5000
+    assert series.count == len(series.range(0, 20000)[0])
+    try:
+        series.add(19990, 1.0)
+    except ValueError:
+        pass
+    else:
+        assert False
+
+
+def test_aggregate(monkeypatch):
+    timestamps = range(0, 1000, 10)
+    values = [float(index % 7) for index in xrange(100)]
+    results = {}
+    for numpy in (tsdb.numpy, None):
+        monkeypatch.setattr(tsdb, 'numpy', numpy)
+        results[numpy is None] = [tsdb.aggregate(timestamps, values, aggregation, 300)
+                                  for aggregation in tsdb.AGGREGATIONS]
+    assert results[False] == results[True]
+    average, total, low, high, count, first, last, spread = results[True]
+    assert count == [(0, 30.0), (300, 30.0), (600, 30.0), (900, 10.0)]
+    assert total[0] == (0, float(sum(values[:30])))
+    assert average[0] == (0, sum(values[:30]) / 30)
+    assert low[0] == (0, 0.0) and high[0] == (0, 6.0) and spread[0] == (0, 6.0)
+    assert first[1] == (300, values[30]) and last[1] == (300, values[59])
+
+
+def test_timeseries_commands():
+    server, client = make_client()
+    assert client.do(['TS.CREATE', 'temp:1', 'RETENTION', '60000', 'LABELS', 'sensor', '1', 'room', 'a']) == OK
+    assert str(client.do(['TS.CREATE', 'temp:1'])) == 'ERR TSDB: key already exists'
+    assert client.do(['TYPE', 'temp:1']) == 'TSDB-TYPE'
+    assert client.do(['TS.ADD', 'temp:1', '1000', '20.5']) == 1000
+    assert str(client.do(['TS.ADD', 'temp:1', '1000', '21'])).startswith('ERR TSDB: timestamp')
+    assert str(client.do(['TS.ADD', 'temp:1', '2000', 'warm'])) == 'ERR TSDB: invalid value'
+    reply = client.do(['TS.MADD', 'temp:1', '2000', '21', 'temp:1', '3000', '22', 'nope', '1', '1'])
+    assert reply[:2] == [2000, 3000] and isinstance(reply[2], Error)
+    assert client.do(['TS.GET', 'temp:1']) == [3000, '22']
+    assert client.do(['TS.RANGE', 'temp:1', '-', '+']) == [[1000, '20.5'], [2000, '21'], [3000, '22']]
+    assert client.do(['TS.REVRANGE', 'temp:1', '1500', '+', 'COUNT', '1']) == [[3000, '22']]
+    assert client.do(['TS.RANGE', 'temp:1', '0', '5000', 'AGGREGATION', 'avg', '2000']) == [
+        [0, '20.5'], [2000, '21.5']]
+    assert str(client.do(['TS.RANGE', 'temp:1', '0', '1', 'AGGREGATION', 'median', '10'])) == \
+        'ERR TSDB: unknown aggregation type'
+    # TS.ADD creates a series, with the options given
+    assert client.do(['TS.ADD', 'temp:2', '5000', '18', 'LABELS', 'sensor', '2', 'room', 'b']) == 5000
+    assert client.do(['TS.ADD', 'cpu', '*', '0.5', 'LABELS', 'host', 'x']) > 0
+    assert client.do(['TS.QUERYINDEX', 'sensor!=']) == ['temp:1', 'temp:2']
+    assert client.do(['TS.QUERYINDEX', 'room=(a,c)']) == ['temp:1']
+    assert client.do(['TS.MRANGE', '-', '+', 'WITHLABELS', 'FILTER', 'room=b']) == [
+        ['temp:2', [['room', 'b'], ['sensor', '2']], [[5000, '18']]]]
+    assert client.do(['TS.MREVRANGE', '-', '+', 'COUNT', '1', 'FILTER', 'sensor!=', 'host=']) == [
+        ['temp:1', [], [[3000, '22']]], ['temp:2', [], [[5000, '18']]]]
+    assert str(client.do(['TS.MRANGE', '-', '+', 'FILTER', 'room'])) == 'ERR TSDB: failed parsing labels'
+    info = dict(zip(*[iter(client.do(['TS.INFO', 'temp:1']))] * 2))
+    assert info['totalSamples'] == 3 and info['retentionTime'] == 60000
+    assert info['firstTimestamp'] == 1000 and info['lastTimestamp'] == 3000
+    assert info['labels'] == [['room', 'a'], ['sensor', '1']]
+    assert str(client.do(['TS.GET', 'nope'])) == 'ERR TSDB: the key does not exist'
+    client.do(['SET', 'string', 'x'])
+    assert str(client.do(['TS.ADD', 'string', '1', '1'])).startswith('WRONGTYPE')
+
+
+def test_timeseries_persistence():
+    server, client = make_client()
+    for index in xrange(2500):
+        client.do(['TS.ADD', 'series', str(index * 1000), str(index % 10), 'LABELS', 'a', 'b'])
+    series = server.dbs[0]['series']
+    copy = rdb.loads(rdb.dumps(series))
+    assert copy.fields() == series.fields()
+    assert len(copy.chunks) == 2 and len(copy.timestamps) == 452
+    copy.add(2500000, 1.0)
+    payload = client.do(['DUMP', 'series'])
+    assert client.do(['RESTORE', 'copy', '0', payload]) == OK
+    assert client.do(['TS.RANGE', 'copy', '2498000', '+']) == [[2498000, '8'], [2499000, '9']]
+    other = Server()
+    bulk.load(other, StringIO(''.join(bulk.export(server))))
+    assert other.dbs[0]['series'].fields() == series.fields()
+    assert client.do(['OBJECT', 'ENCODING', 'series']) == 'compressed'
+    assert client.do(['MEMORY', 'USAGE', 'series']) > series.size()
@@ -5,15 +5,23 @@
 
 import os
 import sys
+import time
+import collections
 import logging
 logger = logging.getLogger('twisted_karton')
 
-from twisted.python import log, usage
-from twisted.internet import defer, protocol
-import hiredis
+from twisted.python import log, usage, failure
+from twisted.internet import defer, interfaces, protocol, task
+from zope.interface import implementer
 
 import karton.protocol
 import karton.server
+import karton.bulk
+import karton.rdb
+import karton.snapshot
+import karton.mapped
+import karton.replycache
+import karton.iothreads
 
 
 def reactor():
@@ -21,40 +29,275 @@ def reactor():
     return r
 
 
+@implementer(interfaces.IPushProducer)
 class RedisProtocol(protocol.Protocol):
+    """Also the producer of its own replies: when the transport's send
+    buffer fills up, stop reading (and running) requests until it drains.
+    Large replies are encoded and written a chunk at a time, as long as the
+    transport keeps up.
 
-    def __init__(self, server, addr):
+    With I/O threads (see karton.iothreads), input is parsed and replies
+    are encoded in batches, on the threads; requests are run from process()
+    as usual, but their replies are queued while the batch is being run."""
+
+    def __init__(self, server, addr, io=None):
         self.client = server.new_client(addr)
-        self.reader = hiredis.Reader()
+        # Pub/Sub messages, invalidations and such
+        self.client.writer = self.push
+        self.reader = karton.protocol.reader()
+        # set while a blocking command (XREAD BLOCK...) waits for its reply
+        self.blocked = False
+        # set while the client doesn't keep up with its replies
+        self.paused = False
+        # chunks of a reply that's being streamed
+        self.streaming = None
+        self.io = io
+        if io is not None:
+            # received, not parsed yet
+            self.received = []
+            # parsed, not run yet
+            self.requests = collections.deque()
+            # what stopped parsing, once the requests before it have run
+            self.failure = None
+            # replies and pushed messages, not encoded yet
+            self.outgoing = []
+        self.lost = False
+
+    def connectionMade(self):
+        self.client.closer = self.transport.loseConnection
+        self.transport.registerProducer(self, True)
 
     def connectionLost(self, reason):
+        self.lost = True
+        if self.streaming is not None:
+            self.streaming.close()
+            self.streaming = None
         self.client.die()
         del self.client
         del self.reader
-        
+
+    def pauseProducing(self):
+        self.paused = True
+        self.transport.stopReading()
+
+    def resumeProducing(self):
+        self.paused = False
+        self.transport.startReading()
+        self.produce()
+        self.process()
+
+    def stopProducing(self):
+        pass
+
     def dataReceived(self, data):
+        self.client.net_input += len(data)
+        if self.io is not None:
+            self.received.append(data)
+            self.io.schedule(self)
+            return
         self.reader.feed(data)
-        request = self.reader.gets()
-        if request is not False:
+        self.process()
+
+    def parse(self):
+        """Parse what's been received, on an I/O thread."""
+        received, self.received = self.received, []
+        reader = self.reader
+        requests = self.requests
+        try:
+            for data in received:
+                reader.feed(data)
+            request = reader.gets()
+            while request is not False:
+                requests.append(request)
+                request = reader.gets()
+        except Exception:
+            self.failure = failure.Failure()
+
+    def next_request(self):
+        if self.io is None:
+            return self.reader.gets()
+        if self.requests:
+            return self.requests.popleft()
+        if self.failure is not None:
+            # as when dataReceived() raises without I/O threads
+            reason, self.failure = self.failure, None
+            log.err(reason, 'closing client %d' % self.client.id)
+            self.client.killed = True
+            self.transport.abortConnection()
+        return False
+
+    def process(self):
+        # requests pipelined behind a blocked one wait in the reader.
+        while not (self.blocked or self.paused or self.streaming or self.client.killed):
+            request = self.next_request()
+            if request is False:
+                break
             response = self.client.do(request)
-            raw = karton.protocol.python_to_redis(response)
-            self.transport.write(raw)
+            if isinstance(response, defer.Deferred):
+                self.blocked = True
+                response.addCallback(self.unblocked)
+                break
+            self.reply(response)
+
+    def reply(self, response):
+        if isinstance(response, (karton.protocol.Stream, karton.protocol.Encoded)):
+            if self.io is not None and self.outgoing:
+                self.write(self.encode())
+            self.streaming = karton.protocol.chunks(response)
+            self.produce()
+        elif self.io is not None and self.io.batching:
+            self.queue([response])
+        else:
+            self.write(karton.protocol.python_to_redis(response))
+
+    def queue(self, replies):
+        if not self.outgoing:
+            self.io.queued(self)
+        self.outgoing.extend(replies)
+
+    def encode(self):
+        """Encode what's been queued, on an I/O thread."""
+        outgoing, self.outgoing = self.outgoing, []
+        return ''.join(map(karton.protocol.python_to_redis, outgoing))
+
+    def produce(self):
+        """Write chunks of the current streamed reply until it's done or
+        the transport asks us to pause."""
+        while self.streaming is not None and not (self.paused or self.client.killed):
+            chunk = next(self.streaming, None)
+            if chunk is None:
+                self.streaming = None
+            else:
+                self.write(chunk)
+
+    def push(self, messages):
+        if self.io is not None and self.io.batching:
+            self.queue(messages)
+        else:
+            self.write(''.join(map(karton.protocol.python_to_redis, messages)))
+
+    def write(self, raw):
+        self.transport.write(raw)
+        self.client.net_output += len(raw)
+        if not self.client.check_output(self.buffered()):
+            logger.warning('closing client %d for overcoming output buffer limits', self.client.id)
+            self.client.killed = True
+            self.transport.abortConnection()
+
+    def buffered(self):
+        """Bytes written but not sent yet."""
+        transport = self.transport
+        return len(getattr(transport, 'dataBuffer', '')) - getattr(transport, 'offset', 0) + \
+            getattr(transport, '_tempDataLen', 0)
+
+    def unblocked(self, response):
+        # a snapshot reply may come in after the client has gone
+        if self.lost:
+            return
+        self.blocked = False
+        self.reply(response)
+        self.process()
 
 
 class RedisProtocolFactory(protocol.ServerFactory):
 
     protocol = RedisProtocol
 
+    # Server.cron() frequency, per second.
+    hz = 10
+
+    # karton.iothreads.IOThreads, with --io-threads
+    io = None
+
+    def __init__(self, load=None, rdb=None, snapshot_workers=0, snapshot_max_age=1.0, mmap=None,
+                 reply_cache=0, io_threads=0):
+        # RESP file to mass-insert on startup; '-' for stdin
+        self.load = load
+        # Redis dump to load on startup
+        self.rdb = rdb
+        # forked children running expensive reads (see karton.snapshot)
+        self.snapshot_workers = snapshot_workers
+        self.snapshot_max_age = snapshot_max_age
+        # mapped snapshot to start from, and to SAVE to
+        self.mmap = mmap
+        # bytes of encoded replies cached (see karton.replycache)
+        self.reply_cache = reply_cache
+        # threads parsing requests and encoding replies, the reactor's
+        # included; 0 for none at all
+        self.io_threads = io_threads
+
     def startFactory(self):
         self.server = karton.server.Server()
+        if self.mmap is not None:
+            self.server.dbfilename = self.mmap
+            if os.path.exists(self.mmap):
+                self.load_mmap(self.mmap)
+        if self.rdb is not None:
+            self.load_rdb(self.rdb)
+        if self.load is not None:
+            self.load_file(self.load)
+        if self.reply_cache:
+            self.server.reply_cache = karton.replycache.ReplyCache(self.reply_cache)
+        if self.snapshot_workers:
+            self.server.snapshots = karton.snapshot.Snapshots(
+                self.server, self.snapshot_workers, self.snapshot_max_age,
+                reactor().addReader, reactor().removeReader)
+        if self.io_threads:
+            self.io = karton.iothreads.IOThreads(self.io_threads, lambda function: reactor().callLater(0, function))
+        self.cron = task.LoopingCall(self.server.cron)
+        self.cron.start(1.0 / self.hz, now=False)
+
+    def load_file(self, path):
+        started = time.time()
+        file = sys.stdin if path == '-' else open(path, 'rb')
+        try:
+            result = karton.bulk.load(self.server, file)
+        finally:
+            if file is not sys.stdin:
+                file.close()
+        logger.info('loaded %s: %d commands, %d errors, %.1f seconds', path,
+                    result.replies, result.errors, time.time() - started)
+        for command, error in result.first_errors:
+            logger.warning('%s: %s', command, error)
+
+    def load_rdb(self, path):
+        started = time.time()
+        with open(path, 'rb') as file:
+            loaded, expired = karton.rdb.load(self.server, file)
+        logger.info('loaded %s: %d keys, %d expired keys skipped, %.1f seconds', path,
+                    loaded, expired, time.time() - started)
+
+    def load_mmap(self, path):
+        started = time.time()
+        keys = karton.mapped.Mapped(path).load(self.server)
+        logger.info('mapped %s: %d keys, %.1f seconds', path, keys, time.time() - started)
+
+    def stopFactory(self):
+        self.cron.stop()
+        if self.mmap is not None:
+            started = time.time()
+            karton.mapped.save_path(self.server.dbs, self.mmap, self.server.mapped)
+            logger.info('saved %s: %.1f seconds', self.mmap, time.time() - started)
+        if self.server.snapshots is not None:
+            self.server.snapshots.close()
+        if self.io is not None:
+            self.io.close()
 
     def buildProtocol(self, addr):
-        return self.protocol(self.server, addr)
+        return self.protocol(self.server, addr, self.io)
 
 class Options(usage.Options):
 
     optParameters = [
-        ["port", "p", 6379, "server port", int]
+        ["port", "p", 6379, "server port", int],
+        ["load", "l", None, "RESP file to mass-insert on startup ('-' for stdin)"],
+        ["rdb", "r", None, "Redis RDB file to load on startup"],
+        ["mmap", "m", None, "mapped snapshot to start from (values are decoded as needed) and to SAVE to"],
+        ["reply-cache", None, 0, "bytes of encoded replies to cache for GET, HGETALL, SMEMBERS... (e.g. 64mb)",
+         karton.server.memory_size],
+        ["snapshot-workers", None, 0, "forked children running expensive read-only commands", int],
+        ["snapshot-max-age", None, 1.0, "seconds a snapshot reply may be behind", float],
+        ["io-threads", None, 0, "threads parsing requests and encoding replies, for many busy connections", int],
     ]
 
 
@@ -74,7 +317,9 @@ def main():
 
     protocol.Factory.noisy = True
 
-    reactor().listenTCP(config['port'], RedisProtocolFactory())
+    reactor().listenTCP(config['port'], RedisProtocolFactory(
+        config['load'], config['rdb'], config['snapshot-workers'], config['snapshot-max-age'],
+        config['mmap'], config['reply-cache'], config['io-threads']))
     reactor().callWhenRunning(logger.info, "The server is now ready to accept connections on port %d", config['port'])
     reactor().run()
 